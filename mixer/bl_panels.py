@@ -158,6 +158,7 @@ def draw_advanced_settings_ui(layout: bpy.types.UILayout):
     layout.prop(mixer_prefs, "log_level")
     layout.prop(mixer_prefs, "env")
     layout.prop(mixer_prefs, "show_server_console")
+    layout.prop(mixer_prefs, "compression")
 
 
 def draw_developer_settings_ui(layout: bpy.types.UILayout):
@@ -192,6 +193,7 @@ def draw_preferences_ui(mixer_prefs: MixerPreferences, context: bpy.types.Contex
     layout.label(text="Room Settings")
     layout.prop(mixer_prefs, "room", text="Default Room Name")
     layout.prop(mixer_prefs, "experimental_sync")
+    layout.prop(mixer_prefs, "binary_data_codec")
 
     layout = mixer_prefs.layout.box().column()
     layout.label(text="Advanced Settings")
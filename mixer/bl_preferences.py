@@ -101,8 +101,25 @@ class MixerPreferences(bpy.types.AddonPreferences):
         name="Experimental sync", default=os.environ.get("MIXER_EXPERIMENTAL_SYNC") is not None
     )
 
+    binary_data_codec: bpy.props.BoolProperty(
+        name="Binary data codec",
+        description="Send experimental sync updates in binary format instead of JSON",
+        default=os.environ.get("MIXER_BINARY_DATA_CODEC") is not None,
+    )
+
     show_server_console: bpy.props.BoolProperty(name="Show Server Console", default=False)
 
+    compression: bpy.props.EnumProperty(
+        name="Compression",
+        description="Compression of large messages sent to the server, applied at the next connection",
+        items=[
+            ("NONE", "None", "", common.Compression.NONE),
+            ("ZLIB", "zlib", "", common.Compression.ZLIB),
+            ("LZMA", "lzma", "Smaller messages, slower compression", common.Compression.LZMA),
+        ],
+        default="ZLIB",
+    )
+
     VRtist: bpy.props.StringProperty(
         name="VRtist", default=os.environ.get("VRTIST_EXE", "D:/unity/VRtist/Build/VRtist.exe"), subtype="FILE_PATH"
     )
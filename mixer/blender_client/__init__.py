@@ -16,10 +16,12 @@ The main function in this file is BlenderClient.network_consumer, which is the f
 we register.
 """
 
+from collections import deque
 import logging
 import os
 import struct
-from typing import Set, Tuple, Optional
+import time
+from typing import Deque, Set, Tuple, Optional
 
 import bpy
 from mathutils import Matrix, Quaternion
@@ -29,6 +31,7 @@ from mixer.share_data import share_data
 from mixer.broadcaster import common
 from mixer.broadcaster.common import ClientAttributes, MessageType, RoomAttributes
 from mixer.broadcaster.client import Client
+from mixer.broadcaster.schema import get_schema
 from mixer.blender_client import camera as camera_api
 from mixer.blender_client import collection as collection_api
 from mixer.blender_client import data as data_api
@@ -47,6 +50,16 @@ from mixer.blender_client.light import send_light
 
 logger = logging.getLogger(__name__)
 
+# Seconds spent processing received commands per network_consumer() call
+APPLY_BUDGET = 0.008
+
+# Seconds until the next network_consumer() call: while received commands are left to process, after a call that sent
+# or received commands, and at most when there is no traffic. The interval doubles at each call without traffic, so
+# commands received while idle wait for up to IDLE_INTERVAL, the traffic is polled
+BACKLOG_INTERVAL = 0.0
+ACTIVE_INTERVAL = 0.01
+IDLE_INTERVAL = 0.1
+
 
 def get_target(region: bpy.types.Region, region_3d: bpy.types.RegionView3D, pixel_coords: Tuple[float, float]):
     from bpy_extras import view3d_utils
@@ -88,8 +101,9 @@ class BlenderClient(Client):
     See network_consumer() method which can be considered the entry point of this class.
     """
 
-    def __init__(self, host=common.DEFAULT_HOST, port=common.DEFAULT_PORT):
-        super(BlenderClient, self).__init__(host, port)
+    def __init__(self, host=common.DEFAULT_HOST, port=common.DEFAULT_PORT, compression=common.Compression.ZLIB):
+        # the socket is read and written by a thread, so that network transfers do not block the user interface
+        super(BlenderClient, self).__init__(host, port, compression, io_thread=True)
 
         self.textures: Set[str] = set()
 
@@ -100,6 +114,12 @@ class BlenderClient(Client):
         self.block_signals = False
         # block_signals is set to True when our timer transforms received commands into scene updates
 
+        self.apply_budget = APPLY_BUDGET
+        self._received_commands: Deque[common.Command] = deque()  # received, not processed yet
+        self._group_count = 0  # of GROUP_BEGIN processed without their GROUP_END
+        self._leaving = False  # until the server acknowledges leave_room()
+        self._consumer_interval = ACTIVE_INTERVAL
+
         self._joining: bool = False
         self._joining_room_name: Optional[str] = None
         self._received_command_count: int = 0
@@ -146,35 +166,38 @@ class BlenderClient(Client):
         s[2][2] = scale[2]
         return s @ r @ t
 
+    def build_matrix_from_columns(self, columns):
+        m = Matrix()
+        m.col[0] = columns[0]
+        m.col[1] = columns[1]
+        m.col[2] = columns[2]
+        m.col[3] = columns[3]
+        return m
+
     def decode_matrix(self, data, index):
         matrix_data, index = common.decode_matrix(data, index)
-        m = Matrix()
-        m.col[0] = matrix_data[0]
-        m.col[1] = matrix_data[1]
-        m.col[2] = matrix_data[2]
-        m.col[3] = matrix_data[3]
-        return m, index
+        return self.build_matrix_from_columns(matrix_data), index
 
     def build_transform(self, data):
-        start = 0
-        object_path, start = common.decode_string(data, start)
-        parent_invert_matrix, start = self.decode_matrix(data, start)
-        basis_matrix, start = self.decode_matrix(data, start)
-        local_matrix, start = self.decode_matrix(data, start)
+        transform = get_schema(MessageType.TRANSFORM).decode(data)
 
         try:
-            obj = self.get_or_create_path(object_path)
+            obj = self.get_or_create_path(transform.path)
         except KeyError:
             # Object doesn't exist anymore
             return
         if obj:
-            self.set_transform(obj, parent_invert_matrix, basis_matrix, local_matrix)
+            self.set_transform(
+                obj,
+                self.build_matrix_from_columns(transform.parent_inverse_matrix),
+                self.build_matrix_from_columns(transform.basis_matrix),
+                self.build_matrix_from_columns(transform.local_matrix),
+            )
 
     def build_rename(self, data):
         # Object rename, actually
         # renaming the data referenced by Object.data (Light, Camera, ...) is not supported
-        old_path, index = common.decode_string(data, 0)
-        new_path, index = common.decode_string(data, index)
+        old_path, new_path = get_schema(MessageType.RENAME).decode(data)
         logger.info("build_rename %s into %s", old_path, new_path)
         old_name = old_path.split("/")[-1]
         new_name = new_path.split("/")[-1]
@@ -183,9 +206,8 @@ class BlenderClient(Client):
         share_data.old_objects = share_data.blender_objects
 
     def build_duplicate(self, data):
-        src_path, index = common.decode_string(data, 0)
-        dst_name, index = common.decode_string(data, index)
-        basis_matrix, index = self.decode_matrix(data, index)
+        src_path, dst_name, basis_columns = get_schema(MessageType.DUPLICATE).decode(data)
+        basis_matrix = self.build_matrix_from_columns(basis_columns)
 
         try:
             obj = self.get_or_create_path(src_path)
@@ -203,7 +225,7 @@ class BlenderClient(Client):
             pass
 
     def build_delete(self, data):
-        path, _ = common.decode_string(data, 0)
+        path = get_schema(MessageType.DELETE).decode(data).name
 
         try:
             obj = share_data.blender_objects[path.split("/")[-1]]
@@ -247,11 +269,8 @@ class BlenderClient(Client):
 
     def get_transform_buffer(self, obj):
         path = self.get_object_path(obj)
-        return (
-            common.encode_string(path)
-            + common.encode_matrix(obj.matrix_parent_inverse)
-            + common.encode_matrix(obj.matrix_basis)
-            + common.encode_matrix(obj.matrix_local)
+        return get_schema(MessageType.TRANSFORM).encode(
+            path, obj.matrix_parent_inverse, obj.matrix_basis, obj.matrix_local
         )
 
     def send_transform(self, obj):
@@ -276,10 +295,14 @@ class BlenderClient(Client):
             return
         if os.path.exists(path):
             try:
-                f = open(path, "rb")
-                data = f.read()
-                f.close()
-                self.send_texture_data(path, data)
+                # the file is read when sent, chunk by chunk if the server allows it
+                size = os.path.getsize(path)
+                self.textures.add(path)
+                self.add_command(
+                    common.FileCommand(
+                        MessageType.TEXTURE, common.encode_string(path) + common.encode_int(size), path, size
+                    )
+                )
             except Exception as e:
                 logger.error("could not read file %s ...", path)
                 logger.error("... %s", e)
@@ -307,15 +330,10 @@ class BlenderClient(Client):
         return None
 
     def build_add_keyframe(self, data):
-        index = 0
-        name, index = common.decode_string(data, index)
+        name, channel, channel_index, frame, value = get_schema(MessageType.ADD_KEYFRAME).decode(data)
         if name not in share_data.blender_objects:
             return name
         ob = share_data.blender_objects[name]
-        channel, index = common.decode_string(data, index)
-        channel_index, index = common.decode_int(data, index)
-        frame, index = common.decode_int(data, index)
-        value, index = common.decode_float(data, index)
 
         if not hasattr(ob, channel):
             ob = ob.data
@@ -330,34 +348,28 @@ class BlenderClient(Client):
         return name
 
     def build_remove_keyframe(self, data):
-        index = 0
-        name, index = common.decode_string(data, index)
+        name, channel, channel_index = get_schema(MessageType.REMOVE_KEYFRAME).decode(data)
         if name not in share_data.blender_objects:
             return name
         ob = share_data.blender_objects[name]
-        channel, index = common.decode_string(data, index)
-        channel_index, index = common.decode_int(data, index)
         if not hasattr(ob, channel):
             ob = ob.data
         ob.keyframe_delete(channel, index=channel_index)
         return name
 
     def build_query_object_data(self, data):
-        index = 0
-        name, index = common.decode_string(data, index)
+        name = get_schema(MessageType.QUERY_OBJECT_DATA).decode(data).name
         self.query_object_data(name)
 
     def build_clear_animations(self, data):
-        index = 0
-        name, index = common.decode_string(data, index)
+        name = get_schema(MessageType.CLEAR_ANIMATIONS).decode(data).name
         ob = share_data.blender_objects[name]
         ob.animation_data_clear()
         if ob.data:
             ob.data.animation_data_clear()
 
     def build_montage_mode(self, data):
-        index = 0
-        montage, index = common.decode_bool(data, index)
+        montage = get_schema(MessageType.SHOT_MANAGER_MONTAGE_MODE).decode(data).montage_mode
         winman = bpy.data.window_managers["WinMan"]
         if hasattr(winman, "UAS_shot_manager_handler_toggle"):
             winman.UAS_shot_manager_handler_toggle = montage
@@ -442,8 +454,7 @@ class BlenderClient(Client):
                 slot.material = material_api.get_or_create_material(material_name)
 
     def send_set_current_scene(self, name):
-        buffer = common.encode_string(name)
-        self.add_command(common.Command(MessageType.SET_SCENE, buffer, 0))
+        self.add_command(get_schema(MessageType.SET_SCENE).command(name))
 
     def send_animation_buffer(self, obj_name, animation_data, channel_name, channel_index=-1):
         if not animation_data:
@@ -481,17 +492,14 @@ class BlenderClient(Client):
         self.send_animation_buffer(obj.name_full, obj.data.animation_data, "lens")
 
     def send_camera_attributes(self, obj):
-        buffer = (
-            common.encode_string(obj.name_full)
-            + common.encode_float(obj.data.lens)
-            + common.encode_float(obj.data.dof.aperture_fstop)
-            + common.encode_float(obj.data.dof.focus_distance)
+        self.add_command(
+            get_schema(MessageType.CAMERA_ATTRIBUTES).command(
+                obj.name_full, obj.data.lens, obj.data.dof.aperture_fstop, obj.data.dof.focus_distance
+            )
         )
-        self.add_command(common.Command(MessageType.CAMERA_ATTRIBUTES, buffer, 0))
 
     def send_current_camera(self, camera_name):
-        buffer = common.encode_string(camera_name)
-        self.add_command(common.Command(MessageType.CURRENT_CAMERA, buffer, 0))
+        self.add_command(get_schema(MessageType.CURRENT_CAMERA).command(camera_name))
 
     def send_deleted_object(self, obj_name):
         self.send_delete(obj_name)
@@ -501,32 +509,21 @@ class BlenderClient(Client):
             self.send_rename(old_name, new_name)
 
     def get_rename_buffer(self, old_name, new_name):
-        encoded_old_name = old_name.encode()
-        encoded_new_name = new_name.encode()
-        buffer = (
-            common.int_to_bytes(len(encoded_old_name), 4)
-            + encoded_old_name
-            + common.int_to_bytes(len(encoded_new_name), 4)
-            + encoded_new_name
-        )
-        return buffer
+        return get_schema(MessageType.RENAME).encode(old_name, new_name)
 
     def send_rename(self, old_name, new_name):
         logger.info("send_rename %s into %s", old_name, new_name)
         self.add_command(common.Command(MessageType.RENAME, self.get_rename_buffer(old_name, new_name), 0))
 
     def get_delete_buffer(self, name):
-        encoded_name = name.encode()
-        buffer = common.int_to_bytes(len(encoded_name), 4) + encoded_name
-        return buffer
+        return get_schema(MessageType.DELETE).encode(name)
 
     def send_delete(self, obj_name):
         logger.info("send_delate %s", obj_name)
         self.add_command(common.Command(MessageType.DELETE, self.get_delete_buffer(obj_name), 0))
 
     def build_frame(self, data):
-        start = 0
-        frame, start = common.decode_int(data, start)
+        frame = get_schema(MessageType.FRAME).decode(data).frame
         if bpy.context.scene.frame_current != frame:
             previous_value = share_data.client.skip_next_depsgraph_update
             share_data.client.skip_next_depsgraph_update = False
@@ -537,12 +534,10 @@ class BlenderClient(Client):
             share_data.client.skip_next_depsgraph_update = previous_value
 
     def send_frame(self, frame):
-        self.add_command(common.Command(MessageType.FRAME, common.encode_int(frame), 0))
+        self.add_command(get_schema(MessageType.FRAME).command(frame))
 
     def send_frame_start_end(self, start, end):
-        self.add_command(
-            common.Command(MessageType.FRAME_START_END, common.encode_int(start) + common.encode_int(end), 0)
-        )
+        self.add_command(get_schema(MessageType.FRAME_START_END).command(start, end))
 
     def override_context(self):
         for window in bpy.context.window_manager.windows:
@@ -614,212 +609,60 @@ class BlenderClient(Client):
 
         return {"blender_windows": windows, common.ClientAttributes.USERSCENES: scene_attributes}
 
+    def reset_received_commands(self):
+        """
+        Drop the received commands not processed yet, and the group they were part of, when the room is left or the
+        connection lost: the group will not be completed, and local changes would be ignored until it is.
+        """
+        self._received_commands.clear()
+        self._group_count = 0
+        self._leaving = False
+        self.block_signals = False
+
+    def leave_room(self, room_name: str):
+        self.reset_received_commands()
+        # the commands of the room received from now until the server acknowledges are dropped
+        self._leaving = True
+        return super().leave_room(room_name)
+
+    def disconnect(self):
+        self.reset_received_commands()
+        super().disconnect()
+
+    def handle_connection_lost(self):
+        self.reset_received_commands()
+        super().handle_connection_lost()
+
     @stats_timer(share_data)
-    def network_consumer(self):
+    def network_consumer(self) -> float:
         """
         This method can be considered the entry point of this class. It is meant to be called regularly to send
         pending commands to the server, and receive then process new ones.
 
         Pending commands are accumulated with add_command(), most calls originate from handlers function.
 
-        Incoming commands are read from the socket and directly processed here to update Blender's data. This can
-        be costly and a possible optimization in the future would be to split the processing accross several timer
-        run. This can be challenging because we need to keep the current update state. Maybe this can be solved
-        naturally with coroutines.
+        Incoming commands are read from the socket, and pending commands written to it, by the I/O thread of the
+        client, see ClientIOThread. The commands it has received are processed here to update Blender's data, for at
+        most apply_budget seconds per call so that Blender remains responsive while a room is joined. The commands
+        left are processed by the next calls, the GROUP_BEGIN and GROUP_END commands are counted across calls.
 
-        We call it from the timer registered by the addon.
-        """
+        We call it from the timer registered by the addon, that it schedules: return the number of seconds until the
+        next call, shorter while commands are received or sent, longer when there is no traffic.
 
-        from mixer.bl_panels import redraw as redraw_panels, update_ui_lists
+        The I/O thread cannot wake the timer, as the Blender API must only be used from the main thread. The traffic is
+        polled instead, with has_incoming_commands() at the end of each call, so that commands received while the
+        client is idle are processed at most IDLE_INTERVAL later.
+        """
 
         assert self.is_connected()
 
         set_draw_handlers()
 
-        # Loop remains infinite while we have GROUP_BEGIN commands without their corresponding GROUP_END received
-        # todo Change this -> probably not a good idea because the sending client might disconnect before GROUP_END occurs
-        # or it needs to be guaranteed by the server
-        group_count = 0
-        while True:
-            received_commands = self.fetch_commands(get_mixer_prefs().commands_send_interval)
-
-            set_dirty = True
-            # Process all received commands
-            for command in received_commands:
-                if self._joining and command.type.value > common.MessageType.COMMAND.value:
-                    self._received_byte_size += command.byte_size()
-                    self._received_command_count += 1
-                    if self._joining_room_name in self.rooms_attributes:
-                        get_mixer_props().joining_percentage = (
-                            self._received_byte_size
-                            / self.rooms_attributes[self._joining_room_name][RoomAttributes.BYTE_SIZE]
-                        )
-                        redraw_panels()
-
-                if command.type == MessageType.GROUP_BEGIN:
-                    group_count += 1
-                    continue
+        sending = len(self.pending_commands) > 0
+        received_commands = self.fetch_commands(get_mixer_prefs().commands_send_interval)
+        self._received_commands.extend(received_commands)
 
-                if command.type == MessageType.GROUP_END:
-                    group_count -= 1
-                    continue
-
-                if self.has_default_handler(command.type):
-                    if command.type == MessageType.JOIN_ROOM and self._joining:
-                        self._joining = False
-                        get_mixer_props().joining_percentage = 1
-
-                    update_ui_lists()
-                    self.block_signals = False  # todo investigate why we should but this to false here
-                    continue
-
-                if set_dirty:
-                    share_data.set_dirty()
-                    set_dirty = False
-
-                self.block_signals = True
-
-                try:
-                    if command.type == MessageType.CONTENT:
-                        # The server asks for scene content (at room creation)
-                        try:
-                            assert share_data.client.current_room is not None
-                            self.set_room_attributes(
-                                share_data.client.current_room,
-                                {"experimental_sync": get_mixer_prefs().experimental_sync},
-                            )
-                            send_scene_content()
-                            # Inform end of content
-                            self.add_command(common.Command(MessageType.CONTENT))
-                        except Exception as e:
-                            raise SendSceneContentFailed() from e
-                        continue
-
-                    # Put this to true by default
-                    # todo Check build commands that do not trigger depsgraph update
-                    # because it can lead to ignoring real updates when a false positive is encountered
-                    command_triggers_depsgraph_update = True
-
-                    if command.type == MessageType.GREASE_PENCIL_MESH:
-                        grease_pencil_api.build_grease_pencil_mesh(command.data)
-                    elif command.type == MessageType.GREASE_PENCIL_MATERIAL:
-                        grease_pencil_api.build_grease_pencil_material(command.data)
-                    elif command.type == MessageType.GREASE_PENCIL_CONNECTION:
-                        grease_pencil_api.build_grease_pencil_connection(command.data)
-
-                    elif command.type == MessageType.CLEAR_CONTENT:
-                        clear_scene_content()
-                        self._joining = True
-                        self._received_command_count = 0
-                        self._received_byte_size = 0
-                        get_mixer_props().joining_percentage = 0
-                        redraw_panels()
-                    elif command.type == MessageType.MESH:
-                        self.build_mesh(command.data)
-                    elif command.type == MessageType.TRANSFORM:
-                        self.build_transform(command.data)
-                    elif command.type == MessageType.MATERIAL:
-                        material_api.build_material(command.data)
-                    elif command.type == MessageType.ASSIGN_MATERIAL:
-                        material_api.build_assign_material(command.data)
-                    elif command.type == MessageType.DELETE:
-                        self.build_delete(command.data)
-                    elif command.type == MessageType.CAMERA:
-                        camera_api.build_camera(command.data)
-                    elif command.type == MessageType.LIGHT:
-                        light_api.build_light(command.data)
-                    elif command.type == MessageType.RENAME:
-                        self.build_rename(command.data)
-                    elif command.type == MessageType.DUPLICATE:
-                        self.build_duplicate(command.data)
-                    elif command.type == MessageType.SEND_TO_TRASH:
-                        self.build_send_to_trash(command.data)
-                    elif command.type == MessageType.RESTORE_FROM_TRASH:
-                        self.build_restore_from_trash(command.data)
-                    elif command.type == MessageType.TEXTURE:
-                        self.build_texture_file(command.data)
-
-                    elif command.type == MessageType.COLLECTION:
-                        collection_api.build_collection(command.data)
-                    elif command.type == MessageType.COLLECTION_REMOVED:
-                        collection_api.build_collection_removed(command.data)
-
-                    elif command.type == MessageType.INSTANCE_COLLECTION:
-                        collection_api.build_collection_instance(command.data)
-
-                    elif command.type == MessageType.ADD_COLLECTION_TO_COLLECTION:
-                        collection_api.build_collection_to_collection(command.data)
-                    elif command.type == MessageType.REMOVE_COLLECTION_FROM_COLLECTION:
-                        collection_api.build_remove_collection_from_collection(command.data)
-                    elif command.type == MessageType.ADD_OBJECT_TO_COLLECTION:
-                        collection_api.build_add_object_to_collection(command.data)
-                    elif command.type == MessageType.REMOVE_OBJECT_FROM_COLLECTION:
-                        collection_api.build_remove_object_from_collection(command.data)
-
-                    elif command.type == MessageType.ADD_COLLECTION_TO_SCENE:
-                        scene_api.build_collection_to_scene(command.data)
-                    elif command.type == MessageType.REMOVE_COLLECTION_FROM_SCENE:
-                        scene_api.build_remove_collection_from_scene(command.data)
-                    elif command.type == MessageType.ADD_OBJECT_TO_SCENE:
-                        scene_api.build_add_object_to_scene(command.data)
-                    elif command.type == MessageType.REMOVE_OBJECT_FROM_SCENE:
-                        scene_api.build_remove_object_from_scene(command.data)
-
-                    elif command.type == MessageType.SCENE:
-                        scene_api.build_scene(command.data)
-                    elif command.type == MessageType.SCENE_REMOVED:
-                        scene_api.build_scene_removed(command.data)
-                    elif command.type == MessageType.SCENE_RENAMED:
-                        scene_api.build_scene_renamed(command.data)
-
-                    elif command.type == MessageType.OBJECT_VISIBILITY:
-                        object_api.build_object_visibility(command.data)
-
-                    elif command.type == MessageType.FRAME:
-                        self.build_frame(command.data)
-                    elif command.type == MessageType.QUERY_CURRENT_FRAME:
-                        self.query_current_frame()
-
-                    elif command.type == MessageType.PLAY:
-                        self.build_play(command.data)
-                    elif command.type == MessageType.PAUSE:
-                        self.build_pause(command.data)
-                    elif command.type == MessageType.ADD_KEYFRAME:
-                        self.build_add_keyframe(command.data)
-                    elif command.type == MessageType.REMOVE_KEYFRAME:
-                        self.build_remove_keyframe(command.data)
-                    elif command.type == MessageType.QUERY_OBJECT_DATA:
-                        self.build_query_object_data(command.data)
-
-                    elif command.type == MessageType.CLEAR_ANIMATIONS:
-                        self.build_clear_animations(command.data)
-                    elif command.type == MessageType.SHOT_MANAGER_MONTAGE_MODE:
-                        self.build_montage_mode(command.data)
-                    elif command.type == MessageType.SHOT_MANAGER_ACTION:
-                        shot_manager.build_shot_manager_action(command.data)
-
-                    elif command.type == MessageType.BLENDER_DATA_UPDATE:
-                        data_api.build_data_update(command.data)
-                    elif command.type == MessageType.BLENDER_DATA_REMOVE:
-                        data_api.build_data_remove(command.data)
-                    else:
-                        # Command is ignored, so no depsgraph update can be triggered
-                        command_triggers_depsgraph_update = False
-
-                    if command_triggers_depsgraph_update:
-                        self.skip_next_depsgraph_update = True
-
-                except Exception as e:
-                    logger.warning(f"Exception during processing of message {str(command.type)} ...\n", stack_info=True)
-                    if get_mixer_prefs().env == "development" or isinstance(e, SendSceneContentFailed):
-                        raise
-
-                self.block_signals = False
-
-            if group_count == 0:
-                break
-
-        if not set_dirty:
+        if self.apply_received_commands():
             share_data.update_current_data()
 
         # Some objects may have been obtained before their parent
@@ -842,7 +685,217 @@ class BlenderClient(Client):
                     parent = ob
             share_data.pending_parenting = remaining_parentings
 
-        self.set_client_attributes(self.compute_client_custom_attributes())
+        self.set_presence_attributes(self.compute_client_custom_attributes())
+
+        if self._received_commands or self.has_incoming_commands():
+            self._consumer_interval = BACKLOG_INTERVAL
+        elif sending or received_commands or len(self.pending_commands) > 0:
+            self._consumer_interval = ACTIVE_INTERVAL
+        else:
+            self._consumer_interval = min(max(2 * self._consumer_interval, ACTIVE_INTERVAL), IDLE_INTERVAL)
+
+        if share_data.current_stats_timer is not None:
+            share_data.current_stats_timer.add_value("interval", self._consumer_interval)
+        return self._consumer_interval
+
+    def apply_received_commands(self) -> bool:
+        """
+        Process the received commands for at most apply_budget seconds. Return True if commands that update Blender
+        data were processed.
+        """
+        from mixer.bl_panels import redraw as redraw_panels, update_ui_lists
+
+        # Apply the received commands until the budget is spent, and at least one of the commands that update Blender
+        # data (set_dirty is then cleared), so that progress is made when a single one exceeds the budget. The others
+        # are applied by the next calls.
+        deadline = time.perf_counter() + self.apply_budget
+        set_dirty = True
+        while self._received_commands and (set_dirty or time.perf_counter() < deadline):
+            command = self._received_commands.popleft()
+            if self._leaving:
+                if command.type in (MessageType.LEAVE_ROOM, MessageType.CLEAR_CONTENT, MessageType.SEND_ERROR):
+                    self._leaving = False
+                elif command.type > MessageType.COMMAND:
+                    continue
+
+            if self._joining and command.type.value > common.MessageType.COMMAND.value:
+                self._received_byte_size += command.byte_size()
+                self._received_command_count += 1
+                if self._joining_room_name in self.rooms_attributes:
+                    get_mixer_props().joining_percentage = (
+                        self._received_byte_size
+                        / self.rooms_attributes[self._joining_room_name][RoomAttributes.BYTE_SIZE]
+                    )
+                    redraw_panels()
+
+            if command.type == MessageType.GROUP_BEGIN:
+                self._group_count += 1
+                continue
+
+            if command.type == MessageType.GROUP_END:
+                # the GROUP_BEGIN may have been dropped with the commands of a room that was left
+                self._group_count = max(0, self._group_count - 1)
+                continue
+
+            if self.has_default_handler(command.type):
+                if command.type == MessageType.JOIN_ROOM and self._joining:
+                    self._joining = False
+                    get_mixer_props().joining_percentage = 1
+
+                update_ui_lists()
+                self.block_signals = False  # todo investigate why we should but this to false here
+                continue
+
+            if set_dirty:
+                share_data.set_dirty()
+                set_dirty = False
+
+            self.block_signals = True
+
+            try:
+                if command.type == MessageType.CONTENT:
+                    # The server asks for scene content (at room creation)
+                    try:
+                        assert share_data.client.current_room is not None
+                        self.set_room_attributes(
+                            share_data.client.current_room,
+                            {"experimental_sync": get_mixer_prefs().experimental_sync},
+                        )
+                        send_scene_content()
+                        # Inform end of content
+                        self.add_command(common.Command(MessageType.CONTENT))
+                    except Exception as e:
+                        raise SendSceneContentFailed() from e
+                    continue
+
+                # Put this to true by default
+                # todo Check build commands that do not trigger depsgraph update
+                # because it can lead to ignoring real updates when a false positive is encountered
+                command_triggers_depsgraph_update = True
+
+                if command.type == MessageType.GREASE_PENCIL_MESH:
+                    grease_pencil_api.build_grease_pencil_mesh(command.data)
+                elif command.type == MessageType.GREASE_PENCIL_MATERIAL:
+                    grease_pencil_api.build_grease_pencil_material(command.data)
+                elif command.type == MessageType.GREASE_PENCIL_CONNECTION:
+                    grease_pencil_api.build_grease_pencil_connection(command.data)
+
+                elif command.type == MessageType.CLEAR_CONTENT:
+                    clear_scene_content()
+                    self._group_count = 0
+                    self._joining = True
+                    self._received_command_count = 0
+                    self._received_byte_size = 0
+                    get_mixer_props().joining_percentage = 0
+                    redraw_panels()
+                elif command.type == MessageType.MESH:
+                    self.build_mesh(command.data)
+                elif command.type == MessageType.TRANSFORM:
+                    self.build_transform(command.data)
+                elif command.type == MessageType.MATERIAL:
+                    material_api.build_material(command.data)
+                elif command.type == MessageType.ASSIGN_MATERIAL:
+                    material_api.build_assign_material(command.data)
+                elif command.type == MessageType.DELETE:
+                    self.build_delete(command.data)
+                elif command.type == MessageType.CAMERA:
+                    camera_api.build_camera(command.data)
+                elif command.type == MessageType.LIGHT:
+                    light_api.build_light(command.data)
+                elif command.type == MessageType.RENAME:
+                    self.build_rename(command.data)
+                elif command.type == MessageType.DUPLICATE:
+                    self.build_duplicate(command.data)
+                elif command.type == MessageType.SEND_TO_TRASH:
+                    self.build_send_to_trash(command.data)
+                elif command.type == MessageType.RESTORE_FROM_TRASH:
+                    self.build_restore_from_trash(command.data)
+                elif command.type == MessageType.TEXTURE:
+                    self.build_texture_file(command.data)
+
+                elif command.type == MessageType.COLLECTION:
+                    collection_api.build_collection(command.data)
+                elif command.type == MessageType.COLLECTION_REMOVED:
+                    collection_api.build_collection_removed(command.data)
+
+                elif command.type == MessageType.INSTANCE_COLLECTION:
+                    collection_api.build_collection_instance(command.data)
+
+                elif command.type == MessageType.ADD_COLLECTION_TO_COLLECTION:
+                    collection_api.build_collection_to_collection(command.data)
+                elif command.type == MessageType.REMOVE_COLLECTION_FROM_COLLECTION:
+                    collection_api.build_remove_collection_from_collection(command.data)
+                elif command.type == MessageType.ADD_OBJECT_TO_COLLECTION:
+                    collection_api.build_add_object_to_collection(command.data)
+                elif command.type == MessageType.REMOVE_OBJECT_FROM_COLLECTION:
+                    collection_api.build_remove_object_from_collection(command.data)
+
+                elif command.type == MessageType.ADD_COLLECTION_TO_SCENE:
+                    scene_api.build_collection_to_scene(command.data)
+                elif command.type == MessageType.REMOVE_COLLECTION_FROM_SCENE:
+                    scene_api.build_remove_collection_from_scene(command.data)
+                elif command.type == MessageType.ADD_OBJECT_TO_SCENE:
+                    scene_api.build_add_object_to_scene(command.data)
+                elif command.type == MessageType.REMOVE_OBJECT_FROM_SCENE:
+                    scene_api.build_remove_object_from_scene(command.data)
+
+                elif command.type == MessageType.SCENE:
+                    scene_api.build_scene(command.data)
+                elif command.type == MessageType.SCENE_REMOVED:
+                    scene_api.build_scene_removed(command.data)
+                elif command.type == MessageType.SCENE_RENAMED:
+                    scene_api.build_scene_renamed(command.data)
+
+                elif command.type == MessageType.OBJECT_VISIBILITY:
+                    object_api.build_object_visibility(command.data)
+
+                elif command.type == MessageType.FRAME:
+                    self.build_frame(command.data)
+                elif command.type == MessageType.QUERY_CURRENT_FRAME:
+                    self.query_current_frame()
+
+                elif command.type == MessageType.PLAY:
+                    self.build_play(command.data)
+                elif command.type == MessageType.PAUSE:
+                    self.build_pause(command.data)
+                elif command.type == MessageType.ADD_KEYFRAME:
+                    self.build_add_keyframe(command.data)
+                elif command.type == MessageType.REMOVE_KEYFRAME:
+                    self.build_remove_keyframe(command.data)
+                elif command.type == MessageType.QUERY_OBJECT_DATA:
+                    self.build_query_object_data(command.data)
+
+                elif command.type == MessageType.CLEAR_ANIMATIONS:
+                    self.build_clear_animations(command.data)
+                elif command.type == MessageType.SHOT_MANAGER_MONTAGE_MODE:
+                    self.build_montage_mode(command.data)
+                elif command.type == MessageType.SHOT_MANAGER_ACTION:
+                    shot_manager.build_shot_manager_action(command.data)
+
+                elif command.type == MessageType.BLENDER_DATA_UPDATE:
+                    data_api.build_data_update(command.data)
+                elif command.type == MessageType.BLENDER_DATA_BINARY_UPDATE:
+                    data_api.build_data_update(command.data, binary=True)
+                elif command.type == MessageType.BLENDER_DATA_REMOVE:
+                    data_api.build_data_remove(command.data)
+                else:
+                    # Command is ignored, so no depsgraph update can be triggered
+                    command_triggers_depsgraph_update = False
+
+                if command_triggers_depsgraph_update:
+                    self.skip_next_depsgraph_update = True
+
+            except Exception as e:
+                logger.warning(f"Exception during processing of message {str(command.type)} ...\n", stack_info=True)
+                if get_mixer_prefs().env == "development" or isinstance(e, SendSceneContentFailed):
+                    raise
+
+            self.block_signals = False
+
+        # A group is applied over several calls. Until it is complete, its commands are not sent back to the server as
+        # local changes
+        self.block_signals = self._group_count > 0
+        return not set_dirty
 
 
 def update_params(obj):
@@ -2,6 +2,7 @@ import logging
 from mixer.blender_client.misc import get_or_create_object_data, get_object_path
 from mixer.broadcaster import common
 from mixer.broadcaster.client import Client
+from mixer.broadcaster.schema import get_schema
 from mixer.share_data import share_data
 import bpy
 
@@ -26,16 +27,16 @@ def get_camera_buffer(obj):
     sensor_height = cam.sensor_height
 
     path = get_object_path(obj)
-    return (
-        common.encode_string(path)
-        + common.encode_string(obj.name_full)
-        + common.encode_float(focal)
-        + common.encode_float(front_clip_plane)
-        + common.encode_float(far_clip_plane)
-        + common.encode_float(aperture)
-        + common.encode_int(sensor_fit.value)
-        + common.encode_float(sensor_width)
-        + common.encode_float(sensor_height)
+    return get_schema(common.MessageType.CAMERA).encode(
+        path,
+        obj.name_full,
+        focal,
+        front_clip_plane,
+        far_clip_plane,
+        aperture,
+        sensor_fit.value,
+        sensor_width,
+        sensor_height,
     )
 
 
@@ -47,18 +48,18 @@ def send_camera(client: Client, obj):
 
 
 def build_camera(data):
-    camera_path, start = common.decode_string(data, 0)
+    attributes = get_schema(common.MessageType.CAMERA).decode(data)
+    camera_path = attributes.path
     logger.info("build_camera %s", camera_path)
-    camera_name, start = common.decode_string(data, start)
-    camera = get_or_create_camera(camera_name)
+    camera = get_or_create_camera(attributes.name)
 
-    camera.lens, start = common.decode_float(data, start)
-    camera.clip_start, start = common.decode_float(data, start)
-    camera.clip_end, start = common.decode_float(data, start)
-    camera.dof.aperture_fstop, start = common.decode_float(data, start)
-    sensor_fit, start = common.decode_int(data, start)
-    camera.sensor_width, start = common.decode_float(data, start)
-    camera.sensor_height, start = common.decode_float(data, start)
+    camera.lens = attributes.lens
+    camera.clip_start = attributes.clip_start
+    camera.clip_end = attributes.clip_end
+    camera.dof.aperture_fstop = attributes.aperture_fstop
+    sensor_fit = attributes.sensor_fit
+    camera.sensor_width = attributes.sensor_width
+    camera.sensor_height = attributes.sensor_height
 
     if sensor_fit == 0:
         camera.sensor_fit = "AUTO"
@@ -3,6 +3,7 @@ import bpy
 
 from mixer.broadcaster import common
 from mixer.broadcaster.client import Client
+from mixer.broadcaster.schema import get_schema
 from mixer.share_data import share_data
 
 logger = logging.getLogger(__name__)
@@ -16,21 +17,16 @@ def send_collection(client: Client, collection: bpy.types.Collection):
     if layer_collection:
         temporary_visibility = not layer_collection.hide_viewport
 
-    buffer = (
-        common.encode_string(collection.name_full)
-        + common.encode_bool(not collection.hide_viewport)
-        + common.encode_vector3(collection_instance_offset)
-        + common.encode_bool(temporary_visibility)
+    client.add_command(
+        get_schema(common.MessageType.COLLECTION).command(
+            collection.name_full, not collection.hide_viewport, collection_instance_offset, temporary_visibility
+        )
     )
-    client.add_command(common.Command(common.MessageType.COLLECTION, buffer, 0))
 
 
 def build_collection(data):
-    name_full, index = common.decode_string(data, 0)
-    visible, index = common.decode_bool(data, index)
+    name_full, visible, offset, temporary_visibility = get_schema(common.MessageType.COLLECTION).decode(data)
     hide_viewport = not visible
-    offset, index = common.decode_vector3(data, index)
-    temporary_visibility, index = common.decode_bool(data, index)
 
     logger.info("build_collection %s", name_full)
     collection = share_data.blender_collections.get(name_full)
@@ -51,12 +47,11 @@ def build_collection(data):
 
 def send_collection_removed(client: Client, collection_name):
     logger.info("send_collection_removed %s", collection_name)
-    buffer = common.encode_string(collection_name)
-    client.add_command(common.Command(common.MessageType.COLLECTION_REMOVED, buffer, 0))
+    client.add_command(get_schema(common.MessageType.COLLECTION_REMOVED).command(collection_name))
 
 
 def build_collection_removed(data):
-    name_full, index = common.decode_string(data, 0)
+    name_full = get_schema(common.MessageType.COLLECTION_REMOVED).decode(data).name
     logger.info("build_collectionRemove %s", name_full)
     collection = share_data.blender_collections[name_full]
     del share_data.blender_collections[name_full]
@@ -66,13 +61,13 @@ def build_collection_removed(data):
 def send_add_collection_to_collection(client: Client, parent_collection_name, collection_name):
     logger.info("send_add_collection_to_collection %s <- %s", parent_collection_name, collection_name)
 
-    buffer = common.encode_string(parent_collection_name) + common.encode_string(collection_name)
-    client.add_command(common.Command(common.MessageType.ADD_COLLECTION_TO_COLLECTION, buffer, 0))
+    client.add_command(
+        get_schema(common.MessageType.ADD_COLLECTION_TO_COLLECTION).command(parent_collection_name, collection_name)
+    )
 
 
 def build_collection_to_collection(data):
-    parent_name, index = common.decode_string(data, 0)
-    child_name, _ = common.decode_string(data, index)
+    parent_name, child_name = get_schema(common.MessageType.ADD_COLLECTION_TO_COLLECTION).decode(data)
     logger.info("build_collection_to_collection %s <- %s", parent_name, child_name)
 
     parent = share_data.blender_collections[parent_name]
@@ -83,13 +78,15 @@ def build_collection_to_collection(data):
 def send_remove_collection_from_collection(client: Client, parent_collection_name, collection_name):
     logger.info("send_remove_collection_from_collection %s <- %s", parent_collection_name, collection_name)
 
-    buffer = common.encode_string(parent_collection_name) + common.encode_string(collection_name)
-    client.add_command(common.Command(common.MessageType.REMOVE_COLLECTION_FROM_COLLECTION, buffer, 0))
+    client.add_command(
+        get_schema(common.MessageType.REMOVE_COLLECTION_FROM_COLLECTION).command(
+            parent_collection_name, collection_name
+        )
+    )
 
 
 def build_remove_collection_from_collection(data):
-    parent_name, index = common.decode_string(data, 0)
-    child_name, _ = common.decode_string(data, index)
+    parent_name, child_name = get_schema(common.MessageType.REMOVE_COLLECTION_FROM_COLLECTION).decode(data)
     logger.info("build_remove_collection_from_collection %s <- %s", parent_name, child_name)
 
     parent = share_data.blender_collections[parent_name]
@@ -99,13 +96,11 @@ def build_remove_collection_from_collection(data):
 
 def send_add_object_to_collection(client: Client, collection_name, obj_name):
     logger.info("send_add_object_to_collection %s <- %s", collection_name, obj_name)
-    buffer = common.encode_string(collection_name) + common.encode_string(obj_name)
-    client.add_command(common.Command(common.MessageType.ADD_OBJECT_TO_COLLECTION, buffer, 0))
+    client.add_command(get_schema(common.MessageType.ADD_OBJECT_TO_COLLECTION).command(collection_name, obj_name))
 
 
 def build_add_object_to_collection(data):
-    collection_name, index = common.decode_string(data, 0)
-    object_name, _ = common.decode_string(data, index)
+    collection_name, object_name = get_schema(common.MessageType.ADD_OBJECT_TO_COLLECTION).decode(data)
     logger.info("build_add_object_to_collection %s <- %s", collection_name, object_name)
 
     collection = share_data.blender_collections[collection_name]
@@ -119,13 +114,11 @@ def build_add_object_to_collection(data):
 
 def send_remove_object_from_collection(client: Client, collection_name, obj_name):
     logger.info("send_remove_object_from_collection %s <- %s", collection_name, obj_name)
-    buffer = common.encode_string(collection_name) + common.encode_string(obj_name)
-    client.add_command(common.Command(common.MessageType.REMOVE_OBJECT_FROM_COLLECTION, buffer, 0))
+    client.add_command(get_schema(common.MessageType.REMOVE_OBJECT_FROM_COLLECTION).command(collection_name, obj_name))
 
 
 def build_remove_object_from_collection(data):
-    collection_name, index = common.decode_string(data, 0)
-    object_name, _ = common.decode_string(data, index)
+    collection_name, object_name = get_schema(common.MessageType.REMOVE_OBJECT_FROM_COLLECTION).decode(data)
     logger.info("build_remove_object_from_collection %s <- %s", collection_name, object_name)
 
     collection = share_data.blender_collections[collection_name]
@@ -140,13 +133,13 @@ def send_collection_instance(client: Client, obj):
         return
     instance_name = obj.name_full
     instanciated_collection = obj.instance_collection.name_full
-    buffer = common.encode_string(instance_name) + common.encode_string(instanciated_collection)
-    client.add_command(common.Command(common.MessageType.INSTANCE_COLLECTION, buffer, 0))
+    client.add_command(
+        get_schema(common.MessageType.INSTANCE_COLLECTION).command(instance_name, instanciated_collection)
+    )
 
 
 def build_collection_instance(data):
-    instance_name, index = common.decode_string(data, 0)
-    instantiated_name, _ = common.decode_string(data, index)
+    instance_name, instantiated_name = get_schema(common.MessageType.INSTANCE_COLLECTION).decode(data)
     logger.info("build_collection_instance %s from %s", instantiated_name, instance_name)
 
     instantiated = share_data.blender_collections[instantiated_name]
@@ -9,6 +9,7 @@ import logging
 import traceback
 from typing import List, Tuple
 
+from mixer.blender_data.binary_codec import BinaryCodec
 from mixer.blender_data.json_codec import Codec
 from mixer.blender_data.proxy import BpyIDProxy
 from mixer.broadcaster import common
@@ -59,12 +60,19 @@ def blenddata_path(proxy):
 #
 # WARNING There ara duplicate keys in blendata collections with linked blendfiles
 #
-def build_data_update(buffer):
+def build_data_update(buffer, binary: bool = False):
+    """
+    Apply a BLENDER_DATA_UPDATE, or a BLENDER_DATA_BINARY_UPDATE if binary is True.
+    """
     if not share_data.use_experimental_sync():
         return
 
-    buffer, _ = common.decode_string(buffer, 0)
-    codec = Codec()
+    if binary:
+        codec = BinaryCodec()
+    else:
+        buffer, _ = common.decode_string(buffer, 0)
+        codec = Codec()
+    id_proxy = None
     try:
         id_proxy = codec.decode(buffer)
         try:
@@ -78,13 +86,14 @@ def build_data_update(buffer):
         # TODO temporary until VRtist protocol uses Blenddata instead of blender_objects & co
         share_data.set_dirty()
     except Exception:
+        excerpt = buffer if isinstance(buffer, str) else str(bytes(buffer))
         logger.error(
             "Exception during build_data_update\n"
             + traceback.format_exc()
-            + f"During processing of buffer with blenddata_path {id_proxy._blenddata_path}\n"
-            + buffer[0:200]
+            + f"During processing of buffer with blenddata_path {getattr(id_proxy, '_blenddata_path', None)}\n"
+            + excerpt[0:200]
             + "\n...\n"
-            + buffer[-200:0]
+            + excerpt[-200:]
         )
         logger.error(f"Creation or update of bpy.data.{collection_name}[{key}] was ignored")
 
@@ -105,7 +114,7 @@ def send_data_updates(updates: List[BpyIDProxy]):
         return
     if not updates:
         return
-    codec = Codec()
+    codec = BinaryCodec() if share_data.binary_data_codec else Codec()
     for proxy in updates:
         # We send an ID, so we need to make sure that it includes a bp.data collection name
         # and the associated key
@@ -125,6 +134,8 @@ def send_data_updates(updates: List[BpyIDProxy]):
             logger.error(f"while processing bpy.data.{collection_name}[{key}]:")
 
         # For BpyIdProxy, the target is encoded in the proxy._blenddata_path
-        buffer = common.encode_string(encoded_proxy)
-        command = common.Command(common.MessageType.BLENDER_DATA_UPDATE, buffer, 0)
+        if isinstance(encoded_proxy, str):
+            command = common.Command(common.MessageType.BLENDER_DATA_UPDATE, common.encode_string(encoded_proxy), 0)
+        else:
+            command = common.Command(common.MessageType.BLENDER_DATA_BINARY_UPDATE, encoded_proxy, 0)
         share_data.client.add_command(command)
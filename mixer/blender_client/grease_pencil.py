@@ -3,6 +3,7 @@ import struct
 from mixer.blender_client.misc import get_or_create_object_data, get_object_path
 from mixer.broadcaster import common
 from mixer.broadcaster.client import Client
+from mixer.broadcaster.schema import get_schema
 from mixer.share_data import share_data
 import bpy
 
@@ -94,27 +95,29 @@ def send_grease_pencil_material(client: Client, material):
     fill_enable = gp_material.show_fill
     fill_style = gp_material.fill_style
     fill_color = gp_material.fill_color
-    gp_material_buffer = common.encode_string(material.name_full)
-    gp_material_buffer += common.encode_bool(stroke_enable)
-    gp_material_buffer += common.encode_string(stroke_mode)
-    gp_material_buffer += common.encode_string(stroke_style)
-    gp_material_buffer += common.encode_color(stroke_color)
-    gp_material_buffer += common.encode_bool(stroke_overlap)
-    gp_material_buffer += common.encode_bool(fill_enable)
-    gp_material_buffer += common.encode_string(fill_style)
-    gp_material_buffer += common.encode_color(fill_color)
-    client.add_command(common.Command(common.MessageType.GREASE_PENCIL_MATERIAL, gp_material_buffer, 0))
+    client.add_command(
+        get_schema(common.MessageType.GREASE_PENCIL_MATERIAL).command(
+            material.name_full,
+            stroke_enable,
+            stroke_mode,
+            stroke_style,
+            stroke_color,
+            stroke_overlap,
+            fill_enable,
+            fill_style,
+            fill_color,
+        )
+    )
 
 
 def send_grease_pencil_connection(client: Client, obj):
-    buffer = common.encode_string(get_object_path(obj))
-    buffer += common.encode_string(obj.data.name_full)
-    client.add_command(common.Command(common.MessageType.GREASE_PENCIL_CONNECTION, buffer, 0))
+    client.add_command(
+        get_schema(common.MessageType.GREASE_PENCIL_CONNECTION).command(get_object_path(obj), obj.data.name_full)
+    )
 
 
 def build_grease_pencil_connection(data):
-    path, start = common.decode_string(data, 0)
-    grease_pencil_name, start = common.decode_string(data, start)
+    path, grease_pencil_name = get_schema(common.MessageType.GREASE_PENCIL_CONNECTION).decode(data)
     gp = share_data.blender_grease_pencils[grease_pencil_name]
     get_or_create_object_data(path, gp)
 
@@ -196,7 +199,8 @@ def build_grease_pencil_mesh(data):
 
 
 def build_grease_pencil_material(data):
-    grease_pencil_material_name, start = common.decode_string(data, 0)
+    attributes = get_schema(common.MessageType.GREASE_PENCIL_MATERIAL).decode(data)
+    grease_pencil_material_name = attributes.name
     material = share_data.blender_materials.get(grease_pencil_material_name)
     if not material:
         material = bpy.data.materials.new(grease_pencil_material_name)
@@ -205,14 +209,14 @@ def build_grease_pencil_material(data):
         bpy.data.materials.create_gpencil_data(material)
 
     gp_material = material.grease_pencil
-    gp_material.show_stroke, start = common.decode_bool(data, start)
-    gp_material.mode, start = common.decode_string(data, start)
-    gp_material.stroke_style, start = common.decode_string(data, start)
-    gp_material.color, start = common.decode_color(data, start)
-    gp_material.use_overlap_strokes, start = common.decode_bool(data, start)
-    gp_material.show_fill, start = common.decode_bool(data, start)
-    gp_material.fill_style, start = common.decode_string(data, start)
-    gp_material.fill_color, start = common.decode_color(data, start)
+    gp_material.show_stroke = attributes.show_stroke
+    gp_material.mode = attributes.mode
+    gp_material.stroke_style = attributes.stroke_style
+    gp_material.color = attributes.color
+    gp_material.use_overlap_strokes = attributes.use_overlap_strokes
+    gp_material.show_fill = attributes.show_fill
+    gp_material.fill_style = attributes.fill_style
+    gp_material.fill_color = attributes.fill_color
 
 
 def build_grease_pencil(data):
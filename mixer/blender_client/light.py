@@ -2,6 +2,7 @@ import logging
 from mixer.blender_client.misc import get_or_create_object_data, get_object_path
 from mixer.broadcaster import common
 from mixer.broadcaster.client import Client
+from mixer.broadcaster.schema import get_schema
 from mixer.share_data import share_data
 import bpy
 
@@ -35,15 +36,8 @@ def get_light_buffer(obj):
         spot_size = light.spot_size
         spot_blend = light.spot_blend
 
-    return (
-        common.encode_string(get_object_path(obj))
-        + common.encode_string(light.name_full)
-        + common.encode_int(light_type.value)
-        + common.encode_int(shadow)
-        + common.encode_color(color)
-        + common.encode_float(power)
-        + common.encode_float(spot_size)
-        + common.encode_float(spot_blend)
+    return get_schema(common.MessageType.LIGHT).encode(
+        get_object_path(obj), light.name_full, light_type.value, shadow, color, power, spot_size, spot_blend
     )
 
 
@@ -55,10 +49,10 @@ def send_light(client: Client, obj):
 
 
 def build_light(data):
-    light_path, start = common.decode_string(data, 0)
-    light_name, start = common.decode_string(data, start)
+    attributes = get_schema(common.MessageType.LIGHT).decode(data)
+    light_path = attributes.path
     logger.info("build_light %s", light_path)
-    light_type, start = common.decode_int(data, start)
+    light_type = attributes.light_type
     blighttype = "POINT"
     if light_type == common.LightType.SUN.value:
         blighttype = "SUN"
@@ -69,20 +63,19 @@ def build_light(data):
     else:
         blighttype = "SPOT"
 
-    light = get_or_create_light(light_name, blighttype)
+    light = get_or_create_light(attributes.name, blighttype)
 
-    shadow, start = common.decode_int(data, start)
-    if shadow != 0:
+    if attributes.shadow != 0:
         light.use_shadow = True
     else:
         light.use_shadow = False
 
-    color, start = common.decode_color(data, start)
+    color = attributes.color
     light.color = (color[0], color[1], color[2])
-    light.energy, start = common.decode_float(data, start)
+    light.energy = attributes.power
     if light_type == common.LightType.SPOT.value:
-        light.spot_size, start = common.decode_float(data, start)
-        light.spot_blend, start = common.decode_float(data, start)
+        light.spot_size = attributes.spot_size
+        light.spot_blend = attributes.spot_blend
 
     get_or_create_object_data(light_path, light)
 
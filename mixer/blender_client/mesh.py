@@ -3,7 +3,7 @@ import struct
 
 import bpy
 import bmesh
-from mathutils import Vector
+import numpy
 
 from mixer.broadcaster import common
 from mixer.stats import stats_timer
@@ -13,11 +13,6 @@ from mixer.blender_client import material as material_api
 logger = logging.getLogger(__name__)
 
 
-def decode_layer_float(elmt, layer, data, index):
-    elmt[layer], index = common.decode_float(data, index)
-    return index
-
-
 def extract_layer_float(elmt, layer):
     return (elmt[layer],)
 
@@ -25,11 +20,6 @@ def extract_layer_float(elmt, layer):
 extract_layer_float.struct = "1f"
 
 
-def decode_layer_int(elmt, layer, data, index):
-    elmt[layer], index = common.decode_int(data, index)
-    return index
-
-
 def extract_layer_int(elmt, layer):
     return (elmt[layer],)
 
@@ -37,11 +27,6 @@ def extract_layer_int(elmt, layer):
 extract_layer_int.struct = "1i"
 
 
-def decode_layer_vector(elmt, layer, data, index):
-    elmt[layer], index = common.decode_vector3(data, index)
-    return index
-
-
 def extract_layer_vector3(elmt, layer):
     v = elmt[layer]
     return (v[0], v[1], v[2])
@@ -50,11 +35,6 @@ def extract_layer_vector3(elmt, layer):
 extract_layer_vector3.struct = "3f"
 
 
-def decode_layer_color(elmt, layer, data, index):
-    elmt[layer], index = common.decode_color(data, index)
-    return index
-
-
 def extract_layer_color(elmt, layer):
     color = elmt[layer]
     if len(color) == 3:
@@ -65,14 +45,6 @@ def extract_layer_color(elmt, layer):
 extract_layer_color.struct = "4f"
 
 
-def decode_layer_uv(elmt, layer, data, index):
-    pin_uv, index = common.decode_bool(data, index)
-    uv, index = common.decode_vector2(data, index)
-    elmt[layer].pin_uv = pin_uv
-    elmt[layer].uv = uv
-    return index
-
-
 def extract_layer_uv(elmt, layer):
     return (elmt[layer].pin_uv, *elmt[layer].uv)
 
@@ -80,21 +52,6 @@ def extract_layer_uv(elmt, layer):
 extract_layer_uv.struct = "1I2f"
 
 
-def decode_bmesh_layer(data, index, layer_collection, element_seq, decode_layer_value_func):
-    layer_count, index = common.decode_int(data, index)
-    while layer_count > len(layer_collection):
-        if not layer_collection.is_singleton:
-            layer_collection.new()
-        else:
-            layer_collection.verify()  # Will create a layer and returns it
-            break  # layer_count should be one but break just in case
-    for i in range(layer_count):
-        layer = layer_collection[i]
-        for elt in element_seq:
-            index = decode_layer_value_func(elt, layer, data, index)
-    return index
-
-
 def encode_bmesh_layer(layer_collection, element_seq, extract_layer_tuple_func):
     buffer = []
     count = 0
@@ -289,14 +246,28 @@ def encode_base_mesh_geometry(mesh_data):
     logger.debug("Writing %d faces", len(bm.faces))
     bm.faces.ensure_lookup_table()
 
-    faces_array = []
+    # Each face field is encoded as an array, then the vertices of all the faces, so that they are decoded in bulk
+    material_indices = []
+    smooths = []
+    loop_totals = []
+    loop_vertices = []
     for face in bm.faces:
-        faces_array.extend((face.material_index, face.smooth, len(face.verts)))
-        faces_array.extend((vert.index for vert in face.verts))
+        material_indices.append(face.material_index)
+        smooths.append(face.smooth)
+        loop_totals.append(len(face.verts))
+        loop_vertices.extend(vert.index for vert in face.verts)
 
     stats_timer.checkpoint("make_faces_buffer")
 
-    binary_buffer += struct.pack(f"1I{len(faces_array)}I", len(bm.faces), *faces_array)
+    face_count = len(bm.faces)
+    binary_buffer += struct.pack(
+        f"1I{3 * face_count + len(loop_vertices)}I",
+        face_count,
+        *material_indices,
+        *smooths,
+        *loop_totals,
+        *loop_vertices,
+    )
 
     stats_timer.checkpoint("encode_faces_buffer")
 
@@ -443,6 +414,62 @@ def encode_mesh(obj, do_encode_base_mesh, do_encode_baked_mesh):
     return binary_buffer
 
 
+def _decode_layers(data, index, item_count, dtype):
+    """
+    Decode the layers encoded by encode_bmesh_layer(), as flat arrays of item_count values, that share the memory of
+    data.
+    """
+    layer_count, index = common.decode_int(data, index)
+    layers = []
+    for _ in range(layer_count):
+        layers.append(numpy.frombuffer(data, dtype=dtype, count=item_count, offset=index))
+        index += item_count * 4
+    return layers, index
+
+
+def _edge_keys(vertices):
+    """
+    Return a key for each (vertex 1, vertex 2) row of vertices, that does not depend on the order of the vertices.
+    """
+    vertices = numpy.sort(vertices, axis=1).astype(numpy.int64)
+    return vertices[:, 0] << 32 | vertices[:, 1]
+
+
+def _set_edge_attributes(mesh, vertices, attributes):
+    """
+    Set the attributes of the edges of mesh, given as arrays in the order of the (vertex 1, vertex 2) rows of vertices.
+
+    mesh.update(calc_edges=True) builds a new edge array, so the edges are matched by their vertices rather than their
+    index. The edges that are not in vertices keep default values.
+    """
+    if len(vertices) == 0:
+        return
+    mesh_vertices = numpy.empty(len(mesh.edges) * 2, dtype=numpy.int32)
+    mesh.edges.foreach_get("vertices", mesh_vertices)
+    mesh_keys = _edge_keys(mesh_vertices.reshape(-1, 2))
+    keys = _edge_keys(vertices)
+    order = numpy.argsort(keys)
+    sources = order[numpy.searchsorted(keys, mesh_keys, sorter=order).clip(max=len(keys) - 1)]
+    matched = keys[sources] == mesh_keys
+    for name, values in attributes.items():
+        mesh_values = numpy.zeros(len(mesh_keys), dtype=values.dtype)
+        mesh_values[matched] = values[sources[matched]]
+        mesh.edges.foreach_set(name, mesh_values)
+
+
+def _add_faces(mesh, loop_start, loop_total, loop_vertices):
+    """
+    Add faces to a mesh without faces, and compute their edges, keeping the ones that the mesh already has but not
+    their order, see _set_edge_attributes().
+    """
+    mesh.loops.add(len(loop_vertices))
+    mesh.loops.foreach_set("vertex_index", loop_vertices)
+    mesh.polygons.add(len(loop_start))
+    mesh.polygons.foreach_set("loop_start", loop_start)
+    mesh.polygons.foreach_set("loop_total", loop_total)
+    mesh.update(calc_edges=True)
+
+
 @stats_timer(share_data)
 def decode_bakes_mesh(obj, data, index):
     # Note: Blender should not load a baked mesh but we have this function to debug the encoding part
@@ -451,64 +478,38 @@ def decode_bakes_mesh(obj, data, index):
     if byte_size == 0:
         return index
 
-    positions, index = common.decode_vector3_array(data, index)
-    normals, index = common.decode_vector3_array(data, index)
-    uvs, index = common.decode_vector2_array(data, index)
-    material_indices, index = common.decode_int2_array(data, index)
-    triangles, index = common.decode_int3_array(data, index)
-
-    bm = bmesh.new()
-    for i in range(len(positions)):
-        vertex = bm.verts.new(positions[i])
-        # according to https://blender.stackexchange.com/questions/49357/bmesh-how-can-i-import-custom-vertex-normals
-        # normals are not working for bmesh...
-        vertex.normal = normals[i]
-    bm.verts.ensure_lookup_table()
-
-    uv_layer = None
-    if len(uvs) > 0:
-        uv_layer = bm.loops.layers.uv.new()
-
-    current_material_index = 0
-    index_in_material_indices = 0
-    next_triangle_index = len(triangles)
-    if len(material_indices) > 1:
-        next_triangle_index = material_indices[index_in_material_indices + 1][0]
-    if len(material_indices) > 0:
-        current_material_index = material_indices[index_in_material_indices][1]
-
-    for i in range(len(triangles)):
-        if i >= next_triangle_index:
-            index_in_material_indices = index_in_material_indices + 1
-            next_triangle_index = len(triangles)
-            if len(material_indices) > index_in_material_indices + 1:
-                next_triangle_index = material_indices[index_in_material_indices + 1][0]
-            current_material_index = material_indices[index_in_material_indices][1]
-
-        triangle = triangles[i]
-        i1 = triangle[0]
-        i2 = triangle[1]
-        i3 = triangle[2]
-        try:
-            face = bm.faces.new((bm.verts[i1], bm.verts[i2], bm.verts[i3]))
-            face.material_index = current_material_index
-            if uv_layer:
-                face.loops[0][uv_layer].uv = uvs[i1]
-                face.loops[1][uv_layer].uv = uvs[i2]
-                face.loops[2][uv_layer].uv = uvs[i3]
-        except Exception:
-            pass
+    positions, index = common.decode_vector3_buffer(data, index)
+    normals, index = common.decode_vector3_buffer(data, index)
+    uvs, index = common.decode_vector2_buffer(data, index)
+    material_indices, index = common.decode_int2_buffer(data, index)
+    triangles, index = common.decode_int3_buffer(data, index)
+    triangles = numpy.asarray(triangles).view(numpy.int32)
+    triangle_count = len(triangles) // 3
 
     me = obj.data
+    me.clear_geometry()
+    me.vertices.add(len(positions) // 3)
+    me.vertices.foreach_set("co", positions)
+    _add_faces(
+        me,
+        numpy.arange(0, 3 * triangle_count, 3, dtype=numpy.int32),
+        numpy.full(triangle_count, 3, dtype=numpy.int32),
+        triangles,
+    )
 
-    bm.to_mesh(me)
-    bm.free()
+    # (first triangle, material index) pairs, in triangle order
+    triangle_materials = numpy.zeros(triangle_count, dtype=numpy.int32)
+    material_indices = numpy.asarray(material_indices).reshape(-1, 2)
+    for first_triangle, material_index in material_indices:
+        triangle_materials[first_triangle:] = material_index
+    me.polygons.foreach_set("material_index", triangle_materials)
+
+    # the uvs and normals are given per vertex, and set per loop
+    if len(uvs) > 0:
+        uv_layer = me.uv_layers.new(do_init=False)
+        uv_layer.data.foreach_set("uv", numpy.asarray(uvs).reshape(-1, 2)[triangles].ravel())
 
-    # hack ! Since bmesh cannot be used to set custom normals
-    normals2 = []
-    for l in me.loops:
-        normals2.append(normals[l.vertex_index])
-    me.normals_split_custom_set(normals2)
+    me.normals_split_custom_set(numpy.asarray(normals).reshape(-1, 3)[triangles])
     me.use_auto_smooth = True
 
     return index
@@ -516,57 +517,75 @@ def decode_bakes_mesh(obj, data, index):
 
 @stats_timer(share_data)
 def decode_base_mesh(client, obj, data, index):
-    bm = bmesh.new()
-
-    position_count, index = common.decode_int(data, index)
-    logger.debug("Reading %d vertices", position_count)
-
-    for _pos_idx in range(position_count):
-        co, index = common.decode_vector3(data, index)
-        bm.verts.new(co)
-
-    bm.verts.ensure_lookup_table()
-
-    index = decode_bmesh_layer(data, index, bm.verts.layers.bevel_weight, bm.verts, decode_layer_float)
+    # The elements and their layers are created in bulk with foreach_set(), that is much faster than creating them one
+    # by one with bmesh, which encode_base_mesh_geometry() uses
+    mesh = obj.data
+    mesh.clear_geometry()
+
+    positions, index = common.decode_vector3_buffer(data, index)
+    vertex_count = len(positions) // 3
+    logger.debug("Reading %d vertices", vertex_count)
+    mesh.vertices.add(vertex_count)
+    mesh.vertices.foreach_set("co", positions)
+
+    bevel_weights, index = _decode_layers(data, index, vertex_count, numpy.float32)
+    mesh.use_customdata_vertex_bevel = bool(bevel_weights)
+    if bevel_weights:
+        mesh.vertices.foreach_set("bevel_weight", bevel_weights[0])
 
     edge_count, index = common.decode_int(data, index)
     logger.debug("Reading %d edges", edge_count)
-
-    edges_data = struct.unpack(f"{edge_count * 4}I", data[index : index + edge_count * 4 * 4])
+    # vertex 1, vertex 2, smooth, seam
+    edges = numpy.frombuffer(data, dtype=numpy.int32, count=edge_count * 4, offset=index).reshape(-1, 4)
     index += edge_count * 4 * 4
-
-    for edge_idx in range(edge_count):
-        v1 = edges_data[edge_idx * 4]
-        v2 = edges_data[edge_idx * 4 + 1]
-        edge = bm.edges.new((bm.verts[v1], bm.verts[v2]))
-        edge.smooth = bool(edges_data[edge_idx * 4 + 2])
-        edge.seam = bool(edges_data[edge_idx * 4 + 3])
-
-    index = decode_bmesh_layer(data, index, bm.edges.layers.bevel_weight, bm.edges, decode_layer_float)
-    index = decode_bmesh_layer(data, index, bm.edges.layers.crease, bm.edges, decode_layer_float)
+    edge_bevel_weights, index = _decode_layers(data, index, edge_count, numpy.float32)
+    creases, index = _decode_layers(data, index, edge_count, numpy.float32)
 
     face_count, index = common.decode_int(data, index)
     logger.debug("Reading %d faces", face_count)
-
-    for _face_idx in range(face_count):
-        material_idx, index = common.decode_int(data, index)
-        smooth, index = common.decode_bool(data, index)
-        vert_count, index = common.decode_int(data, index)
-        face_vertices = struct.unpack(f"{vert_count}I", data[index : index + vert_count * 4])
-        index += vert_count * 4
-        verts = [bm.verts[i] for i in face_vertices]
-        face = bm.faces.new(verts)
-        face.material_index = material_idx
-        face.smooth = smooth
-
-    index = decode_bmesh_layer(data, index, bm.faces.layers.face_map, bm.faces, decode_layer_int)
-
-    index = decode_bmesh_layer(data, index, bm.loops.layers.uv, loops_iterator(bm), decode_layer_uv)
-    index = decode_bmesh_layer(data, index, bm.loops.layers.color, loops_iterator(bm), decode_layer_color)
-
-    bm.normal_update()
-    bm.to_mesh(obj.data)
-    bm.free()
+    # material index, smooth and vertex count of each face, then the vertices of all the faces
+    material_indices, smooths, loop_total = numpy.frombuffer(
+        data, dtype=numpy.int32, count=face_count * 3, offset=index
+    ).reshape(3, face_count)
+    index += face_count * 3 * 4
+    loop_count = int(loop_total.sum())
+    loop_vertices = numpy.frombuffer(data, dtype=numpy.int32, count=loop_count, offset=index)
+    index += loop_count * 4
+    loop_start = (numpy.cumsum(loop_total) - loop_total).astype(numpy.int32)
+
+    # the edges are added first to keep the loose ones, the others are rebuilt with the faces
+    mesh.edges.add(edge_count)
+    mesh.edges.foreach_set("vertices", edges[:, :2].ravel())
+    _add_faces(mesh, loop_start, loop_total, loop_vertices)
+    mesh.polygons.foreach_set("material_index", material_indices)
+    mesh.polygons.foreach_set("use_smooth", smooths != 0)
+
+    edge_attributes = {"use_edge_sharp": edges[:, 2] == 0, "use_seam": edges[:, 3] != 0}
+    mesh.use_customdata_edge_bevel = bool(edge_bevel_weights)
+    if edge_bevel_weights:
+        edge_attributes["bevel_weight"] = edge_bevel_weights[0]
+    mesh.use_customdata_edge_crease = bool(creases)
+    if creases:
+        edge_attributes["crease"] = creases[0]
+    _set_edge_attributes(mesh, edges[:, :2], edge_attributes)
+
+    face_maps, index = _decode_layers(data, index, face_count, numpy.int32)
+    for values in face_maps:
+        mesh.face_maps.new().data.foreach_set("value", values)
+
+    # pin_uv, then uv
+    uv_layers, index = _decode_layers(data, index, loop_count * 3, numpy.float32)
+    for values in uv_layers:
+        values = values.reshape(-1, 3)
+        uv_layer = mesh.uv_layers.new(do_init=False)
+        uv_layer.data.foreach_set("uv", values[:, 1:].ravel())
+        uv_layer.data.foreach_set("pin_uv", values[:, 0].view(numpy.int32) != 0)
+
+    color_layers, index = _decode_layers(data, index, loop_count * 4, numpy.float32)
+    for values in color_layers:
+        mesh.vertex_colors.new(do_init=False).data.foreach_set("color", values)
+
+    mesh.update()
 
     # Load shape keys
     shape_keys_count, index = common.decode_int(data, index)
@@ -589,10 +608,8 @@ def decode_base_mesh(client, obj, data, index):
             shape_key.value, index = common.decode_float(data, index)
             shape_key.slider_min, index = common.decode_float(data, index)
             shape_key.slider_max, index = common.decode_float(data, index)
-            shape_key_data_size, index = common.decode_int(data, index)
-            for i in range(shape_key_data_size):
-                shape_key.data[i].co = Vector(struct.unpack("3f", data[index : index + 3 * 4]))
-                index += 3 * 4
+            shape_key_co, index = common.decode_vector3_buffer(data, index)
+            shape_key.data.foreach_set("co", shape_key_co)
         obj.data.shape_keys.use_relative, index = common.decode_bool(data, index)
 
     # Vertex Groups
@@ -615,13 +632,12 @@ def decode_base_mesh(client, obj, data, index):
     has_custom_normal, index = common.decode_bool(data, index)
 
     if has_custom_normal:
-        normals = []
-        for _loop in obj.data.loops:
-            normal, index = common.decode_vector3(data, index)
-            normals.append(normal)
-        obj.data.normals_split_custom_set(normals)
+        loop_count = len(obj.data.loops)
+        normals = numpy.frombuffer(data, dtype=numpy.float32, count=loop_count * 3, offset=index)
+        index += loop_count * 3 * 4
+        obj.data.normals_split_custom_set(normals.reshape(-1, 3))
 
-    # UV Maps and Vertex Colors are added automatically based on layers in the bmesh
+    # UV Maps and Vertex Colors have been added with the geometry
     # We just need to update their name and active_render state:
 
     # UV Maps
@@ -3,6 +3,7 @@ import bpy
 
 from mixer.broadcaster import common
 from mixer.broadcaster.client import Client
+from mixer.broadcaster.schema import get_schema
 from mixer.share_data import share_data
 
 logger = logging.getLogger(__name__)
@@ -10,22 +11,17 @@ logger = logging.getLogger(__name__)
 
 def send_object_visibility(client: Client, object_: bpy.types.Object):
     logger.debug("send_object_visibility %s", object_.name_full)
-    buffer = (
-        common.encode_string(object_.name_full)
-        + common.encode_bool(object_.hide_viewport)
-        + common.encode_bool(object_.hide_select)
-        + common.encode_bool(object_.hide_render)
-        + common.encode_bool(object_.hide_get())
+    client.add_command(
+        get_schema(common.MessageType.OBJECT_VISIBILITY).command(
+            object_.name_full, object_.hide_viewport, object_.hide_select, object_.hide_render, object_.hide_get()
+        )
     )
-    client.add_command(common.Command(common.MessageType.OBJECT_VISIBILITY, buffer, 0))
 
 
 def build_object_visibility(data):
-    name_full, index = common.decode_string(data, 0)
-    hide_viewport, index = common.decode_bool(data, index)
-    hide_select, index = common.decode_bool(data, index)
-    hide_render, index = common.decode_bool(data, index)
-    hide_get, index = common.decode_bool(data, index)
+    name_full, hide_viewport, hide_select, hide_render, hide_get = get_schema(
+        common.MessageType.OBJECT_VISIBILITY
+    ).decode(data)
 
     logger.debug("build_object_visibility %s", name_full)
     object_ = share_data.blender_objects.get(name_full)
@@ -0,0 +1,312 @@
+"""
+Binary serialization of the proxy classes, an alternative to json_codec.Codec.
+
+An encoded message is made of:
+- MAGIC, that identifies the format and its version,
+- a table of the strings used in the message, so that each property name is sent once,
+- the encoded root value.
+
+Each value is a one byte tag followed by a tag specific payload. Typed arrays, such as SoaElement._data, are
+stored as raw little endian buffers. All integers and floats are little endian.
+
+MAGIC, Tag and the proxy option flags are defined in mixer.broadcaster.binary_format, that the server also uses.
+"""
+
+import array
+import struct
+import sys
+from typing import Any, Dict
+
+from mixer.broadcaster.binary_format import BLENDDATA_PATH, CLASS_NAME, MAGIC, Tag
+from mixer.blender_data.proxy import (
+    AosElement,
+    BpyIDProxy,
+    BpyIDRefProxy,
+    BpyPropertyGroupProxy,
+    BpyPropDataCollectionProxy,
+    BpyPropStructCollectionProxy,
+    BpyStructProxy,
+    NodeLinksProxy,
+    NodeTreeProxy,
+    SoaElement,
+)
+
+# index in this list is the proxy class identifier on the wire, only append to it
+proxy_classes = [
+    BpyIDProxy,
+    BpyIDRefProxy,
+    BpyStructProxy,
+    BpyPropertyGroupProxy,
+    NodeLinksProxy,
+    NodeTreeProxy,
+    BpyPropStructCollectionProxy,
+    BpyPropDataCollectionProxy,
+    SoaElement,
+    AosElement,
+]
+_proxy_class_ids = {c: i for i, c in enumerate(proxy_classes)}
+
+
+_u32 = struct.Struct("<I")
+_i64 = struct.Struct("<q")
+_f64 = struct.Struct("<d")
+_tag_u32 = struct.Struct("<BI")
+_tag_i64 = struct.Struct("<Bq")
+_tag_f64 = struct.Struct("<Bd")
+_proxy_header = struct.Struct("<BBB")  # tag, class identifier, option flags
+_proxy_fields = struct.Struct("<BB")  # class identifier, option flags
+
+_array_typecodes = "bBhHiIlLqQfd"
+
+# plain ints are much faster to compare and pack than IntEnum members
+_NONE, _FALSE, _TRUE, _INT, _FLOAT, _STRING, _LIST, _TUPLE, _DICT, _STRING_DICT, _FLOAT_LIST, _ARRAY, _PROXY = (
+    int(tag) for tag in Tag
+)
+
+
+class BinaryCodecError(Exception):
+    pass
+
+
+class _Encoder:
+    def __init__(self):
+        self.strings: Dict[str, int] = {}
+        self.out = bytearray()
+
+    def string_index(self, value: str) -> int:
+        index = self.strings.get(value)
+        if index is None:
+            index = len(self.strings)
+            self.strings[value] = index
+        return index
+
+    def encode(self, obj: Any):
+        encoder = self._encoders.get(obj.__class__)
+        if encoder is None:
+            if obj.__class__ in _proxy_class_ids:
+                encoder = _Encoder.encode_proxy
+            else:
+                raise BinaryCodecError(f"Cannot encode {obj!r} of type {obj.__class__}")
+        encoder(self, obj)
+
+    def encode_none(self, obj):
+        self.out.append(_NONE)
+
+    def encode_bool(self, obj: bool):
+        self.out.append(_TRUE if obj else _FALSE)
+
+    def encode_int(self, obj: int):
+        self.out += _tag_i64.pack(_INT, obj)
+
+    def encode_float(self, obj: float):
+        self.out += _tag_f64.pack(_FLOAT, obj)
+
+    def encode_string(self, obj: str):
+        self.out += _tag_u32.pack(_STRING, self.string_index(obj))
+
+    def encode_sequence(self, obj):
+        if obj.__class__ is list and obj and all(item.__class__ is float for item in obj):
+            self.out += _tag_u32.pack(_FLOAT_LIST, len(obj))
+            self.out += struct.pack(f"<{len(obj)}d", *obj)
+            return
+        self.out += _tag_u32.pack(_LIST if obj.__class__ is list else _TUPLE, len(obj))
+        encode = self.encode
+        for item in obj:
+            encode(item)
+
+    def encode_dict(self, obj: dict):
+        encode = self.encode
+        if all(key.__class__ is str for key in obj):
+            self.out += _tag_u32.pack(_STRING_DICT, len(obj))
+            string_index = self.string_index
+            for key, value in obj.items():
+                self.out += _u32.pack(string_index(key))
+                encode(value)
+        else:
+            self.out += _tag_u32.pack(_DICT, len(obj))
+            for key, value in obj.items():
+                encode(key)
+                encode(value)
+
+    def encode_array(self, obj: array.array):
+        if obj.typecode not in _array_typecodes:
+            raise BinaryCodecError(f"Unsupported array typecode {obj.typecode}")
+        if sys.byteorder != "little":
+            obj = array.array(obj.typecode, obj)
+            obj.byteswap()
+        self.out.append(_ARRAY)
+        self.out += obj.typecode.encode()
+        self.out += _u32.pack(len(obj) * obj.itemsize)
+        self.out += obj.tobytes()
+
+    def encode_proxy(self, obj):
+        blenddata_path = getattr(obj, "_blenddata_path", None)
+        class_name = getattr(obj, "_class_name", None)
+        flags = (BLENDDATA_PATH if blenddata_path is not None else 0) | (CLASS_NAME if class_name else 0)
+        self.out += _proxy_header.pack(_PROXY, _proxy_class_ids[obj.__class__], flags)
+        if blenddata_path is not None:
+            self.encode(tuple(blenddata_path))
+        if class_name:
+            self.out += _u32.pack(self.string_index(class_name))
+        self.encode(obj._data)
+
+    _encoders = {
+        type(None): encode_none,
+        bool: encode_bool,
+        int: encode_int,
+        float: encode_float,
+        str: encode_string,
+        list: encode_sequence,
+        tuple: encode_sequence,
+        dict: encode_dict,
+        array.array: encode_array,
+    }
+
+
+class _Decoder:
+    def __init__(self, buffer: memoryview):
+        self.buffer = buffer
+        self.offset = len(MAGIC)
+        self.strings = [self.read_string() for _ in range(self.read_u32())]
+        self._decoders = [
+            self.decode_none,
+            self.decode_false,
+            self.decode_true,
+            self.decode_int,
+            self.decode_float,
+            self.decode_string,
+            self.decode_list,
+            self.decode_tuple,
+            self.decode_dict,
+            self.decode_string_dict,
+            self.decode_float_list,
+            self.decode_array,
+            self.decode_proxy,
+        ]
+
+    def read_u32(self) -> int:
+        value = _u32.unpack_from(self.buffer, self.offset)[0]
+        self.offset += 4
+        return value
+
+    def read_string(self) -> str:
+        length = self.read_u32()
+        start = self.offset
+        self.offset += length
+        return bytes(self.buffer[start : self.offset]).decode()
+
+    def decode(self) -> Any:
+        tag = self.buffer[self.offset]
+        self.offset += 1
+        try:
+            decoder = self._decoders[tag]
+        except IndexError:
+            raise BinaryCodecError(f"Unexpected tag {tag} at offset {self.offset - 1}") from None
+        return decoder()
+
+    def decode_none(self):
+        return None
+
+    def decode_false(self):
+        return False
+
+    def decode_true(self):
+        return True
+
+    def decode_int(self):
+        value = _i64.unpack_from(self.buffer, self.offset)[0]
+        self.offset += 8
+        return value
+
+    def decode_float(self):
+        value = _f64.unpack_from(self.buffer, self.offset)[0]
+        self.offset += 8
+        return value
+
+    def decode_string(self):
+        return self.strings[self.read_u32()]
+
+    def decode_list(self):
+        decode = self.decode
+        return [decode() for _ in range(self.read_u32())]
+
+    def decode_tuple(self):
+        return tuple(self.decode_list())
+
+    def decode_dict(self):
+        decode = self.decode
+        result = {}
+        for _ in range(self.read_u32()):
+            key = decode()
+            result[key] = decode()
+        return result
+
+    def decode_string_dict(self):
+        decode = self.decode
+        read_u32 = self.read_u32
+        strings = self.strings
+        result = {}
+        for _ in range(read_u32()):
+            key = strings[read_u32()]
+            result[key] = decode()
+        return result
+
+    def decode_float_list(self):
+        count = self.read_u32()
+        value = list(struct.unpack_from(f"<{count}d", self.buffer, self.offset))
+        self.offset += count * 8
+        return value
+
+    def decode_array(self):
+        typecode = chr(self.buffer[self.offset])
+        self.offset += 1
+        length = self.read_u32()
+        start = self.offset
+        self.offset += length
+        result = array.array(typecode)
+        result.frombytes(self.buffer[start : self.offset])
+        if sys.byteorder != "little":
+            result.byteswap()
+        return result
+
+    def decode_proxy(self):
+        class_id, flags = _proxy_fields.unpack_from(self.buffer, self.offset)
+        self.offset += _proxy_fields.size
+        obj = proxy_classes[class_id]()
+        if flags & BLENDDATA_PATH:
+            obj._blenddata_path = self.decode()
+        if flags & CLASS_NAME:
+            obj._class_name = self.strings[self.read_u32()]
+        data = self.decode()
+        if isinstance(obj._data, dict):
+            obj._data.update(data)
+        else:
+            obj._data = data
+        return obj
+
+
+class BinaryCodec:
+    """
+    Same interface as json_codec.Codec, but encodes to and decodes from bytes.
+    """
+
+    def encode(self, obj) -> bytes:
+        encoder = _Encoder()
+        encoder.encode(obj)
+
+        chunks = [MAGIC, _u32.pack(len(encoder.strings))]
+        for string in encoder.strings:
+            encoded = string.encode()
+            chunks.append(_u32.pack(len(encoded)))
+            chunks.append(encoded)
+        chunks.append(encoder.out)
+        return b"".join(chunks)
+
+    def decode(self, message):
+        buffer = memoryview(message)
+        if bytes(buffer[: len(MAGIC)]) != MAGIC:
+            raise BinaryCodecError("Not a binary codec message")
+        try:
+            return _Decoder(buffer).decode()
+        except (struct.error, IndexError) as e:
+            raise BinaryCodecError(f"Truncated or corrupted message: {e}") from e
@@ -0,0 +1,89 @@
+"""
+Compare encode time, decode time and payload size of json_codec.Codec and binary_codec.BinaryCodec.
+
+Run inside Blender, from the repository root:
+    blender --background --python-expr "from mixer.blender_data.tests.bench_codec import main; main()"
+
+The proxies are built synthetically so that the benchmark does not depend on a blend file. The JSON codec cannot
+encode SoaElement arrays, so the JSON variant of the mesh benchmark stores them as lists, which is what
+JSON would have to transmit.
+"""
+
+import array
+import time
+
+from mixer.blender_data.binary_codec import BinaryCodec
+from mixer.blender_data.json_codec import Codec
+from mixer.blender_data.proxy import (
+    BpyIDProxy,
+    BpyIDRefProxy,
+    BpyPropStructCollectionProxy,
+    BpyStructProxy,
+    SoaElement,
+)
+
+
+def make_struct(depth: int, width: int) -> BpyStructProxy:
+    proxy = BpyStructProxy()
+    for i in range(width):
+        proxy._data[f"float_property_{i}"] = i * 0.5
+        proxy._data[f"int_property_{i}"] = i
+        proxy._data[f"vector_property_{i}"] = [1.0, 2.0, 3.0]
+        proxy._data[f"name_property_{i}"] = f"name {i}"
+    if depth > 0:
+        for i in range(2):
+            proxy._data[f"struct_{i}"] = make_struct(depth - 1, width)
+    return proxy
+
+
+def make_id(name: str, depth: int, width: int) -> BpyIDProxy:
+    proxy = BpyIDProxy()
+    proxy._blenddata_path = ("objects", name)
+    proxy._data.update(make_struct(depth, width)._data)
+    ref = BpyIDRefProxy()
+    ref._blenddata_path = ("materials", "Material")
+    proxy._data["active_material"] = ref
+    return proxy
+
+
+def make_mesh(vertex_count: int, soa_as_list: bool) -> BpyIDProxy:
+    proxy = make_id("Mesh", 1, 10)
+    vertices = BpyPropStructCollectionProxy()
+    for name, components in (("co", 3), ("normal", 3), ("bevel_weight", 1)):
+        soa = SoaElement()
+        soa._data = array.array("f", (float(i) for i in range(vertex_count * components)))
+        vertices._data[name] = soa._data.tolist() if soa_as_list else soa
+    proxy._data["vertices"] = vertices
+    return proxy
+
+
+def bench(codec, proxy, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        message = codec.encode(proxy)
+    encode_time = (time.perf_counter() - start) / repeat
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        codec.decode(message)
+    decode_time = (time.perf_counter() - start) / repeat
+
+    return encode_time, decode_time, len(message)
+
+
+def main():
+    cases = [
+        ("struct", make_id("Cube", 3, 10), make_id("Cube", 3, 10), 200),
+        ("mesh 10k vertices", make_mesh(10000, True), make_mesh(10000, False), 20),
+    ]
+    for name, json_proxy, binary_proxy, repeat in cases:
+        for codec_name, codec, proxy in (("json", Codec(), json_proxy), ("binary", BinaryCodec(), binary_proxy)):
+            encode_time, decode_time, size = bench(codec, proxy, repeat)
+            print(
+                f"{name:20} {codec_name:8} encode {encode_time * 1e3:8.3f} ms   decode {decode_time * 1e3:8.3f} ms"
+                f"   size {size:9} bytes"
+            )
+
+
+if __name__ == "__main__":
+    main()
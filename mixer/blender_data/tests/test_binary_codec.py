@@ -0,0 +1,106 @@
+import array
+import unittest
+
+import bpy
+from bpy import data as D  # noqa
+from bpy import types as T  # noqa
+from mixer.blender_data.binary_codec import BinaryCodec, BinaryCodecError
+from mixer.blender_data.json_codec import Codec
+from mixer.blender_data.proxy import (
+    BpyBlendProxy,
+    BpyIDProxy,
+    BpyIDRefProxy,
+    BpyPropStructCollectionProxy,
+    BpyStructProxy,
+    NodeLinksProxy,
+    SoaElement,
+)
+from mixer.blender_data.tests.utils import register_bl_equals, test_blend_file
+
+from mixer.blender_data.filter import test_context
+
+
+class TestBinaryCodec(unittest.TestCase):
+    def setUp(self):
+        bpy.ops.wm.open_mainfile(filepath=test_blend_file)
+        self.proxy = BpyBlendProxy()
+        register_bl_equals(self, test_context)
+
+    def test_camera(self):
+        # test_binary_codec.TestBinaryCodec.test_camera
+        transmit_name = "transmit_camera"
+        cam_sent = D.cameras["Camera_0"]
+        cam_sent.dof.focus_object = D.objects["Cube"]
+
+        self.proxy.load(test_context)
+        cam_proxy_sent = self.proxy.data("cameras").data("Camera_0")
+        cam_proxy_sent._data["name"] = transmit_name
+
+        codec = BinaryCodec()
+        message = codec.encode(cam_proxy_sent)
+        with self.assertRaises(BinaryCodecError):
+            codec.decode(Codec().encode(cam_proxy_sent).encode())
+
+        cam_received = D.cameras.new(transmit_name)
+        cam_proxy_received = codec.decode(message)
+        self.assertIsInstance(cam_proxy_received, BpyIDProxy)
+        self.assertEqual(cam_proxy_received._blenddata_path, cam_proxy_sent._blenddata_path)
+
+        focus_object_proxy = cam_proxy_received.data("dof").data("focus_object")
+        self.assertIsInstance(focus_object_proxy, BpyIDRefProxy)
+        self.assertEqual(focus_object_proxy.collection, "objects")
+        self.assertEqual(focus_object_proxy.key, "Cube")
+
+        cam_proxy_received.save(D.cameras, transmit_name)
+        self.assertEqual(cam_sent, cam_received)
+
+    def test_mesh(self):
+        # test_binary_codec.TestBinaryCodec.test_mesh
+        self.proxy.load(test_context)
+        mesh_proxy_sent = self.proxy.data("meshes").data("Cube")
+
+        codec = BinaryCodec()
+        mesh_proxy_received = codec.decode(codec.encode(mesh_proxy_sent))
+
+        vertices = mesh_proxy_received.data("vertices")
+        self.assertIsInstance(vertices, BpyPropStructCollectionProxy)
+        self.assertIsInstance(vertices.data("co"), SoaElement)
+        self.assertEqual(vertices.data("co")._data, mesh_proxy_sent.data("vertices").data("co")._data)
+
+    def test_values(self):
+        # test_binary_codec.TestBinaryCodec.test_values
+        struct_proxy = BpyStructProxy()
+        struct_proxy._data.update(
+            {
+                "none": None,
+                "bool": True,
+                "int": -(2 ** 40),
+                "float": 0.1,
+                "string": "été",
+                "vector": [1.0, 2.0, 3.0],
+                "matrix": [[1.0, 0.0], [0.0, 1.0]],
+                0: "integer key",
+            }
+        )
+        links = NodeLinksProxy()
+        links._data["__mixer_sequence__"] = [("Node", "Output", "Other node", "Input")]
+        soa = SoaElement()
+        soa._data = array.array("f", [0.5, 1.5, 2.5])
+        sent = {"struct": struct_proxy, "links": links, "soa": soa}
+
+        codec = BinaryCodec()
+        received = codec.decode(codec.encode(sent))
+        self.assertEqual(received["struct"]._data, struct_proxy._data)
+        self.assertEqual(received["links"]._data, links._data)
+        self.assertIsInstance(received["soa"]._data, array.array)
+        self.assertEqual(received["soa"]._data, soa._data)
+
+    def test_errors(self):
+        codec = BinaryCodec()
+        with self.assertRaises(BinaryCodecError):
+            codec.encode(object())
+        message = codec.encode(["a", "b"])
+        with self.assertRaises(BinaryCodecError):
+            codec.decode(message[:-3])
+        with self.assertRaises(BinaryCodecError):
+            codec.decode(b"{}")
@@ -0,0 +1,34 @@
+import unittest
+from unittest import mock
+
+from mixer.blender_client import BlenderClient
+from mixer.broadcaster.common import Command, MessageType
+
+
+class TestReceivedCommands(unittest.TestCase):
+    def setUp(self):
+        self.client = BlenderClient()
+
+    def test_group_released_on_leave(self):
+        self.client._received_commands.append(Command(MessageType.GROUP_BEGIN))
+        self.assertFalse(self.client.apply_received_commands())
+        self.assertTrue(self.client.block_signals)
+
+        self.client._received_commands.append(Command(MessageType.GROUP_BEGIN))
+        with mock.patch.object(self.client, "send_command", return_value=True):
+            self.client.leave_room("room")
+        self.assertFalse(self.client.block_signals)
+        self.assertEqual(len(self.client._received_commands), 0)
+
+        # the end of the group of the room that was left
+        self.client._received_commands.append(Command(MessageType.GROUP_END))
+        self.client.apply_received_commands()
+        self.assertFalse(self.client.block_signals)
+
+    def test_unmatched_group_end(self):
+        self.client._received_commands.extend([Command(MessageType.GROUP_END), Command(MessageType.GROUP_BEGIN)])
+        self.client.apply_received_commands()
+        self.assertTrue(self.client.block_signals)
+        self.client._received_commands.append(Command(MessageType.GROUP_END))
+        self.client.apply_received_commands()
+        self.assertFalse(self.client.block_signals)
@@ -0,0 +1,66 @@
+import unittest
+from unittest import mock
+
+import bmesh
+import bpy
+
+from mixer.blender_client import mesh as mesh_api
+from mixer.share_data import share_data
+
+
+def edge_attributes(mesh):
+    return {
+        frozenset(edge.vertices): (edge.use_edge_sharp, edge.use_seam, edge.bevel_weight, edge.crease)
+        for edge in mesh.edges
+    }
+
+
+class TestBaseMesh(unittest.TestCase):
+    def setUp(self):
+        mesh = bpy.data.meshes.new("Source")
+        bm = bmesh.new()
+        bmesh.ops.create_cube(bm, size=2.0)
+        # a loose edge, that is not rebuilt from the faces
+        bm.edges.new((bm.verts.new((3.0, 0.0, 0.0)), bm.verts.new((4.0, 0.0, 0.0))))
+        bm.to_mesh(mesh)
+        bm.free()
+
+        mesh.use_customdata_vertex_bevel = True
+        mesh.use_customdata_edge_bevel = True
+        mesh.use_customdata_edge_crease = True
+        for i, vertex in enumerate(mesh.vertices):
+            vertex.bevel_weight = i / len(mesh.vertices)
+        for i, edge in enumerate(mesh.edges):
+            edge.use_edge_sharp = i % 3 == 0
+            edge.use_seam = i % 2 == 0
+            edge.bevel_weight = i / len(mesh.edges)
+            edge.crease = 1.0 - i / len(mesh.edges)
+        for i, polygon in enumerate(mesh.polygons):
+            polygon.material_index = i % 2
+            polygon.use_smooth = i % 3 == 0
+
+        self.source = bpy.data.objects.new("Source", mesh)
+        self.target = bpy.data.objects.new("Target", bpy.data.meshes.new("Target"))
+
+    def tearDown(self):
+        for obj in (self.source, self.target):
+            mesh = obj.data
+            bpy.data.objects.remove(obj)
+            bpy.data.meshes.remove(mesh)
+
+    def test_round_trip(self):
+        # the encoder records its checkpoints in the current statistics
+        with mock.patch.object(share_data, "current_statistics", {"children": {}}):
+            data = mesh_api.encode_base_mesh(self.source)
+            index = mesh_api.decode_base_mesh(None, self.target, data, 0)
+        self.assertEqual(index, len(data))
+
+        source, target = self.source.data, self.target.data
+        self.assertEqual([v.co[:] for v in target.vertices], [v.co[:] for v in source.vertices])
+        self.assertEqual([v.bevel_weight for v in target.vertices], [v.bevel_weight for v in source.vertices])
+        self.assertEqual(len(target.edges), len(source.edges))
+        self.assertEqual(edge_attributes(target), edge_attributes(source))
+        self.assertEqual(
+            [(p.vertices[:], p.material_index, p.use_smooth) for p in target.polygons],
+            [(p.vertices[:], p.material_index, p.use_smooth) for p in source.polygons],
+        )
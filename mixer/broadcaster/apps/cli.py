@@ -39,6 +39,10 @@ class CliClient(client.Client):
         command = common.Command(common.MessageType.LIST_CLIENTS)
         self.add_and_process_command(command, common.MessageType.LIST_CLIENTS)
 
+    def server_stats(self):
+        command = common.Command(common.MessageType.SERVER_STATS)
+        self.add_and_process_command(command, common.MessageType.SERVER_STATS)
+
     def add_and_process_command(self, command: common.Command, expected_response_type: common.MessageType = None):
         if not self.send_command(command):
             self.disconnect()
@@ -99,6 +103,33 @@ def process_client_command(args):
             client.disconnect()
 
 
+def process_play_command(args):
+    from mixer.broadcaster.session import load_session, play_session
+
+    _, records = load_session(args.file)
+    logger.info("Playing %d commands from %s to room %s", len(records), args.file, args.room)
+    result = play_session(
+        args.host, int(args.port), args.room, records, args.speed, args.senders, timeout=float(args.timeout)
+    )
+    print(
+        f"Played {result['command_count']} commands from {result['client_count']} clients in "
+        f"{result['duration']:.2f} s, at most {result['max_lag']:.3f} s late"
+    )
+
+
+def process_stats_command(args):
+    client = None
+
+    try:
+        client = CliClient(args)
+        client.server_stats()
+    except ServerError as e:
+        logger.error(e, exc_info=True)
+    finally:
+        if client is not None:
+            client.disconnect()
+
+
 commands = [
     "connect",
     "disconnect",
@@ -109,6 +140,7 @@ commands = [
     "listallclients",
     "setclientname <clientname>",
     "listroomclients <roomname>",
+    "serverstats",
     "help",
     "exit",  # this loop
 ]
@@ -166,6 +198,8 @@ def interactive_loop(args):
                     client.join_room(command_args[0])
                 elif command == "leave":
                     client.leave_room(command_args[0])
+                elif command == "serverstats":
+                    client.server_stats()
                 elif command == "setclientname":
                     client.set_client_attributes({common.ClientAttributes.USERNAME: command_args[0]})
                 elif command == "disconnect":
@@ -214,6 +248,20 @@ def parse_cli_args():
     client_parser.add_argument("command", help="", choices=("list"))
     client_parser.set_defaults(func=process_client_command)
 
+    stats_parser = sub_parsers.add_parser("stats", help="Print the operational metrics of the server")
+    stats_parser.set_defaults(func=process_stats_command)
+
+    play_parser = sub_parsers.add_parser("play", help="Play a session recorded with the server --record-dir option")
+    play_parser.add_argument("file", help="Session file")
+    play_parser.add_argument("room", help="Room to play the session in, created if it does not exist")
+    play_parser.add_argument(
+        "--speed", type=float, default=1.0, help="Speed relative to the recording, 0 to play as fast as possible"
+    )
+    play_parser.add_argument(
+        "--senders", type=int, help="Number of clients that send the commands, one per recorded client by default"
+    )
+    play_parser.set_defaults(func=process_play_command)
+
     return parser.parse_args(), parser
 
 
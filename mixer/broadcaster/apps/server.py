@@ -6,19 +6,25 @@ Can be launched from command line, or from the Mixer addon in Blender.
 
 from __future__ import annotations
 
+import asyncio
+from collections import deque
+from enum import Enum
 import logging
 import argparse
 import select
 import threading
+import time
 import socket
-import queue
-from typing import List, Mapping, Dict, Optional, Any
+from math import inf
+from typing import Deque, List, Mapping, Dict, Optional, Any, Set
 
 from mixer.broadcaster.cli_utils import init_logging, add_logging_cli_args
 import mixer.broadcaster.common as common
 from mixer.broadcaster.common import update_attributes_and_get_diff
-
-SHUTDOWN = False
+from mixer.broadcaster.history import RoomHistory
+from mixer.broadcaster.room_log import SYNC_INTERVAL, LoggedCommand, RoomLog
+from mixer.broadcaster.session import SessionRecorder, is_recorded
+from mixer.broadcaster.stats import ConnectionStats, Histogram, RateMeter, StatsExporter
 
 logger = logging.getLogger() if __name__ == "__main__" else logging.getLogger(__name__)
 _log_server_updates: bool = False
@@ -27,26 +33,92 @@ _log_server_updates: bool = False
 # client, then release the room mutex while broadcasting
 MAX_BROADCAST_COMMAND_COUNT = 64
 
+# Bulk commands are sent to a client by slices of this many bytes, or one command if larger, so that interactive
+# commands queued meanwhile are sent between slices
+BULK_SEND_SIZE = 256 * 1024
 
-class Connection:
-    """ Represent a connection with a client """
+# Size of the commands that may be queued for a client, besides the history replayed when it joins a room, before the
+# SlowClientPolicy of the server applies
+SEND_QUEUE_BUDGET = 128 * 1024 * 1024
 
-    def __init__(self, server: Server, sock: socket.socket, address):
-        self.socket: socket.socket = sock
+# Whatever the policy, a client is disconnected when its queue exceeds this many budgets
+SEND_QUEUE_HARD_LIMIT = 4
+
+# Interval at which a connection paused by SlowClientPolicy.PAUSE checks whether it can resume reading, in seconds
+PAUSE_POLL_INTERVAL = 0.01
+
+# Interval at which the stats are written to --stats-file, in seconds
+STATS_INTERVAL = 10.0
+
+# The command count and byte size of rooms are broadcast at most at this interval, in seconds
+ROOM_UPDATE_INTERVAL = 0.25
+
+# The presence attributes of the clients of a room are sent to the room at most at this interval, in seconds
+PRESENCE_INTERVAL = 0.1
+
+# Room attributes that change with every command, see ClientCapabilities.ROOM_STATISTICS
+ROOM_STATISTICS = {common.RoomAttributes.COMMAND_COUNT, common.RoomAttributes.BYTE_SIZE}
+
+
+class SlowClientPolicy(Enum):
+    """
+    What the server does when the commands queued for a client exceed the send queue budget:
+    - COALESCE: a queued TRANSFORM, FRAME or CLIENT_UPDATE is dropped or merged when a later one supersedes it,
+    - PAUSE: the server stops reading from the other clients of the room, until the queue is down to half the budget,
+    - DISCONNECT: the client is sent a SEND_ERROR, then disconnected.
+    """
+
+    COALESCE = "coalesce"
+    PAUSE = "pause"
+    DISCONNECT = "disconnect"
+
+
+class BaseConnection:
+    """
+    State and command handling of a connection with a client, independent of how the connection does I/O
+    """
+
+    def __init__(self, server: Server, address):
         self.address = address
         self.room: Optional[Room] = None
 
         self.unique_id = f"{address[0]}:{address[1]}"
 
         self.custom_attributes: Dict[str, Any] = {}  # custom attributes are used between clients, but not by the server
-
-        self._command_queue: queue.Queue = queue.Queue()  # Pending commands to send to the client
+        self.compressions: Set[common.Compression] = set()  # codecs the client can decode
+        self.command_batch = False  # the client can decode COMMAND_BATCH messages
+        self.chunk = False  # the client can assemble CHUNK messages
+        self.room_statistics = True  # the client is sent the ROOM_UPDATE messages of ROOM_STATISTICS
+        self.presence = False  # the client handles CLIENT_PRESENCE messages
+        self.presence_attributes: Dict[str, Any] = {}  # see ClientCapabilities.PRESENCE
+
+        self._command_lanes = common.CommandLanes()  # Pending commands to send to the client
         self._server = server
 
-        self.thread: threading.Thread = threading.Thread(None, self.run)
-
-    def start(self):
-        self.thread.start()
+        # send queue state, see SlowClientPolicy
+        self.congested = False  # the room is paused until the queue is drained
+        self.congestion_count = 0
+        self.overflowed = False  # the client is disconnected once sent the pending SEND_ERROR
+        self.send_queue_peak = 0  # largest size of the queue, besides replayed history
+
+        self.stats = ConnectionStats()
+
+        self._command_handlers = {
+            common.MessageType.JOIN_ROOM: self._join_room,
+            common.MessageType.LEAVE_ROOM: self._leave_room,
+            common.MessageType.LIST_ROOMS: self._list_rooms,
+            common.MessageType.DELETE_ROOM: self._delete_room,
+            common.MessageType.SET_ROOM_CUSTOM_ATTRIBUTES: self._set_room_custom_attributes,
+            common.MessageType.SET_ROOM_KEEP_OPEN: self._set_room_keep_open,
+            common.MessageType.LIST_CLIENTS: self._list_clients,
+            common.MessageType.SET_CLIENT_NAME: self._set_client_name,
+            common.MessageType.SET_CLIENT_CUSTOM_ATTRIBUTES: self._set_client_custom_attributes,
+            common.MessageType.CLIENT_ID: self._client_id,
+            common.MessageType.CONTENT: self._content,
+            common.MessageType.CLIENT_CAPABILITIES: self._client_capabilities,
+            common.MessageType.SERVER_STATS: self._server_stats,
+            common.MessageType.CLIENT_PRESENCE: self._client_presence,
+        }
 
     def client_attributes(self) -> Dict[str, Any]:
         return {
@@ -57,179 +129,488 @@ class Connection:
             common.ClientAttributes.ROOM: self.room.name if self.room is not None else None,
         }
 
-    def run(self):
-        def _send_error(s: str):
-            logger.warning("Sending error %s", s)
-            self.send_command(common.Command(common.MessageType.SEND_ERROR, common.encode_string(s)))
+    def _send_error(self, s: str):
+        logger.warning("Sending error %s", s)
+        self.send_command(common.Command(common.MessageType.SEND_ERROR, common.encode_string(s)))
 
-        def _join_room(command: common.Command):
-            if self.room is not None:
-                _send_error(f"Received join_room but room {self.room.name} is already joined")
-                return
-            room_name = command.data.decode()
-            try:
-                self._server.join_room(self, room_name)
-            except Exception as e:
-                _send_error(f"{e}")
+    def _join_room(self, command: common.Command):
+        if self.room is not None:
+            self._send_error(f"Received join_room but room {self.room.name} is already joined")
+            return
+        room_name = bytes(command.data).decode()
+        try:
+            self._server.join_room(self, room_name)
+        except Exception as e:
+            self._send_error(f"{e}")
 
-        def _leave_room(command: common.Command):
-            if self.room is None:
-                _send_error(f"Received leave_room but no room is joined")
-                return
-            _ = command.data.decode()  # todo remove room_name from protocol
-            self._server.leave_room(self)
-            self.send_command(common.Command(common.MessageType.LEAVE_ROOM))
+    def _leave_room(self, command: common.Command):
+        if self.room is None:
+            self._send_error(f"Received leave_room but no room is joined")
+            return
+        _ = bytes(command.data).decode()  # todo remove room_name from protocol
+        self._server.leave_room(self)
+        self.send_command(common.Command(common.MessageType.LEAVE_ROOM))
 
-        def _list_rooms(command: common.Command):
-            self.send_command(self._server.get_list_rooms_command())
+    def _list_rooms(self, command: common.Command):
+        self.send_command(self._server.get_list_rooms_command())
 
-        def _delete_room(command: common.Command):
-            self._server.delete_room(command.data.decode())
+    def _delete_room(self, command: common.Command):
+        self._server.delete_room(bytes(command.data).decode())
 
-        def _set_custom_attributes(custom_attributes: Mapping[str, Any]):
-            diff = update_attributes_and_get_diff(self.custom_attributes, custom_attributes)
-            self._server.broadcast_client_update(self, diff)
+    def _set_custom_attributes(self, custom_attributes: Mapping[str, Any]):
+        diff = update_attributes_and_get_diff(self.custom_attributes, custom_attributes)
+        self._server.broadcast_client_update(self, diff)
 
-        def _set_client_name(command: common.Command):
-            _set_custom_attributes({common.ClientAttributes.USERNAME: command.data.decode()})
+    def _set_client_name(self, command: common.Command):
+        self._set_custom_attributes({common.ClientAttributes.USERNAME: bytes(command.data).decode()})
 
-        def _list_clients(command: common.Command):
-            self.send_command(self._server.get_list_clients_command())
+    def _list_clients(self, command: common.Command):
+        self.send_command(self._server.get_list_clients_command())
 
-        def _set_client_custom_attributes(command: common.Command):
-            _set_custom_attributes(common.decode_json(command.data, 0)[0])
+    def _set_client_custom_attributes(self, command: common.Command):
+        self._set_custom_attributes(common.decode_json(command.data, 0)[0])
 
-        def _set_room_custom_attributes(command: common.Command):
-            room_name, offset = common.decode_string(command.data, 0)
-            custom_attributes, _ = common.decode_json(command.data, offset)
-            self._server.set_room_custom_attributes(room_name, custom_attributes)
+    def _set_room_custom_attributes(self, command: common.Command):
+        room_name, offset = common.decode_string(command.data, 0)
+        custom_attributes, _ = common.decode_json(command.data, offset)
+        self._server.set_room_custom_attributes(room_name, custom_attributes)
 
-        def _set_room_keep_open(command: common.Command):
-            room_name, offset = common.decode_string(command.data, 0)
-            value, _ = common.decode_bool(command.data, offset)
-            self._server.set_room_keep_open(room_name, value)
+    def _set_room_keep_open(self, command: common.Command):
+        room_name, offset = common.decode_string(command.data, 0)
+        value, _ = common.decode_bool(command.data, offset)
+        self._server.set_room_keep_open(room_name, value)
 
-        def _client_id(command: common.Command):
-            self.send_command(
-                common.Command(common.MessageType.CLIENT_ID, f"{self.address[0]}:{self.address[1]}".encode("utf8"))
-            )
+    def _client_id(self, command: common.Command):
+        self.send_command(
+            common.Command(common.MessageType.CLIENT_ID, f"{self.address[0]}:{self.address[1]}".encode("utf8"))
+        )
 
-        def _content(command: common.Command):
-            if self.room is None:
-                _send_error("Unjoined client trying to set room joinable")
-                return
-            if self.room.joinable:
-                _send_error(f"Trying to set joinable room {self.room.name} which is already joinable")
-                return
-            self.room.joinable = True
-            self._server.broadcast_room_update(self.room, {common.RoomAttributes.JOINABLE: True})
-
-        command_handlers = {
-            common.MessageType.JOIN_ROOM: _join_room,
-            common.MessageType.LEAVE_ROOM: _leave_room,
-            common.MessageType.LIST_ROOMS: _list_rooms,
-            common.MessageType.DELETE_ROOM: _delete_room,
-            common.MessageType.SET_ROOM_CUSTOM_ATTRIBUTES: _set_room_custom_attributes,
-            common.MessageType.SET_ROOM_KEEP_OPEN: _set_room_keep_open,
-            common.MessageType.LIST_CLIENTS: _list_clients,
-            common.MessageType.SET_CLIENT_NAME: _set_client_name,
-            common.MessageType.SET_CLIENT_CUSTOM_ATTRIBUTES: _set_client_custom_attributes,
-            common.MessageType.CLIENT_ID: _client_id,
-            common.MessageType.CONTENT: _content,
+    def _client_capabilities(self, command: common.Command):
+        requested, _ = common.decode_json(command.data, 0)
+        names = requested.get(common.ClientCapabilities.COMPRESSION, [])
+        compressions = [c for c in map(common.compression_from_name, names) if c is not None]
+        self.compressions = set(compressions)
+        self.command_batch = requested.get(common.ClientCapabilities.COMMAND_BATCH, False) is True
+        self.chunk = requested.get(common.ClientCapabilities.CHUNK, False) is True
+        self.room_statistics = requested.get(common.ClientCapabilities.ROOM_STATISTICS, True) is not False
+        self.presence = requested.get(common.ClientCapabilities.PRESENCE, False) is True
+
+        enabled: Dict[str, Any] = {}
+        if compressions:
+            enabled[common.ClientCapabilities.COMPRESSION] = compressions[0].name.lower()
+        if self.command_batch:
+            enabled[common.ClientCapabilities.COMMAND_BATCH] = True
+        if self.chunk:
+            enabled[common.ClientCapabilities.CHUNK] = True
+        if self.room_statistics:
+            enabled[common.ClientCapabilities.ROOM_STATISTICS] = True
+        if self.presence:
+            enabled[common.ClientCapabilities.PRESENCE] = True
+        self.send_command(common.Command(common.MessageType.CLIENT_CAPABILITIES, common.encode_json(enabled)))
+
+    def _content(self, command: common.Command):
+        if self.room is None:
+            self._send_error("Unjoined client trying to set room joinable")
+            return
+        if self.room.joinable:
+            self._send_error(f"Trying to set joinable room {self.room.name} which is already joinable")
+            return
+        self.room.joinable = True
+        self.room.save_attributes()
+        self._server.broadcast_room_update(self.room, {common.RoomAttributes.JOINABLE: True})
+
+    def _client_presence(self, command: common.Command):
+        attributes, _ = common.decode_json(command.data, 0)
+        self.presence_attributes.update(attributes)
+        room = self.room
+        if room is not None:
+            room.update_presence(self, attributes)
+
+    def _server_stats(self, command: common.Command):
+        self.send_command(common.Command(common.MessageType.SERVER_STATS, common.encode_json(self._server.stats())))
+
+    def handle_command(self, command: common.Command):
+        self.stats.received(command)
+        room = self.room
+        if room is not None and room.recorder is not None and is_recorded(command):
+            room.recorder.record(self.unique_id, command)
+        if _log_server_updates or command.type not in (common.MessageType.SET_CLIENT_CUSTOM_ATTRIBUTES,):
+            logger.debug("Received from %s - %s", self.unique_id, command.type)
+
+        handler = self._command_handlers.get(command.type)
+        if handler is not None:
+            handler(command)
+        elif command.type.value > common.MessageType.COMMAND.value:
+            if self.room is not None:
+                self.room.add_command(command, self)
+            else:
+                logger.warning(
+                    "%s:%s - %s received but no room was joined", self.address[0], self.address[1], command.type
+                )
+        else:
+            logger.error("Command %s received but no handler for it on server", command.type)
+
+    def accepts_chunks(self, compression: common.Compression) -> bool:
+        """
+        Return True if the client can assemble chunks of a command payload compressed with compression.
+        """
+        return self.chunk and (compression == common.Compression.NONE or compression in self.compressions)
+
+    def _split(self, command: common.Command):
+        """
+        Return the chunks to send instead of a large command, or None to send command as is.
+        """
+        if (
+            command.type == common.MessageType.CHUNK
+            or isinstance(command, common.CommandRun)
+            or command.byte_size() - common.MESSAGE_HEADER_SIZE <= common.CHUNK_SIZE
+            or not self.accepts_chunks(command.compression)
+        ):
+            return None
+        return common.split_command(command)
+
+    def add_command(self, command: common.Command, replay: bool = False):
+        """
+        Add command to be consumed later. Meant to be used by other threads.
+
+        replay tells that command is part of the room history replayed to the client, that is not subject to the send
+        queue budget.
+        """
+        if self.overflowed:
+            return
+        self._command_lanes.put(command, replay)
+        self._check_send_queue()
+
+    def _send_queue_size(self) -> int:
+        lanes = self._command_lanes
+        return lanes.byte_size - lanes.replay_byte_size
+
+    def _check_send_queue(self):
+        """
+        Apply the SlowClientPolicy of the server if the queue exceeds its budget.
+        """
+        size = self._send_queue_size()
+        if size > self.send_queue_peak:
+            self.send_queue_peak = size
+        budget = self._server.send_queue_budget
+        if size <= budget:
+            return
+
+        policy = self._server.slow_client_policy
+        if policy == SlowClientPolicy.DISCONNECT or size > SEND_QUEUE_HARD_LIMIT * budget:
+            logger.warning("%s: %d bytes queued, over budget, disconnecting", self.unique_id, size)
+            self.overflowed = True
+            self._command_lanes.clear()
+            error = f"Disconnected by the server: {size} bytes queued for this client, over its {budget} bytes budget"
+            self._command_lanes.put(common.Command(common.MessageType.SEND_ERROR, common.encode_string(error)))
+        elif policy == SlowClientPolicy.COALESCE:
+            if not self._command_lanes.coalesce:
+                logger.warning("%s: %d bytes queued, coalescing the superseded commands", self.unique_id, size)
+                self._command_lanes.coalesce = True
+        elif not self.congested:
+            logger.warning("%s: %d bytes queued, pausing its room", self.unique_id, size)
+            self.congested = True
+            self.congestion_count += 1
+
+    def _take_commands(self) -> List[common.Command]:
+        """
+        Remove and return the commands to send now: the interactive commands, then a slice of the bulk commands.
+        """
+        interactive, bulk = self._command_lanes.take(BULK_SEND_SIZE, self._split)
+        if interactive or bulk:
+            self.stats.waited(self._command_lanes.wait)
+        if self._send_queue_size() <= self._server.send_queue_budget // 2:
+            self._command_lanes.coalesce = False
+            if self.congested:
+                logger.info("%s: send queue drained, resuming its room", self.unique_id)
+                self.congested = False
+        return interactive + bulk
+
+    def reading_paused(self) -> bool:
+        """
+        Return True if the commands of the client must not be read now, since the room has a congested client.
+        """
+        room = self.room
+        return room is not None and room.is_congested(self)
+
+    def send_queue_attributes(self) -> Dict[str, Any]:
+        lanes = self._command_lanes
+        return {
+            common.ClientAttributes.SEND_QUEUE_SIZE: lanes.byte_size,
+            common.ClientAttributes.SEND_QUEUE_COMMAND_COUNT: len(lanes),
+            common.ClientAttributes.SEND_QUEUE_PEAK: self.send_queue_peak,
+            common.ClientAttributes.COALESCED_COMMAND_COUNT: lanes.coalesced_count,
+            common.ClientAttributes.CONGESTION_COUNT: self.congestion_count,
         }
 
-        def _handle_incoming_commands():
-            received_commands = common.read_all_messages(self.socket)
-            count = len(received_commands)
-            if count > 0:
-                logger.debug("Received from %s - %d commands ", self.unique_id, count)
-
-            for command in received_commands:
-                if _log_server_updates or command.type not in (common.MessageType.SET_CLIENT_CUSTOM_ATTRIBUTES,):
-                    logger.debug("Received from %s - %s", self.unique_id, command.type)
-
-                if command.type in command_handlers:
-                    command_handlers[command.type](command)
-                elif command.type.value > common.MessageType.COMMAND.value:
-                    if self.room is not None:
-                        self.room.add_command(command, self)
-                    else:
-                        logger.warning(
-                            "%s:%s - %s received but no room was joined",
-                            self.address[0],
-                            self.address[1],
-                            command.type,
-                        )
-                else:
-                    logger.error("Command %s received but no handler for it on server", command.type)
-
-        def _handle_outgoing_commands():
-            self.fetch_outgoing_commands()
-
-        global SHUTDOWN
-        while not SHUTDOWN:
+    def _log_send(self, command: common.Command):
+        if _log_server_updates or command.type not in (
+            common.MessageType.CLIENT_UPDATE,
+            common.MessageType.ROOM_UPDATE,
+        ):
+            logger.debug("Sending to %s:%s - %s", self.address[0], self.address[1], command.type)
+
+    def _prepare_send(self, command: common.Command) -> List[common.Command]:
+        """
+        Return the commands to send for command, according to the capabilities of the client.
+        """
+        if isinstance(command, common.CommandRun):
+            accepted = self.compressions | {common.Compression.NONE}
+            if all(c.compression in accepted for c in command.commands):
+                logger.debug("Sending to %s:%s - %d commands", self.address[0], self.address[1], len(command.commands))
+                return [command]
+            return [prepared for c in command.commands for prepared in self._prepare_send(c)]
+
+        self._log_send(command)
+        if command.compression != common.Compression.NONE and command.compression not in self.compressions:
+            # this client cannot decode the payload as received from its sender
+            command = common.decompress_command(command)
+        if command.type == common.MessageType.COMMAND_BATCH and not self.command_batch:
+            # this client cannot decode batches, send the batched commands one by one
+            return common.decode_command_batch(command.data)
+        return [command]
+
+    def _prepare_sends(self, commands: List[common.Command]) -> List[common.Command]:
+        prepared: List[common.Command] = []
+        for command in commands:
+            prepared.extend(self._prepare_send(command))
+        self.stats.sent(prepared)
+        return prepared
+
+    def fetch_outgoing_commands(self):
+        raise NotImplementedError()
+
+    def send_command(self, command: common.Command):
+        raise NotImplementedError()
+
+    def close(self):
+        raise NotImplementedError()
+
+
+class Connection(BaseConnection):
+    """ Represent a connection with a client, served by a thread """
+
+    def __init__(self, server: Server, sock: socket.socket, address):
+        super().__init__(server, address)
+        self.socket: socket.socket = sock
+        self._reader = common.FrameReader(sock)
+
+        self.thread: threading.Thread = threading.Thread(None, self.run)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while not self._server.is_shutting_down():
             try:
-                _handle_incoming_commands()
-                _handle_outgoing_commands()
+                if self.reading_paused():
+                    self.fetch_outgoing_commands()
+                    time.sleep(PAUSE_POLL_INTERVAL)
+                    continue
+
+                received_commands = self._reader.read_all_messages()
+                count = len(received_commands)
+                if count > 0:
+                    logger.debug("Received from %s - %d commands ", self.unique_id, count)
+                for command in received_commands:
+                    self.handle_command(command)
+
+                self.fetch_outgoing_commands()
+                if self.overflowed and not self._command_lanes:
+                    break
             except common.ClientDisconnectedException:
                 break
 
         self._server.handle_client_disconnect(self)
 
     def fetch_outgoing_commands(self):
+        """
+        Send the pending interactive commands, then a slice of the pending bulk commands.
+        """
+        commands = self._take_commands()
+        if commands:
+            self.send_commands(commands)
+
+    def send_command(self, command: common.Command):
+        """
+        Directly send a command to the socket. Meant to be used by this thread.
+        """
+        assert threading.current_thread() is self.thread
+        common.write_messages(self.socket, self._prepare_sends([command]))
+
+    def send_commands(self, commands: List[common.Command]):
+        """
+        Directly send commands to the socket with a single vectored write. Meant to be used by this thread.
+        """
+        assert threading.current_thread() is self.thread
+        common.write_messages(self.socket, self._prepare_sends(commands))
+
+    def close(self):
+        self.socket.close()
+
+
+class AsyncConnection(BaseConnection):
+    """
+    Represent a connection with a client, served by two tasks of the server event loop: one reads and handles the
+    received commands, the other waits for commands to send and writes them.
+
+    All the methods are meant to be called from the event loop thread.
+    """
+
+    def __init__(self, server: AsyncServer, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        super().__init__(server, writer.get_extra_info("peername"))
+        self._stream_reader = reader
+        self._stream_writer = writer
+        self._direct_commands: Deque[common.Command] = deque()  # sent before the lanes, like Connection.send_command
+        self._send_event = asyncio.Event()  # set when there are commands to send
+        self._send_task: Optional[asyncio.Task] = None
+        self._sendfile = True  # cleared if the event loop cannot sendfile() to this connection
+
+    async def _read_command(self) -> common.Command:
+        while self.reading_paused():
+            await asyncio.sleep(PAUSE_POLL_INTERVAL)
+        header = await self._stream_reader.readexactly(common.MESSAGE_HEADER_SIZE)
+        frame_size = common.unpack_message_header(header)[0]
+        data = await self._stream_reader.readexactly(frame_size) if frame_size > 0 else b""
+        return common.FrameCommand(header, data)
+
+    async def run(self):
+        self._send_task = asyncio.create_task(self._send_loop())
+        try:
+            while True:
+                self.handle_command(await self._read_command())
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._server.handle_client_disconnect(self)
+
+    async def _send_pending(self):
+        """
+        Send the direct commands, then the interactive commands, then slices of the bulk commands, until the queues are
+        empty. The queues are refilled while waiting for the writes to drain.
+        """
         while True:
-            try:
-                command = self._command_queue.get_nowait()
-            except queue.Empty:
-                break
+            commands = list(self._direct_commands)
+            self._direct_commands.clear()
+            commands += self._take_commands()
+            if not commands:
+                return
+            buffers: List[Any] = []
+            for command in self._prepare_sends(commands):
+                if isinstance(command, common.CommandRun):
+                    if command.file is not None and self._sendfile:
+                        self._stream_writer.writelines(buffers)
+                        buffers = []
+                        await self._stream_writer.drain()
+                        if await self._send_file(command):
+                            continue
+                    for run_command in command.commands:
+                        buffers.append(run_command.header())
+                        buffers.append(memoryview(run_command.data).cast("B"))
+                    continue
+                buffers.append(command.header())
+                buffers.append(memoryview(command.data).cast("B"))
+            self._stream_writer.writelines(buffers)
+            await self._stream_writer.drain()
+
+    async def _send_file(self, run: common.CommandRun) -> bool:
+        """
+        Send run from its file with the event loop sendfile(), return False if it is not available.
+        """
+        # no fallback: it would use the file position, that is shared with the other connections
+        try:
+            await asyncio.get_running_loop().sendfile(
+                self._stream_writer.transport, run.file, run.offset, run.byte_size(), fallback=False
+            )
+        except asyncio.SendfileNotAvailableError:
+            self._sendfile = False
+            return False
+        return True
 
-            self.send_command(command)
-            self._command_queue.task_done()
+    async def _send_loop(self):
+        try:
+            while True:
+                await self._send_event.wait()
+                self._send_event.clear()
+                await self._send_pending()
+                if self.overflowed and not self._command_lanes:
+                    self._stream_writer.close()
+                    return
+        except ConnectionError as e:
+            logger.warning(e)
+            self._stream_writer.close()
 
-    def add_command(self, command: common.Command):
+    def fetch_outgoing_commands(self):
         """
-        Add command to be consumed later. Meant to be used by other threads.
+        Wake up the task that sends the pending commands.
         """
-        self._command_queue.put(command)
+        self._send_event.set()
+
+    def add_command(self, command: common.Command, replay: bool = False):
+        super().add_command(command, replay)
+        self._send_event.set()
 
     def send_command(self, command: common.Command):
         """
-        Directly send a command to the socket. Meant to be used by this thread.
+        Send a command before the pending commands.
         """
-        assert threading.current_thread() is self.thread
-        if _log_server_updates or command.type not in (
-            common.MessageType.CLIENT_UPDATE,
-            common.MessageType.ROOM_UPDATE,
-        ):
-            logger.debug("Sending to %s:%s - %s", self.address[0], self.address[1], command.type)
-        common.write_message(self.socket, command)
+        self._direct_commands.append(command)
+        self._send_event.set()
+
+    def close(self):
+        if self._send_task is not None:
+            self._send_task.cancel()
+        self._stream_writer.close()
 
 
 class Room:
     """
     Room class is responsible for:
     - handling its list of clients (as Connection instances)
-    - keep a list of commands, to be dispatched to new clients
+    - keep a history of commands, to be dispatched to new clients
     - dispatch added commands to clients already in the room
+
+    If the room has a log, its commands are held in the log rather than in memory. A room restored from its log
+    has no creator.
     """
 
-    def __init__(self, server: Server, room_name: str, creator: Connection):
+    def __init__(
+        self, server: Server, room_name: str, creator: Optional[BaseConnection], log: Optional[RoomLog] = None
+    ):
         self.name = room_name
         self.keep_open = False  # Should the room remain open when no more clients are inside ?
-        self.byte_size = 0
         self.joinable = False  # A room becomes joinable when its first client has send all the initial content
 
         self.custom_attributes: Dict[str, Any] = {}  # custom attributes are used between clients, but not by the server
 
-        self._commands: List[common.Command] = []
+        self._log = log
+        self.recorder: Optional[SessionRecorder] = None  # set by the server to record the traffic of the room
+        self._history = RoomHistory(server.compact_history, log.release if log is not None else None)
+
+        # Chunks are forwarded as received, and their command is stored when assembled
+        self._chunk_assembler = common.ChunkAssembler()
+        self._chunk_receivers: Dict[int, List[BaseConnection]] = {}  # connections that receive chunks, by transfer id
 
         self._commands_mutex: threading.RLock = threading.RLock()
-        self._connections: List[Connection] = [creator]
+        self._connections: List[BaseConnection] = []
+
+        # counted under _commands_mutex, see Server.stats()
+        self.commands_in = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._command_rate = RateMeter()
+
+        self._server = server
+        self._presence: Dict[str, Dict[str, Any]] = {}  # presence attributes not sent yet, by client id
 
         self.join_count: int = 0
         # this is used to ensure a room cannot be deleted while clients are joining (creator is not considered to be joining)
         # Server is responsible of increasing / decreasing join_count, with mutex protection
 
+        if creator is None:
+            return
+
+        self._connections.append(creator)
         creator.room = self
         creator.send_command(common.Command(common.MessageType.JOIN_ROOM, common.encode_string(self.name)))
         creator.send_command(
@@ -239,48 +620,177 @@ class Room:
     def client_count(self):
         return len(self._connections) + self.join_count
 
+    def is_congested(self, connection: BaseConnection) -> bool:
+        """
+        Return True if a client of the room other than connection has a congested send queue.
+        """
+        return any(c.congested for c in list(self._connections) if c is not connection)
+
+    @property
+    def byte_size(self):
+        return self._history.byte_size
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "client_count": self.client_count(),
+            "command_count": self.command_count(),
+            "byte_size": self.byte_size,
+            "commands_in": self.commands_in,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "command_rate": self._command_rate.rate(),
+        }
+
+    def restore(self):
+        """
+        Restore the attributes and the commands of the room from its log.
+        """
+        assert self._log is not None
+        attributes = self._log.attributes
+        self.keep_open = attributes.get(common.RoomAttributes.KEEP_OPEN, False)
+        self.joinable = attributes.get(common.RoomAttributes.JOINABLE, False)
+        self.custom_attributes = attributes.get("custom_attributes", {})
+        for command in self._log.commands():
+            self._history.add(command)
+
+    def save_attributes(self):
+        if self._log is not None:
+            self._log.save_attributes(
+                {
+                    common.RoomAttributes.KEEP_OPEN: self.keep_open,
+                    common.RoomAttributes.JOINABLE: self.joinable,
+                    "custom_attributes": self.custom_attributes,
+                }
+            )
+
+    def sync_log(self):
+        with self._commands_mutex:
+            if self._log is not None:
+                self._log.sync()
+
+    def delete_log(self):
+        if self._log is not None:
+            self._log.delete()
+
+    def stop_recording(self):
+        if self.recorder is not None:
+            self.recorder.close()
+
     def command_count(self):
-        return len(self._commands)
+        return len(self._history)
 
-    def add_client(self, connection: Connection):
+    def add_client(self, connection: BaseConnection):
         logger.info(f"Add Client {connection.unique_id} to Room {self.name}")
 
         connection.send_command(common.Command(common.MessageType.CLEAR_CONTENT))  # todo temporary size stored here
 
-        offset = 0
+        sequence = 0  # of the last command sent to the client
 
-        def _try_finish_sync():
+        while True:
             connection.fetch_outgoing_commands()
             with self._commands_mutex:
-                # from here no one can add commands anymore to self._commands (clients can still join and read previous commands)
-                command_count = self.command_count()
-                if command_count - offset > MAX_BROADCAST_COMMAND_COUNT:
-                    return False  # while still more than MAX_BROADCAST_COMMAND_COUNT commands to broadcast, release the mutex
-
-                # now is time to synchronize all room participants: broadcast remaining commands to new client
-                for i in range(offset, command_count):
-                    command = self._commands[i]
-                    connection.add_command(command)
-
-                # now he's part of the room, let him/her know
-                self._connections.append(connection)
-                connection.room = self
-                connection.add_command(common.Command(common.MessageType.JOIN_ROOM, common.encode_string(self.name)))
-                return True
+                # from here no one can add commands anymore to the history (clients can still join and read previous commands)
+                commands, last_sequence = self._history.commands_after(sequence)
+                if len(commands) <= MAX_BROADCAST_COMMAND_COUNT:
+                    # now is time to synchronize all room participants: broadcast remaining commands to new client
+                    for command in commands:
+                        connection.add_command(command, replay=True)
+
+                    # now he's part of the room, let him/her know
+                    self._connections.append(connection)
+                    connection.room = self
+                    connection.add_command(
+                        common.Command(common.MessageType.JOIN_ROOM, common.encode_string(self.name))
+                    )
+                    self._send_presence_snapshot(connection)
+                    return
+
+            # while still more than MAX_BROADCAST_COMMAND_COUNT commands to broadcast, release the mutex
+            for command in self._replay_commands(commands):
+                connection.add_command(command, replay=True)
+            sequence = last_sequence
+
+    @staticmethod
+    def _replay_commands(commands: List[common.Command]) -> List[common.Command]:
+        """
+        Return commands with the consecutive small commands grouped into runs, that are queued and sent as a whole.
+        Runs of commands that are contiguous in the room log are sent from the log file.
+        """
+        replayed: List[common.Command] = []
+        run: List[common.Command] = []
+        run_size = 0
+
+        def _end_run():
+            if len(run) == 1:
+                replayed.append(run[0])
+            elif run and isinstance(run[0], LoggedCommand):
+                replayed.append(common.CommandRun(run, run[0].segment.reader(), run[0].frame_offset))
+            elif run:
+                replayed.append(common.CommandRun(run))
+
+        def _continues_run(command: common.Command) -> bool:
+            if isinstance(command, LoggedCommand):
+                return command.follows(run[-1])
+            return not isinstance(run[-1], LoggedCommand)
+
+        for command in commands:
+            size = command.byte_size()
+            large = size - common.MESSAGE_HEADER_SIZE > common.CHUNK_SIZE
+            if large or run_size + size > BULK_SEND_SIZE or (run and not _continues_run(command)):
+                _end_run()
+                run, run_size = [], 0
+            if large:
+                # sent on its own, in chunks if the client supports them
+                replayed.append(command)
+                continue
+            run.append(command)
+            run_size += size
+        _end_run()
+        return replayed
+
+    def remove_client(self, connection: BaseConnection):
+        logger.info("Remove Client % s from Room % s", connection.address, self.name)
+        with self._commands_mutex:
+            self._connections.remove(connection)
+            self._presence.pop(connection.unique_id, None)
 
-        while True:
-            if _try_finish_sync():
-                break  # all done
-            # broadcast commands that were added since last check
-            command_count = self.command_count()
-            for i in range(offset, command_count):
-                command = self._commands[i]  # atomic wrt. the GIL
-                connection.add_command(command)
-            offset = command_count
+    def update_presence(self, connection: BaseConnection, attributes: Dict[str, Any]):
+        """
+        Send the presence attributes of connection to the room with the next flush_presence(), superseding the ones
+        not sent yet, unless the presence interval of the server is 0.
+        """
+        with self._commands_mutex:
+            self._presence.setdefault(connection.unique_id, {}).update(attributes)
+            if self._server.presence_interval <= 0:
+                self.flush_presence()
 
-    def remove_client(self, connection: Connection):
-        logger.info("Remove Client % s from Room % s", connection.address, self.name)
-        self._connections.remove(connection)
+    def flush_presence(self):
+        """
+        Send the presence attributes updated since the last call to the clients of the room.
+        """
+        with self._commands_mutex:
+            presence, self._presence = self._presence, {}
+            if presence:
+                self._send_presence(self._connections, presence)
+
+    def _send_presence_snapshot(self, connection: BaseConnection):
+        """
+        Send the presence attributes of the clients of the room to connection, that joins it, and its own to the room.
+        """
+        snapshot = {c.unique_id: c.presence_attributes for c in self._connections if c.presence_attributes}
+        if snapshot:
+            self._send_presence([connection], snapshot)
+        if connection.presence_attributes:
+            self._presence.setdefault(connection.unique_id, {}).update(connection.presence_attributes)
+
+    @staticmethod
+    def _send_presence(connections: List[BaseConnection], presence: Dict[str, Dict[str, Any]]):
+        data = common.encode_json(presence)
+        presence_command = common.Command(common.MessageType.CLIENT_PRESENCE, data)
+        # clients that do not handle CLIENT_PRESENCE handle the same payload as CLIENT_UPDATE
+        update_command = common.Command(common.MessageType.CLIENT_UPDATE, data)
+        for connection in connections:
+            connection.add_command(presence_command if connection.presence else update_command)
 
     def attributes_dict(self):
         return {
@@ -291,29 +801,29 @@ class Room:
             common.RoomAttributes.JOINABLE: self.joinable,
         }
 
-    def add_command(self, command, sender: Connection):
-        def merge_command():
-            """
-            Add the command to the room list, possibly merge with the previous command.
-            """
-            command_type = command.type
-            if command_type.value > common.MessageType.OPTIMIZED_COMMANDS.value:
-                command_path = common.decode_string(command.data, 0)[0]
-                if self.command_count() > 0:
-                    stored_command = self._commands[-1]
-                    if (
-                        command_type == stored_command.type
-                        and command_path == common.decode_string(stored_command.data, 0)[0]
-                    ):
-                        self._commands.pop()
-                        self.byte_size -= stored_command.byte_size()
-            self._commands.append(command)
-            self.byte_size += command.byte_size()
-
+    def add_command(self, command, sender: BaseConnection):
         with self._commands_mutex:
             current_byte_size = self.byte_size
             current_command_count = self.command_count()
-            merge_command()
+
+            size = command.byte_size()
+            self.commands_in += 1
+            self.bytes_in += size
+            self.bytes_out += size * (len(self._connections) - 1)
+            self._command_rate.add()
+
+            stored_command = command
+            if command.type == common.MessageType.CHUNK:
+                stored_command = self._chunk_assembler.add(command)
+
+            if stored_command is None:
+                pass
+            elif stored_command.type == common.MessageType.COMMAND_BATCH:
+                # The batch is broadcast as a unit, but its commands are stored one by one so that they can be dropped
+                for batched_command in common.decode_command_batch(common.decompress_command(stored_command).data):
+                    self._store(batched_command)
+            else:
+                self._store(stored_command)
 
             room_update = {}
             if self.byte_size != current_byte_size:
@@ -321,18 +831,92 @@ class Room:
             if current_command_count != self.command_count():
                 room_update[common.RoomAttributes.COMMAND_COUNT] = self.command_count()
 
-            sender._server.broadcast_room_update(self, room_update)
-
+            if command.type == common.MessageType.CHUNK:
+                self._broadcast_chunk(command, stored_command, sender)
+            else:
+                for connection in self._connections:
+                    if connection != sender:
+                        connection.add_command(command)
+
+        # the server takes its mutex, then the mutex of a room, so the room mutex must be released first
+        sender._server.update_room_statistics(self, room_update)
+
+    def _store(self, command: common.Command):
+        # a received command may be a view of a receive buffer, that the history would keep alive
+        command = common.detach_command(command)
+        if self._log is not None:
+            self._history.add(command, self._log.append(command))
+        else:
+            self._history.add(command)
+
+    def _broadcast_chunk(self, chunk: common.Command, assembled: Optional[common.Command], sender: BaseConnection):
+        """
+        Forward chunk to the connections that received the first chunk of its transfer and can assemble it, send the
+        assembled command to the others.
+        """
+        info = common.chunk_info(chunk)
+        if info.offset == 0:
+            self._chunk_receivers[info.transfer_id] = [
+                c for c in self._connections if c != sender and c.accepts_chunks(info.compression)
+            ]
+
+        receivers = self._chunk_receivers.get(info.transfer_id, [])
+        for connection in receivers:
+            if connection in self._connections:
+                connection.add_command(chunk)
+
+        if assembled is not None:
+            del self._chunk_receivers[info.transfer_id]
             for connection in self._connections:
-                if connection != sender:
-                    connection.add_command(command)
+                if connection != sender and connection not in receivers:
+                    connection.add_command(assembled)
+
+
+def _only_room_statistics(command: common.Command) -> bool:
+    """
+    Return True if the ROOM_UPDATE command only updates ROOM_STATISTICS attributes.
+    """
+    rooms_attributes, _ = common.decode_json(common.decompress_command(command).data, 0)
+    return all(attributes.keys() <= ROOM_STATISTICS for attributes in rooms_attributes.values())
 
 
 class Server:
     def __init__(self):
         self._rooms: Dict[str, Room] = {}
-        self._connections: Dict[str, Connection] = {}
+        self._connections: Dict[str, BaseConnection] = {}
         self._mutex = threading.RLock()
+        self._shutdown = False
+        self.compact_history = True  # drop superseded commands from room histories, see RoomHistory
+        self.room_log_directory: Optional[str] = None  # if set, rooms are logged there, see RoomLog
+        self.session_directory: Optional[str] = None  # if set, the traffic of rooms is recorded there, see session
+        self.send_queue_budget = SEND_QUEUE_BUDGET  # per connection, see SlowClientPolicy
+        self.slow_client_policy = SlowClientPolicy.COALESCE
+        self.room_update_interval = ROOM_UPDATE_INTERVAL  # broadcast room statistics immediately if 0
+        self._room_statistics: Dict[str, Dict[str, Any]] = {}  # not broadcast yet, by room name
+        self.presence_interval = PRESENCE_INTERVAL  # send presence attributes immediately if 0
+        self._next_room_updates_flush = 0.0
+        self._next_presence_flush = 0.0
+        self._next_log_sync = 0.0
+
+        self._start_time = time.monotonic()
+        self._closed_connection_stats = ConnectionStats()
+        self._join_duration = Histogram()
+        self._stats_exporter: Optional[StatsExporter] = None
+
+    def shutdown(self):
+        """
+        Stop accepting connections, close all the connections and return from run().
+        """
+        self._shutdown = True
+        if self._stats_exporter is not None:
+            self._stats_exporter.stop()
+            self._stats_exporter = None
+        with self._mutex:
+            for room in self._rooms.values():
+                room.stop_recording()
+
+    def is_shutting_down(self) -> bool:
+        return self._shutdown
 
     def delete_room(self, room_name: str):
         with self._mutex:
@@ -343,19 +927,26 @@ class Server:
                 logger.warning("Room %s is not empty.", room_name)
                 return
 
-            del self._rooms[room_name]
+            room = self._rooms.pop(room_name)
+            room.delete_log()
+            room.stop_recording()
+            self._room_statistics.pop(room_name, None)
             logger.info(f"Room {room_name} deleted")
 
             self.broadcast_to_all_clients(
                 common.Command(common.MessageType.ROOM_DELETED, common.encode_string(room_name))
             )
 
-    def join_room(self, connection: Connection, room_name: str):
+    def join_room(self, connection: BaseConnection, room_name: str):
         assert connection.room is None
 
         def _create_room():
             logger.info(f"Room {room_name} does not exist. Creating it.")
-            room = Room(self, room_name, connection)
+            log = None
+            if self.room_log_directory is not None:
+                log = RoomLog.create(self.room_log_directory, room_name)
+            room = Room(self, room_name, connection, log)
+            self._record(room)
             self._rooms[room_name] = room
             # room is now visible to others, but not joinable until the client has sent CONTENT
             logger.info(f"Room {room_name} added")
@@ -376,17 +967,19 @@ class Server:
             # Ensure the room will not be deleted because it now has at least one client
             room.join_count += 1
 
+        start = time.monotonic()
         room.add_client(connection)
         # this call can take a while because history broadcasting occurs, so the mutex is released here
 
         # from here client is in the room list, we can decrease join_count
         with self._mutex:
             room.join_count -= 1
+            self._join_duration.observe(time.monotonic() - start)
 
         assert connection.room is not None
         self.broadcast_client_update(connection, {common.ClientAttributes.ROOM: connection.room.name})
 
-    def leave_room(self, connection: Connection):
+    def leave_room(self, connection: BaseConnection):
         assert connection.room is not None
         with self._mutex:
             room = self._rooms.get(connection.room.name)
@@ -404,10 +997,14 @@ class Server:
 
     def broadcast_to_all_clients(self, command: common.Command):
         with self._mutex:
-            for connection in self._connections.values():
+            connections = self._connections.values()
+            if command.type == common.MessageType.ROOM_UPDATE and not all(c.room_statistics for c in connections):
+                if _only_room_statistics(command):
+                    connections = [c for c in connections if c.room_statistics]
+            for connection in connections:
                 connection.add_command(command)
 
-    def broadcast_client_update(self, connection: Connection, attributes: Dict[str, Any]):
+    def broadcast_client_update(self, connection: BaseConnection, attributes: Dict[str, Any]):
         if attributes == {}:
             return
 
@@ -423,6 +1020,59 @@ class Server:
             common.Command(common.MessageType.ROOM_UPDATE, common.encode_json({room.name: attributes}),)
         )
 
+    def update_room_statistics(self, room: Room, attributes: Dict[str, Any]):
+        """
+        Broadcast the ROOM_STATISTICS attributes of room with the next flush_room_updates(), unless
+        room_update_interval is 0, so that a busy room does not send a ROOM_UPDATE to every client for each command.
+        """
+        if self.room_update_interval <= 0:
+            self.broadcast_room_update(room, attributes)
+            return
+        if attributes == {}:
+            return
+        with self._mutex:
+            self._room_statistics.setdefault(room.name, {}).update(attributes)
+
+    def flush_room_updates(self):
+        """
+        Broadcast the room statistics updated since the last call, in a single ROOM_UPDATE.
+        """
+        with self._mutex:
+            statistics, self._room_statistics = self._room_statistics, {}
+            if statistics:
+                self.broadcast_to_all_clients(
+                    common.Command(common.MessageType.ROOM_UPDATE, common.encode_json(statistics))
+                )
+
+    def flush_presence(self):
+        with self._mutex:
+            rooms = list(self._rooms.values())
+        for room in rooms:
+            room.flush_presence()
+
+    def sync_room_logs(self):
+        with self._mutex:
+            rooms = list(self._rooms.values())
+        for room in rooms:
+            room.sync_log()
+
+    def flush_updates(self) -> float:
+        """
+        Flush the room statistics and the presence attributes, and sync the room logs, when due. Return the time until
+        the next are due, in seconds. Meant to be called periodically by run().
+        """
+        now = time.monotonic()
+        if now >= self._next_room_updates_flush:
+            self.flush_room_updates()
+            self._next_room_updates_flush = now + self.room_update_interval if self.room_update_interval > 0 else inf
+        if now >= self._next_presence_flush:
+            self.flush_presence()
+            self._next_presence_flush = now + self.presence_interval if self.presence_interval > 0 else inf
+        if now >= self._next_log_sync:
+            self.sync_room_logs()
+            self._next_log_sync = now + SYNC_INTERVAL if self.room_log_directory is not None else inf
+        return min(self._next_room_updates_flush, self._next_presence_flush, self._next_log_sync) - now
+
     def set_room_custom_attributes(self, room_name: str, custom_attributes: Mapping[str, Any]):
         with self._mutex:
             if room_name not in self._rooms:
@@ -430,6 +1080,7 @@ class Server:
                 return
 
             diff = update_attributes_and_get_diff(self._rooms[room_name].custom_attributes, custom_attributes)
+            self._rooms[room_name].save_attributes()
             self.broadcast_room_update(self._rooms[room_name], diff)
 
     def set_room_keep_open(self, room_name: str, value: bool):
@@ -440,8 +1091,30 @@ class Server:
             room = self._rooms[room_name]
             if room.keep_open != value:
                 room.keep_open = value
+                room.save_attributes()
                 self.broadcast_room_update(room, {common.RoomAttributes.KEEP_OPEN: room.keep_open})
 
+    def _record(self, room: Room):
+        if self.session_directory is not None:
+            room.recorder = SessionRecorder.create(self.session_directory, room.name)
+
+    def restore_rooms(self):
+        """
+        Restore the rooms logged in room_log_directory that were kept open, and delete the logs of the others.
+        """
+        if self.room_log_directory is None:
+            return
+        for log in RoomLog.open_all(self.room_log_directory):
+            attributes = log.attributes
+            if not (attributes.get(common.RoomAttributes.KEEP_OPEN) and attributes.get(common.RoomAttributes.JOINABLE)):
+                log.delete()
+                continue
+            room = Room(self, log.room_name, None, log)
+            room.restore()
+            self._record(room)
+            self._rooms[room.name] = room
+            logger.info("Room %s restored, %d commands", room.name, room.command_count())
+
     def get_list_rooms_command(self) -> common.Command:
         with self._mutex:
             result_dict = {room_name: value.attributes_dict() for room_name, value in self._rooms.items()}
@@ -449,20 +1122,72 @@ class Server:
 
     def get_list_clients_command(self) -> common.Command:
         with self._mutex:
-            result_dict = {cid: c.client_attributes() for cid, c in self._connections.items()}
+            result_dict = {
+                cid: {**c.client_attributes(), **c.send_queue_attributes()} for cid, c in self._connections.items()
+            }
             return common.Command(common.MessageType.LIST_CLIENTS, common.encode_json(result_dict))
 
-    def handle_client_disconnect(self, connection: Connection):
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return a snapshot of the operational metrics of the server, as a JSON compatible dictionary:
+        - the number of connections and the uptime in seconds,
+        - the commands and bytes received and sent since startup, and the received commands by MessageType name,
+        - histograms of the join durations, and of the time commands wait in the send queues, in seconds,
+        - per room: the history size, the commands and bytes received and broadcast, the commands per second,
+        - per client: the commands and bytes received and sent, the send queue depth, the send lag of its last write.
+
+        Counters are read without synchronization with the threads that update them, and may be slightly off.
+        """
+        with self._mutex:
+            connections = list(self._connections.values())
+            rooms = list(self._rooms.values())
+            totals = ConnectionStats()
+            totals.merge(self._closed_connection_stats)
+            join_duration = self._join_duration.to_dict()
+
+        clients = {}
+        for connection in connections:
+            totals.merge(connection.stats)
+            clients[connection.unique_id] = {
+                **connection.stats.to_dict(),
+                **connection.send_queue_attributes(),
+                "send_lag": connection.stats.last_send_lag,
+            }
+
+        return {
+            "uptime": time.monotonic() - self._start_time,
+            "connection_count": len(connections),
+            **totals.to_dict(),
+            "message_types": {common.MessageType(t).name: count for t, count in sorted(totals.message_types.items())},
+            "join_duration": join_duration,
+            "send_lag": totals.send_lag.to_dict(),
+            "rooms": {room.name: room.stats() for room in rooms},
+            "clients": clients,
+        }
+
+    def export_stats(self, path: Optional[str] = None, port: Optional[int] = None, interval: float = STATS_INTERVAL):
+        """
+        Export stats() to the file at path every interval seconds, see write_stats_file(), and serve them over HTTP
+        on port of localhost. Stopped by shutdown().
+        """
+        self._stats_exporter = StatsExporter(self.stats)
+        if path is not None:
+            self._stats_exporter.write_periodically(path, interval)
+        if port is not None:
+            self._stats_exporter.serve("localhost", port)
+
+    def handle_client_disconnect(self, connection: BaseConnection):
         # First remove connection from server state, to avoid further broadcasting tentatives
         with self._mutex:
             del self._connections[connection.unique_id]
+            self._closed_connection_stats.merge(connection.stats)
 
         # Clean leaving of the room
         if connection.room is not None:
             self.leave_room(connection)
 
         try:
-            connection.socket.close()
+            connection.close()
         except Exception as e:
             logger.warning(e)
         logger.info("%s closed", connection.address)
@@ -472,7 +1197,6 @@ class Server:
         )
 
     def run(self, port):
-        global SHUTDOWN
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         binding_host = ""
         sock.bind((binding_host, port))
@@ -480,12 +1204,15 @@ class Server:
         sock.listen(1000)
 
         logger.info("Listening on port % s", port)
-        while True:
+        while not self._shutdown:
             try:
                 timeout = 0.1  # Check for a new client every 10th of a second
+                timeout = max(0.0, min(timeout, self.flush_updates()))
                 readable, _, _ = select.select([sock], [], [], timeout)
                 if len(readable) > 0:
                     client_socket, client_address = sock.accept()
+                    # whether the accepted socket inherits non blocking mode is platform dependent
+                    client_socket.setblocking(True)
                     connection = Connection(self, client_socket, client_address)
                     with self._mutex:
                         self._connections[connection.unique_id] = connection
@@ -496,10 +1223,92 @@ class Server:
                 break
 
         logger.info("Shutting down server")
-        SHUTDOWN = True
+        self._shutdown = True
         sock.close()
 
 
+class AsyncServer(Server):
+    """
+    A server that serves all its connections from an asyncio event loop in the thread that calls run(), rather than
+    from a thread per connection.
+
+    The rooms are shared with the threaded server. Their mutexes are never contended, and room and server methods run
+    to completion without awaiting, so that they are atomic with respect to the connection tasks.
+    """
+
+    connection_class = AsyncConnection
+
+    def __init__(self):
+        super().__init__()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop_event: Optional[asyncio.Event] = None
+        self._connection_tasks: Set[asyncio.Task] = set()
+
+    def shutdown(self):
+        """
+        Stop accepting connections, close all the connections and return from run(). May be called from any thread.
+        """
+        super().shutdown()
+        loop, stop_event = self._loop, self._stop_event
+        if loop is not None and stop_event is not None:
+            try:
+                loop.call_soon_threadsafe(stop_event.set)
+            except RuntimeError:
+                pass  # the loop is already closed
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        connection = self.connection_class(self, reader, writer)
+        with self._mutex:
+            self._connections[connection.unique_id] = connection
+        logger.info(f"New connection from {connection.address}")
+        self.broadcast_client_update(connection, connection.client_attributes())
+        await self._serve_connection(connection)
+
+    async def _serve_connection(self, connection: AsyncConnection):
+        task = asyncio.current_task()
+        self._connection_tasks.add(task)
+        try:
+            await connection.run()
+        finally:
+            self._connection_tasks.discard(task)
+
+    async def _close_connections(self):
+        with self._mutex:
+            connections = list(self._connections.values())
+        for connection in connections:
+            # the connection task handles the disconnection
+            connection.close()
+        await asyncio.gather(*self._connection_tasks, return_exceptions=True)
+
+    async def _flush_updates_periodically(self):
+        while True:
+            await asyncio.sleep(max(0.0, min(0.1, self.flush_updates())))
+
+    async def _serve(self, port):
+        self._loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        server = await asyncio.start_server(self._handle_connection, "", port, backlog=1000)
+        flush_task = asyncio.create_task(self._flush_updates_periodically())
+
+        logger.info("Listening on port % s (asyncio)", port)
+        if not self._shutdown:
+            await self._stop_event.wait()
+
+        logger.info("Shutting down server")
+        flush_task.cancel()
+        server.close()
+        await server.wait_closed()
+        await self._close_connections()
+
+    def run(self, port):
+        try:
+            asyncio.run(self._serve(port))
+        except KeyboardInterrupt:
+            pass
+        self._shutdown = True
+        self._loop = None
+
+
 def main():
     global _log_server_updates
     args, args_parser = parse_cli_args()
@@ -507,7 +1316,28 @@ def main():
 
     _log_server_updates = args.log_server_updates
 
-    server = Server()
+    if args.shards > 0 and args.room_log_dir:
+        args_parser.error("--room-log-dir is not supported with --shards")
+    if args.shards > 0 and args.record_dir:
+        args_parser.error("--record-dir is not supported with --shards")
+
+    if args.shards > 0:
+        from mixer.broadcaster.apps.sharded_server import ShardedServer
+
+        server: Server = ShardedServer(args.shards)
+    elif args.asyncio:
+        server = AsyncServer()
+    else:
+        server = Server()
+    server.room_log_directory = args.room_log_dir
+    server.session_directory = args.record_dir
+    server.send_queue_budget = args.send_queue_budget * 1024 * 1024
+    server.slow_client_policy = SlowClientPolicy(args.slow_client_policy)
+    server.room_update_interval = args.room_update_interval
+    server.presence_interval = args.presence_interval
+    server.restore_rooms()
+    if args.stats_file or args.stats_port is not None:
+        server.export_stats(args.stats_file, args.stats_port, args.stats_interval)
     server.run(args.port)
 
 
@@ -516,6 +1346,56 @@ def parse_cli_args():
     add_logging_cli_args(parser)
     parser.add_argument("--port", type=int, default=common.DEFAULT_PORT)
     parser.add_argument("--log-server-updates", action="store_true")
+    parser.add_argument(
+        "--asyncio", action="store_true", help="Serve all the clients from an asyncio event loop instead of threads"
+    )
+    parser.add_argument(
+        "--shards", type=int, default=0, help="Serve the rooms from this many worker processes, with asyncio"
+    )
+    parser.add_argument(
+        "--room-log-dir", help="Log the room commands in this directory, and restore the rooms kept open at startup"
+    )
+    parser.add_argument(
+        "--record-dir", help="Record the traffic of each room in this directory, to be played with the cli play command"
+    )
+    parser.add_argument(
+        "--send-queue-budget",
+        type=int,
+        default=SEND_QUEUE_BUDGET // (1024 * 1024),
+        help="Size in MB of the commands that may be queued for a client before --slow-client-policy applies",
+    )
+    parser.add_argument(
+        "--slow-client-policy",
+        choices=[p.value for p in SlowClientPolicy],
+        default=SlowClientPolicy.COALESCE.value,
+        help="When the queue of a client exceeds its budget, coalesce superseded commands, pause the room, or "
+        f"disconnect the client. Clients are disconnected at {SEND_QUEUE_HARD_LIMIT} times the budget",
+    )
+    parser.add_argument(
+        "--room-update-interval",
+        type=float,
+        default=ROOM_UPDATE_INTERVAL,
+        help="Broadcast the command count and byte size of rooms at most at this interval in seconds, 0 for each "
+        "command",
+    )
+    parser.add_argument(
+        "--presence-interval",
+        type=float,
+        default=PRESENCE_INTERVAL,
+        help="Send the presence attributes of clients (viewports, selection, ...) to their room at most at this "
+        "interval in seconds, 0 for each change",
+    )
+    parser.add_argument(
+        "--stats-file",
+        help="Write the server stats to this file periodically, in the Prometheus text format if it ends with .prom, "
+        "as JSON otherwise",
+    )
+    parser.add_argument(
+        "--stats-interval", type=float, default=STATS_INTERVAL, help="Interval at which --stats-file is written"
+    )
+    parser.add_argument(
+        "--stats-port", type=int, help="Serve the server stats on localhost at /metrics (Prometheus) and / (JSON)"
+    )
     return parser.parse_args(), parser
 
 
@@ -0,0 +1,562 @@
+"""
+Sharded server: the rooms are spread over worker processes, so that a busy room does not slow down the others.
+
+The front process accepts the connections and serves the clients that have not joined a room. When a client joins a
+room, its socket is passed over a Unix socket (SCM_RIGHTS) to the worker process that owns the room. A worker passes
+the socket back to the front process when its client leaves the room and joins another one.
+
+The front process also coordinates the workers:
+- the commands broadcast to all the clients (ROOM_UPDATE, CLIENT_UPDATE, ...) by a process are relayed to the other
+  processes. Each process keeps the attributes of all the rooms and clients up to date from them, to answer LIST_ROOMS
+  and LIST_CLIENTS,
+- the room commands (DELETE_ROOM, SET_ROOM_KEEP_OPEN, SET_ROOM_CUSTOM_ATTRIBUTES) are routed to the owner of the room.
+
+Commands broadcast while a client is passed between processes are not sent to this client.
+
+Only available where Unix sockets can pass file descriptors.
+"""
+
+from __future__ import annotations
+
+import array
+import asyncio
+from collections import Counter, deque
+from enum import IntEnum
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import struct
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+
+import mixer.broadcaster.common as common
+from mixer.broadcaster.apps.server import AsyncConnection, AsyncServer, BaseConnection, Server, SlowClientPolicy
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKER_COUNT = 2
+
+# control message kind, file descriptor count, json header size, payload size
+_frame_header = struct.Struct("<BBII")
+
+_RECV_SIZE = 64 * 1024
+_MAX_RECV_FDS = 16
+
+
+def is_supported() -> bool:
+    return hasattr(socket, "AF_UNIX") and hasattr(socket, "SCM_RIGHTS") and hasattr(socket.socket, "sendmsg")
+
+
+class Control(IntEnum):
+    # A command broadcast to all the clients, in the payload
+    BROADCAST = 1
+
+    # A method of Server to call on the process that owns a room
+    ROOM_OPERATION = 2
+
+    # A connection that joins a room, with its socket and the bytes received but not read yet in the payload
+    HANDOFF = 3
+
+
+ControlMessage = Tuple[Control, Dict[str, Any], bytes, List[int]]
+
+
+class ControlChannel:
+    """
+    Exchange messages and file descriptors with another process over a Unix socket, from an event loop.
+    """
+
+    def __init__(self, sock: socket.socket):
+        self._socket = sock
+        self._socket.setblocking(False)
+        self._loop = asyncio.get_running_loop()
+        self._received = bytearray()
+        self._received_fds: Deque[int] = deque()  # file descriptors are received ahead of their message
+        self._messages: asyncio.Queue = asyncio.Queue()
+        self._outgoing: Deque[Tuple[memoryview, List[int]]] = deque()
+        self._closed = False
+        self._loop.add_reader(self._socket.fileno(), self._on_readable)
+
+    def send(self, kind: Control, header: Dict[str, Any], payload=b"", fds: Sequence[int] = ()):
+        """
+        Queue a message. The file descriptors are closed once sent.
+        """
+        if self._closed:
+            for fd in fds:
+                os.close(fd)
+            return
+        encoded_header = json.dumps(header).encode()
+        frame = _frame_header.pack(kind, len(fds), len(encoded_header), len(payload)) + encoded_header + payload
+        self._outgoing.append((memoryview(frame), list(fds)))
+        self._on_writable()
+
+    async def receive(self) -> Optional[ControlMessage]:
+        """
+        Return the next message, or None if the channel is closed.
+        """
+        return await self._messages.get()
+
+    def _on_writable(self):
+        while self._outgoing:
+            view, fds = self._outgoing[0]
+            try:
+                if fds:
+                    rights = [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds))]
+                    sent = self._socket.sendmsg([view], rights)
+                else:
+                    sent = self._socket.send(view)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                logger.error("Control channel closed: %s", e)
+                self.close()
+                return
+
+            # the file descriptors are sent with the first bytes of the message
+            for fd in fds:
+                os.close(fd)
+            if sent < len(view):
+                self._outgoing[0] = (view[sent:], [])
+            else:
+                self._outgoing.popleft()
+
+        if self._outgoing:
+            self._loop.add_writer(self._socket.fileno(), self._on_writable)
+        else:
+            self._loop.remove_writer(self._socket.fileno())
+
+    def _on_readable(self):
+        fds = array.array("i")
+        try:
+            data, ancdata, _, _ = self._socket.recvmsg(_RECV_SIZE, socket.CMSG_SPACE(_MAX_RECV_FDS * fds.itemsize))
+        except BlockingIOError:
+            return
+        except OSError as e:
+            logger.error("Control channel closed: %s", e)
+            data, ancdata = b"", []
+
+        for level, cmsg_type, cmsg_data in ancdata:
+            if level == socket.SOL_SOCKET and cmsg_type == socket.SCM_RIGHTS:
+                fds.frombytes(cmsg_data[: len(cmsg_data) - (len(cmsg_data) % fds.itemsize)])
+        self._received_fds.extend(fds)
+
+        if not data:
+            self.close()
+            return
+
+        self._received += data
+        while len(self._received) >= _frame_header.size:
+            kind, fd_count, header_size, payload_size = _frame_header.unpack_from(self._received, 0)
+            header_end = _frame_header.size + header_size
+            frame_end = header_end + payload_size
+            if len(self._received) < frame_end:
+                break
+            header = json.loads(self._received[_frame_header.size : header_end].decode())
+            payload = bytes(self._received[header_end:frame_end])
+            message_fds = [self._received_fds.popleft() for _ in range(fd_count)]
+            del self._received[:frame_end]
+            self._messages.put_nowait((Control(kind), header, payload, message_fds))
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._loop.remove_reader(self._socket.fileno())
+        self._loop.remove_writer(self._socket.fileno())
+        for _, fds in self._outgoing:
+            for fd in fds:
+                os.close(fd)
+        self._outgoing.clear()
+        for fd in self._received_fds:
+            os.close(fd)
+        self._received_fds.clear()
+        self._socket.close()
+        self._messages.put_nowait(None)
+
+
+class ShardConnection(AsyncConnection):
+    """
+    A connection that is passed to another process when its client joins a room.
+    """
+
+    def __init__(self, server: ShardServerBase, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        super().__init__(server, reader, writer)
+        self.joining_room: Optional[str] = None  # the connection stops reading once set, to be passed
+
+    async def run(self):
+        self._send_task = asyncio.create_task(self._send_loop())
+        try:
+            while self.joining_room is None:
+                self.handle_command(await self._read_command())
+        except (asyncio.IncompleteReadError, ConnectionError):
+            self._server.handle_client_disconnect(self)
+            return
+        await self._server.hand_off(self)
+
+    async def detach(self) -> Tuple[int, bytes]:
+        """
+        Send the pending commands, then close the connection, but not the client socket.
+        Return a duplicate of the socket file descriptor and the bytes received but not read yet.
+        """
+        transport = self._stream_writer.transport
+        transport.pause_reading()
+        if self._send_task is not None:
+            self._send_task.cancel()
+        # wait until everything is written to the socket, since the next owner of the socket will write to it
+        transport.set_write_buffer_limits(0)
+        await self._send_pending()
+        await self._stream_writer.drain()
+
+        # Nothing is received once reading is paused, so the reader can be ended, to read the bytes it has buffered
+        # without waiting for more
+        self._stream_reader.feed_eof()
+        pending = await self._stream_reader.read()
+        fd = os.dup(self._stream_writer.get_extra_info("socket").fileno())
+        self._stream_writer.close()
+        return fd, pending
+
+    def state(self) -> Dict[str, Any]:
+        """
+        Return what the next owner of the connection needs to know about it, besides the socket.
+        """
+        return {
+            "room": self.joining_room,
+            "custom_attributes": self.custom_attributes,
+            "compressions": [c.value for c in self.compressions],
+            "command_batch": self.command_batch,
+            "chunk": self.chunk,
+            "room_statistics": self.room_statistics,
+            "presence": self.presence,
+            "presence_attributes": self.presence_attributes,
+        }
+
+    def restore(self, state: Dict[str, Any]):
+        self.custom_attributes = state["custom_attributes"]
+        self.compressions = {common.Compression(c) for c in state["compressions"]}
+        self.command_batch = state["command_batch"]
+        self.chunk = state["chunk"]
+        self.room_statistics = state["room_statistics"]
+        self.presence = state["presence"]
+        self.presence_attributes = state["presence_attributes"]
+
+
+class ShardServerBase(AsyncServer):
+    """
+    What the front and worker processes have in common: relaying broadcast commands, answering LIST_ROOMS and
+    LIST_CLIENTS for all the processes and passing connections.
+    """
+
+    connection_class = ShardConnection
+
+    def __init__(self):
+        super().__init__()
+        # attributes of the rooms and clients of all the processes, from the broadcast commands
+        self._rooms_attributes: Dict[str, Dict[str, Any]] = {}
+        self._clients_attributes: Dict[str, Dict[str, Any]] = {}
+
+    def _relay(self, command: common.Command):
+        """
+        Send a broadcast command to the other processes.
+        """
+        raise NotImplementedError()
+
+    def _relay_room_operation(self, room_name: str, operation: str, *args):
+        """
+        Call a Server method on the process that owns room_name.
+        """
+        raise NotImplementedError()
+
+    def _send_handoff(self, state: Dict[str, Any], pending: bytes, fd: int):
+        raise NotImplementedError()
+
+    def _deliver(self, command: common.Command):
+        """
+        Send a broadcast command to the clients of this process.
+        """
+        data = command.data
+        if command.type == common.MessageType.CLIENT_UPDATE:
+            common.update_named_attributes(self._clients_attributes, common.decode_json(data, 0)[0])
+        elif command.type == common.MessageType.ROOM_UPDATE:
+            common.update_named_attributes(self._rooms_attributes, common.decode_json(data, 0)[0])
+        elif command.type == common.MessageType.ROOM_DELETED:
+            self._rooms_attributes.pop(common.decode_string(data, 0)[0], None)
+        elif command.type == common.MessageType.CLIENT_DISCONNECTED:
+            self._clients_attributes.pop(common.decode_string(data, 0)[0], None)
+        super().broadcast_to_all_clients(command)
+
+    def _receive_broadcast(self, payload: bytes) -> common.Command:
+        message_type, _ = common.decode_int(payload, 0)
+        command = common.Command(common.MessageType(message_type), payload[4:])
+        self._deliver(command)
+        return command
+
+    def broadcast_to_all_clients(self, command: common.Command):
+        self._deliver(command)
+        self._relay(command)
+
+    def get_list_rooms_command(self) -> common.Command:
+        with self._mutex:
+            local = {room_name: room.attributes_dict() for room_name, room in self._rooms.items()}
+            result_dict = {**self._rooms_attributes, **local}
+            return common.Command(common.MessageType.LIST_ROOMS, common.encode_json(result_dict))
+
+    def get_list_clients_command(self) -> common.Command:
+        with self._mutex:
+            # the send queues of the clients of other processes are not known here
+            local = {
+                cid: {**c.client_attributes(), **c.send_queue_attributes()} for cid, c in self._connections.items()
+            }
+            result_dict = {**self._clients_attributes, **local}
+            return common.Command(common.MessageType.LIST_CLIENTS, common.encode_json(result_dict))
+
+    def delete_room(self, room_name: str):
+        if room_name in self._rooms:
+            super().delete_room(room_name)
+        else:
+            self._relay_room_operation(room_name, "delete_room", room_name)
+
+    def set_room_custom_attributes(self, room_name: str, custom_attributes: Dict[str, Any]):
+        if room_name in self._rooms:
+            super().set_room_custom_attributes(room_name, custom_attributes)
+        else:
+            self._relay_room_operation(room_name, "set_room_custom_attributes", room_name, custom_attributes)
+
+    def set_room_keep_open(self, room_name: str, value: bool):
+        if room_name in self._rooms:
+            super().set_room_keep_open(room_name, value)
+        else:
+            self._relay_room_operation(room_name, "set_room_keep_open", room_name, value)
+
+    def _apply_room_operation(self, header: Dict[str, Any]):
+        operation = _room_operations.get(header["operation"])
+        if operation is None:
+            logger.error("Unknown room operation %s", header["operation"])
+            return
+        operation(self, *header["args"])
+
+    def join_room(self, connection: BaseConnection, room_name: str):
+        assert connection.room is None
+        # the connection stops reading and calls hand_off()
+        connection.joining_room = room_name
+
+    async def hand_off(self, connection: ShardConnection):
+        """
+        Pass the connection to the process that owns the room it joins.
+        """
+        with self._mutex:
+            del self._connections[connection.unique_id]
+        try:
+            fd, pending = await connection.detach()
+        except (OSError, ConnectionError) as e:
+            logger.warning("%s disconnected while joining %s: %s", connection.unique_id, connection.joining_room, e)
+            with self._mutex:
+                self._connections[connection.unique_id] = connection
+            self.handle_client_disconnect(connection)
+            return
+
+        logger.info("Pass %s to the owner of room %s", connection.unique_id, connection.joining_room)
+        self._send_handoff(connection.state(), pending, fd)
+
+
+# Server methods that may be called on the process that owns a room
+_room_operations = {
+    "delete_room": Server.delete_room,
+    "set_room_custom_attributes": Server.set_room_custom_attributes,
+    "set_room_keep_open": Server.set_room_keep_open,
+}
+
+
+def _encode_broadcast(command: common.Command) -> bytes:
+    return common.encode_int(command.type.value) + bytes(command.data)
+
+
+class ShardedServer(ShardServerBase):
+    """
+    The front process of the sharded server. Accepts the connections, serves the clients until they join a room, starts
+    the worker processes and coordinates them.
+    """
+
+    def __init__(self, worker_count: int = DEFAULT_WORKER_COUNT):
+        if not is_supported():
+            raise RuntimeError("Sharded server not supported on this platform")
+        super().__init__()
+        self._worker_count = worker_count
+        self._workers: List[multiprocessing.Process] = []
+        self._channels: List[ControlChannel] = []
+        self._channel_tasks: List[asyncio.Task] = []
+        self._room_owners: Dict[str, int] = {}  # index of the worker that owns each room
+
+    def _room_owner(self, room_name: str) -> int:
+        owner = self._room_owners.get(room_name)
+        if owner is None:
+            room_counts = Counter(self._room_owners.values())
+            owner = min(range(self._worker_count), key=lambda index: room_counts[index])
+            self._room_owners[room_name] = owner
+        return owner
+
+    def _relay(self, command: common.Command, source: Optional[int] = None):
+        payload = _encode_broadcast(command)
+        for index, channel in enumerate(self._channels):
+            if index != source:
+                channel.send(Control.BROADCAST, {}, payload)
+
+    def _relay_room_operation(self, room_name: str, operation: str, *args):
+        owner = self._room_owners.get(room_name)
+        if owner is None:
+            logger.warning("Room %s does not exist.", room_name)
+            return
+        self._channels[owner].send(Control.ROOM_OPERATION, {"operation": operation, "args": list(args)})
+
+    def _send_handoff(self, state: Dict[str, Any], pending: bytes, fd: int):
+        self._channels[self._room_owner(state["room"])].send(Control.HANDOFF, state, pending, [fd])
+
+    def _track_owners(self, command: common.Command, worker: int):
+        if command.type == common.MessageType.ROOM_UPDATE:
+            for room_name in common.decode_json(command.data, 0)[0]:
+                self._room_owners[room_name] = worker
+        elif command.type == common.MessageType.ROOM_DELETED:
+            room_name, _ = common.decode_string(command.data, 0)
+            if self._room_owners.get(room_name) == worker:
+                del self._room_owners[room_name]
+
+    async def _receive_from(self, worker: int, channel: ControlChannel):
+        while True:
+            message = await channel.receive()
+            if message is None:
+                if not self._shutdown:
+                    logger.error("Worker %d stopped, its rooms are lost", worker)
+                return
+            kind, header, payload, fds = message
+            if kind == Control.BROADCAST:
+                command = self._receive_broadcast(payload)
+                self._track_owners(command, worker)
+                self._relay(command, worker)
+            elif kind == Control.ROOM_OPERATION:
+                self._relay_room_operation(header["args"][0], header["operation"], *header["args"])
+            elif kind == Control.HANDOFF:
+                self._send_handoff(header, payload, fds[0])
+
+    def _start_workers(self):
+        context = multiprocessing.get_context("spawn")
+        # the configuration of the rooms and connections, that the workers serve
+        settings = {
+            "compact_history": self.compact_history,
+            "send_queue_budget": self.send_queue_budget,
+            "slow_client_policy": self.slow_client_policy.value,
+            "room_update_interval": self.room_update_interval,
+            "presence_interval": self.presence_interval,
+        }
+        for index in range(self._worker_count):
+            front_socket, worker_socket = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+            process = context.Process(
+                target=run_worker, args=(index, worker_socket, logging.getLogger().level, settings), daemon=True
+            )
+            process.start()
+            worker_socket.close()
+            self._workers.append(process)
+            channel = ControlChannel(front_socket)
+            self._channels.append(channel)
+            self._channel_tasks.append(asyncio.create_task(self._receive_from(index, channel)))
+
+    async def _serve(self, port):
+        self._start_workers()
+        try:
+            await super()._serve(port)
+        finally:
+            # the workers stop when their channel is closed
+            self._shutdown = True
+            for channel in self._channels:
+                channel.close()
+            await asyncio.gather(*self._channel_tasks, return_exceptions=True)
+
+    def run(self, port):
+        super().run(port)
+        for process in self._workers:
+            process.join(5.0)
+            if process.is_alive():
+                logger.warning("Worker %s did not stop, terminating it", process.pid)
+                process.terminate()
+
+
+class ShardWorker(ShardServerBase):
+    """
+    A worker process of the sharded server. Serves the rooms assigned by the front process.
+    """
+
+    def __init__(self, index: int, channel_socket: socket.socket):
+        super().__init__()
+        self._index = index
+        self._channel_socket = channel_socket
+        self._channel: Optional[ControlChannel] = None
+
+    def _relay(self, command: common.Command):
+        self._channel.send(Control.BROADCAST, {}, _encode_broadcast(command))
+
+    def _relay_room_operation(self, room_name: str, operation: str, *args):
+        self._channel.send(Control.ROOM_OPERATION, {"operation": operation, "args": list(args)})
+
+    def _send_handoff(self, state: Dict[str, Any], pending: bytes, fd: int):
+        self._channel.send(Control.HANDOFF, state, pending, [fd])
+
+    async def _adopt(self, state: Dict[str, Any], pending: bytes, fd: int):
+        """
+        Serve a connection passed by the front process, and join its room.
+        """
+        sock = socket.socket(fileno=fd)
+        reader = asyncio.StreamReader()
+        reader.feed_data(pending)
+        protocol = asyncio.StreamReaderProtocol(reader)
+        try:
+            transport, _ = await self._loop.create_connection(lambda: protocol, sock=sock)
+        except OSError as e:
+            logger.warning("Cannot serve a connection joining %s: %s", state["room"], e)
+            sock.close()
+            return
+        writer = asyncio.StreamWriter(transport, protocol, reader, self._loop)
+
+        connection = ShardConnection(self, reader, writer)
+        connection.restore(state)
+        with self._mutex:
+            self._connections[connection.unique_id] = connection
+        self._connection_tasks.add(asyncio.create_task(self._serve_connection(connection)))
+        try:
+            Server.join_room(self, connection, state["room"])
+        except Exception as e:
+            connection._send_error(f"{e}")
+
+    async def _serve(self, port=None):
+        self._loop = asyncio.get_running_loop()
+        self._channel = ControlChannel(self._channel_socket)
+        flush_task = asyncio.create_task(self._flush_updates_periodically())
+        logger.info("Worker %d started", self._index)
+        while True:
+            message = await self._channel.receive()
+            if message is None:
+                break
+            kind, header, payload, fds = message
+            if kind == Control.BROADCAST:
+                self._receive_broadcast(payload)
+            elif kind == Control.ROOM_OPERATION:
+                self._apply_room_operation(header)
+            elif kind == Control.HANDOFF:
+                await self._adopt(header, payload, fds[0])
+
+        logger.info("Worker %d stopping", self._index)
+        flush_task.cancel()
+        self._shutdown = True
+        await self._close_connections()
+
+
+def run_worker(index: int, channel_socket: socket.socket, log_level: int, settings: Dict[str, Any]):
+    # the front process stops the workers, Ctrl+C in a terminal must not stop them first
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=log_level, format="%(asctime)s - worker %(process)d - %(levelname)s - %(message)s")
+    worker = ShardWorker(index, channel_socket)
+    worker.compact_history = settings["compact_history"]
+    worker.send_queue_budget = settings["send_queue_budget"]
+    worker.slow_client_policy = SlowClientPolicy(settings["slow_client_policy"])
+    worker.room_update_interval = settings["room_update_interval"]
+    worker.presence_interval = settings["presence_interval"]
+    worker.run(None)
@@ -0,0 +1,36 @@
+"""
+Wire constants of the binary encoding of blender_data proxies, see mixer.blender_data.binary_codec.
+
+They are defined here, apart from the codec that requires bpy, so that the server can read the messages it keeps in
+room histories, see history.py.
+"""
+
+from enum import IntEnum
+
+# identifies the format and its version, at the start of each message
+MAGIC = b"MXB\x01"
+
+
+class Tag(IntEnum):
+    """
+    The one byte tag that starts each encoded value.
+    """
+
+    NONE = 0
+    FALSE = 1
+    TRUE = 2
+    INT = 3
+    FLOAT = 4
+    STRING = 5
+    LIST = 6
+    TUPLE = 7
+    DICT = 8  # keys of any type
+    STRING_DICT = 9  # string keys only, stored as string table indices without tag
+    FLOAT_LIST = 10  # list of floats only, such as vectors
+    ARRAY = 11
+    PROXY = 12
+
+
+# option flags of an encoded proxy, that tell which optional fields follow its header
+BLENDDATA_PATH = 1
+CLASS_NAME = 2
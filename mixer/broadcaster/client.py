@@ -1,7 +1,10 @@
+from collections import deque
 import socket
 import logging
+import select
+import threading
 import time
-from typing import Dict, Any, Mapping, Optional, List, Callable
+from typing import Deque, Dict, Any, Mapping, Optional, List, Callable
 
 import mixer.broadcaster.common as common
 from mixer.broadcaster.common import MessageType
@@ -9,6 +12,17 @@ from mixer.broadcaster.common import update_attributes_and_get_diff, update_name
 
 logger = logging.getLogger() if __name__ == "__main__" else logging.getLogger(__name__)
 
+# Pending bulk commands are sent by slices of this many bytes, so that the chunks of a large command are not all built
+# at once
+SEND_SLICE_SIZE = 4 * 1024 * 1024
+
+# With an I/O thread, the received commands are read from the socket until this many bytes are waiting to be fetched
+INCOMING_BUDGET = 256 * 1024 * 1024
+
+# Presence attributes are sent at most at this interval, in seconds, with their floats rounded to this many decimals
+PRESENCE_INTERVAL = 0.1
+PRESENCE_DIGITS = 4
+
 
 class Client:
     """
@@ -19,14 +33,35 @@ class Client:
     - maintain an updated view of clients and room states from server's inputs
     """
 
-    def __init__(self, host=common.DEFAULT_HOST, port=common.DEFAULT_PORT):
+    def __init__(
+        self,
+        host=common.DEFAULT_HOST,
+        port=common.DEFAULT_PORT,
+        compression=common.Compression.ZLIB,
+        room_statistics: bool = True,
+        io_thread: bool = False,
+    ):
         self.host = host
         self.port = port
-        self.pending_commands: List[common.Command] = []
+        self.preferred_compression = compression  # use Compression.NONE to disable compression
+        self.room_statistics = room_statistics  # clear to stop receiving room sizes, if room lists are not displayed
+        self.io_thread = io_thread  # read and write the socket from a ClientIOThread
+        self.presence = False  # negotiated with the server, send presence attributes with CLIENT_PRESENCE
+        self.presence_interval = PRESENCE_INTERVAL
+        self.compression = common.Compression.NONE  # negotiated with the server
+        self.command_batch = False  # negotiated with the server, send small commands in COMMAND_BATCH messages
+        self.chunk = False  # negotiated with the server, send large commands in CHUNK messages
+        self.pending_commands = common.CommandLanes()
         self.socket = None
+        self._reader: Optional[common.FrameReader] = None
+        self._assembler = common.ChunkAssembler()
+        self._io: Optional[ClientIOThread] = None
 
         self.client_id: Optional[str] = None  # Will be filled with a unique string identifying this client
         self.current_custom_attributes: Dict[str, Any] = {}
+        self.current_presence_attributes: Dict[str, Any] = {}
+        self._pending_presence_attributes: Dict[str, Any] = {}  # changed, not sent yet
+        self._next_presence_send = 0.0
         self.clients_attributes: Dict[str, Dict[str, Any]] = {}
         self.rooms_attributes: Dict[str, Dict[str, Any]] = {}
         self.current_room: Optional[str] = None
@@ -50,38 +85,85 @@ class Client:
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.connect((self.host, self.port))
+            self._reader = common.FrameReader(self.socket)
+            self.compression = common.Compression.NONE
+            self.command_batch = False
+            self.chunk = False
+            self.presence = False
+            self._assembler = common.ChunkAssembler()
             local_address = self.socket.getsockname()
             logger.info(
                 "Connecting from local %s:%s to %s:%s", local_address[0], local_address[1], self.host, self.port,
             )
+            self.send_command(
+                common.Command(common.MessageType.CLIENT_CAPABILITIES, common.encode_json(self.capabilities()))
+            )
             self.send_command(common.Command(common.MessageType.CLIENT_ID))
             self.send_command(common.Command(common.MessageType.LIST_CLIENTS))
             self.send_command(common.Command(common.MessageType.LIST_ROOMS))
+            if self.io_thread:
+                self._io = ClientIOThread(self, self.socket, self._reader)
+                self._io.start()
         except ConnectionRefusedError:
             self.socket = None
+            self._reader = None
         except common.ClientDisconnectedException:
             self.handle_connection_lost()
         except Exception as e:
             logger.error("Connection error %s", e, exc_info=True)
             self.socket = None
+            self._reader = None
             raise
 
     def disconnect(self):
+        io = self._io
+        self._io = None
+        if io is not None:
+            # send the commands given to the thread, unless it is blocked
+            io.stop(timeout=1.0)
         if self.socket:
-            self.socket.shutdown(socket.SHUT_RDWR)
-            self.socket.close()
-            self.socket = None
+            try:
+                self.socket.shutdown(socket.SHUT_RDWR)
+            finally:
+                self.socket.close()
+                self.socket = None
+                self._reader = None
+                if io is not None:
+                    io.join()
+                    io.close()
 
     def is_connected(self):
         return self.socket is not None
 
+    def capabilities(self) -> Dict[str, Any]:
+        """
+        Protocol extensions requested to the server when connecting.
+        """
+        compressions = []
+        if self.preferred_compression != common.Compression.NONE:
+            # Advertise all the codecs we can decode, the preferred one first
+            compressions = [self.preferred_compression] + [
+                c for c in common.Compression if c not in (common.Compression.NONE, self.preferred_compression)
+            ]
+        return {
+            common.ClientCapabilities.COMPRESSION: [c.name.lower() for c in compressions],
+            common.ClientCapabilities.COMMAND_BATCH: True,
+            common.ClientCapabilities.CHUNK: True,
+            common.ClientCapabilities.ROOM_STATISTICS: self.room_statistics,
+            common.ClientCapabilities.PRESENCE: True,
+        }
+
     def add_command(self, command: common.Command):
-        self.pending_commands.append(command)
+        self.pending_commands.put(command)
 
     def handle_connection_lost(self):
         logger.info("Connection lost for %s:%s", self.host, self.port)
         # Set socket to None before putting CONNECTION_LIST message to avoid sending/reading new messages
         self.socket = None
+        self._reader = None
+        if self._io is not None:
+            self._io.close()
+            self._io = None
 
     def wait(self, message_type: MessageType) -> bool:
         """
@@ -89,6 +171,7 @@ class Client:
         Usually message_type is LEAVING_ROOM.
         """
         while self.is_connected():
+            self.wait_incoming_commands(0.1)
             try:
                 received_commands = self.fetch_incoming_commands()
             except common.ClientDisconnectedException:
@@ -99,14 +182,69 @@ class Client:
                     return True
         return False
 
+    def wait_incoming_commands(self, timeout: float):
+        """
+        Return when commands may have been received, or after timeout seconds.
+        """
+        if self._io is not None:
+            self._io.wait_received(timeout)
+        elif self.socket is not None:
+            select.select([self.socket], [], [], timeout)
+
+    def has_incoming_commands(self) -> bool:
+        """
+        Return True if commands have been received and not fetched yet, without waiting.
+        """
+        if self._io is not None:
+            return self._io.has_received()
+        if self.socket is not None:
+            readable, _, _ = select.select([self.socket], [], [], 0)
+            return bool(readable)
+        return False
+
+    def _prepare_send(self, commands: List[common.Command]) -> List[common.Command]:
+        prepared = []
+        for command in commands:
+            if isinstance(command, common.FileCommand):
+                try:
+                    command = command.load()
+                except OSError as e:
+                    logger.error("Could not send %s: %s", command.type.name, e)
+                    continue
+            prepared.append(common.compress_command(command, self.compression))
+        return prepared
+
     def send_command(self, command: common.Command):
+        return self.send_commands([command])
+
+    def send_commands(self, commands: List[common.Command]):
+        if self._io is not None:
+            return self._io.send(commands)
         try:
-            common.write_message(self.socket, command)
+            self._write(commands)
             return True
         except common.ClientDisconnectedException:
             self.handle_connection_lost()
             return False
 
+    def _write(self, commands: List[common.Command]):
+        common.write_messages(self.socket, self._prepare_send(commands))
+
+    def _log_send(self, command: common.Command, index: int, count: int):
+        logger.debug("Send %s (%d / %d)", command.type, index + 1, count)
+
+    def _split(self, command: common.Command):
+        """
+        Return the CHUNK commands to send instead of command, or None to send command as is.
+        """
+        if not self.chunk or command.byte_size() - common.MESSAGE_HEADER_SIZE <= common.CHUNK_SIZE:
+            return None
+        # chunks transfer the compressed payload
+        command = common.compress_command(command, self.compression)
+        if command.byte_size() - common.MESSAGE_HEADER_SIZE <= common.CHUNK_SIZE:
+            return iter([command])
+        return common.split_command(command)
+
     def join_room(self, room_name: str):
         return self.send_command(common.Command(common.MessageType.JOIN_ROOM, room_name.encode("utf8"), 0))
 
@@ -126,6 +264,29 @@ class Client:
             common.Command(common.MessageType.SET_CLIENT_CUSTOM_ATTRIBUTES, common.encode_json(diff), 0)
         )
 
+    def set_presence_attributes(self, attributes: Mapping[str, Any]):
+        """
+        Set the attributes that change continuously with the activity of the user, like its viewports, so that they
+        are sent to the clients of the room only. Meant to be called periodically.
+
+        Floats are rounded to PRESENCE_DIGITS decimals. The changes are sent at most every presence_interval seconds,
+        the others are sent by a later call. If the server does not support CLIENT_PRESENCE, the attributes are set
+        with set_client_attributes().
+        """
+        if not self.presence:
+            return self.set_client_attributes(attributes)
+
+        attributes = common.quantize_floats(attributes, PRESENCE_DIGITS)
+        diff = update_attributes_and_get_diff(self.current_presence_attributes, attributes)
+        self._pending_presence_attributes.update(diff)
+        now = time.monotonic()
+        if not self._pending_presence_attributes or now < self._next_presence_send:
+            return True
+
+        self._next_presence_send = now + self.presence_interval
+        pending, self._pending_presence_attributes = self._pending_presence_attributes, {}
+        return self.send_command(common.Command(common.MessageType.CLIENT_PRESENCE, common.encode_json(pending)))
+
     def set_room_attributes(self, room_name: str, attributes: dict):
         return self.send_command(common.make_set_room_attributes_command(room_name, attributes))
 
@@ -148,7 +309,7 @@ class Client:
         update_named_attributes(self.rooms_attributes, rooms_attributes)
 
     def _handle_client_id(self, command: common.Command):
-        self.client_id = command.data.decode()
+        self.client_id = bytes(command.data).decode()
 
     def _handle_room_update(self, command: common.Command):
         rooms_attributes_update, _ = common.decode_json(command.data, 0)
@@ -166,6 +327,13 @@ class Client:
         clients_attributes_update, _ = common.decode_json(command.data, 0)
         update_named_attributes(self.clients_attributes, clients_attributes_update)
 
+    def _handle_client_presence(self, command: common.Command):
+        clients_attributes_update, _ = common.decode_json(command.data, 0)
+        for client_id, attributes_update in clients_attributes_update.items():
+            # presence is only received from the clients of the room
+            default = {common.ClientAttributes.ID: client_id, common.ClientAttributes.ROOM: self.current_room}
+            self.clients_attributes.setdefault(client_id, default).update(attributes_update)
+
     def _handle_client_disconnected(self, command: common.Command):
         client_id, _ = common.decode_string(command.data, 0)
 
@@ -174,6 +342,15 @@ class Client:
             return
         del self.clients_attributes[client_id]
 
+    def _handle_client_capabilities(self, command: common.Command):
+        enabled, _ = common.decode_json(command.data, 0)
+        compression = common.compression_from_name(enabled.get(common.ClientCapabilities.COMPRESSION, ""))
+        self.compression = compression if compression is not None else common.Compression.NONE
+        logger.info("Compression enabled by server: %s", self.compression.name)
+        self.command_batch = enabled.get(common.ClientCapabilities.COMMAND_BATCH, False) is True
+        self.chunk = enabled.get(common.ClientCapabilities.CHUNK, False) is True
+        self.presence = enabled.get(common.ClientCapabilities.PRESENCE, False) is True
+
     def _handle_join_room(self, command: common.Command):
         room_name, _ = common.decode_string(command.data, 0)
 
@@ -187,8 +364,10 @@ class Client:
         MessageType.ROOM_UPDATE: _handle_room_update,
         MessageType.ROOM_DELETED: _handle_room_deleted,
         MessageType.CLIENT_UPDATE: _handle_client_update,
+        MessageType.CLIENT_PRESENCE: _handle_client_presence,
         MessageType.CLIENT_DISCONNECTED: _handle_client_disconnected,
         MessageType.JOIN_ROOM: _handle_join_room,
+        MessageType.CLIENT_CAPABILITIES: _handle_client_capabilities,
     }
 
     def has_default_handler(self, message_type: MessageType):
@@ -199,8 +378,15 @@ class Client:
         Gather incoming commands from the socket and return them as a list.
         Process those that have a default handler with the one registered.
         """
+        if self._reader is None:
+            logger.warning("fetch_incoming_commands called with no socket")
+            return []
+
         try:
-            received_commands = common.read_all_messages(self.socket)
+            if self._io is not None:
+                received_commands = self._io.receive()
+            else:
+                received_commands = self._decode(self._reader.read_all_messages())
         except common.ClientDisconnectedException:
             self.handle_connection_lost()
             raise
@@ -215,21 +401,190 @@ class Client:
 
         return received_commands
 
-    def fetch_outgoing_commands(self, commands_send_interval=0):
+    def _decode(self, messages: List[common.Command]) -> List[common.Command]:
         """
-        Send commands in pending_commands queue to the server.
+        Return the commands of the received messages: chunks assembled, payloads decompressed and batches expanded.
         """
-        for idx, command in enumerate(self.pending_commands):
-            logger.debug("Send %s (%d / %d)", command.type, idx + 1, len(self.pending_commands))
+        received_commands = []
+        for command in messages:
+            if command.type == MessageType.CHUNK:
+                command = self._assembler.add(command)
+                if command is None:
+                    continue
+            received_commands.append(common.decompress_command(command))
+        return common.expand_command_batches(received_commands)
 
-            if not self.send_command(command):
-                break
+    def fetch_outgoing_commands(self, commands_send_interval=0):
+        """
+        Send commands in pending_commands queue to the server, the interactive ones first.
+
+        Unless commands are throttled with commands_send_interval, small room commands are coalesced into COMMAND_BATCH
+        messages and large ones are sent in CHUNK messages, when the server allows it.
 
-            if commands_send_interval > 0:
+        With an I/O thread, the commands are sent by the thread, and this returns immediately.
+        """
+        if self._io is not None:
+            self._io.flush(commands_send_interval)
+            return
+
+        try:
+            self._send_pending_commands(commands_send_interval, self._write)
+        except common.ClientDisconnectedException:
+            self.handle_connection_lost()
+            self.pending_commands = common.CommandLanes()
+
+    def _send_pending_commands(self, commands_send_interval, write: Callable[[List[common.Command]], None]):
+        if commands_send_interval > 0:
+            interactive, bulk = self.pending_commands.take()
+            commands = interactive + bulk
+            for idx, command in enumerate(commands):
+                self._log_send(command, idx, len(commands))
+                write([command])
                 time.sleep(commands_send_interval)
+            return
 
-        self.pending_commands = []
+        while len(self.pending_commands) > 0:
+            interactive, bulk = self.pending_commands.take(SEND_SLICE_SIZE, self._split)
+            commands = interactive + bulk
+            for idx, command in enumerate(commands):
+                self._log_send(command, idx, len(commands))
+            if self.command_batch:
+                # batch each lane separately, so that the server keeps interactive commands in the interactive lane
+                commands = common.batch_commands(interactive) + common.batch_commands(bulk)
+            write(commands)
 
     def fetch_commands(self, commands_send_interval=0) -> List[common.Command]:
         self.fetch_outgoing_commands(commands_send_interval)
         return self.fetch_incoming_commands()
+
+
+class ClientIOThread(threading.Thread):
+    """
+    Thread that owns the socket of a Client created with io_thread=True, so that reading large messages or writing to
+    a congested connection does not block the thread that uses the client, the Blender main thread.
+
+    The thread reads the messages, assembles their chunks, decompresses their payloads and expands the command
+    batches, and queues the commands until fetch_incoming_commands() returns them. It reads until INCOMING_BUDGET
+    bytes are queued, then leaves them in the socket, so that the server holds back the next ones.
+
+    It sends the commands of send_command() in order, and the pending commands of the client when
+    fetch_outgoing_commands() is called, so that they are coalesced and batched as without a thread. The commands are
+    compressed, split in chunks and read from their files by the thread.
+
+    The client is only used from its thread, except _decode(), _prepare_send() and _send_pending_commands(), that
+    only the I/O thread calls once it is started. Its pending commands are thread safe.
+    """
+
+    def __init__(self, client: Client, sock: socket.socket, reader: common.FrameReader):
+        super().__init__(name=f"Mixer I/O {client.host}:{client.port}", daemon=True)
+        self._client = client
+        self._socket = sock
+        self._reader = reader
+        self._mutex = threading.Lock()
+        self._received: Deque[common.Command] = deque()
+        self._received_size = 0
+        self._received_event = threading.Event()
+        self._commands: List[common.Command] = []  # sent before the pending commands of the client
+        self._send_interval: Optional[float] = None  # set when the pending commands of the client are to be sent
+        self._stopping = False
+        self.error: Optional[Exception] = None  # that ended the thread
+        # written to wake the thread when it waits for the socket
+        self._wake_receiver, self._wake_sender = socket.socketpair()
+        self._wake_sender.setblocking(False)
+
+    def _wake(self):
+        try:
+            self._wake_sender.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass  # already woken, or closed
+
+    def send(self, commands: List[common.Command]) -> bool:
+        with self._mutex:
+            if self.error is not None or self._stopping:
+                return False
+            self._commands.extend(commands)
+        self._wake()
+        return True
+
+    def flush(self, commands_send_interval: float):
+        with self._mutex:
+            self._send_interval = commands_send_interval
+        self._wake()
+
+    def receive(self) -> List[common.Command]:
+        """
+        Return the received commands, then raise ClientDisconnectedException once the connection is lost.
+        """
+        alive = self.is_alive()
+        with self._mutex:
+            commands = list(self._received)
+            self._received.clear()
+            resume = self._received_size >= INCOMING_BUDGET
+            self._received_size = 0
+            self._received_event.clear()
+        if resume:
+            self._wake()
+        if not commands and not alive:
+            raise common.ClientDisconnectedException(f"Connection lost: {self.error!r}")
+        return commands
+
+    def has_received(self) -> bool:
+        return self._received_event.is_set()
+
+    def wait_received(self, timeout: float):
+        self._received_event.wait(timeout)
+
+    def stop(self, timeout: Optional[float] = None):
+        """
+        Send the commands given to send(), then end the thread.
+        """
+        with self._mutex:
+            self._stopping = True
+        self._wake()
+        self.join(timeout)
+
+    def close(self):
+        self._wake_receiver.close()
+        self._wake_sender.close()
+
+    def _write(self, commands: List[common.Command]):
+        common.write_messages(self._socket, self._client._prepare_send(commands))
+
+    def _read(self):
+        commands = self._client._decode(self._reader.read_all_messages())
+        size = sum(command.byte_size() for command in commands)
+        with self._mutex:
+            self._received.extend(commands)
+            self._received_size += size
+        if commands:
+            self._received_event.set()
+
+    def run(self):
+        try:
+            while True:
+                with self._mutex:
+                    commands, self._commands = self._commands, []
+                    send_interval, self._send_interval = self._send_interval, None
+                    stopping = self._stopping
+                    reading = self._received_size < INCOMING_BUDGET
+                if commands:
+                    self._write(commands)
+                if send_interval is not None:
+                    self._client._send_pending_commands(send_interval, self._write)
+                if stopping:
+                    break
+
+                sockets = [self._wake_receiver, self._socket] if reading else [self._wake_receiver]
+                readable, _, _ = select.select(sockets, [], [])
+                if self._wake_receiver in readable:
+                    self._wake_receiver.recv(4096)
+                if self._socket in readable:
+                    self._read()
+        except (common.ClientDisconnectedException, OSError) as e:
+            self.error = e
+        except Exception as e:
+            logger.error("Client I/O thread failed: %r", e, exc_info=True)
+            self.error = e
+        finally:
+            # unblock receive()
+            self._received_event.set()
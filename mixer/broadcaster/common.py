@@ -2,20 +2,71 @@
 This module defines types and utilities used by client and server code.
 """
 
+from collections import Counter, deque, namedtuple
 from enum import IntEnum
-from typing import Dict, Mapping, Any, Optional, List
+from typing import BinaryIO, Callable, Deque, Dict, FrozenSet, Iterator, Mapping, Any, Optional, List, Tuple
+import array
+import mmap
+import os
+import random
 import select
 import socket
 import struct
 import json
 import logging
+import lzma
+import tempfile
+import threading
+import time
+import zlib
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 DEFAULT_HOST = "localhost"
 DEFAULT_PORT = 12800
 
+# Each message is prefixed by a header: payload size (8 bytes), command id (4 bytes), message type (2 bytes)
+MESSAGE_HEADER_SIZE = 14
+message_header = struct.Struct("<QIH")
+
+# The upper bits of the message type field hold the compression codec of the payload
+MESSAGE_TYPE_MASK = 0x0FFF
+COMPRESSION_SHIFT = 12
+
+# Payloads smaller than this are not compressed
+COMPRESSION_THRESHOLD = 4 * 1024
+
+# Room commands smaller than COMPRESSION_THRESHOLD are coalesced into COMMAND_BATCH messages of at most this size
+MAX_BATCH_SIZE = 64 * 1024
+
+# Messages larger than this are sent as CHUNK messages with payloads of at most this size, to clients that support them
+CHUNK_SIZE = 256 * 1024
+
+# Chunked messages larger than this are assembled in a temporary file rather than in memory
+CHUNK_SPOOL_SIZE = 64 * 1024 * 1024
+
+# CHUNK payloads start with: transfer id, command id, message type and compression, payload size, offset
+chunk_header = struct.Struct("<QIHQQ")
+
+# Size of the buffer a FrameReader receives into. Larger frames are received into a buffer of their own
+READ_BUFFER_SIZE = 64 * 1024
+
+# Maximum number of buffers passed to a single sendmsg() call, to remain below IOV_MAX
+MAX_SEND_BUFFERS = 512
+
+# Buffers smaller than this are concatenated before sending when sendmsg() is not available
+SMALL_FRAME_SIZE = 64 * 1024
+
 logger = logging.getLogger(__name__)
 
+# Bulk array decoders use array.array typecodes, that are native sized. The protocol uses 4 bytes items
+assert array.array("f").itemsize == 4 and array.array("I").itemsize == 4
+_numpy_dtypes = {"f": "<f4", "I": "<u4", "i": "<i4"}
+
 
 class MessageType(IntEnum):
     """
@@ -50,6 +101,16 @@ class MessageType(IntEnum):
 
     CLIENT_DISCONNECTED = 22  # Server: Notify a client has diconnected
 
+    # Client: send the protocol extensions it supports; Server: reply with the ones enabled for the connection
+    CLIENT_CAPABILITIES = 23
+
+    # Client: ask for the operational metrics of the server; Server: reply with them, as JSON
+    SERVER_STATS = 24
+
+    # Client: set presence attributes of the client, see ClientCapabilities.PRESENCE
+    # Server: notify that presence attributes of clients of the room have changed, like CLIENT_UPDATE
+    CLIENT_PRESENCE = 25
+
     COMMAND = 100
     DELETE = 101
     CAMERA = 102
@@ -114,6 +175,15 @@ class MessageType(IntEnum):
     SHOT_MANAGER_CURRENT_SHOT = 147
     SHOT_MANAGER_ACTION = 148
 
+    # A sequence of room commands sent as a single message, see batch_commands()
+    COMMAND_BATCH = 149
+
+    # A slice of a large message, see split_command()
+    CHUNK = 150
+
+    # BLENDER_DATA_UPDATE encoded with mixer.blender_data.binary_codec instead of json_codec
+    BLENDER_DATA_BINARY_UPDATE = 151
+
     OPTIMIZED_COMMANDS = 200
     TRANSFORM = 201
     MESH = 202
@@ -124,6 +194,68 @@ class MessageType(IntEnum):
     PAUSE = 207
 
 
+# Payloads of these message types are compressed when larger than COMPRESSION_THRESHOLD, if the connection allows it
+COMPRESSIBLE_MESSAGE_TYPES = {
+    MessageType.MESH,
+    MessageType.TEXTURE,
+    MessageType.GREASE_PENCIL_MESH,
+    MessageType.BLENDER_DATA_UPDATE,
+    MessageType.BLENDER_DATA_BINARY_UPDATE,
+}
+
+
+class Lane(IntEnum):
+    """
+    Outbound traffic class of a command, see CommandLanes.
+    """
+
+    INTERACTIVE = 0
+    BULK = 1
+
+
+# Latency sensitive commands, sent ahead of the bulk commands queued before them. The others are in the bulk lane
+INTERACTIVE_MESSAGE_TYPES = {
+    MessageType.TRANSFORM,
+    MessageType.OBJECT_VISIBILITY,
+    MessageType.FRAME,
+    MessageType.PLAY,
+    MessageType.PAUSE,
+    MessageType.QUERY_CURRENT_FRAME,
+    MessageType.SHOT_MANAGER_CURRENT_SHOT,
+    MessageType.SET_CLIENT_CUSTOM_ATTRIBUTES,
+    MessageType.CLIENT_UPDATE,
+    MessageType.CLIENT_PRESENCE,
+    MessageType.ROOM_UPDATE,
+    MessageType.CLIENT_DISCONNECTED,
+}
+
+# Payloads of these message types start with the path or the name of the object they apply to. The other interactive
+# commands apply to no object, and the other bulk commands to unknown objects
+OBJECT_MESSAGE_TYPES = {
+    MessageType.TRANSFORM,
+    MessageType.OBJECT_VISIBILITY,
+    MessageType.MESH,
+    MessageType.CAMERA,
+    MessageType.LIGHT,
+    MessageType.GREASE_PENCIL_CONNECTION,
+    MessageType.DELETE,
+    MessageType.TEXTURE,
+}
+
+
+class Compression(IntEnum):
+    """
+    Codec used to compress a message payload, stored in the message header.
+
+    The codecs a client can decode are negotiated with CLIENT_CAPABILITIES when it connects. The server forwards
+    compressed messages untouched to clients that can decode them, and decompresses them for the others.
+    """
+
+    NONE = 0
+    ZLIB = 1
+    LZMA = 2
+
+
 class LightType(IntEnum):
     SPOT = 0  # directly mapped from Unity enum
     SUN = 1
@@ -150,6 +282,13 @@ class ClientAttributes:
     PORT = "port"  # Sent by server only, type = int
     ROOM = "room"  # Sent by server only, type = str
 
+    # Sent by server only in LIST_CLIENTS, the state of the queue of commands to send to the client
+    SEND_QUEUE_SIZE = "send_queue_size"  # type = int, bytes queued
+    SEND_QUEUE_COMMAND_COUNT = "send_queue_command_count"  # type = int, commands queued
+    SEND_QUEUE_PEAK = "send_queue_peak"  # type = int, largest bytes queued besides the history replayed on join
+    COALESCED_COMMAND_COUNT = "coalesced_command_count"  # type = int, queued commands dropped since superseded
+    CONGESTION_COUNT = "congestion_count"  # type = int, number of times the queue paused the room
+
     # Client to server attributes, not used by the server but clients are encouraged to use these keys for the same semantic
     USERNAME = "user_name"  # type = str
     USERCOLOR = "user_color"  # type = float3 (as list)
@@ -183,6 +322,35 @@ class RoomAttributes:
     JOINABLE = "joinable"  # Sent by server only, type = bool, indicate if the room is joinable
 
 
+class ClientCapabilities:
+    """
+    Protocol extensions negotiated between a client and the server with CLIENT_CAPABILITIES.
+    """
+
+    # Client: list of codec names the client can decode, preferred first
+    # Server: name of the codec the client should use to compress its messages, missing for no compression
+    COMPRESSION = "compression"
+
+    # Client: true if the client can decode COMMAND_BATCH messages
+    # Server: true if the client may send COMMAND_BATCH messages
+    COMMAND_BATCH = "command_batch"
+
+    # Client: true if the client can assemble CHUNK messages
+    # Server: true if the client may send CHUNK messages
+    CHUNK = "chunk"
+
+    # Client: false if the client does not need the ROOM_UPDATE messages that only update the command count and the
+    # byte size of rooms, true if missing
+    # Server: true if these messages are sent to the client
+    ROOM_STATISTICS = "room_statistics"
+
+    # Client: true if the client sends its presence attributes (viewports, selection, ...) with CLIENT_PRESENCE rather
+    # than SET_CLIENT_CUSTOM_ATTRIBUTES, and can handle CLIENT_PRESENCE
+    # Server: true if CLIENT_PRESENCE is enabled. The presence attributes of a client are only sent to the clients of
+    # its room, at most every presence interval, as CLIENT_UPDATE to the clients that do not handle CLIENT_PRESENCE
+    PRESENCE = "presence"
+
+
 class ClientDisconnectedException(Exception):
     """When a client is disconnected and we try to read from it."""
 
@@ -199,6 +367,19 @@ def int_to_message_type(value):
     return MessageType(value)
 
 
+def unpack_message_header(buffer, offset=0):
+    """
+    Return payload size, command id, message type and compression of the message header at offset in buffer.
+    """
+    frame_size, command_id, message_type = message_header.unpack_from(buffer, offset)
+    return (
+        frame_size,
+        command_id,
+        int_to_message_type(message_type & MESSAGE_TYPE_MASK),
+        Compression(message_type >> COMPRESSION_SHIFT),
+    )
+
+
 def encode_bool(value):
     if value:
         return int_to_bytes(1, 4)
@@ -223,7 +404,7 @@ def decode_string(data, index):
     string_length = bytes_to_int(data[index : index + 4])
     start = index + 4
     end = start + string_length
-    value = data[start:end].decode()
+    value = bytes(data[start:end]).decode()
     return value, end
 
 
@@ -329,31 +510,66 @@ def decode_string_array(data, index):
     return values, index
 
 
-def decode_array(data, index, schema, inc):
+def decode_array_buffer(data, index, typecode: str, components: int = 1):
+    """
+    Decode an array of count elements of components items each, in a single call.
+
+    Return a flat array, that can be directly used by foreach_set(): a numpy array that shares the memory of data
+    when numpy is available, an array.array otherwise.
+    """
     count = bytes_to_int(data[index : index + 4])
     start = index + 4
-    end = start
-    values = []
-    for _ in range(count):
-        end = start + inc
-        values.append(struct.unpack(schema, data[start:end]))
-        start = end
+    item_count = count * components
+    end = start + item_count * 4
+    if numpy is not None:
+        values = numpy.frombuffer(data, dtype=_numpy_dtypes[typecode], count=item_count, offset=start)
+    else:
+        values = array.array(typecode)
+        values.frombytes(data[start:end])
     return values, end
 
 
+def decode_float_buffer(data, index):
+    return decode_array_buffer(data, index, "f")
+
+
+def decode_int_buffer(data, index):
+    return decode_array_buffer(data, index, "I")
+
+
+def decode_int2_buffer(data, index):
+    return decode_array_buffer(data, index, "I", 2)
+
+
+def decode_int3_buffer(data, index):
+    return decode_array_buffer(data, index, "I", 3)
+
+
+def decode_vector2_buffer(data, index):
+    return decode_array_buffer(data, index, "f", 2)
+
+
+def decode_vector3_buffer(data, index):
+    return decode_array_buffer(data, index, "f", 3)
+
+
+def decode_array(data, index, schema, inc):
+    """
+    Decode an array as a list of tuples. Prefer decode_array_buffer() that returns a flat array.
+    """
+    count = bytes_to_int(data[index : index + 4])
+    start = index + 4
+    end = start + count * inc
+    return list(struct.iter_unpack(schema, data[start:end])), end
+
+
 def decode_float_array(data, index):
     return decode_array(data, index, "f", 4)
 
 
 def decode_int_array(data, index):
-    count = bytes_to_int(data[index : index + 4])
-    start = index + 4
-    values = []
-    for _ in range(count):
-        end = start + 4
-        values.extend(struct.unpack("I", data[start:end]))
-        start = end
-    return values, end
+    values, end = decode_array_buffer(data, index, "I")
+    return values.tolist(), end
 
 
 def decode_int2_array(data, index):
@@ -375,23 +591,653 @@ def decode_vector2_array(data, index):
 class Command:
     _id = 100
 
-    def __init__(self, command_type: MessageType, data=b"", command_id=0):
+    def __init__(self, command_type: MessageType, data=b"", command_id=0, compression=Compression.NONE):
         self.data = data or b""
         self.type = command_type
         self.id = command_id
+        self.compression = compression
         if command_id == 0:
             self.id = Command._id
             Command._id += 1
 
     def byte_size(self):
-        return 8 + 4 + 2 + len(self.data)
+        return MESSAGE_HEADER_SIZE + len(self.data)
+
+    def header(self) -> bytes:
+        return message_header.pack(len(self.data), self.id, self.type.value | self.compression << COMPRESSION_SHIFT)
 
     def to_byte_buffer(self):
-        size = int_to_bytes(len(self.data), 8)
-        command_id = int_to_bytes(self.id, 4)
-        mtype = int_to_bytes(self.type.value, 2)
+        return self.header() + self.data
+
+
+class FrameCommand(Command):
+    """
+    A command received from the network, that keeps its frame as received: the header bytes and a view of the
+    payload. The frame is written as is each time the command is sent, broadcast to the clients of a room or replayed
+    to the clients that join it, so it is immutable.
+    """
+
+    def __init__(self, header: bytes, data):
+        frame_size, command_id, message_type, compression = unpack_message_header(header)
+        if len(data) != frame_size:
+            raise ValueError(f"Frame payload size {len(data)} does not match its header size {frame_size}")
+        # Command.__init__() is not called, since data is a property
+        self.type = message_type
+        self.id = command_id
+        self.compression = compression
+        self._header = header
+        self._data = data
+        self._byte_size = MESSAGE_HEADER_SIZE + frame_size
+
+    @property
+    def data(self):
+        return self._data
+
+    def byte_size(self):
+        return self._byte_size
+
+    def header(self) -> bytes:
+        return self._header
+
+
+def detach_command(command: Command) -> Command:
+    """
+    Return command, or a copy of it if its payload is a view of a larger buffer, like the receive buffer of a
+    FrameReader, so that keeping the command does not keep the whole buffer alive.
+    """
+    data = command.data
+    if not isinstance(data, memoryview) or data.nbytes == memoryview(data.obj).nbytes:
+        return command
+    if isinstance(command, FrameCommand):
+        return FrameCommand(command.header(), bytes(data))
+    return Command(command.type, bytes(data), command.id, command.compression)
+
+
+class FileCommand(Command):
+    """
+    A command whose payload is data followed by the content of a file. The file is read when the command is sent, in
+    chunks if possible, so that large files are not held in memory.
+    """
+
+    def __init__(self, command_type: MessageType, data, path: str, file_size: int, command_id=0):
+        super().__init__(command_type, data, command_id)
+        self.path = path
+        self.file_size = file_size
+
+    def byte_size(self):
+        return super().byte_size() + self.file_size
+
+    def header(self) -> bytes:
+        return message_header.pack(len(self.data) + self.file_size, self.id, self.type.value)
+
+    def _read_file(self, file, size: int) -> bytes:
+        content = file.read(size)
+        if len(content) != size:
+            raise OSError(f"File {self.path} modified while sent")
+        return content
+
+    def load(self) -> Command:
+        """
+        Return a regular command, with the file content in its data.
+        """
+        with open(self.path, "rb") as file:
+            return Command(self.type, bytes(self.data) + self._read_file(file, self.file_size), self.id)
+
+    def chunks(self, chunk_size: int) -> Iterator[Command]:
+        prefix = bytes(self.data)
+        with open(self.path, "rb") as file:
 
-        return size + command_id + mtype + self.data
+            def _read(offset: int, size: int):
+                # chunks are read in order
+                head = prefix[offset : offset + size]
+                return head + self._read_file(file, size - len(head))
+
+            yield from _iter_chunks(self, len(prefix) + self.file_size, _read, chunk_size)
+
+
+class CommandRun(Command):
+    """
+    Consecutive commands that are queued and sent as a whole, such as the history replayed to a client that joins a
+    room.
+
+    If file is not None, the commands are encoded in file from offset, and are sent from the file with os.sendfile()
+    where available.
+    """
+
+    def __init__(self, commands: List[Command], file: Optional[BinaryIO] = None, offset: int = 0):
+        # COMMAND is not a room command type: the run is in the bulk lane, and applies to unknown objects
+        super().__init__(MessageType.COMMAND, b"", -1)
+        self.commands = commands
+        self.file = file
+        self.offset = offset
+        self._byte_size = sum(command.byte_size() for command in commands)
+
+    def byte_size(self):
+        return self._byte_size
+
+
+def compress(data, compression: Compression) -> bytes:
+    if compression == Compression.ZLIB:
+        return zlib.compress(data, 1)
+    if compression == Compression.LZMA:
+        return lzma.compress(data, preset=1)
+    raise ValueError(f"Unsupported compression {compression}")
+
+
+def decompress(data, compression: Compression, max_length: int = -1) -> bytes:
+    """
+    Decompress data, or only its first max_length bytes if max_length is not -1.
+    """
+    if compression == Compression.ZLIB:
+        if max_length == -1:
+            return zlib.decompress(data)
+        return zlib.decompressobj().decompress(data, max_length)
+    if compression == Compression.LZMA:
+        return lzma.LZMADecompressor().decompress(data, max_length)
+    raise ValueError(f"Unsupported compression {compression}")
+
+
+def compression_from_name(name: str) -> Optional[Compression]:
+    try:
+        compression = Compression[name.upper()]
+    except KeyError:
+        return None
+    return compression if compression != Compression.NONE else None
+
+
+def compress_command(command: Command, compression: Compression) -> Command:
+    """
+    Return a copy of command with a compressed payload, or command itself if compression does not apply.
+    """
+    if (
+        compression == Compression.NONE
+        or command.compression != Compression.NONE
+        or command.type not in COMPRESSIBLE_MESSAGE_TYPES
+        or len(command.data) < COMPRESSION_THRESHOLD
+    ):
+        return command
+
+    data = compress(command.data, compression)
+    if len(data) >= len(command.data):
+        return command
+    return Command(command.type, data, command.id, compression)
+
+
+def decompress_command(command: Command) -> Command:
+    """
+    Return a copy of command with a decompressed payload, or command itself if it is not compressed.
+    """
+    if command.compression == Compression.NONE:
+        return command
+    return Command(command.type, decompress(command.data, command.compression), command.id)
+
+
+def decode_command_path(command: Command) -> str:
+    """
+    Decode the string at the start of the command payload, without decompressing all of it.
+    """
+    if command.compression == Compression.NONE:
+        return decode_string(command.data, 0)[0]
+    string_length = bytes_to_int(decompress(command.data, command.compression, 4))
+    return decode_string(decompress(command.data, command.compression, 4 + string_length), 0)[0]
+
+
+def encode_command_batch(commands: List[Command]) -> bytes:
+    """
+    Return the COMMAND_BATCH payload for commands: their frames, header and data, one after the other.
+    """
+    buffers: List[Any] = []
+    for command in commands:
+        buffers.append(command.header())
+        buffers.append(command.data)
+    return b"".join(buffers)
+
+
+def decode_command_batch(data) -> List[Command]:
+    """
+    Return the commands of a COMMAND_BATCH payload. Their data are slices of data, not copies.
+    """
+    view = memoryview(data)
+    commands = []
+    index = 0
+    while index < len(view):
+        header = bytes(view[index : index + MESSAGE_HEADER_SIZE])
+        frame_size = unpack_message_header(header)[0]
+        index += MESSAGE_HEADER_SIZE
+        commands.append(FrameCommand(header, view[index : index + frame_size]))
+        index += frame_size
+    return commands
+
+
+def is_batchable(command: Command) -> bool:
+    """
+    Batches are forwarded to the room, so only room commands can be batched. Commands large enough to be compressed
+    are sent on their own.
+    """
+    return (
+        command.type > MessageType.COMMAND
+        and command.type not in (MessageType.COMMAND_BATCH, MessageType.CHUNK)
+        and command.byte_size() - MESSAGE_HEADER_SIZE < COMPRESSION_THRESHOLD
+    )
+
+
+def batch_commands(commands: List[Command]) -> List[Command]:
+    """
+    Coalesce runs of consecutive batchable commands into COMMAND_BATCH commands, preserving the command order.
+    """
+    result: List[Command] = []
+    batch: List[Command] = []
+    batch_size = 0
+
+    def _flush():
+        if len(batch) == 1:
+            result.append(batch[0])
+        elif batch:
+            result.append(Command(MessageType.COMMAND_BATCH, encode_command_batch(batch)))
+
+    for command in commands:
+        if not is_batchable(command):
+            _flush()
+            batch, batch_size = [], 0
+            result.append(command)
+            continue
+
+        if batch_size + command.byte_size() > MAX_BATCH_SIZE:
+            _flush()
+            batch, batch_size = [], 0
+        batch.append(command)
+        batch_size += command.byte_size()
+
+    _flush()
+    return result
+
+
+def expand_command_batches(commands: List[Command]) -> List[Command]:
+    """
+    Replace the COMMAND_BATCH commands of a list of decompressed commands by the commands they contain.
+    """
+    if not any(command.type == MessageType.COMMAND_BATCH for command in commands):
+        return commands
+
+    result: List[Command] = []
+    for command in commands:
+        if command.type == MessageType.COMMAND_BATCH:
+            result.extend(decode_command_batch(command.data))
+        else:
+            result.append(command)
+    return result
+
+
+ChunkInfo = namedtuple("ChunkInfo", ["transfer_id", "message_type", "compression", "size", "offset", "last"])
+
+
+def chunk_info(command: Command) -> ChunkInfo:
+    """
+    Return the description of a CHUNK command and of the command it is a slice of.
+    """
+    transfer_id, _, type_field, size, offset = chunk_header.unpack_from(command.data, 0)
+    return ChunkInfo(
+        transfer_id,
+        int_to_message_type(type_field & MESSAGE_TYPE_MASK),
+        Compression(type_field >> COMPRESSION_SHIFT),
+        size,
+        offset,
+        offset + len(command.data) - chunk_header.size >= size,
+    )
+
+
+def _iter_chunks(command: Command, size: int, read: Callable[[int, int], Any], chunk_size: int) -> Iterator[Command]:
+    transfer_id = random.getrandbits(64)  # transfers from all the clients of a room are interleaved
+    type_field = command.type.value | command.compression << COMPRESSION_SHIFT
+    for offset in range(0, size, chunk_size):
+        data = read(offset, min(chunk_size, size - offset))
+        yield Command(MessageType.CHUNK, chunk_header.pack(transfer_id, command.id, type_field, size, offset) + data)
+
+
+def split_command(command: Command, chunk_size: int = CHUNK_SIZE) -> Iterator[Command]:
+    """
+    Return an iterator on the CHUNK commands that transfer command. Each chunk is built when iterated, so that the
+    chunks of a large command are never all in memory.
+    """
+    if isinstance(command, FileCommand):
+        return command.chunks(chunk_size)
+    data = memoryview(command.data).cast("B")
+    return _iter_chunks(command, len(data), lambda offset, size: data[offset : offset + size], chunk_size)
+
+
+class _Assembly:
+    """
+    The payload of a chunked command, in memory or in a temporary file if large.
+    """
+
+    def __init__(self, size: int, spool_size: int):
+        self.size = size
+        self.received = 0
+        self._buffer: Optional[bytearray] = None
+        self._file = None
+        if size > spool_size:
+            self._file = tempfile.TemporaryFile()
+            self._file.truncate(size)
+        else:
+            self._buffer = bytearray(size)
+
+    def write(self, offset: int, data: memoryview):
+        if self._buffer is not None:
+            self._buffer[offset : offset + len(data)] = data
+        else:
+            self._file.seek(offset)
+            self._file.write(data)
+        self.received += len(data)
+
+    def data(self) -> memoryview:
+        if self._buffer is not None:
+            return memoryview(self._buffer)
+        # The mapping remains valid after the file is closed, its pages are backed by the file, not by memory
+        self._file.flush()
+        mapping = mmap.mmap(self._file.fileno(), self.size, access=mmap.ACCESS_READ)
+        self._file.close()
+        return memoryview(mapping)
+
+
+class ChunkAssembler:
+    """
+    Assemble the commands sent as CHUNK commands. The chunks of several transfers may be interleaved.
+    """
+
+    def __init__(self, spool_size: int = CHUNK_SPOOL_SIZE):
+        self._spool_size = spool_size
+        self._assemblies: Dict[int, _Assembly] = {}
+
+    def add(self, chunk: Command) -> Optional[Command]:
+        """
+        Add a CHUNK command. Return the assembled command if chunk is its last chunk, None otherwise.
+        """
+        transfer_id, command_id, type_field, size, offset = chunk_header.unpack_from(chunk.data, 0)
+        data = memoryview(chunk.data)[chunk_header.size :]
+
+        assembly = self._assemblies.get(transfer_id)
+        if assembly is None:
+            if offset != 0:
+                logger.warning("Chunk of unknown transfer %s ignored", transfer_id)
+                return None
+            assembly = _Assembly(size, self._spool_size)
+            self._assemblies[transfer_id] = assembly
+
+        assembly.write(offset, data)
+        if assembly.received < size:
+            return None
+
+        del self._assemblies[transfer_id]
+        return Command(
+            int_to_message_type(type_field & MESSAGE_TYPE_MASK),
+            assembly.data(),
+            command_id,
+            Compression(type_field >> COMPRESSION_SHIFT),
+        )
+
+
+def command_lane(command: Command) -> Lane:
+    """
+    Return the lane of command. A batch is interactive if all its commands are.
+    """
+    if command.type == MessageType.COMMAND_BATCH:
+        data = decompress_command(command).data
+        index = 0
+        while index < len(data):
+            frame_size, _, message_type, _ = unpack_message_header(data, index)
+            if message_type not in INTERACTIVE_MESSAGE_TYPES:
+                return Lane.BULK
+            index += MESSAGE_HEADER_SIZE + frame_size
+        return Lane.INTERACTIVE
+    return Lane.INTERACTIVE if command.type in INTERACTIVE_MESSAGE_TYPES else Lane.BULK
+
+
+def command_objects(command: Command) -> Optional[FrozenSet[str]]:
+    """
+    Return the names of the objects command applies to, or None if they are unknown.
+    """
+    if command.type in OBJECT_MESSAGE_TYPES:
+        # the last path component, so that object paths and object names match
+        return frozenset((decode_command_path(command).rsplit("/", 1)[-1],))
+    if command.type == MessageType.COMMAND_BATCH:
+        names: FrozenSet[str] = frozenset()
+        for batched_command in decode_command_batch(decompress_command(command).data):
+            objects = command_objects(batched_command)
+            if objects is None:
+                return None
+            names |= objects
+        return names
+    if command.type == MessageType.CHUNK:
+        # only the last chunk has an effect on the receiver, when the command is assembled
+        return None if chunk_info(command).last else frozenset()
+    if command.type in INTERACTIVE_MESSAGE_TYPES:
+        return frozenset()
+    return None
+
+
+# Queued commands of these message types are superseded by a later command with the same key, see coalescing_key()
+COALESCING_MESSAGE_TYPES = {MessageType.TRANSFORM, MessageType.FRAME, MessageType.CLIENT_UPDATE}
+
+
+def coalescing_key(command: Command) -> Optional[Tuple[Any, ...]]:
+    """
+    Return a key such that a queued command is superseded by a later command with the same key, or None.
+
+    A TRANSFORM holds the whole transform of its object, and a FRAME the current frame. A CLIENT_UPDATE holds changed
+    attributes of a client, so it is merged into the later one rather than dropped, see merge_client_updates().
+    """
+    if command.type == MessageType.TRANSFORM:
+        return (command.type, decode_command_path(command).rsplit("/", 1)[-1])
+    if command.type == MessageType.FRAME:
+        return (command.type,)
+    if command.type == MessageType.CLIENT_UPDATE:
+        updates, _ = decode_json(decompress_command(command).data, 0)
+        if len(updates) == 1:
+            return (command.type, next(iter(updates)))
+    return None
+
+
+def merge_client_updates(first: Command, second: Command) -> Command:
+    """
+    Return a CLIENT_UPDATE command with the changes of first, then the changes of second.
+    """
+    updates, _ = decode_json(decompress_command(first).data, 0)
+    update_named_attributes(updates, decode_json(decompress_command(second).data, 0)[0])
+    return Command(MessageType.CLIENT_UPDATE, encode_json(updates))
+
+
+class _QueuedCommand:
+    __slots__ = ("command", "objects", "replay", "bulk", "queued_at")
+
+    def __init__(self, command: Command, objects: Optional[FrozenSet[str]], replay: bool):
+        self.command: Optional[Command] = command  # None once sent or superseded
+        self.objects = objects
+        self.replay = replay
+        self.bulk = False  # queued in the bulk lane
+        self.queued_at = time.monotonic()
+
+
+class CommandLanes:
+    """
+    Queue of outbound commands, split into an interactive lane and a bulk lane.
+
+    Interactive commands are sent ahead of the bulk commands queued before them, so that a large texture or the
+    history replayed to a joining client do not delay transforms or frame changes. An interactive command that applies
+    to an object is queued in the bulk lane, keeping its order, when a queued bulk command applies to the same object
+    or to unknown objects: a TRANSFORM does not overtake the MESH that creates its object.
+
+    Commands of a lane are sent in the order they were queued. Can be used from several threads.
+
+    While coalesce is True, a queued command is dropped when a command with the same coalescing_key() is queued, so
+    that the queue of a slow receiver does not grow with the transforms of a drag.
+    """
+
+    def __init__(self):
+        self._mutex = threading.Lock()
+        self._interactive: Deque[_QueuedCommand] = deque()
+        self._bulk: Deque[_QueuedCommand] = deque()
+        self._bulk_objects: Counter = Counter()  # objects the queued bulk commands apply to
+        self._bulk_unknown_count = 0  # queued bulk commands that apply to unknown objects
+        self._chunks: Optional[Iterator[Command]] = None  # chunks of the first bulk command, being sent
+
+        self.coalesce = False
+        self._coalescible: Dict[Tuple[Any, ...], _QueuedCommand] = {}  # last queued command of each coalescing key
+
+        self._count = 0
+        self.byte_size = 0  # of the queued commands
+        self.replay_byte_size = 0  # of the queued commands put with replay=True
+        self.coalesced_count = 0  # commands dropped or merged by coalescing
+        self.wait = 0.0  # time the oldest command returned by the last take() spent in the queue
+        self._queued_at = 0.0
+
+    def __len__(self):
+        return self._count
+
+    def _depends_on_bulk(self, objects: Optional[FrozenSet[str]]) -> bool:
+        if objects is None:
+            return True
+        if not objects:
+            return False
+        return self._bulk_unknown_count > 0 or any(name in self._bulk_objects for name in objects)
+
+    def put(self, command: Command, replay: bool = False):
+        """
+        Queue command. replay tells that command is part of the history replayed to a joining client, so that its size
+        can be told apart from the traffic of the room, see replay_byte_size.
+        """
+        lane = command_lane(command)
+        objects = command_objects(command)
+        key = coalescing_key(command) if self.coalesce and command.type in COALESCING_MESSAGE_TYPES else None
+        with self._mutex:
+            if key is not None:
+                superseded = self._coalescible.get(key)
+                if superseded is not None and superseded.command is not None:
+                    if command.type == MessageType.CLIENT_UPDATE:
+                        command = merge_client_updates(superseded.command, command)
+                    # the entry remains in its lane, and is skipped when reached
+                    self._remove(superseded)
+                    self.coalesced_count += 1
+
+            queued = _QueuedCommand(command, objects, replay)
+            if key is not None:
+                self._coalescible[key] = queued
+            self._count += 1
+            self.byte_size += command.byte_size()
+            if replay:
+                self.replay_byte_size += command.byte_size()
+
+            if lane == Lane.INTERACTIVE and not self._depends_on_bulk(objects):
+                self._interactive.append(queued)
+                return
+
+            queued.bulk = True
+            self._bulk.append(queued)
+            if objects is None:
+                self._bulk_unknown_count += 1
+            else:
+                self._bulk_objects.update(objects)
+
+    def _remove(self, queued: _QueuedCommand) -> Command:
+        """
+        Account for queued leaving the queue, and return its command.
+        """
+        command = queued.command
+        assert command is not None
+        queued.command = None
+        self._count -= 1
+        self.byte_size -= command.byte_size()
+        if queued.replay:
+            self.replay_byte_size -= command.byte_size()
+        if queued.bulk:
+            if queued.objects is None:
+                self._bulk_unknown_count -= 1
+            else:
+                for name in queued.objects:
+                    self._bulk_objects[name] -= 1
+                    if self._bulk_objects[name] == 0:
+                        del self._bulk_objects[name]
+        return command
+
+    def _pop_bulk(self) -> Command:
+        queued = self._bulk.popleft()
+        self._queued_at = min(self._queued_at, queued.queued_at)
+        return self._remove(queued)
+
+    def _skip_dropped(self):
+        while self._bulk and self._bulk[0].command is None:
+            self._bulk.popleft()
+
+    def clear(self):
+        """
+        Drop all the queued commands, including the remaining chunks of the command being sent.
+        """
+        with self._mutex:
+            self._interactive.clear()
+            self._bulk.clear()
+            self._bulk_objects.clear()
+            self._bulk_unknown_count = 0
+            self._chunks = None
+            self._coalescible.clear()
+            self._count = self.byte_size = self.replay_byte_size = 0
+
+    def take(
+        self, bulk_size: Optional[int] = None, split: Optional[Callable[[Command], Optional[Iterator[Command]]]] = None
+    ) -> Tuple[List[Command], List[Command]]:
+        """
+        Remove and return the commands to send now, as a list of interactive commands and a list of bulk commands, to
+        be sent in this order.
+
+        All the interactive commands are returned. Bulk commands are returned up to bulk_size bytes, or all of them if
+        bulk_size is None, but at least one, so that a steady interactive traffic cannot starve the bulk lane.
+
+        split may return the chunks of a bulk command. They are then returned instead of the command, over as many
+        calls as bulk_size requires. The command remains queued meanwhile, so that the interactive commands that
+        depend on it are still held back.
+        """
+        with self._mutex:
+            now = time.monotonic()
+            self._queued_at = now
+            interactive = []
+            for queued in self._interactive:
+                if queued.command is not None:
+                    self._queued_at = min(self._queued_at, queued.queued_at)
+                    interactive.append(self._remove(queued))
+            self._interactive.clear()
+
+            bulk: List[Command] = []
+            size = 0
+            while bulk_size is None or size < bulk_size:
+                if self._chunks is not None:
+                    try:
+                        chunk = next(self._chunks, None)
+                    except OSError as e:
+                        # reading the file of a FileCommand failed, the receivers will not assemble the transfer
+                        logger.error("Could not send %s: %s", self._bulk[0].command.type.name, e)
+                        chunk = None
+                    if chunk is not None:
+                        bulk.append(chunk)
+                        size += chunk.byte_size()
+                        continue
+                    self._chunks = None
+                    self._pop_bulk()
+
+                self._skip_dropped()
+                if not self._bulk:
+                    break
+
+                if split is not None:
+                    self._chunks = split(self._bulk[0].command)
+                    if self._chunks is not None:
+                        continue
+
+                command = self._pop_bulk()
+                bulk.append(command)
+                size += command.byte_size()
+
+            if self._count == 0:
+                self._coalescible.clear()
+            self.wait = now - self._queued_at
+            return interactive, bulk
 
 
 class CommandFormatter:
@@ -419,6 +1265,8 @@ class CommandFormatter:
             else:
                 s += f"  {len(clients)} client(s):\n"
                 s += self.format_clients(clients)
+        elif command.type == MessageType.SERVER_STATS:
+            s += "\n" + json.dumps(decode_json(command.data, 0)[0], indent=2) + "\n"
         elif command.type == MessageType.SEND_ERROR:
             s += f"ERROR: {decode_string(command.data, 0)[0]}\n"
         else:
@@ -427,55 +1275,71 @@ class CommandFormatter:
         return s
 
 
-def recv(socket: socket.socket, size: int):
+def recv_into(sock: socket.socket, view: memoryview):
     """
-    Try to read size bytes from the socket.
+    Fill view with bytes read from the socket, blocking until it is full.
     Raise ClientDisconnectedException if the socket is disconnected.
     """
-    result = b""
-    while size != 0:
-        r, _, _ = select.select([socket], [], [], 0.1)
-        if len(r) > 0:
-            try:
-                tmp = socket.recv(size)
-            except (ConnectionAbortedError, ConnectionResetError) as e:
-                logger.warning(e)
-                raise ClientDisconnectedException()
+    offset = 0
+    size = len(view)
+    while offset < size:
+        offset += recv_some_into(sock, view[offset:])
 
-            if len(tmp) == 0:
-                raise ClientDisconnectedException()
 
-            result += tmp
-            size -= len(tmp)
+def recv_some_into(sock: socket.socket, view: memoryview) -> int:
+    """
+    Read at most len(view) bytes from the socket into view, blocking until at least one byte is available.
+    Return the number of bytes read.
+    Raise ClientDisconnectedException if the socket is disconnected.
+    """
+    while True:
+        try:
+            count = sock.recv_into(view)
+        except BlockingIOError:
+            # non blocking socket (accepted socket may inherit this from the listening socket on some platforms)
+            select.select([sock], [], [], 0.1)
+            continue
+        except (ConnectionAbortedError, ConnectionResetError) as e:
+            logger.warning(e)
+            raise ClientDisconnectedException()
+
+        if count == 0:
+            raise ClientDisconnectedException()
+        return count
+
+
+def recv(sock: socket.socket, size: int) -> bytearray:
+    """
+    Try to read size bytes from the socket.
+    Raise ClientDisconnectedException if the socket is disconnected.
+    """
+    result = bytearray(size)
+    recv_into(sock, memoryview(result))
     return result
 
 
-def read_message(socket: socket.socket, timeout: Optional[float] = None) -> Optional[Command]:
+def read_message(sock: socket.socket, timeout: Optional[float] = None) -> Optional[Command]:
     """
     Try to read a full message from the socket.
     Raise ClientDisconnectedException if the socket is disconnected.
     Return None if no message is waiting on the socket.
+
+    This function reads exactly one frame and keeps no state, prefer a FrameReader for sockets that are read
+    repeatedly.
     """
-    if not socket:
+    if not sock:
         logger.warning("read_message called with no socket")
         return None
 
     select_timeout = timeout if timeout is not None else 0.0001
-    r, _, _ = select.select([socket], [], [], select_timeout)
+    r, _, _ = select.select([sock], [], [], select_timeout)
     if len(r) == 0:
         return None
 
     try:
-        prefix_size = 14
-        msg = recv(socket, prefix_size)
-
-        frame_size = bytes_to_int(msg[:8])
-        command_id = bytes_to_int(msg[8:12])
-        message_type = bytes_to_int(msg[12:])
-
-        msg = recv(socket, frame_size)
-
-        return Command(int_to_message_type(message_type), msg, command_id)
+        header = bytes(recv(sock, MESSAGE_HEADER_SIZE))
+        data = memoryview(recv(sock, unpack_message_header(header)[0]))
+        return FrameCommand(header, data)
 
     except ClientDisconnectedException:
         raise
@@ -484,7 +1348,109 @@ def read_message(socket: socket.socket, timeout: Optional[float] = None) -> Opti
         raise
 
 
-def read_all_messages(socket: socket.socket, timeout: Optional[float] = None) -> List[Command]:
+class FrameReader:
+    """
+    Read messages from a socket without copying their payload.
+
+    Bytes are received with recv_into() into a preallocated buffer, as many as available, so that a single system call
+    can receive several small frames. The data of the returned commands are memoryview slices of this buffer.
+
+    Since these slices may outlive the call, the buffer is never overwritten: a new one is allocated when the current
+    one is exhausted, and the previous one is released when all the commands that reference it are released.
+    Frames larger than the buffer are received into a dedicated buffer of the frame size.
+
+    The commands that are kept, like the ones of a room history, should be detached with detach_command().
+    """
+
+    def __init__(self, sock: socket.socket, buffer_size: int = READ_BUFFER_SIZE):
+        self.socket = sock
+        self._buffer_size = buffer_size
+        self._view = memoryview(bytearray(buffer_size))
+        self._start = 0  # start of received bytes not yet consumed
+        self._end = 0  # end of received bytes
+
+    def _pending(self) -> int:
+        return self._end - self._start
+
+    def _fill(self, size: int):
+        """
+        Receive until at least size contiguous bytes are pending in the buffer.
+        """
+        if self._start + size > len(self._view):
+            # Not enough room left: move the pending bytes, at most one partial frame, to a new buffer
+            pending = self._pending()
+            view = memoryview(bytearray(max(self._buffer_size, size)))
+            view[:pending] = self._view[self._start : self._end]
+            self._view = view
+            self._start = 0
+            self._end = pending
+
+        while self._pending() < size:
+            self._end += recv_some_into(self.socket, self._view[self._end :])
+
+    def _read_large_frame(self, frame_size: int) -> memoryview:
+        data = memoryview(bytearray(frame_size))
+        pending = self._pending()
+        data[:pending] = self._view[self._start : self._end]
+        self._start = self._end
+        recv_into(self.socket, data[pending:])
+        return data
+
+    def read_message(self, timeout: Optional[float] = None) -> Optional[Command]:
+        """
+        Try to read a full message from the socket.
+        Raise ClientDisconnectedException if the socket is disconnected.
+        Return None if no message is waiting on the socket.
+        """
+        if self._pending() == 0:
+            select_timeout = timeout if timeout is not None else 0.0001
+            r, _, _ = select.select([self.socket], [], [], select_timeout)
+            if len(r) == 0:
+                return None
+
+        try:
+            self._fill(MESSAGE_HEADER_SIZE)
+            header = bytes(self._view[self._start : self._start + MESSAGE_HEADER_SIZE])
+            frame_size = unpack_message_header(header)[0]
+            self._start += MESSAGE_HEADER_SIZE
+
+            if frame_size > self._buffer_size:
+                data = self._read_large_frame(frame_size)
+            else:
+                self._fill(frame_size)
+                data = self._view[self._start : self._start + frame_size]
+                self._start += frame_size
+
+            return FrameCommand(header, data)
+
+        except ClientDisconnectedException:
+            raise
+        except Exception as e:
+            logger.error(e, exc_info=True)
+            raise
+
+    def read_all_messages(self, timeout: Optional[float] = None) -> List[Command]:
+        """
+        Try to read all messages waiting on the socket.
+        Raise ClientDisconnectedException if the socket is disconnected.
+        Return empty list if no message is waiting on the socket.
+        """
+        received_commands: List[Command] = []
+        while True:
+            try:
+                command = self.read_message(timeout=timeout)
+            except ClientDisconnectedException:
+                if not received_commands:
+                    raise
+                # the messages sent before disconnecting are returned, the next call raises
+                break
+            if command is None:
+                break
+            received_commands.append(command)
+        return received_commands
+
+
+def read_all_messages(sock: socket.socket, timeout: Optional[float] = None) -> List[Command]:
     """
     Try to read all messages waiting on the socket.
     Raise ClientDisconnectedException if the socket is disconnected.
@@ -492,27 +1458,128 @@ def read_all_messages(socket: socket.socket, timeout: Optional[float] = None) ->
     """
     received_commands: List[Command] = []
     while True:
-        command = read_message(socket, timeout=timeout)
+        command = read_message(sock, timeout=timeout)
         if command is None:
             break
         received_commands.append(command)
     return received_commands
 
 
+def _sendmsg_all(sock: socket.socket, buffers: List[memoryview]):
+    index = 0
+    while index < len(buffers):
+        try:
+            sent = sock.sendmsg(buffers[index : index + MAX_SEND_BUFFERS])
+        except BlockingIOError:
+            select.select([], [sock], [], 0.1)
+            continue
+
+        # skip what has been sent, possibly up to the middle of a buffer
+        while sent > 0:
+            size = len(buffers[index])
+            if sent < size:
+                buffers[index] = buffers[index][sent:]
+                break
+            sent -= size
+            index += 1
+
+
+def _sendall_all(sock: socket.socket, buffers: List[memoryview]):
+    # Without sendmsg(), concatenate small buffers rather than sending them one by one, that would trigger
+    # Nagle's algorithm delays, and send large buffers without copy
+    pending = bytearray()
+    for buffer in buffers:
+        if len(buffer) < SMALL_FRAME_SIZE:
+            pending += buffer
+            if len(pending) >= SMALL_FRAME_SIZE:
+                sock.sendall(pending)
+                pending = bytearray()
+        else:
+            if pending:
+                sock.sendall(pending)
+                pending = bytearray()
+            sock.sendall(buffer)
+
+    if pending:
+        sock.sendall(pending)
+
+
+def send_buffers(sock: socket.socket, buffers: List[Any]):
+    """
+    Send a list of bytes-like objects without concatenating them, using vectored writes where available.
+    Raise ClientDisconnectedException if the socket is disconnected.
+    """
+    views = [memoryview(buffer).cast("B") for buffer in buffers if len(buffer) > 0]
+    try:
+        if hasattr(sock, "sendmsg"):
+            _sendmsg_all(sock, views)
+        else:
+            _sendall_all(sock, views)
+    except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError) as e:
+        logger.warning(e)
+        raise ClientDisconnectedException()
+
+
+def send_file(sock: socket.socket, file: BinaryIO, offset: int, count: int) -> bool:
+    """
+    Send count bytes of file from offset with os.sendfile(), that does not use the file position, so that a file can be
+    sent by several threads. Return False if nothing was sent because os.sendfile() is not available for sock or file.
+    Raise ClientDisconnectedException if the socket is disconnected.
+    """
+    if not hasattr(os, "sendfile"):
+        return False
+    start, end = offset, offset + count
+    try:
+        while offset < end:
+            try:
+                sent = os.sendfile(sock.fileno(), file.fileno(), offset, end - offset)
+            except BlockingIOError:
+                select.select([], [sock], [], 0.1)
+                continue
+            except OSError:
+                if offset == start:
+                    return False  # not supported for this socket or file
+                raise
+            if sent == 0:
+                raise ValueError(f"{file.name} truncated while sent")
+            offset += sent
+    except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError) as e:
+        logger.warning(e)
+        raise ClientDisconnectedException()
+    return True
+
+
 def write_message(sock: Optional[socket.socket], command: Command):
     if not sock:
         logger.warning("write_message called with no socket")
         return
 
-    buffer = command.to_byte_buffer()
+    send_buffers(sock, [command.header(), command.data])
 
-    try:
-        _, w, _ = select.select([], [sock], [])
-        if sock.sendall(buffer) is not None:
-            raise ClientDisconnectedException()
-    except (ConnectionAbortedError, ConnectionResetError) as e:
-        logger.warning(e)
-        raise ClientDisconnectedException()
+
+def write_messages(sock: Optional[socket.socket], commands: List[Command]):
+    """
+    Send a list of commands in as few system calls as possible, without copying their data.
+    """
+    if not sock:
+        logger.warning("write_messages called with no socket")
+        return
+
+    buffers: List[Any] = []
+    for command in commands:
+        if isinstance(command, CommandRun):
+            if command.file is not None:
+                send_buffers(sock, buffers)
+                buffers = []
+                if send_file(sock, command.file, command.offset, command.byte_size()):
+                    continue
+            for run_command in command.commands:
+                buffers.append(run_command.header())
+                buffers.append(run_command.data)
+            continue
+        buffers.append(command.header())
+        buffers.append(command.data)
+    send_buffers(sock, buffers)
 
 
 def make_set_room_attributes_command(room_name: str, attributes: dict):
@@ -549,3 +1616,17 @@ def update_named_attributes(current: Dict[str, Dict[str, Any]], updates: Mapping
             attrs = current[name]
             for attr_name, attr_value in attrs_updates.items():
                 attrs[attr_name] = attr_value
+
+
+def quantize_floats(value: Any, digits: int) -> Any:
+    """
+    Return value with the floats it contains, in nested dicts and lists, rounded to digits decimals, so that
+    insignificant changes of a viewport do not make a diff to send.
+    """
+    if isinstance(value, float):
+        return round(value, digits)
+    if isinstance(value, dict):
+        return {k: quantize_floats(v, digits) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [quantize_floats(v, digits) for v in value]
+    return value
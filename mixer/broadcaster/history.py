@@ -0,0 +1,332 @@
+"""
+Room history: the commands replayed to the clients that join a room.
+
+Commands are kept in the order they were received, but the server drops a command when a later one makes it useless
+to a joining client, so that the history size depends on the room content rather than on the session duration.
+
+Each command is classified by the resource it applies to:
+- object commands (TRANSFORM, MESH, ...) apply to an object, identified by the last component of its path,
+- MATERIAL applies to a material, FRAME to the current frame,
+- BLENDER_DATA_UPDATE, BLENDER_DATA_BINARY_UPDATE and BLENDER_DATA_REMOVE apply to a bpy.data collection item.
+
+Some commands carry the whole state of a resource for their type, and a later command with the same type and resource
+(the same key) supersedes them. A superseded command is dropped, unless:
+- it is the first command of its resource, since it creates the resource, that later commands may refer to,
+- a command that depends on the resource state, or a command whose resources are unknown, was received after it.
+The previous command is always dropped when the new command immediately follows it, as the room always did.
+
+When a resource is deleted, its superseding commands that are not followed by a dependent command are dropped, and a
+RENAME moves the state of an object to its new name.
+"""
+
+from __future__ import annotations
+
+import bisect
+import json
+import logging
+import lzma
+import struct
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+import zlib
+
+from mixer.broadcaster.binary_format import BLENDDATA_PATH, MAGIC, Tag
+from mixer.broadcaster.common import (
+    Command,
+    MessageType,
+    command_objects,
+    decode_command_path,
+    decode_string,
+    decompress_command,
+)
+
+logger = logging.getLogger(__name__)
+
+Resource = Tuple[str, ...]
+Key = Tuple[MessageType, Resource]
+
+# Commands that hold the whole state of their resource for their message type
+OBJECT_STATE_MESSAGE_TYPES = {MessageType.TRANSFORM, MessageType.MESH, MessageType.OBJECT_VISIBILITY}
+STATE_MESSAGE_TYPES = OBJECT_STATE_MESSAGE_TYPES | {
+    MessageType.MATERIAL,
+    MessageType.FRAME,
+    MessageType.BLENDER_DATA_UPDATE,
+}
+
+# Removed holes are packed when they outnumber the commands, and at least this many
+PACK_THRESHOLD = 1024
+
+# command effects, see command_effect()
+STATE, REMOVE, RENAME, DEPEND, UNKNOWN = range(5)
+
+_u32 = struct.Struct("<I")
+_json_path_attribute = b'"_blenddata_path": '
+_json_tail_size = 4096
+
+
+def _object_resource(path: str) -> Resource:
+    # the last path component, so that object paths and object names match
+    return ("object", path.rsplit("/", 1)[-1])
+
+
+def _binary_blenddata_path(data) -> Optional[Tuple[str, str]]:
+    """
+    Return the bpy.data collection and key of a proxy encoded with binary_codec.BinaryCodec.
+    """
+    if bytes(data[: len(MAGIC)]) != MAGIC:
+        return None
+    offset = len(MAGIC)
+    (string_count,) = _u32.unpack_from(data, offset)
+    offset += _u32.size
+    strings = []  # (offset, length) of the strings, that are decoded when used
+    for _ in range(string_count):
+        (length,) = _u32.unpack_from(data, offset)
+        strings.append((offset + _u32.size, length))
+        offset += _u32.size + length
+
+    tag, _, flags = struct.unpack_from("<BBB", data, offset)
+    offset += 3
+    if tag != Tag.PROXY or not flags & BLENDDATA_PATH:
+        return None
+    tag, count = struct.unpack_from("<BI", data, offset)
+    offset += 5
+    if tag not in (Tag.TUPLE, Tag.LIST) or count != 2:
+        return None
+    path = []
+    for _ in range(count):
+        tag, index = struct.unpack_from("<BI", data, offset)
+        offset += 5
+        if tag != Tag.STRING:
+            return None
+        start, length = strings[index]
+        path.append(bytes(data[start : start + length]).decode())
+    return path[0], path[1]
+
+
+def _json_blenddata_path(data) -> Optional[Tuple[str, str]]:
+    """
+    Return the bpy.data collection and key of a proxy encoded with json_codec.Codec.
+
+    The root proxy attributes are encoded after its data, so the path is the last one in the message.
+    """
+    tail = bytes(data[-_json_tail_size:])
+    index = tail.rfind(_json_path_attribute)
+    if index == -1 and len(data) > _json_tail_size:
+        tail = bytes(data)
+        index = tail.rfind(_json_path_attribute)
+    if index == -1:
+        return None
+    path, _ = json.JSONDecoder().raw_decode(tail[index + len(_json_path_attribute) :].decode())
+    if not isinstance(path, list) or len(path) != 2:
+        return None
+    return path[0], path[1]
+
+
+def blenddata_path(command: Command) -> Optional[Tuple[str, str]]:
+    """
+    Return the bpy.data collection and key of a BLENDER_DATA_UPDATE or BLENDER_DATA_BINARY_UPDATE command, or None
+    if it has none.
+
+    A compressed payload is decompressed, since the path of a JSON encoded proxy is at its end.
+    """
+    data = decompress_command(command).data
+    if command.type == MessageType.BLENDER_DATA_BINARY_UPDATE:
+        return _binary_blenddata_path(data)
+    return _json_blenddata_path(memoryview(data)[4:])  # after the string length
+
+
+def _command_effect(command: Command) -> Tuple[int, Any]:
+    command_type = command.type
+    if command_type in OBJECT_STATE_MESSAGE_TYPES or command_type == MessageType.ASSIGN_MATERIAL:
+        return STATE, (command_type, _object_resource(decode_command_path(command)))
+    if command_type == MessageType.MATERIAL:
+        return STATE, (command_type, ("material", decode_command_path(command)))
+    if command_type == MessageType.FRAME:
+        return STATE, (command_type, ("frame",))
+    if command_type in (MessageType.BLENDER_DATA_UPDATE, MessageType.BLENDER_DATA_BINARY_UPDATE):
+        path = blenddata_path(command)
+        if path is None:
+            return UNKNOWN, None
+        # an update supersedes the previous ones, whatever their encoding
+        return STATE, (MessageType.BLENDER_DATA_UPDATE, ("blenddata",) + path)
+    if command_type == MessageType.BLENDER_DATA_REMOVE:
+        collection_name, index = decode_string(command.data, 0)
+        key, _ = decode_string(command.data, index)
+        return REMOVE, ("blenddata", collection_name, key)
+    if command_type == MessageType.DELETE:
+        return REMOVE, _object_resource(decode_command_path(command))
+    if command_type == MessageType.RENAME:
+        old_path, index = decode_string(command.data, 0)
+        new_path, _ = decode_string(command.data, index)
+        return RENAME, (_object_resource(old_path), _object_resource(new_path))
+    if command_type.value > MessageType.OPTIMIZED_COMMANDS.value:
+        return STATE, (command_type, ("path", decode_command_path(command)))
+
+    objects = command_objects(command)
+    if objects is None:
+        return UNKNOWN, None
+    return DEPEND, [_object_resource(name) for name in objects]
+
+
+def command_effect(command: Command) -> Tuple[int, Any]:
+    """
+    Return how command affects the history:
+    - (STATE, key) if it holds a state of the resource key[1], a whole one if its type is in STATE_MESSAGE_TYPES,
+    - (REMOVE, resource) if it removes resource,
+    - (RENAME, (old resource, new resource)) if it renames an object,
+    - (DEPEND, resources) if it depends on the state of resources, possibly none,
+    - (UNKNOWN, None) if the resources it depends on are unknown.
+    """
+    try:
+        return _command_effect(command)
+    except (ValueError, IndexError, struct.error, zlib.error, lzma.LZMAError) as e:
+        logger.warning("Cannot decode %s command for history compaction: %r", command.type.name, e)
+        return UNKNOWN, None
+
+
+class _ResourceState:
+    __slots__ = ("anchor", "barrier", "keys")
+
+    def __init__(self, anchor: int):
+        self.anchor = anchor  # sequence number of the first command of the resource, that creates it
+        self.barrier = 0  # sequence number of the last command that depends on the resource
+        self.keys: Set[Key] = set()  # keys of the resource with a command in the history
+
+
+class RoomHistory:
+    """
+    Commands of a room, in order, with the superseded ones dropped as commands are added.
+
+    Commands are numbered in the order they are added, so that a client that joins the room can be sent the commands
+    added since the last ones it was sent, see commands_after().
+
+    If compact is False, a command is only dropped when the next command has the same key. on_drop is called with
+    each dropped command.
+    """
+
+    def __init__(self, compact: bool = True, on_drop: Optional[Callable[[Command], None]] = None):
+        self.compact = compact
+        self._on_drop = on_drop
+        self.byte_size = 0
+
+        # Dropped commands are replaced by None in _commands, and packed later, so that dropping is O(log(n))
+        self._sequences: List[int] = []
+        self._commands: List[Optional[Command]] = []
+        self._count = 0
+
+        self._last = 0  # sequence number of the last command added
+        self._barrier = 0  # sequence number of the last command with unknown resources
+        self._latest: Dict[Key, int] = {}  # sequence number of the last command of each key
+        self._resources: Dict[Resource, _ResourceState] = {}
+
+    def __len__(self):
+        return self._count
+
+    def commands_after(self, sequence: int = 0) -> Tuple[List[Command], int]:
+        """
+        Return the commands added after the command with the sequence number, and the sequence number of the last
+        command added.
+        """
+        start = bisect.bisect_right(self._sequences, sequence)
+        return [command for command in self._commands[start:] if command is not None], self._last
+
+    def add(self, command: Command, stored: Optional[Command] = None):
+        """
+        Add command to the history, or stored in its place, such as a copy of command that is not held in memory.
+        """
+        self._last += 1
+        sequence = self._last
+        self._sequences.append(sequence)
+        self._commands.append(stored if stored is not None else command)
+        self._count += 1
+        self.byte_size += command.byte_size()
+
+        effect, value = command_effect(command)
+        if effect == STATE:
+            self._add_state(value, sequence)
+        elif effect == REMOVE:
+            self._remove(value)
+        elif effect == RENAME:
+            self._rename(value[0], value[1], sequence)
+        elif effect == DEPEND:
+            for resource in value:
+                state = self._resources.get(resource)
+                if state is not None:
+                    state.barrier = sequence
+        else:
+            self._barrier = sequence
+
+    def _add_state(self, key: Key, sequence: int):
+        resource = key[1]
+        state = self._resources.get(resource)
+        if state is None:
+            state = self._resources[resource] = _ResourceState(sequence)
+
+        whole_state = key[0] in STATE_MESSAGE_TYPES
+        previous = self._latest.get(key)
+        if previous is not None:
+            if previous == sequence - 1:
+                # merged when adjacent, as the room always did
+                self._drop(previous)
+                if previous == state.anchor:
+                    state.anchor = sequence
+            elif whole_state and self._is_superseded(previous, state):
+                self._drop(previous)
+
+        if not whole_state:
+            state.barrier = sequence
+        self._latest[key] = sequence
+        state.keys.add(key)
+
+    def _is_superseded(self, previous: int, state: _ResourceState) -> bool:
+        """
+        Return True if the command with sequence number previous can be dropped when a command with the same key is
+        added.
+        """
+        return self.compact and previous != state.anchor and max(self._barrier, state.barrier) < previous
+
+    def _remove(self, resource: Resource):
+        state = self._resources.pop(resource, None)
+        if state is None:
+            return
+        for key in state.keys:
+            previous = self._latest.pop(key)
+            if self._is_superseded(previous, state):
+                self._drop(previous)
+
+    def _rename(self, old: Resource, new: Resource, sequence: int):
+        state = self._resources.pop(old, None)
+        if state is None:
+            return
+        if new in self._resources:
+            # the history has commands for both names, and cannot tell which commands apply to which object
+            for key in state.keys:
+                del self._latest[key]
+            self._barrier = sequence
+            return
+
+        self._resources[new] = state
+        keys = set()
+        for key in state.keys:
+            new_key = (key[0], new)
+            self._latest[new_key] = self._latest.pop(key)
+            keys.add(new_key)
+        state.keys = keys
+
+    def _drop(self, sequence: int):
+        position = bisect.bisect_left(self._sequences, sequence)
+        command = self._commands[position]
+        assert self._sequences[position] == sequence and command is not None
+        self._commands[position] = None
+        self._count -= 1
+        self.byte_size -= command.byte_size()
+        if self._on_drop is not None:
+            self._on_drop(command)
+
+        holes = len(self._commands) - self._count
+        if holes > max(self._count, PACK_THRESHOLD):
+            self._pack()
+
+    def _pack(self):
+        kept = [i for i, command in enumerate(self._commands) if command is not None]
+        self._sequences = [self._sequences[i] for i in kept]
+        self._commands = [self._commands[i] for i in kept]
@@ -7,7 +7,6 @@ An known issue is that all these functions are synchronous, so we cannot inform
 from mixer.broadcaster.common import MessageType, encode_json
 from mixer.broadcaster.common import Command
 from mixer.broadcaster.common import ClientDisconnectedException
-from mixer.broadcaster.common import read_all_messages
 from mixer.broadcaster.client import Client
 from typing import List, Tuple, Dict, Any
 import logging
@@ -79,7 +78,7 @@ def upload_room(host: str, port: int, room_name: str, room_attributes: dict, com
 
             # The server will send back room update messages since the room is joined.
             # Consume them to avoid a client/server deadlock on broadcaster full send socket
-            read_all_messages(client.socket, timeout=0.0)
+            client.fetch_incoming_commands()
 
         client.send_command(Command(MessageType.CONTENT))
 
@@ -96,7 +95,7 @@ def save_room(room_attributes: dict, commands: List[Command], file_path: str):
 
 
 def load_room(file_path: str) -> Tuple[dict, List[Command]]:
-    from mixer.broadcaster.common import bytes_to_int, int_to_message_type
+    from mixer.broadcaster.common import bytes_to_int, unpack_message_header, MESSAGE_HEADER_SIZE
     import json
 
     # todo factorize file reading with network reading
@@ -108,18 +107,15 @@ def load_room(file_path: str) -> Tuple[dict, List[Command]]:
         attributes_string = f.read(string_length).decode()
         room_medata = json.loads(attributes_string)
         while True:
-            prefix_size = 14
-            msg = f.read(prefix_size)
+            msg = f.read(MESSAGE_HEADER_SIZE)
             if not msg:
                 break
 
-            frame_size = bytes_to_int(msg[:8])
-            command_id = bytes_to_int(msg[8:12])
-            message_type = bytes_to_int(msg[12:])
+            frame_size, command_id, message_type, compression = unpack_message_header(msg)
 
             msg = f.read(frame_size)
 
-            commands.append(Command(int_to_message_type(message_type), msg, command_id))
+            commands.append(Command(message_type, msg, command_id, compression))
 
     assert room_medata is not None
 
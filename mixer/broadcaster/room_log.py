@@ -0,0 +1,338 @@
+"""
+On disk log of the commands of a room, so that rooms survive a server restart and their history is not held in memory.
+
+The log of a room is a directory with:
+- room.json, the room attributes, rewritten when they change,
+- segment files, named by their index, to which the commands of the room history are appended.
+
+A segment uses the room_bake.save_room() format: a JSON header, then the commands as they are sent on the network, so
+that it can be read with room_bake.load_room(). A segment is deleted when all its commands are dropped from the history.
+
+Each command is flushed when it is appended, so a crash of the server can only lose or truncate the last command of
+the log, which is discarded when the log is opened. The log is written to disk by sync(), that the server calls every
+SYNC_INTERVAL seconds, so a crash of the machine loses the commands appended since the last call.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import shutil
+from typing import Any, BinaryIO, Dict, List, Optional
+import weakref
+
+from mixer.broadcaster.common import (
+    COMPRESSION_SHIFT,
+    MESSAGE_HEADER_SIZE,
+    Command,
+    Compression,
+    MessageType,
+    encode_json,
+    message_header,
+    unpack_message_header,
+)
+
+logger = logging.getLogger(__name__)
+
+# A new segment is started when a command does not fit in the current one
+SEGMENT_SIZE = 64 * 1024 * 1024
+
+# Seconds between the calls of RoomLog.sync() by the server
+SYNC_INTERVAL = 1.0
+
+ATTRIBUTES_FILE = "room.json"
+SEGMENT_SUFFIX = ".log"
+
+
+class _Segment:
+    """
+    A segment file, opened for reading until the segment is released, so that the commands that are queued to be sent
+    can still be read when the segment has been deleted.
+    """
+
+    def __init__(self, path: str, index: int):
+        self.path = path
+        self.index = index
+        self.size = 0
+        self.header_size = 0
+        self.live_count = 0  # commands of the segment in the room history
+        self._reader: Optional[BinaryIO] = None
+        self._map: Optional[mmap.mmap] = None
+
+    def reader(self) -> BinaryIO:
+        if self._reader is None:
+            self._reader = open(self.path, "rb")
+            weakref.finalize(self, self._reader.close)
+        return self._reader
+
+    def read(self, offset: int, length: int):
+        """
+        Return a view of the segment content, mapped in memory.
+        """
+        if length == 0:
+            return b""
+        mapped = self._map
+        if mapped is None or offset + length > len(mapped):
+            # the segment has grown since it was mapped. The previous mapping is released with its last view
+            mapped = self._map = mmap.mmap(self.reader().fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(mapped)[offset : offset + length]
+
+    def release(self):
+        self._map = None
+        if self._reader is not None:
+            self._reader.close()
+
+
+class LoggedCommand(Command):
+    """
+    A command of a room log, whose payload is read from its segment when used.
+    """
+
+    def __init__(
+        self,
+        command_type: MessageType,
+        command_id: int,
+        compression: Compression,
+        segment: _Segment,
+        offset: int,
+        length: int,
+    ):
+        # Command.__init__() is not called, since data is a property
+        self.type = command_type
+        self.id = command_id
+        self.compression = compression
+        self.segment = segment
+        self._offset = offset
+        self._length = length
+
+    @property
+    def data(self):
+        return self.segment.read(self._offset, self._length)
+
+    @property
+    def frame_offset(self) -> int:
+        return self._offset - MESSAGE_HEADER_SIZE
+
+    def follows(self, command: Command) -> bool:
+        """
+        Return True if this command immediately follows command in their segment.
+        """
+        return (
+            isinstance(command, LoggedCommand)
+            and command.segment is self.segment
+            and command._offset + command._length == self.frame_offset
+        )
+
+    def byte_size(self):
+        return MESSAGE_HEADER_SIZE + self._length
+
+    def header(self) -> bytes:
+        return message_header.pack(self._length, self.id, self.type.value | self.compression << COMPRESSION_SHIFT)
+
+
+def room_log_path(directory: str, room_name: str) -> str:
+    # room names are free strings, that may not be valid or unique file names
+    return os.path.join(directory, hashlib.sha1(room_name.encode()).hexdigest()[:16])
+
+
+class RoomLog:
+    """
+    Append only log of the commands of a room, see the module documentation.
+
+    Use create() for a new room, and open_all() to restore the rooms logged in a directory.
+    """
+
+    def __init__(self, path: str, room_name: str, segment_size: int = SEGMENT_SIZE):
+        self.path = path
+        self.room_name = room_name
+        self.attributes: Dict[str, Any] = {}
+        self._segment_size = segment_size
+        self._segments: Dict[int, _Segment] = {}
+        self._current: Optional[_Segment] = None
+        self._file = None
+        self._synced = True  # no command appended since the last sync()
+
+    @classmethod
+    def create(cls, directory: str, room_name: str, segment_size: int = SEGMENT_SIZE) -> RoomLog:
+        """
+        Create the log of a new room, replacing the log of a previous room with the same name.
+        """
+        path = room_log_path(directory, room_name)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+        log = cls(path, room_name, segment_size)
+        log.save_attributes({})
+        return log
+
+    @classmethod
+    def open_all(cls, directory: str, segment_size: int = SEGMENT_SIZE) -> List[RoomLog]:
+        """
+        Open the room logs in directory.
+        """
+        logs = []
+        if not os.path.isdir(directory):
+            return logs
+        for entry in sorted(os.listdir(directory)):
+            path = os.path.join(directory, entry)
+            try:
+                with open(os.path.join(path, ATTRIBUTES_FILE)) as file:
+                    attributes = json.load(file)
+                room_name = attributes.pop("room_name")
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning("Ignoring room log %s: %r", path, e)
+                continue
+            log = cls(path, room_name, segment_size)
+            log.attributes = attributes
+            logs.append(log)
+        return logs
+
+    def save_attributes(self, attributes: Dict[str, Any]):
+        """
+        Replace the room attributes, atomically.
+        """
+        self.attributes = attributes
+        temporary_path = os.path.join(self.path, ATTRIBUTES_FILE + ".tmp")
+        with open(temporary_path, "w") as file:
+            json.dump({"room_name": self.room_name, **attributes}, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, os.path.join(self.path, ATTRIBUTES_FILE))
+
+    def commands(self) -> List[LoggedCommand]:
+        """
+        Return the commands of the log, in the order they were appended, discarding a truncated last command.
+        """
+        commands = []
+        for name in sorted(n for n in os.listdir(self.path) if n.endswith(SEGMENT_SUFFIX)):
+            segment = _Segment(os.path.join(self.path, name), int(name[: -len(SEGMENT_SUFFIX)]))
+            self._segments[segment.index] = segment
+            commands.extend(self._read_segment(segment))
+        if self._segments:
+            self._current = self._segments[max(self._segments)]
+            self._file = open(self._current.path, "ab")
+        return commands
+
+    def _read_segment(self, segment: _Segment) -> List[LoggedCommand]:
+        commands: List[LoggedCommand] = []
+        with open(segment.path, "r+b") as file:
+            file_size = os.fstat(file.fileno()).st_size
+            header = file.read(4)
+            offset = 4 + int.from_bytes(header, "little")
+            if len(header) < 4 or offset > file_size:
+                # the segment was being created, and has no command
+                file.seek(0)
+                file.truncate()
+                file.write(self._segment_header(segment.index))
+                offset = file_size = file.tell()
+            segment.header_size = offset
+            while offset + MESSAGE_HEADER_SIZE <= file_size:
+                file.seek(offset)
+                try:
+                    frame_size, command_id, message_type, compression = unpack_message_header(
+                        file.read(MESSAGE_HEADER_SIZE)
+                    )
+                except ValueError:
+                    break
+                data_offset = offset + MESSAGE_HEADER_SIZE
+                if data_offset + frame_size > file_size:
+                    break
+                commands.append(LoggedCommand(message_type, command_id, compression, segment, data_offset, frame_size))
+                offset = data_offset + frame_size
+
+            if offset != file_size:
+                logger.warning("Truncating room log segment %s from %d to %d bytes", segment.path, file_size, offset)
+                file.truncate(offset)
+        segment.size = offset
+        segment.live_count = len(commands)
+        return commands
+
+    def append(self, command: Command) -> LoggedCommand:
+        """
+        Write command at the end of the log, and return it as read from the log.
+        """
+        size = command.byte_size()
+        current = self._current
+        if current is None or (current.size + size > self._segment_size and current.size > current.header_size):
+            self._start_segment()
+        segment = self._current
+        assert segment is not None and self._file is not None
+
+        data = command.data
+        self._file.write(command.header())
+        self._file.write(data)
+        self._file.flush()
+        self._synced = False
+
+        logged = LoggedCommand(
+            command.type, command.id, command.compression, segment, segment.size + MESSAGE_HEADER_SIZE, len(data)
+        )
+        segment.size += size
+        segment.live_count += 1
+        return logged
+
+    def _segment_header(self, index: int) -> bytes:
+        # room attributes for room_bake.load_room()
+        return encode_json({"name": self.room_name, "segment": index})
+
+    def sync(self):
+        """
+        Write the commands appended since the last call to disk.
+        """
+        if self._file is not None and not self._synced:
+            os.fsync(self._file.fileno())
+        self._synced = True
+
+    def _start_segment(self):
+        previous = self._current
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+        index = previous.index + 1 if previous is not None else 0
+        self._current = _Segment(os.path.join(self.path, f"{index:08d}{SEGMENT_SUFFIX}"), index)
+        self._segments[index] = self._current
+        self._file = open(self._current.path, "wb")
+        header = self._segment_header(index)
+        self._file.write(header)
+        self._current.size = self._current.header_size = len(header)
+        if previous is not None and previous.live_count == 0:
+            self._delete_segment(previous)
+
+    def release(self, command: Command):
+        """
+        Notify that command was dropped from the room history, and delete its segment if it has no command left.
+        """
+        segment = command.segment
+        segment.live_count -= 1
+        if segment.live_count == 0 and segment is not self._current:
+            self._delete_segment(segment)
+
+    def _delete_segment(self, segment: _Segment):
+        del self._segments[segment.index]
+        # the segment is not released, since its commands may still be queued for clients that join the room
+        segment.reader()
+        try:
+            os.remove(segment.path)
+        except OSError as e:
+            # on Windows, while clients are sent commands mapped from the segment
+            logger.warning("Cannot delete room log segment %s: %s", segment.path, e)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        for segment in self._segments.values():
+            segment.release()
+
+    def delete(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        # the segments are not released, since their commands may still be queued for clients, see _delete_segment()
+        for segment in self._segments.values():
+            segment.reader()
+        self._segments = {}
+        shutil.rmtree(self.path, ignore_errors=True)
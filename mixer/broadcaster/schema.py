@@ -0,0 +1,341 @@
+"""
+Declarative layouts of the VRtist protocol messages.
+
+A message layout is a sequence of named fields. It is compiled once into a MessageSchema whose encoder and
+decoder pack and unpack runs of fixed size fields with a single precomputed struct.Struct, and handle variable
+size fields (strings and arrays) with dedicated fast paths. The byte layout is the same as the one produced by the
+encode_* functions of common.py, so that messages built with a schema can be decoded by hand written code and
+conversely.
+
+Usage:
+    buffer = get_schema(MessageType.CAMERA_ATTRIBUTES).encode(name, lens, aperture, focus_distance)
+    attributes = get_schema(MessageType.CAMERA_ATTRIBUTES).decode(buffer)
+    attributes.name, attributes.lens, ...
+"""
+
+from collections import namedtuple
+import struct
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from mixer.broadcaster.common import Command, MessageType
+
+
+class FieldType:
+    """
+    The wire representation of a message field.
+
+    Fixed size fields have a struct format and two source templates used to generate the encoder and the decoder:
+    - encode_template turns the field value into struct.pack arguments, for instance "*{}" for a vector,
+    - decode_template turns the values unpacked in the tuple {v} into the field value, {0}, {1}, ... being the
+      positions of the field values in the tuple.
+    Variable size fields have no format.
+    """
+
+    def __init__(
+        self, name: str, format_: Optional[str] = None, encode_template: str = "{}", decode_template: str = "{v}[{0}]",
+    ):
+        self.name = name
+        self.format = format_
+        self.size = struct.calcsize("<" + format_) if format_ is not None else None
+        self.count = len(struct.unpack("<" + format_, bytes(self.size))) if format_ is not None else None
+        self.encode_template = encode_template
+        self.decode_template = decode_template
+
+    def __repr__(self):
+        return f"FieldType({self.name})"
+
+
+def _color_values(value):
+    if len(value) == 3:
+        return (value[0], value[1], value[2], 1.0)
+    return (value[0], value[1], value[2], value[3])
+
+
+def _matrix_values(value):
+    columns = getattr(value, "col", value)
+    return (*columns[0], *columns[1], *columns[2], *columns[3])
+
+
+STRING = FieldType("string")
+STRING_ARRAY = FieldType("string_array")
+INT_ARRAY = FieldType("int_array")
+FLOAT_ARRAY = FieldType("float_array")
+INT = FieldType("int", "i")
+FLOAT = FieldType("float", "f")
+BOOL = FieldType("bool", "I", "1 if {} else 0", "{v}[{0}] == 1")
+VECTOR2 = FieldType("vector2", "2f", "*{}", "{v}[{0}:{2}]")
+VECTOR3 = FieldType("vector3", "3f", "*{}", "{v}[{0}:{3}]")
+VECTOR4 = FieldType("vector4", "4f", "*{}", "{v}[{0}:{4}]")
+COLOR = FieldType("color", "4f", "*_color_values({})", "{v}[{0}:{4}]")
+# w, x, y, z, as iterated by mathutils.Quaternion
+QUATERNION = FieldType("quaternion", "4f", "*{}", "{v}[{0}:{4}]")
+# column major, as in encode_matrix
+MATRIX = FieldType(
+    "matrix",
+    "16f",
+    "*_matrix_values({})",
+    "({v}[{0}:{4}], {v}[{4}:{8}], {v}[{8}:{12}], {v}[{12}:{16}])",
+)
+
+_u32 = struct.Struct("<I")
+
+
+def _encode_string_array(values: Sequence[str]) -> bytes:
+    encoded = [value.encode() for value in values]
+    return b"".join([_u32.pack(len(values))] + [_u32.pack(len(value)) + value for value in encoded])
+
+
+def _decode_string_array(data, index: int) -> Tuple[List[str], int]:
+    count = _u32.unpack_from(data, index)[0]
+    index += 4
+    values = []
+    for _ in range(count):
+        length = _u32.unpack_from(data, index)[0]
+        index += 4
+        values.append(str(data[index : index + length], "utf8"))
+        index += length
+    return values, index
+
+
+def _encode_int_array(values: Sequence[int]) -> bytes:
+    return _u32.pack(len(values)) + struct.pack(f"<{len(values)}i", *values)
+
+
+def _decode_int_array(data, index: int) -> Tuple[List[int], int]:
+    count = _u32.unpack_from(data, index)[0]
+    return list(struct.unpack_from(f"<{count}i", data, index + 4)), index + 4 + 4 * count
+
+
+def _encode_float_array(values: Sequence[float]) -> bytes:
+    return _u32.pack(len(values)) + struct.pack(f"<{len(values)}f", *values)
+
+
+def _decode_float_array(data, index: int) -> Tuple[List[float], int]:
+    count = _u32.unpack_from(data, index)[0]
+    return list(struct.unpack_from(f"<{count}f", data, index + 4)), index + 4 + 4 * count
+
+
+_array_codecs = {
+    STRING_ARRAY: ("_encode_string_array", "_decode_string_array"),
+    INT_ARRAY: ("_encode_int_array", "_decode_int_array"),
+    FLOAT_ARRAY: ("_encode_float_array", "_decode_float_array"),
+}
+
+
+class MessageSchema:
+    """
+    Encoder and decoder for a message layout.
+
+    The encoder and decoder are generated as python source code and compiled, so that encoding a message costs
+    one struct.pack() call per run of fixed size fields and no per field function call.
+    """
+
+    def __init__(self, message_type: MessageType, fields: Sequence[Tuple[str, FieldType]]):
+        self.message_type = message_type
+        self.fields = list(fields)
+        self.values_type = namedtuple(message_type.name.title().replace("_", ""), [name for name, _ in fields])
+
+        self.size = None  # size of messages without variable size fields
+        if all(field_type.format is not None for _, field_type in self.fields):
+            self.size = sum(field_type.size for _, field_type in self.fields)
+
+        namespace = {
+            "_u32_pack": _u32.pack,
+            "_u32_unpack_from": _u32.unpack_from,
+            "_color_values": _color_values,
+            "_matrix_values": _matrix_values,
+            "_make": self.values_type._make,
+            "_encode_string_array": _encode_string_array,
+            "_decode_string_array": _decode_string_array,
+            "_encode_int_array": _encode_int_array,
+            "_decode_int_array": _decode_int_array,
+            "_encode_float_array": _encode_float_array,
+            "_decode_float_array": _decode_float_array,
+        }
+        self.source = self._generate(namespace)
+        exec(compile(self.source, f"<schema {message_type.name}>", "exec"), namespace)
+        self.encode: Callable[..., bytes] = namespace["encode"]
+        self.decode_from: Callable[[Any, int], Tuple[Any, int]] = namespace["decode_from"]
+
+    def _segments(self) -> List[List[Tuple[str, FieldType]]]:
+        """
+        Split the fields into single variable size fields and runs of fixed size fields.
+        """
+        segments: List[List[Tuple[str, FieldType]]] = []
+        for name, field_type in self.fields:
+            if field_type.format is not None and segments and segments[-1][0][1].format is not None:
+                segments[-1].append((name, field_type))
+            else:
+                segments.append([(name, field_type)])
+        return segments
+
+    def _generate(self, namespace: Dict[str, Any]) -> str:
+        # prefix argument names to avoid clashes with the generated code names
+        arguments = [f"{name}_" for name, _ in self.fields]
+        encode_lines = [f"def encode({', '.join(arguments)}):"]
+        encode_parts = []
+        decode_lines = ["def decode_from(data, index=0):"]
+        decode_values = []
+
+        argument_index = 0
+        for segment_index, segment in enumerate(self._segments()):
+            first_type = segment[0][1]
+            if first_type.format is None:
+                argument = arguments[argument_index]
+                argument_index += 1
+                value = f"_value{segment_index}"
+                if first_type is STRING:
+                    encode_lines.append(f"    {value} = {argument}.encode()")
+                    encode_parts.extend([f"_u32_pack(len({value}))", value])
+                    decode_lines.append("    _length = _u32_unpack_from(data, index)[0]")
+                    decode_lines.append(f"    {value} = str(data[index + 4 : index + 4 + _length], 'utf8')")
+                    decode_lines.append("    index += 4 + _length")
+                else:
+                    encoder, decoder = _array_codecs[first_type]
+                    encode_parts.append(f"{encoder}({argument})")
+                    decode_lines.append(f"    {value}, index = {decoder}(data, index)")
+                decode_values.append(value)
+                continue
+
+            packer = struct.Struct("<" + "".join(field_type.format for _, field_type in segment))
+            namespace[f"_pack{segment_index}"] = packer.pack
+            namespace[f"_unpack_from{segment_index}"] = packer.unpack_from
+            pack_arguments = []
+            position = 0
+            for _, field_type in segment:
+                pack_arguments.append(field_type.encode_template.format(arguments[argument_index]))
+                positions = range(position, position + field_type.count + 1)
+                decode_values.append(field_type.decode_template.format(*positions, v=f"_v{segment_index}"))
+                argument_index += 1
+                position += field_type.count
+            encode_parts.append(f"_pack{segment_index}({', '.join(pack_arguments)})")
+            decode_lines.append(f"    _v{segment_index} = _unpack_from{segment_index}(data, index)")
+            decode_lines.append(f"    index += {packer.size}")
+
+        encode_lines.append(f"    return {' + '.join(encode_parts)}")
+        decode_lines.append(f"    return _make(({''.join(value + ', ' for value in decode_values)})), index")
+        return "\n".join(encode_lines + [""] + decode_lines) + "\n"
+
+    def decode(self, data):
+        return self.decode_from(data, 0)[0]
+
+    def command(self, *values) -> Command:
+        return Command(self.message_type, self.encode(*values), 0)
+
+
+_schemas: Dict[MessageType, MessageSchema] = {}
+
+
+def register_schema(message_type: MessageType, *fields: Tuple[str, FieldType]) -> MessageSchema:
+    if message_type in _schemas:
+        raise ValueError(f"Schema already registered for {message_type.name}")
+    schema = MessageSchema(message_type, fields)
+    _schemas[message_type] = schema
+    return schema
+
+
+def get_schema(message_type: MessageType) -> MessageSchema:
+    return _schemas[message_type]
+
+
+def has_schema(message_type: MessageType) -> bool:
+    return message_type in _schemas
+
+
+register_schema(
+    MessageType.TRANSFORM,
+    ("path", STRING),
+    ("parent_inverse_matrix", MATRIX),
+    ("basis_matrix", MATRIX),
+    ("local_matrix", MATRIX),
+)
+register_schema(MessageType.DUPLICATE, ("path", STRING), ("name", STRING), ("basis_matrix", MATRIX))
+register_schema(
+    MessageType.CAMERA,
+    ("path", STRING),
+    ("name", STRING),
+    ("lens", FLOAT),
+    ("clip_start", FLOAT),
+    ("clip_end", FLOAT),
+    ("aperture_fstop", FLOAT),
+    ("sensor_fit", INT),
+    ("sensor_width", FLOAT),
+    ("sensor_height", FLOAT),
+)
+register_schema(
+    MessageType.CAMERA_ATTRIBUTES,
+    ("name", STRING),
+    ("lens", FLOAT),
+    ("aperture_fstop", FLOAT),
+    ("focus_distance", FLOAT),
+)
+register_schema(
+    MessageType.LIGHT,
+    ("path", STRING),
+    ("name", STRING),
+    ("light_type", INT),
+    ("shadow", INT),
+    ("color", COLOR),
+    ("power", FLOAT),
+    ("spot_size", FLOAT),
+    ("spot_blend", FLOAT),
+)
+register_schema(
+    MessageType.GREASE_PENCIL_MATERIAL,
+    ("name", STRING),
+    ("show_stroke", BOOL),
+    ("mode", STRING),
+    ("stroke_style", STRING),
+    ("color", COLOR),
+    ("use_overlap_strokes", BOOL),
+    ("show_fill", BOOL),
+    ("fill_style", STRING),
+    ("fill_color", COLOR),
+)
+register_schema(MessageType.GREASE_PENCIL_CONNECTION, ("path", STRING), ("name", STRING))
+register_schema(
+    MessageType.OBJECT_VISIBILITY,
+    ("name", STRING),
+    ("hide_viewport", BOOL),
+    ("hide_select", BOOL),
+    ("hide_render", BOOL),
+    ("hide_get", BOOL),
+)
+register_schema(
+    MessageType.COLLECTION,
+    ("name", STRING),
+    ("visible", BOOL),
+    ("instance_offset", VECTOR3),
+    ("temporary_visibility", BOOL),
+)
+for _message_type, _parent, _child in (
+    (MessageType.ADD_COLLECTION_TO_COLLECTION, "parent_name", "child_name"),
+    (MessageType.REMOVE_COLLECTION_FROM_COLLECTION, "parent_name", "child_name"),
+    (MessageType.ADD_OBJECT_TO_COLLECTION, "collection_name", "object_name"),
+    (MessageType.REMOVE_OBJECT_FROM_COLLECTION, "collection_name", "object_name"),
+    (MessageType.INSTANCE_COLLECTION, "instance_name", "collection_name"),
+    (MessageType.RENAME, "old_path", "new_path"),
+):
+    register_schema(_message_type, (_parent, STRING), (_child, STRING))
+for _message_type in (
+    MessageType.DELETE,
+    MessageType.COLLECTION_REMOVED,
+    MessageType.SET_SCENE,
+    MessageType.CURRENT_CAMERA,
+    MessageType.QUERY_OBJECT_DATA,
+    MessageType.CLEAR_ANIMATIONS,
+):
+    register_schema(_message_type, ("name", STRING))
+register_schema(MessageType.FRAME, ("frame", INT))
+register_schema(MessageType.FRAME_START_END, ("start", INT), ("end", INT))
+register_schema(
+    MessageType.ADD_KEYFRAME,
+    ("name", STRING),
+    ("channel", STRING),
+    ("channel_index", INT),
+    ("frame", INT),
+    ("value", FLOAT),
+)
+register_schema(MessageType.REMOVE_KEYFRAME, ("name", STRING), ("channel", STRING), ("channel_index", INT))
+register_schema(MessageType.SHOT_MANAGER_MONTAGE_MODE, ("montage_mode", BOOL))
+register_schema(MessageType.SHOT_MANAGER_CURRENT_SHOT, ("shot_index", INT))
@@ -0,0 +1,236 @@
+"""
+Recording of the traffic of a room, with its timing, and playback of the recording against a server.
+
+Unlike room_bake.save_room(), that saves the history of a room, a session records every command that the clients of a
+room send to the server while it is open, with its sender and the time it was received, so that the traffic of a real
+session can be reproduced: bursts of mesh updates, steady transform and presence updates.
+
+A session file has the header of a room_bake.save_room() file, a JSON object whose "format" is SESSION_FORMAT, then a
+record per command: the time in seconds since the start of the recording, as a little endian double, the sender id as
+an encoded string, then the command as it was received on the network.
+
+The records are buffered and flushed every RECORD_FLUSH_INTERVAL seconds and when the recording is closed, so a crash
+of the server loses the last records, and may truncate the last one, that is discarded by load_session().
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import select
+import struct
+import threading
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from mixer.broadcaster.client import Client
+from mixer.broadcaster.common import (
+    MESSAGE_HEADER_SIZE,
+    ClientDisconnectedException,
+    Command,
+    MessageType,
+    RoomAttributes,
+    bytes_to_int,
+    decode_json,
+    encode_json,
+    encode_string,
+    unpack_message_header,
+)
+
+logger = logging.getLogger(__name__)
+
+SESSION_FORMAT = "mixer-session"
+SESSION_VERSION = 1
+SESSION_SUFFIX = ".session"
+
+# The commands recorded besides the room commands, that clients send to be broadcast to the others
+RECORDED_MESSAGE_TYPES = {
+    MessageType.CLIENT_PRESENCE,
+    MessageType.SET_CLIENT_CUSTOM_ATTRIBUTES,
+    MessageType.SET_CLIENT_NAME,
+}
+
+RECORD_FLUSH_INTERVAL = 1.0
+
+_time = struct.Struct("<d")
+
+
+class SessionRecord(NamedTuple):
+    time: float  # seconds since the start of the recording
+    sender: str  # id of the client that sent command
+    command: Command
+
+
+def is_recorded(command: Command) -> bool:
+    return command.type > MessageType.COMMAND or command.type in RECORDED_MESSAGE_TYPES
+
+
+class SessionRecorder:
+    """
+    Append the commands received by a room to a session file. May be called from the threads of all the clients of
+    the room.
+    """
+
+    def __init__(self, path: str, room_name: str):
+        self.path = path
+        self.room_name = room_name
+        self._lock = threading.Lock()
+        self._file = open(path, "wb")
+        self._file.write(encode_json({"name": room_name, "format": SESSION_FORMAT, "version": SESSION_VERSION}))
+        self._start = time.monotonic()
+        self._next_flush = self._start + RECORD_FLUSH_INTERVAL
+
+    @classmethod
+    def create(cls, directory: str, room_name: str) -> SessionRecorder:
+        """
+        Start recording a room to a new file of directory, named after the room and the current time.
+        """
+        os.makedirs(directory, exist_ok=True)
+        # room names are free strings, that may not be valid or unique file names
+        name = hashlib.sha1(room_name.encode()).hexdigest()[:16]
+        path = os.path.join(directory, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}{SESSION_SUFFIX}")
+        logger.info("Recording room %s to %s", room_name, path)
+        return cls(path, room_name)
+
+    def record(self, sender: str, command: Command):
+        now = time.monotonic()
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(_time.pack(now - self._start))
+            self._file.write(encode_string(sender))
+            self._file.write(command.header())
+            self._file.write(command.data)
+            if now >= self._next_flush:
+                self._file.flush()
+                self._next_flush = now + RECORD_FLUSH_INTERVAL
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def load_session(file_path: str) -> Tuple[Dict[str, Any], List[SessionRecord]]:
+    """
+    Return the header and the records of a session file.
+    """
+    with open(file_path, "rb") as f:
+        data = f.read()
+
+    header, offset = decode_json(data, 0)
+    if header.get("format") != SESSION_FORMAT:
+        raise ValueError(f"{file_path} is not a session file")
+
+    records = []
+    while offset + _time.size + 4 <= len(data):
+        (record_time,) = _time.unpack_from(data, offset)
+        sender_offset = offset + _time.size
+        sender_end = sender_offset + 4 + bytes_to_int(data[sender_offset : sender_offset + 4])
+        if sender_end + MESSAGE_HEADER_SIZE > len(data):
+            break
+        frame_size, command_id, message_type, compression = unpack_message_header(
+            data[sender_end : sender_end + MESSAGE_HEADER_SIZE]
+        )
+        data_offset = sender_end + MESSAGE_HEADER_SIZE
+        if data_offset + frame_size > len(data):
+            break
+        sender = data[sender_offset + 4 : sender_end].decode()
+        command = Command(message_type, data[data_offset : data_offset + frame_size], command_id, compression)
+        records.append(SessionRecord(record_time, sender, command))
+        offset = data_offset + frame_size
+
+    if offset != len(data):
+        logger.warning("Discarding the truncated end of session %s", file_path)
+    return header, records
+
+
+def _wait_for(client: Client, predicate: Callable[[List[Command]], bool], timeout: float):
+    """
+    Receive commands until predicate returns True for the commands received at once.
+    """
+    deadline = time.monotonic() + timeout
+    while not predicate(client.fetch_incoming_commands()):
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Timeout while playing session with {client.host}:{client.port}")
+        select.select([client.socket], [], [], 0.1)
+
+
+def _join(client: Client, room_name: str, timeout: float):
+    """
+    Join room_name, creating it if it does not exist.
+    """
+    received: List[MessageType] = []
+
+    def _joined(commands: List[Command]) -> bool:
+        received.extend(command.type for command in commands)
+        return MessageType.JOIN_ROOM in received
+
+    def _joinable(commands: List[Command]) -> bool:
+        return client.rooms_attributes.get(room_name, {}).get(RoomAttributes.JOINABLE, False)
+
+    client.join_room(room_name)
+    _wait_for(client, _joined, timeout)
+    if MessageType.CLEAR_CONTENT not in received:
+        # the room was created, it is joinable once its content is sent, that is none
+        client.send_command(Command(MessageType.CONTENT))
+        _wait_for(client, _joinable, timeout)
+
+
+def play_session(
+    host: str,
+    port: int,
+    room_name: str,
+    records: List[SessionRecord],
+    speed: float = 1.0,
+    sender_count: Optional[int] = None,
+    timeout: float = 10.0,
+) -> Dict[str, Any]:
+    """
+    Send the recorded commands to room_name from sender_count clients, by default one per recorded sender, at speed
+    times the recorded rate, or as fast as possible if speed is 0.
+
+    The commands of a recorded sender are sent by the same client, and the senders are assigned to the clients in
+    turn. Return the duration of the playback and the maximum delay of a command behind its schedule, in seconds.
+    """
+    senders: Dict[str, int] = {}
+    for record in records:
+        senders.setdefault(record.sender, len(senders))
+    client_count = max(1, sender_count if sender_count is not None else len(senders))
+
+    clients = [Client(host, port) for _ in range(client_count)]
+    max_lag = 0.0
+    try:
+        for client in clients:
+            client.connect()
+            if not client.is_connected():
+                raise ClientDisconnectedException(f"Cannot connect to {host}:{port}")
+            _join(client, room_name, timeout)
+
+        clients_by_socket = {client.socket: client for client in clients}
+        start = time.monotonic()
+        for record in records:
+            scheduled = start + record.time / speed if speed > 0 else 0.0
+            while True:
+                # consume the commands broadcast to the clients, that would block the server otherwise
+                now = time.monotonic()
+                readable, _, _ = select.select(list(clients_by_socket), [], [], max(0.0, min(0.1, scheduled - now)))
+                for sock in readable:
+                    clients_by_socket[sock].fetch_incoming_commands()
+                now = time.monotonic()
+                if now >= scheduled:
+                    break
+
+            if speed > 0:
+                max_lag = max(max_lag, now - scheduled)
+            client = clients[senders[record.sender] % client_count]
+            if not client.send_command(record.command):
+                raise ClientDisconnectedException(f"Disconnected from {host}:{port} while playing session")
+        duration = time.monotonic() - start
+    finally:
+        for client in clients:
+            client.disconnect()
+
+    return {"duration": duration, "command_count": len(records), "client_count": client_count, "max_lag": max_lag}
@@ -0,0 +1,263 @@
+"""
+Operational metrics of the server.
+
+The counters are plain attributes, updated without locks by the thread that owns them: a connection counts the
+commands it receives and sends, a room the commands it broadcasts, under its mutex. They are summed when a snapshot is
+taken, so that counting a command costs a few attribute increments, and metrics can remain enabled in production.
+
+A snapshot is a JSON compatible dictionary, see Server.stats(). It is sent to the clients that request it with
+SERVER_STATS, and can be exported to a file or over HTTP, as JSON or in the Prometheus text format.
+"""
+
+from __future__ import annotations
+
+import bisect
+import http.server
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from mixer.broadcaster.common import Command, CommandRun, MessageType
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets, in seconds
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+
+# Command rates are averaged over this many seconds
+RATE_WINDOW = 10
+
+# Files that are exported in the Prometheus text format rather than as JSON
+PROMETHEUS_SUFFIX = ".prom"
+
+
+class Histogram:
+    """
+    Counts of observed values by bucket, as Prometheus histograms.
+    """
+
+    def __init__(self, bounds: Sequence[float] = DURATION_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last bucket has no upper bound
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other: Histogram):
+        for index, count in enumerate(list(other.counts)):
+            self.counts[index] += count
+        self.count += other.count
+        self.sum += other.sum
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Return the count, the sum and the cumulative counts of the buckets, by upper bound.
+        """
+        buckets = {}
+        cumulative = 0
+        for bound, count in zip(list(self.bounds) + ["+Inf"], list(self.counts)):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {"count": self.count, "sum": self.sum, "buckets": buckets}
+
+
+class RateMeter:
+    """
+    Number of events per second, over the last RATE_WINDOW seconds.
+    """
+
+    def __init__(self, window: int = RATE_WINDOW):
+        self._window = window
+        self._seconds = [-1] * window  # the second counted by each slot
+        self._counts = [0] * window
+
+    def add(self, count: int = 1):
+        second = int(time.monotonic())
+        index = second % self._window
+        if self._seconds[index] != second:
+            self._seconds[index] = second
+            self._counts[index] = 0
+        self._counts[index] += count
+
+    def rate(self) -> float:
+        # the current second is not complete
+        now = int(time.monotonic())
+        total = sum(c for s, c in zip(self._seconds, self._counts) if now - self._window <= s < now)
+        return total / self._window
+
+
+class ConnectionStats:
+    """
+    Counters of a connection, updated by the thread or the task that serves it.
+    """
+
+    def __init__(self):
+        self.commands_in = 0
+        self.bytes_in = 0
+        self.commands_out = 0
+        self.bytes_out = 0
+        self.message_types: Dict[MessageType, int] = {}  # received commands, by type
+        self.send_lag = Histogram()  # time the commands spend in the send queue
+        self.last_send_lag = 0.0
+
+    def received(self, command: Command):
+        self.commands_in += 1
+        self.bytes_in += command.byte_size()
+        self.message_types[command.type] = self.message_types.get(command.type, 0) + 1
+
+    def sent(self, commands: List[Command]):
+        for command in commands:
+            self.commands_out += len(command.commands) if isinstance(command, CommandRun) else 1
+            self.bytes_out += command.byte_size()
+
+    def waited(self, lag: float):
+        self.send_lag.observe(lag)
+        self.last_send_lag = lag
+
+    def merge(self, other: ConnectionStats):
+        self.commands_in += other.commands_in
+        self.bytes_in += other.bytes_in
+        self.commands_out += other.commands_out
+        self.bytes_out += other.bytes_out
+        for message_type, count in other.message_types.copy().items():
+            self.message_types[message_type] = self.message_types.get(message_type, 0) + count
+        self.send_lag.merge(other.send_lag)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "commands_in": self.commands_in,
+            "bytes_in": self.bytes_in,
+            "commands_out": self.commands_out,
+            "bytes_out": self.bytes_out,
+        }
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def to_prometheus(stats: Dict[str, Any]) -> str:
+    """
+    Return a snapshot of Server.stats() in the Prometheus text exposition format.
+    """
+    lines: List[str] = []
+
+    def _metric(name: str, kind: str, samples: List[Tuple[str, Any]]):
+        lines.append(f"# TYPE mixer_{name} {kind}")
+        for labels, value in samples:
+            lines.append(f"mixer_{name}{labels} {value}")
+
+    def _histogram(name: str, histogram: Dict[str, Any]):
+        lines.append(f"# TYPE mixer_{name} histogram")
+        for bound, count in histogram["buckets"].items():
+            lines.append(f'mixer_{name}_bucket{{le="{bound}"}} {count}')
+        lines.append(f"mixer_{name}_sum {histogram['sum']}")
+        lines.append(f"mixer_{name}_count {histogram['count']}")
+
+    def _by(key: str, label: str, items: Dict[str, Dict[str, Any]]) -> List[Tuple[str, Any]]:
+        return [(f'{{{label}="{_label(name)}"}}', values[key]) for name, values in items.items()]
+
+    _metric("uptime_seconds", "gauge", [("", stats["uptime"])])
+    _metric("connections", "gauge", [("", stats["connection_count"])])
+    for key in ("commands_in", "bytes_in", "commands_out", "bytes_out"):
+        _metric(f"{key}_total", "counter", [("", stats[key])])
+    message_types = stats["message_types"]
+    _metric("messages_in_total", "counter", [(f'{{type="{name}"}}', n) for name, n in message_types.items()])
+    _histogram("join_duration_seconds", stats["join_duration"])
+    _histogram("send_lag_seconds", stats["send_lag"])
+
+    rooms = stats["rooms"]
+    _metric("room_clients", "gauge", _by("client_count", "room", rooms))
+    _metric("room_history_commands", "gauge", _by("command_count", "room", rooms))
+    _metric("room_history_bytes", "gauge", _by("byte_size", "room", rooms))
+    _metric("room_commands_in_total", "counter", _by("commands_in", "room", rooms))
+    _metric("room_bytes_in_total", "counter", _by("bytes_in", "room", rooms))
+    _metric("room_bytes_out_total", "counter", _by("bytes_out", "room", rooms))
+    _metric("room_command_rate", "gauge", _by("command_rate", "room", rooms))
+
+    clients = stats["clients"]
+    for key in ("commands_in", "bytes_in", "commands_out", "bytes_out"):
+        _metric(f"client_{key}_total", "counter", _by(key, "client", clients))
+    _metric("client_send_queue_bytes", "gauge", _by("send_queue_size", "client", clients))
+    _metric("client_send_queue_commands", "gauge", _by("send_queue_command_count", "client", clients))
+    _metric("client_send_lag_seconds", "gauge", _by("send_lag", "client", clients))
+    return "\n".join(lines) + "\n"
+
+
+def write_stats_file(path: str, stats: Dict[str, Any]):
+    """
+    Replace the file at path with stats, in the Prometheus text format if path ends with PROMETHEUS_SUFFIX, as JSON
+    otherwise.
+    """
+    content = to_prometheus(stats) if path.endswith(PROMETHEUS_SUFFIX) else json.dumps(stats, indent=2)
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "w") as file:
+        file.write(content)
+    os.replace(temporary_path, path)
+
+
+class StatsExporter:
+    """
+    Export the snapshots returned by get_stats: to a file every interval seconds, and over HTTP, as Prometheus text at
+    /metrics and as JSON at any other path.
+    """
+
+    def __init__(self, get_stats: Callable[[], Dict[str, Any]]):
+        self._get_stats = get_stats
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._http_server: Optional[http.server.HTTPServer] = None
+
+    def write_periodically(self, path: str, interval: float):
+        def _write():
+            while not self._stop.wait(interval):
+                try:
+                    write_stats_file(path, self._get_stats())
+                except Exception as e:
+                    logger.warning("Cannot write stats to %s: %r", path, e)
+
+        self._start(_write)
+
+    def serve(self, host: str, port: int):
+        get_stats = self._get_stats
+
+        class _Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                stats = get_stats()
+                if self.path == "/metrics":
+                    body, content_type = to_prometheus(stats), "text/plain; version=0.0.4"
+                else:
+                    body, content_type = json.dumps(stats), "application/json"
+                data = body.encode()
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        self._http_server = http.server.ThreadingHTTPServer((host, port), _Handler)
+        self._start(self._http_server.serve_forever)
+        logger.info("Serving stats on http://%s:%s/metrics", host, self._http_server.server_address[1])
+
+    def _start(self, target: Callable[[], None]):
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        if self._http_server is not None:
+            self._http_server.shutdown()
+            self._http_server.server_close()
+        for thread in self._threads:
+            thread.join()
@@ -8,7 +8,7 @@ import logging
 import bpy
 from mixer.bl_utils import get_mixer_prefs
 from mixer.share_data import share_data
-from mixer.broadcaster.common import ClientAttributes, ClientDisconnectedException
+from mixer.broadcaster.common import ClientAttributes, ClientDisconnectedException, Compression
 import subprocess
 import time
 from pathlib import Path
@@ -16,7 +16,7 @@ from pathlib import Path
 from mixer.stats import save_statistics, get_stats_filename
 from mixer.blender_data.blenddata import BlendData
 from mixer.draw_handlers import remove_draw_handlers
-from mixer.blender_client import SendSceneContentFailed, BlenderClient
+from mixer.blender_client import IDLE_INTERVAL, SendSceneContentFailed, BlenderClient
 from mixer.handlers import HandlerManager
 
 
@@ -58,6 +58,7 @@ def join_room(room_name: str):
     share_data.auto_save_statistics = prefs.auto_save_statistics
     share_data.statistics_directory = prefs.statistics_directory
     share_data.set_experimental_sync(prefs.experimental_sync)
+    share_data.binary_data_codec = prefs.binary_data_codec
     share_data.pending_test_update = False
 
     # join a room <==> want to track local changes
@@ -183,7 +184,7 @@ def network_consumer_timer():
     # return False...
     # However, with a simple function bpy.app.timers.is_registered works.
     try:
-        share_data.client.network_consumer()
+        return share_data.client.network_consumer()
     except (ClientDisconnectedException, SendSceneContentFailed) as e:
         logger.warning(e)
         share_data.client = None
@@ -194,8 +195,7 @@ def network_consumer_timer():
         if get_mixer_prefs().env == "development":
             raise
 
-    # Run every 1 / 100 seconds
-    return 0.01
+    return IDLE_INTERVAL
 
 
 def create_main_client(host: str, port: int):
@@ -204,7 +204,7 @@ def create_main_client(host: str, port: int):
         logger.debug("create_main_client: share_data.client is not None")
         share_data.client = None
 
-    client = BlenderClient(host, port)
+    client = BlenderClient(host, port, Compression[get_mixer_prefs().compression])
     client.connect()
     if not client.is_connected():
         return False
@@ -148,6 +148,7 @@ class ShareData:
         self.end_frame = 0
 
         self.proxy: BpyBlendProxy = None
+        self.binary_data_codec = False  # send BLENDER_DATA_BINARY_UPDATE, encoded with binary_codec, instead of json_codec
 
     def leave_current_room(self):
         if self.client is not None:
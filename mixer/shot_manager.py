@@ -12,6 +12,7 @@ from mixer.share_data import share_data
 from mixer.shot_manager_data import Shot
 
 import mixer.broadcaster.common as common
+from mixer.broadcaster.schema import get_schema
 
 try:
     from shotmanager.api import shot_manager
@@ -118,8 +119,9 @@ def build_shot_manager_action(data):
 
 
 def send_montage_mode():
-    buffer = common.encode_bool(share_data.shot_manager.montage_mode)
-    share_data.client.add_command(common.Command(common.MessageType.SHOT_MANAGER_MONTAGE_MODE, buffer, 0))
+    share_data.client.add_command(
+        get_schema(common.MessageType.SHOT_MANAGER_MONTAGE_MODE).command(share_data.shot_manager.montage_mode)
+    )
 
 
 def check_montage_mode():
@@ -143,8 +145,9 @@ def send_frame():
 
     if share_data.shot_manager.current_shot_index != current_shot_index:
         share_data.shot_manager.current_shot_index = current_shot_index
-        buffer = common.encode_int(share_data.shot_manager.current_shot_index)
-        share_data.client.add_command(common.Command(common.MessageType.SHOT_MANAGER_CURRENT_SHOT, buffer, 0))
+        share_data.client.add_command(
+            get_schema(common.MessageType.SHOT_MANAGER_CURRENT_SHOT).command(share_data.shot_manager.current_shot_index)
+        )
 
 
 def get_state():
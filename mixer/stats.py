@@ -72,6 +72,19 @@ class StatsTimer:
     def child(self, key, log=None):
         return StatsTimer(self.share_data, key, log)
 
+    def add_value(self, key, value):
+        """
+        Accumulate a value measured in the timed code section, such as a size or an interval.
+        """
+        values = self.stats_dict.setdefault("values", {})
+        if key not in values:
+            values[key] = {"total": 0, "min": value, "max": value, "count": 0}
+        stats = values[key]
+        stats["total"] += value
+        stats["min"] = min(value, stats["min"])
+        stats["max"] = max(value, stats["max"])
+        stats["count"] += 1
+
 
 def get_stats_directory():
     if "MIXER_USER_STATS_DIR" in os.environ:
@@ -98,6 +111,8 @@ def compute_final_statistics(stats_dict):
             d["parent_percent_time"] = 100 * d["time"] / parent["time"] if parent["time"] > 0 else 0
         if root:
             d["global_percent_time"] = 100 * d["time"] / root["time"] if root["time"] > 0 else 0
+        for stats in d.get("values", {}).values():
+            stats["mean"] = stats["total"] / stats["count"] if stats["count"] > 0 else 0
         if "children" in d:
             for _child, child_dict in d["children"].items():
                 recursive_compute(child_dict, d, root)
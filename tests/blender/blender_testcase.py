@@ -53,6 +53,7 @@ class BlenderTestCase(MixerTestCase):
             MessageType.BLENDER_DATA_REMOVE,
             MessageType.BLENDER_DATA_RENAME,
             MessageType.BLENDER_DATA_UPDATE,
+            MessageType.BLENDER_DATA_BINARY_UPDATE,
         ]
         for k in a.keys():
             if k not in keep:
@@ -0,0 +1,61 @@
+"""
+Micro benchmarks of the array decoders of mixer.broadcaster.common.
+
+Compares the original per element decoding loop, the list of tuples decoders and the bulk decoders.
+
+Run with:
+python -m tests.broadcaster.bench_decoders --count 1000000
+"""
+import argparse
+import struct
+import timeit
+
+import mixer.broadcaster.common as common
+
+
+def legacy_decode_array(data, index, schema, inc):
+    # The decoding loop before the bulk decoders
+    count = common.bytes_to_int(data[index : index + 4])
+    start = index + 4
+    end = start
+    values = []
+    for _ in range(count):
+        end = start + inc
+        values.append(struct.unpack(schema, data[start:end]))
+        start = end
+    return values, end
+
+
+decoders = [
+    # name, schema, item size, list decoder, buffer decoder
+    ("float", "f", 4, common.decode_float_array, common.decode_float_buffer),
+    ("int", "I", 4, common.decode_int_array, common.decode_int_buffer),
+    ("int2", "2I", 2 * 4, common.decode_int2_array, common.decode_int2_buffer),
+    ("int3", "3I", 3 * 4, common.decode_int3_array, common.decode_int3_buffer),
+    ("vector2", "2f", 2 * 4, common.decode_vector2_array, common.decode_vector2_buffer),
+    ("vector3", "3f", 3 * 4, common.decode_vector3_array, common.decode_vector3_buffer),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark array decoders")
+    parser.add_argument("--count", type=int, default=1000000, help="number of array elements")
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs, the best one is reported")
+    args = parser.parse_args()
+
+    print(f"Decoding {args.count} elements, numpy {'enabled' if common.numpy is not None else 'disabled'}")
+    print(f"{'decoder':10} {'per element':>12} {'list':>12} {'buffer':>12}")
+    for name, schema, item_size, list_decoder, buffer_decoder in decoders:
+        data = memoryview(common.int_to_bytes(args.count, 4) + bytes(item_size * args.count))
+
+        def _time(function):
+            return min(timeit.repeat(function, number=1, repeat=args.repeat))
+
+        legacy = _time(lambda: legacy_decode_array(data, 0, schema, item_size))
+        as_list = _time(lambda: list_decoder(data, 0))
+        as_buffer = _time(lambda: buffer_decoder(data, 0))
+        print(f"{name:10} {legacy:11.4f}s {as_list:11.4f}s {as_buffer:11.4f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Benchmark of message reading: receive throughput of the original recv() loop versus FrameReader.
+
+Run with:
+python -m tests.broadcaster.bench_framing --size 200000000 --count 1
+python -m tests.broadcaster.bench_framing --size 200 --count 200000
+"""
+import argparse
+import select
+import socket
+import threading
+import time
+
+import mixer.broadcaster.common as common
+from mixer.broadcaster.common import Command, MessageType
+
+
+def legacy_recv(sock: socket.socket, size: int):
+    # The reading loop before FrameReader: select before each recv and append to bytes
+    result = b""
+    while size != 0:
+        r, _, _ = select.select([sock], [], [], 0.1)
+        if len(r) > 0:
+            tmp = sock.recv(size)
+            if len(tmp) == 0:
+                raise common.ClientDisconnectedException()
+            result += tmp
+            size -= len(tmp)
+    return result
+
+
+def legacy_read_message(sock: socket.socket):
+    r, _, _ = select.select([sock], [], [], 0.0001)
+    if len(r) == 0:
+        return None
+    msg = legacy_recv(sock, common.MESSAGE_HEADER_SIZE)
+    frame_size = common.bytes_to_int(msg[:8])
+    command_id = common.bytes_to_int(msg[8:12])
+    message_type = common.bytes_to_int(msg[12:])
+    msg = legacy_recv(sock, frame_size)
+    return Command(common.int_to_message_type(message_type), msg, command_id)
+
+
+def run(read_message, size: int, count: int) -> float:
+    sender, receiver = socket.socketpair()
+    buffer = Command(MessageType.MESH, b"\x01" * size, 1).to_byte_buffer()
+
+    def _send():
+        for _ in range(count):
+            sender.sendall(buffer)
+
+    thread = threading.Thread(target=_send)
+    start = time.perf_counter()
+    thread.start()
+    received = 0
+    while received < count:
+        if read_message(receiver) is not None:
+            received += 1
+    duration = time.perf_counter() - start
+    thread.join()
+    sender.close()
+    receiver.close()
+    return duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark message reading")
+    parser.add_argument("--size", type=int, default=50 * 1000 * 1000, help="payload size in bytes")
+    parser.add_argument("--count", type=int, default=2, help="number of messages")
+    args = parser.parse_args()
+
+    megabytes = args.size * args.count / 1e6
+    print(f"{args.count} messages of {args.size} bytes")
+
+    duration = run(legacy_read_message, args.size, args.count)
+    print(f"recv loop   : {duration:8.3f} s {megabytes / duration:10.1f} MB/s")
+
+    readers = {}
+
+    def _frame_reader(sock):
+        if sock not in readers:
+            readers[sock] = common.FrameReader(sock)
+        return readers[sock].read_message()
+
+    duration = run(_frame_reader, args.size, args.count)
+    print(f"FrameReader : {duration:8.3f} s {megabytes / duration:10.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
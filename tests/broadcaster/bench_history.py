@@ -0,0 +1,117 @@
+"""
+Benchmark of the room history compaction.
+
+A client sends a synthetic editing session to a room: objects are created, dragged, edited and some of them deleted.
+Then the room size is read, and a client joins the room. This is done with the history compaction disabled, so that
+only adjacent commands are merged, then enabled.
+
+Run with:
+python -m tests.broadcaster.bench_history --objects 100 --edits 2000
+"""
+import argparse
+import json
+import threading
+import time
+from typing import List
+
+from mixer.broadcaster.apps.server import Server
+from mixer.broadcaster.client import Client
+import mixer.broadcaster.common as common
+from mixer.broadcaster.common import Command, MessageType
+from tests.broadcaster.bench_server import connect_room, wait_for
+from tests.broadcaster.test_protocol import free_port
+
+
+def blenddata_update(collection: str, key: str, size: int) -> Command:
+    proxy = {
+        "__bpy_proxy_class__": "BpyIDProxy",
+        "_data": {"vertices": [0.5] * (size // 5)},
+        "_blenddata_path": [collection, key],
+        "_class_name": "Mesh",
+    }
+    return Command(MessageType.BLENDER_DATA_UPDATE, common.encode_string(json.dumps(proxy)))
+
+
+def session(object_count: int, edit_count: int, mesh_size: int) -> List[Command]:
+    def mesh(i: int) -> Command:
+        return Command(MessageType.MESH, common.encode_string(f"/Object{i}") + bytes(mesh_size))
+
+    commands = []
+    for i in range(object_count):
+        commands.append(mesh(i))
+        commands.append(
+            Command(
+                MessageType.ADD_OBJECT_TO_COLLECTION,
+                common.encode_string("Collection") + common.encode_string(f"Object{i}"),
+            )
+        )
+        commands.append(blenddata_update("meshes", f"Mesh{i}", mesh_size))
+
+    for edit in range(edit_count):
+        i = edit % object_count
+        path = common.encode_string(f"/Object{i}")
+        for step in range(10):  # a drag
+            commands.append(Command(MessageType.TRANSFORM, path + common.encode_int(step) + bytes(192)))
+        if edit % 4 == 0:
+            commands.append(mesh(i))
+            commands.append(blenddata_update("meshes", f"Mesh{i}", mesh_size))
+
+    for i in range(0, object_count, 4):
+        commands.append(Command(MessageType.DELETE, common.encode_string(f"Object{i}")))
+        commands.append(
+            Command(MessageType.BLENDER_DATA_REMOVE, common.encode_string("meshes") + common.encode_string(f"Mesh{i}"))
+        )
+    return commands
+
+
+def run(compact: bool, commands: List[Command]):
+    port = free_port()
+    server = Server()
+    server.compact_history = compact
+    server_thread = threading.Thread(target=server.run, args=(port,))
+    server_thread.start()
+    time.sleep(0.5)
+
+    (sender,) = connect_room(port, 1)
+    start = time.perf_counter()
+    for command in commands:
+        sender.send_command(command)
+    room = server._rooms["room"]
+    while room._history.commands_after()[1] < len(commands):
+        sender.fetch_commands()
+        time.sleep(0.01)
+    add_duration = time.perf_counter() - start
+
+    joiner = Client("localhost", port)
+    joiner.connect()
+    start = time.perf_counter()
+    joiner.join_room("room")
+    wait_for(joiner, MessageType.JOIN_ROOM, timeout=60.0)
+    join_duration = time.perf_counter() - start
+
+    print(
+        f"{'compaction' if compact else 'adjacent':12} {len(commands):10} {room.command_count():10} "
+        f"{room.byte_size / 1e6:10.2f} {1000 * join_duration:10.1f} {1000 * add_duration:10.1f}"
+    )
+
+    joiner.disconnect()
+    sender.disconnect()
+    server.shutdown()
+    server_thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the room history compaction")
+    parser.add_argument("--objects", type=int, default=100, help="number of objects created")
+    parser.add_argument("--edits", type=int, default=2000, help="number of object edits")
+    parser.add_argument("--mesh-size", type=int, default=20000, help="size of mesh commands")
+    args = parser.parse_args()
+
+    commands = session(args.objects, args.edits, args.mesh_size)
+    print(f"{'history':12} {'sent':>10} {'commands':>10} {'MB':>10} {'join ms':>10} {'add ms':>10}")
+    for compact in (False, True):
+        run(compact, commands)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+Benchmark of joining a recorded room.
+
+A room saved with room_bake.save_room, or a synthetic editing session when no file is given, is uploaded to a server
+with room_bake.upload_room. Then a headless client joins the room, and the arrival times of the replayed commands are
+recorded until JOIN_ROOM, that the server sends once the history is replayed:
+
+- first byte: time until CLEAR_CONTENT, the first answer of the server to the join,
+- by message type: count and size of the replayed commands, time until the first and the last one arrived,
+- join: time until JOIN_ROOM, and the replay throughput.
+
+The client receives the commands like the Blender addon, with Client.fetch_incoming_commands(), but does not apply
+them, so that the times only cover the server and the network side of the join.
+
+The server is started as a separate process, see bench_load. The results can be written as JSON with --json, labelled
+with --label, to compare builds.
+
+Run with:
+python -m tests.broadcaster.bench_join room.mixer --joins 5 --json results.json --label my-branch
+python -m tests.broadcaster.bench_join --objects 200 --edits 5000 --server-args="--asyncio"
+"""
+import argparse
+from collections import defaultdict
+import json
+import select
+import statistics
+import time
+from typing import Any, Dict, List, Tuple
+
+from mixer.broadcaster.client import Client
+from mixer.broadcaster.common import Command, MessageType, RoomAttributes
+from mixer.broadcaster import room_bake
+from tests.broadcaster.bench_history import session
+from tests.broadcaster.bench_load import start_server
+from tests.broadcaster.test_protocol import free_port
+
+ROOM_NAME = "bench-join"
+
+
+def join(port: int, timeout: float) -> Dict[str, Any]:
+    """
+    Join the room and return the timings of the replay, in seconds from the join request.
+    """
+    counts: Dict[str, int] = defaultdict(int)
+    sizes: Dict[str, int] = defaultdict(int)
+    first: Dict[str, float] = {}
+    last: Dict[str, float] = {}
+    first_byte = None
+
+    with Client("localhost", port) as client:
+        start = time.perf_counter()
+        client.join_room(ROOM_NAME)
+        deadline = start + timeout
+        while True:
+            if time.perf_counter() > deadline:
+                raise TimeoutError(f"{ROOM_NAME} not joined in {timeout} s")
+            select.select([client.socket], [], [], 0.1)
+            commands = client.fetch_incoming_commands()
+            now = time.perf_counter() - start
+            for command in commands:
+                if command.type == MessageType.CLEAR_CONTENT and first_byte is None:
+                    first_byte = now
+                elif command.type == MessageType.JOIN_ROOM:
+                    byte_size = sum(sizes.values())
+                    return {
+                        "first_byte": first_byte,
+                        "join": now,
+                        "command_count": sum(counts.values()),
+                        "byte_size": byte_size,
+                        "throughput": byte_size / now,
+                        "message_types": {
+                            name: {
+                                "count": counts[name],
+                                "byte_size": sizes[name],
+                                "first": first[name],
+                                "last": last[name],
+                            }
+                            for name in counts
+                        },
+                    }
+                elif command.type > MessageType.COMMAND:
+                    name = command.type.name
+                    counts[name] += 1
+                    sizes[name] += command.byte_size()
+                    first.setdefault(name, now)
+                    last[name] = now
+
+
+def load_commands(args) -> Tuple[Dict[str, Any], List[Command]]:
+    if args.room_file is None:
+        room_attributes, commands = {}, session(args.objects, args.edits, args.mesh_size)
+    else:
+        room_attributes, commands = room_bake.load_room(args.room_file)
+    # the attributes of the server are set again on upload
+    for key in (RoomAttributes.NAME, RoomAttributes.KEEP_OPEN, RoomAttributes.JOINABLE):
+        room_attributes.pop(key, None)
+    return room_attributes, commands
+
+
+def run(args) -> Dict[str, Any]:
+    room_attributes, commands = load_commands(args)
+
+    process = None
+    port = args.port
+    if port is None:
+        port = free_port()
+        process = start_server(port, args.server_args)
+    try:
+        start = time.perf_counter()
+        room_bake.upload_room("localhost", port, ROOM_NAME, room_attributes, commands)
+        upload = time.perf_counter() - start
+        joins = [join(port, args.timeout) for _ in range(args.joins)]
+        with Client("localhost", port) as client:
+            client.delete_room(ROOM_NAME)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    return {
+        "label": args.label,
+        "room_file": args.room_file,
+        "server_args": args.server_args,
+        "command_count": len(commands),
+        "byte_size": sum(c.byte_size() for c in commands),
+        "upload": upload,
+        "joins": joins,
+    }
+
+
+def report(results: Dict[str, Any]):
+    print(
+        f"{results['command_count']} commands, {results['byte_size'] / 1e6:.1f} MB uploaded in "
+        f"{results['upload']:.2f} s"
+    )
+    joins = results["joins"]
+    print(f"{'join':>6} {'first byte ms':>14} {'join ms':>10} {'commands':>10} {'MB':>8} {'MB/s':>8}")
+    for index, timings in enumerate(joins):
+        print(
+            f"{index:6} {1000 * timings['first_byte']:14.1f} {1000 * timings['join']:10.1f} "
+            f"{timings['command_count']:10} {timings['byte_size'] / 1e6:8.1f} {timings['throughput'] / 1e6:8.1f}"
+        )
+
+    # the first join may include the warmup of the server, the breakdown is given for the median join
+    median = sorted(joins, key=lambda timings: timings["join"])[len(joins) // 2]
+    print(f"median join {1000 * statistics.median(t['join'] for t in joins):.1f} ms, by message type:")
+    print(f"{'type':28} {'count':>8} {'MB':>8} {'first ms':>10} {'last ms':>10}")
+    for name, timings in sorted(median["message_types"].items(), key=lambda item: item[1]["last"]):
+        print(
+            f"{name:28} {timings['count']:8} {timings['byte_size'] / 1e6:8.2f} "
+            f"{1000 * timings['first']:10.1f} {1000 * timings['last']:10.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark joining a recorded room")
+    parser.add_argument("room_file", nargs="?", help="room saved by room_bake.save_room, a synthetic one if omitted")
+    parser.add_argument("--joins", type=int, default=3, help="number of times the room is joined")
+    parser.add_argument("--objects", type=int, default=100, help="number of objects of the synthetic room")
+    parser.add_argument("--edits", type=int, default=2000, help="number of object edits of the synthetic room")
+    parser.add_argument("--mesh-size", type=int, default=20000, help="size of the mesh commands of the synthetic room")
+    parser.add_argument("--timeout", type=float, default=600.0, help="seconds before a join is abandoned")
+    parser.add_argument("--json", help="file to write the results to as JSON, - for the standard output")
+    parser.add_argument("--label", default="", help="label of the results, to compare builds")
+    parser.add_argument("--server-args", default="", help="arguments of the server started for the benchmark")
+    parser.add_argument("--port", type=int, help="port of a running server to benchmark instead of starting one")
+    args = parser.parse_args()
+    if args.joins < 1:
+        parser.error("--joins must be at least 1")
+
+    results = run(args)
+    if args.json == "-":
+        print(json.dumps(results, indent=2))
+        return
+    report(results)
+    if args.json is not None:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
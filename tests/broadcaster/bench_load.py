@@ -0,0 +1,316 @@
+"""
+Load test of a server: simulated clients spread over rooms send a mix of room commands and client updates at fixed
+rates, and measure the latency until the other clients of their room receive them.
+
+The server is started as a separate process, so that its CPU and memory use are measured apart from the clients, from
+/proc on Linux. To measure another release, start it and pass --port and --server-pid instead.
+
+The clients run in threads of this process and send their commands like the Blender addon does, through the pending
+commands of Client: small commands are batched and large ones chunked when the server allows it. The client CPU use is
+reported so that a saturated load generator can be told apart from a saturated server.
+
+Run with:
+python -m tests.broadcaster.bench_load --clients 20 --rooms 4 --duration 10
+python -m tests.broadcaster.bench_load --server-args="--asyncio"
+"""
+import argparse
+from collections import defaultdict
+import os
+import random
+import select
+import shlex
+import struct
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from mixer.broadcaster.client import Client
+import mixer.broadcaster.common as common
+from mixer.broadcaster.common import Command, MessageType, RoomAttributes
+from tests.broadcaster.test_protocol import free_port
+
+# sender index and send time, after the path of the room commands, and in the client attribute
+_stamp = struct.Struct("<id")
+STAMP_ATTRIBUTE = "load_stamp"
+
+MEASURED_TYPES = (MessageType.TRANSFORM, MessageType.MESH, MessageType.TEXTURE, MessageType.CLIENT_UPDATE)
+
+
+class Traffic:
+    """
+    Rates in messages per second per client, and payload sizes in bytes, by message type.
+    """
+
+    def __init__(self, args):
+        self.rates = {
+            MessageType.TRANSFORM: args.transform_rate,
+            MessageType.MESH: args.mesh_rate,
+            MessageType.TEXTURE: args.texture_rate,
+            MessageType.CLIENT_UPDATE: args.client_update_rate,
+        }
+        self.sizes = {
+            MessageType.TRANSFORM: 200,
+            MessageType.MESH: args.mesh_size * 1024,
+            MessageType.TEXTURE: args.texture_size * 1024,
+        }
+
+
+class SimulatedClient:
+    def __init__(self, index: int, port: int, room: str, traffic: Traffic):
+        self.index = index
+        self.room = room
+        self.client = Client("localhost", port)
+        self._traffic = traffic
+        self._sequences: Dict[MessageType, int] = defaultdict(int)
+        self._measured = (0.0, 0.0)  # commands sent in this interval are measured
+        self.sent: Dict[MessageType, int] = defaultdict(int)  # measured
+        self.latencies: Dict[MessageType, List[float]] = defaultdict(list)
+        self.received_bytes = 0
+        self.error: Optional[str] = None
+
+    def wait_for(self, message_type: MessageType, timeout: float = 30.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            self.client.fetch_outgoing_commands()
+            command = self.client._reader.read_message(timeout=0.1)
+            if command is None:
+                continue
+            if self.client.has_default_handler(command.type):
+                self.client._default_command_handlers[command.type](self.client, common.decompress_command(command))
+            if command.type == message_type:
+                return
+        raise TimeoutError(f"{message_type.name} not received by client {self.index}")
+
+    def join(self, create: bool):
+        self.client.connect()
+        assert self.client.is_connected()
+        self.client.join_room(self.room)
+        if create:
+            self.wait_for(MessageType.CONTENT)
+            self.client.send_command(Command(MessageType.CONTENT))
+            # the other clients fail to join until the room is joinable
+            while not self.client.rooms_attributes.get(self.room, {}).get(RoomAttributes.JOINABLE, False):
+                self.wait_for(MessageType.ROOM_UPDATE)
+        else:
+            self.wait_for(MessageType.JOIN_ROOM)
+
+    def _command(self, message_type: MessageType, sequence: int, sent_at: float) -> Command:
+        stamp = _stamp.pack(self.index, sent_at)
+        # transforms update a few objects, meshes and textures are new objects
+        name = f"/Object{sequence % 10}" if message_type == MessageType.TRANSFORM else f"/{self.index}-{sequence}"
+        padding = self._traffic.sizes[message_type] - len(stamp)
+        # random payloads, that compression does not shrink
+        return Command(message_type, common.encode_string(name) + stamp + os.urandom(max(0, padding)))
+
+    def _send(self, message_type: MessageType):
+        sequence = self._sequences[message_type]
+        self._sequences[message_type] += 1
+        sent_at = time.perf_counter()
+        if self._measured[0] <= sent_at < self._measured[1]:
+            self.sent[message_type] += 1
+        if message_type == MessageType.CLIENT_UPDATE:
+            self.client.set_client_attributes({STAMP_ATTRIBUTE: [self.index, sent_at]})
+        else:
+            self.client.add_command(self._command(message_type, sequence, sent_at))
+
+    def _measure(self, message_type: MessageType, sender: int, sent_at: float, now: float):
+        if sender != self.index and self._measured[0] <= sent_at < self._measured[1]:
+            self.latencies[message_type].append(now - sent_at)
+
+    def _receive(self, commands: List[Command]):
+        now = time.perf_counter()
+        for command in commands:
+            self.received_bytes += command.byte_size()
+            if command.type == MessageType.CLIENT_UPDATE:
+                # also received by the other rooms, and by the sender
+                for attributes in common.decode_json(command.data, 0)[0].values():
+                    stamp = attributes.get(STAMP_ATTRIBUTE)
+                    if stamp is not None:
+                        self._measure(command.type, stamp[0], stamp[1], now)
+            elif command.type in MEASURED_TYPES:
+                _, offset = common.decode_string(command.data, 0)
+                sender, sent_at = _stamp.unpack_from(command.data, offset)
+                self._measure(command.type, sender, sent_at, now)
+
+    def run(self, start: float, measure_start: float, end: float):
+        """
+        Send at the traffic rates from start to end, measure the latencies of the commands sent after measure_start.
+        """
+        self._measured = (measure_start, end)
+        next_sends = {}
+        for message_type, rate in self._traffic.rates.items():
+            if rate > 0:
+                # spread the clients over the first period
+                next_sends[message_type] = start + random.random() / rate
+        try:
+            while True:
+                now = time.perf_counter()
+                if now >= end:
+                    break
+                for message_type, next_send in next_sends.items():
+                    if now >= next_send:
+                        self._send(message_type)
+                        next_sends[message_type] = next_send + 1.0 / self._traffic.rates[message_type]
+
+                timeout = min([end, *next_sends.values()]) - time.perf_counter()
+                select.select([self.client.socket], [], [], max(0.0, timeout))
+                self._receive(self.client.fetch_commands())
+
+            # receive what was sent until the end
+            drain_end = time.perf_counter() + 1.0
+            while time.perf_counter() < drain_end:
+                self._receive(self.client.fetch_commands())
+                time.sleep(0.01)
+        except Exception as e:
+            self.error = f"{e!r}"
+        finally:
+            self.client.disconnect()
+
+
+class ProcessMonitor:
+    """
+    Sample the CPU time and the resident memory of a process from /proc, where available.
+    """
+
+    def __init__(self, pid: Optional[int]):
+        self._pid = pid
+        self._clock_ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+        self.peak_rss = 0
+
+    def available(self) -> bool:
+        return self._pid is not None and os.path.exists(f"/proc/{self._pid}/stat")
+
+    def cpu_time(self) -> float:
+        with open(f"/proc/{self._pid}/stat") as file:
+            # the command name may contain spaces, the fields are counted after it
+            fields = file.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / self._clock_ticks
+
+    def rss(self) -> int:
+        with open(f"/proc/{self._pid}/status") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+        return 0
+
+    def sample(self, stop: threading.Event, interval: float = 0.2):
+        while not stop.wait(interval):
+            self.peak_rss = max(self.peak_rss, self.rss())
+
+
+def percentiles(values: List[float]) -> Tuple[float, ...]:
+    ordered = sorted(values)
+    return tuple(ordered[min(len(ordered) - 1, int(p * len(ordered)))] for p in (0.5, 0.9, 0.99)) + (ordered[-1],)
+
+
+def start_server(port: int, server_args: str) -> subprocess.Popen:
+    command = [sys.executable, "-m", "mixer.broadcaster.apps.server", "--port", str(port), *shlex.split(server_args)]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(1.0)
+    if process.poll() is not None:
+        raise RuntimeError(f"Server exited with code {process.returncode}: {' '.join(command)}")
+    return process
+
+
+def run(args):
+    process = None
+    port = args.port
+    pid = args.server_pid
+    if port is None:
+        port = free_port()
+        process = start_server(port, args.server_args)
+        pid = process.pid
+
+    traffic = Traffic(args)
+    rooms = [f"load-room-{i}" for i in range(args.rooms)]
+    clients = [SimulatedClient(i, port, rooms[i % len(rooms)], traffic) for i in range(args.clients)]
+    monitor = ProcessMonitor(pid)
+    try:
+        # the first client of a room creates it, the others can join once it is joinable
+        for client in clients:
+            client.join(create=client.index < len(rooms))
+
+        start = time.perf_counter()
+        measure_start = start + args.warmup
+        end = measure_start + args.duration
+        threads = [threading.Thread(target=c.run, args=(start, measure_start, end)) for c in clients]
+        stop_sampling = threading.Event()
+        sampler = threading.Thread(target=monitor.sample, args=(stop_sampling,), daemon=True)
+        if monitor.available():
+            sampler.start()
+        start_client_cpu, start_wall = time.process_time(), time.perf_counter()
+        for thread in threads:
+            thread.start()
+
+        # the CPU of the server is measured while the latencies are
+        time.sleep(max(0.0, measure_start - time.perf_counter()))
+        start_server_cpu = monitor.cpu_time() if monitor.available() else None
+        time.sleep(max(0.0, end - time.perf_counter()))
+        server_cpu = monitor.cpu_time() - start_server_cpu if start_server_cpu is not None else None
+        for thread in threads:
+            thread.join()
+        client_cpu = (time.process_time() - start_client_cpu) / (time.perf_counter() - start_wall)
+        stop_sampling.set()
+        final_rss = monitor.rss() if monitor.available() else None
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    report(args, clients, server_cpu, monitor.peak_rss, final_rss, client_cpu)
+
+
+def report(args, clients: List[SimulatedClient], server_cpu, peak_rss, final_rss, client_cpu):
+    errors = [f"client {c.index}: {c.error}" for c in clients if c.error is not None]
+    for error in errors:
+        print(error)
+
+    print(f"{args.clients} clients in {args.rooms} rooms, {args.duration:.0f} s measured")
+    print(f"{'type':14} {'sent':>8} {'received':>10} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for message_type in MEASURED_TYPES:
+        latencies = [latency for c in clients for latency in c.latencies[message_type]]
+        sent = sum(c.sent[message_type] for c in clients)
+        if not latencies:
+            print(f"{message_type.name:14} {sent:8} {0:10}")
+            continue
+        p50, p90, p99, maximum = (1000 * value for value in percentiles(latencies))
+        print(f"{message_type.name:14} {sent:8} {len(latencies):10} {p50:9.2f} {p90:9.2f} {p99:9.2f} {maximum:9.2f}")
+
+    received = sum(len(latencies) for c in clients for latencies in c.latencies.values())
+    # the bytes are counted from the start of the traffic
+    received_bytes = sum(c.received_bytes for c in clients)
+    duration = args.warmup + args.duration
+    print(f"throughput: {received / args.duration:.0f} messages/s, {received_bytes / duration / 1e6:.1f} MB/s received")
+    if server_cpu is not None:
+        print(f"server: {100 * server_cpu / args.duration:.1f} % cpu, {peak_rss / 1e6:.1f} MB peak rss, ", end="")
+        print(f"{final_rss / 1e6:.1f} MB final rss")
+    else:
+        print("server: cpu and rss not available")
+    print(f"clients: {100 * client_cpu:.1f} % cpu")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a server with simulated clients")
+    parser.add_argument("--clients", type=int, default=20, help="number of simulated clients")
+    parser.add_argument("--rooms", type=int, default=4, help="number of rooms the clients are spread over")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds measured")
+    parser.add_argument("--warmup", type=float, default=2.0, help="seconds of traffic before measuring")
+    parser.add_argument("--transform-rate", type=float, default=30.0, help="TRANSFORM per second per client")
+    parser.add_argument("--mesh-rate", type=float, default=0.5, help="MESH per second per client")
+    parser.add_argument("--texture-rate", type=float, default=0.05, help="TEXTURE per second per client")
+    parser.add_argument("--client-update-rate", type=float, default=5.0, help="CLIENT_UPDATE per second per client")
+    parser.add_argument("--mesh-size", type=int, default=64, help="MESH size in KB")
+    parser.add_argument("--texture-size", type=int, default=2048, help="TEXTURE size in KB")
+    parser.add_argument("--server-args", default="", help="arguments of the server started for the test")
+    parser.add_argument("--port", type=int, help="port of a running server to test instead of starting one")
+    parser.add_argument("--server-pid", type=int, help="process id of the server given by --port, to measure it")
+    args = parser.parse_args()
+    if args.rooms > args.clients:
+        parser.error("--rooms must not exceed --clients")
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Throughput of the message schemas of mixer.broadcaster.schema against hand written encoders and decoders.
+
+The hand written functions reproduce the encode_* / decode_* chains used by the Blender client for the most
+frequent message types.
+
+Run with:
+python -m tests.broadcaster.bench_schema --count 100000
+"""
+import argparse
+import timeit
+
+import mixer.broadcaster.common as common
+from mixer.broadcaster.common import MessageType
+from mixer.broadcaster.schema import get_schema
+
+
+class Vector(tuple):
+    """
+    Mimics mathutils.Vector for the encode_* functions.
+    """
+
+    x = property(lambda self: self[0])
+    y = property(lambda self: self[1])
+    z = property(lambda self: self[2])
+
+
+class Matrix:
+    """
+    Mimics mathutils.Matrix for common.encode_matrix.
+    """
+
+    def __init__(self, columns):
+        self.col = columns
+
+    def __iter__(self):
+        return iter(self.col)
+
+
+matrix = Matrix([(1.0, 0.0, 0.0, 0.0), (0.0, 1.0, 0.0, 0.0), (0.0, 0.0, 1.0, 0.0), (1.0, 2.0, 3.0, 1.0)])
+path = "/Collection/Parent/Cube"
+
+# message type, values, hand written encoder, hand written decoder
+cases = [
+    (
+        MessageType.TRANSFORM,
+        (path, matrix, matrix, matrix),
+        lambda p, m0, m1, m2: common.encode_string(p)
+        + common.encode_matrix(m0)
+        + common.encode_matrix(m1)
+        + common.encode_matrix(m2),
+        lambda data: common.decode_matrix(
+            data, common.decode_matrix(data, common.decode_matrix(data, common.decode_string(data, 0)[1])[1])[1]
+        ),
+    ),
+    (
+        MessageType.CAMERA_ATTRIBUTES,
+        ("Camera", 50.0, 2.8, 10.0),
+        lambda n, lens, fstop, focus: common.encode_string(n)
+        + common.encode_float(lens)
+        + common.encode_float(fstop)
+        + common.encode_float(focus),
+        lambda data: common.decode_float(
+            data, common.decode_float(data, common.decode_float(data, common.decode_string(data, 0)[1])[1])[1]
+        ),
+    ),
+    (
+        MessageType.FRAME,
+        (12,),
+        common.encode_int,
+        lambda data: common.decode_int(data, 0),
+    ),
+    (
+        MessageType.CAMERA,
+        (path, "Camera", 50.0, 0.1, 100.0, 2.8, 0, 36.0, 24.0),
+        lambda p, n, *values: common.encode_string(p)
+        + common.encode_string(n)
+        + b"".join(common.encode_int(v) if isinstance(v, int) else common.encode_float(v) for v in values),
+        lambda data: _decode_chain(data, "ssffffiff"),
+    ),
+    (
+        MessageType.LIGHT,
+        (path, "Light", 1, 1, Vector((1.0, 1.0, 1.0)), 10.0, 0.5, 0.2),
+        lambda p, n, t, s, c, power, size, blend: common.encode_string(p)
+        + common.encode_string(n)
+        + common.encode_int(t)
+        + common.encode_int(s)
+        + common.encode_color(c)
+        + common.encode_float(power)
+        + common.encode_float(size)
+        + common.encode_float(blend),
+        lambda data: _decode_chain(data, "ssiicfff"),
+    ),
+    (
+        MessageType.OBJECT_VISIBILITY,
+        ("Cube", False, False, True, False),
+        lambda n, *values: common.encode_string(n) + b"".join(common.encode_bool(v) for v in values),
+        lambda data: _decode_chain(data, "sbbbb"),
+    ),
+    (
+        MessageType.COLLECTION,
+        ("Collection", True, Vector((0.0, 1.0, 2.0)), True),
+        lambda n, visible, offset, temporary: common.encode_string(n)
+        + common.encode_bool(visible)
+        + common.encode_vector3(offset)
+        + common.encode_bool(temporary),
+        lambda data: _decode_chain(data, "sbvb"),
+    ),
+    (
+        MessageType.ADD_OBJECT_TO_COLLECTION,
+        ("Collection", "Cube"),
+        lambda c, o: common.encode_string(c) + common.encode_string(o),
+        lambda data: _decode_chain(data, "ss"),
+    ),
+    (
+        MessageType.GREASE_PENCIL_MATERIAL,
+        ("Material", True, "LINE", "SOLID", Vector((1.0, 0.0, 0.0, 1.0)), False, True, "SOLID", (0.0, 1.0, 0.0, 1.0)),
+        lambda n, stroke, mode, style, color, overlap, fill, fill_style, fill_color: common.encode_string(n)
+        + common.encode_bool(stroke)
+        + common.encode_string(mode)
+        + common.encode_string(style)
+        + common.encode_color(color)
+        + common.encode_bool(overlap)
+        + common.encode_bool(fill)
+        + common.encode_string(fill_style)
+        + common.encode_color(fill_color),
+        lambda data: _decode_chain(data, "sbsscbbsc"),
+    ),
+    (
+        MessageType.ADD_KEYFRAME,
+        ("Cube", "location", 0, 10, 1.5),
+        lambda n, channel, index, frame, value: common.encode_string(n)
+        + common.encode_string(channel)
+        + common.encode_int(index)
+        + common.encode_int(frame)
+        + common.encode_float(value),
+        lambda data: _decode_chain(data, "ssiif"),
+    ),
+]
+
+_decoders = {
+    "s": common.decode_string,
+    "f": common.decode_float,
+    "i": common.decode_int,
+    "b": common.decode_bool,
+    "c": common.decode_color,
+    "v": common.decode_vector3,
+}
+
+
+def _decode_chain(data, codes):
+    index = 0
+    values = []
+    for code in codes:
+        value, index = _decoders[code](data, index)
+        values.append(value)
+    return values
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark message schemas")
+    parser.add_argument("--count", type=int, default=100000, help="number of messages encoded and decoded")
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs, the best one is reported")
+    args = parser.parse_args()
+
+    def _rate(function):
+        return args.count / min(timeit.repeat(function, number=args.count, repeat=args.repeat))
+
+    print(f"messages per second, {args.count} messages")
+    print(f"{'message':28} {'encode':>12} {'schema':>12} {'decode':>12} {'schema':>12}")
+    for message_type, values, encode, decode in cases:
+        schema = get_schema(message_type)
+        data = schema.encode(*values)
+        assert data == encode(*values), f"{message_type.name} schema encoding differs"
+
+        hand_encode = _rate(lambda: encode(*values))
+        schema_encode = _rate(lambda: schema.encode(*values))
+        hand_decode = _rate(lambda: decode(data))
+        schema_decode = _rate(lambda: schema.decode(data))
+        print(
+            f"{message_type.name:28} {hand_encode:12.0f} {schema_encode:12.0f} {hand_decode:12.0f} {schema_decode:12.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
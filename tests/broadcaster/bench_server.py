@@ -0,0 +1,115 @@
+"""
+Benchmark of the threaded server against the asyncio server.
+
+- idle: CPU time used by the server while clients are connected to a room but send nothing,
+- fan-out: time for a command sent by one client to reach all the other clients of the room.
+
+The server runs in this process, so that its CPU time is measured with time.process_time(). The clients only use CPU
+during the fan-out benchmark.
+
+Run with:
+python -m tests.broadcaster.bench_server --clients 40 --idle 5 --count 2000
+"""
+import argparse
+import threading
+import time
+from typing import List
+
+from mixer.broadcaster.apps.server import AsyncServer, Server
+from mixer.broadcaster.client import Client
+import mixer.broadcaster.common as common
+from mixer.broadcaster.common import Command, MessageType
+from tests.broadcaster.test_protocol import free_port
+
+
+def wait_for(client: Client, message_type: MessageType, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        client.fetch_outgoing_commands()
+        command = client._reader.read_message(timeout=0.1)
+        if command is not None and command.type == message_type:
+            return
+    raise TimeoutError(f"{message_type.name} not received")
+
+
+def connect_room(port: int, count: int) -> List[Client]:
+    clients = []
+    for i in range(count):
+        client = Client("localhost", port)
+        client.connect()
+        assert client.is_connected()
+        client.join_room("room")
+        if i == 0:
+            wait_for(client, MessageType.CONTENT)
+            client.send_command(Command(MessageType.CONTENT))
+        else:
+            wait_for(client, MessageType.JOIN_ROOM)
+        clients.append(client)
+    return clients
+
+
+def receive_room_commands(client: Client, count: int):
+    received = 0
+    while received < count:
+        command = client._reader.read_message(timeout=1.0)
+        if command is None:
+            continue
+        if command.type == MessageType.COMMAND_BATCH:
+            received += len(common.decode_command_batch(common.decompress_command(command).data))
+        elif command.type > MessageType.COMMAND:
+            received += 1
+
+
+def run(server_class, client_count: int, idle_duration: float, command_count: int):
+    port = free_port()
+    server = server_class()
+    server_thread = threading.Thread(target=server.run, args=(port,))
+    server_thread.start()
+    time.sleep(0.5)
+
+    clients = connect_room(port, client_count)
+    sender, receivers = clients[0], clients[1:]
+    time.sleep(0.5)  # let the room and client updates be sent
+
+    start_cpu, start = time.process_time(), time.perf_counter()
+    time.sleep(idle_duration)
+    idle_cpu = (time.process_time() - start_cpu) / (time.perf_counter() - start)
+
+    threads = [threading.Thread(target=receive_room_commands, args=(r, command_count)) for r in receivers]
+    for thread in threads:
+        thread.start()
+    start_cpu, start = time.process_time(), time.perf_counter()
+    for i in range(command_count):
+        # one message per command, as when transforms are sent while dragging
+        sender.send_command(Command(MessageType.TRANSFORM, common.encode_string(f"/Cube{i % 10}") + bytes(192)))
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+    cpu = time.process_time() - start_cpu
+
+    for client in clients:
+        client.disconnect()
+    server.shutdown()
+    server_thread.join()
+
+    delivered = command_count * len(receivers)
+    print(
+        f"{server_class.__name__:12} {client_count:8} {100 * idle_cpu:10.1f} "
+        f"{delivered / duration:14.0f} {1000 * duration:10.1f} {cpu:8.2f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the threaded and asyncio servers")
+    parser.add_argument("--clients", type=int, default=40, help="number of clients in the room")
+    parser.add_argument("--idle", type=float, default=5.0, help="seconds of idle time measured")
+    parser.add_argument("--count", type=int, default=2000, help="number of commands sent to the room")
+    args = parser.parse_args()
+
+    print(f"{'server':12} {'clients':>8} {'idle cpu %':>10} {'commands/s':>14} {'ms':>10} {'cpu s':>8}")
+    for server_class in (Server, AsyncServer):
+        run(server_class, args.clients, args.idle, args.count)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,492 @@
+import os
+import socket
+import struct
+import tempfile
+import threading
+import unittest
+
+import mixer.broadcaster.common as common
+from mixer.broadcaster.common import Command, MessageType
+
+
+class TestFrameReader(unittest.TestCase):
+    def setUp(self):
+        self.sender, self.receiver = socket.socketpair()
+
+    def tearDown(self):
+        self.sender.close()
+        self.receiver.close()
+
+    def send(self, commands):
+        def _send():
+            for command in commands:
+                self.sender.sendall(command.to_byte_buffer())
+
+        thread = threading.Thread(target=_send)
+        thread.start()
+        return thread
+
+    def test_small_frames(self):
+        commands = [Command(MessageType.TRANSFORM, f"command {i}".encode(), i + 1) for i in range(100)]
+        thread = self.send(commands)
+
+        reader = common.FrameReader(self.receiver, buffer_size=256)
+        received = []
+        while len(received) < len(commands):
+            received.extend(reader.read_all_messages(timeout=0.1))
+        thread.join()
+
+        self.assertEqual(len(received), len(commands))
+        for sent, read in zip(commands, received):
+            self.assertEqual(sent.type, read.type)
+            self.assertEqual(sent.id, read.id)
+            self.assertIsInstance(read.data, memoryview)
+            self.assertEqual(sent.data, read.data)
+
+    def test_large_frame(self):
+        large = bytes(range(256)) * 1000
+        commands = [
+            Command(MessageType.MESH, b"before", 1),
+            Command(MessageType.TEXTURE, large, 2),
+            Command(MessageType.MESH, b"after", 3),
+            Command(MessageType.GROUP_END, b"", 4),
+        ]
+        thread = self.send(commands)
+
+        reader = common.FrameReader(self.receiver, buffer_size=1024)
+        received = []
+        while len(received) < len(commands):
+            received.extend(reader.read_all_messages(timeout=0.1))
+        thread.join()
+
+        self.assertEqual([c.data for c in commands], [bytes(c.data) for c in received])
+
+    def test_data_survives_buffer_reuse(self):
+        commands = [Command(MessageType.TRANSFORM, bytes([i]) * 100, i + 1) for i in range(50)]
+        thread = self.send(commands)
+
+        reader = common.FrameReader(self.receiver, buffer_size=300)
+        received = []
+        while len(received) < len(commands):
+            received.extend(reader.read_all_messages(timeout=0.1))
+        thread.join()
+
+        for sent, read in zip(commands, received):
+            self.assertEqual(sent.data, read.data)
+
+    def test_detach_command(self):
+        large = bytes(range(256)) * 10
+        commands = [Command(MessageType.TRANSFORM, b"small", 1), Command(MessageType.MESH, large, 2)]
+        thread = self.send(commands)
+
+        reader = common.FrameReader(self.receiver, buffer_size=1024)
+        received = []
+        while len(received) < len(commands):
+            received.extend(reader.read_all_messages(timeout=0.1))
+        thread.join()
+
+        # a view of the receive buffer is copied, a frame received into its own buffer is kept as is
+        small = common.detach_command(received[0])
+        self.assertIsInstance(small.data, bytes)
+        self.assertEqual((small.type, small.id, small.data), (MessageType.TRANSFORM, 1, b"small"))
+        self.assertEqual(small.header(), received[0].header())
+        self.assertIs(common.detach_command(received[1]), received[1])
+        self.assertIs(common.detach_command(commands[0]), commands[0])
+
+    def test_disconnected(self):
+        reader = common.FrameReader(self.receiver)
+        self.sender.sendall(Command(MessageType.MESH, b"0123456789", 1).to_byte_buffer()[:-4])
+        self.sender.close()
+        with self.assertRaises(common.ClientDisconnectedException):
+            reader.read_message(timeout=1.0)
+
+    def test_read_before_disconnected(self):
+        reader = common.FrameReader(self.receiver)
+        self.sender.sendall(Command(MessageType.MESH, b"0123456789", 1).to_byte_buffer())
+        self.sender.close()
+        self.assertEqual(len(reader.read_all_messages(timeout=1.0)), 1)
+        with self.assertRaises(common.ClientDisconnectedException):
+            reader.read_all_messages(timeout=1.0)
+
+    def test_nothing_to_read(self):
+        reader = common.FrameReader(self.receiver)
+        self.assertIsNone(reader.read_message(timeout=0.0))
+
+    def test_decode_string(self):
+        self.sender.sendall(Command(MessageType.DELETE, common.encode_string("Cube"), 1).to_byte_buffer())
+        command = common.FrameReader(self.receiver).read_message(timeout=1.0)
+        self.assertEqual(common.decode_string(command.data, 0), ("Cube", 8))
+
+    def test_frame_command(self):
+        sent = Command(MessageType.MESH, b"compressed", 1, common.Compression.ZLIB)
+        self.sender.sendall(sent.to_byte_buffer())
+        command = common.FrameReader(self.receiver).read_message(timeout=1.0)
+        self.assertIsInstance(command, common.FrameCommand)
+        self.assertEqual(command.header(), sent.header())
+        self.assertEqual(command.byte_size(), sent.byte_size())
+        self.assertEqual(command.compression, common.Compression.ZLIB)
+
+        # forwarded as received
+        common.write_messages(self.sender, [command, command])
+        self.assertEqual(common.recv(self.receiver, 2 * sent.byte_size()), 2 * sent.to_byte_buffer())
+
+        with self.assertRaises(ValueError):
+            common.FrameCommand(sent.header(), b"truncated")
+
+
+class TestWriteMessages(unittest.TestCase):
+    def setUp(self):
+        self.sender, self.receiver = socket.socketpair()
+        self.commands = [
+            Command(MessageType.TRANSFORM, b"small", 1),
+            Command(MessageType.GROUP_END, b"", 2),
+            Command(MessageType.TEXTURE, bytes(range(256)) * 2000, 3),
+            Command(MessageType.MESH, memoryview(b"a memoryview"), 4),
+        ] * 300
+
+    def tearDown(self):
+        self.sender.close()
+        self.receiver.close()
+
+    def check_received(self, write):
+        thread = threading.Thread(target=write)
+        thread.start()
+        reader = common.FrameReader(self.receiver)
+        received = []
+        while len(received) < len(self.commands):
+            received.extend(reader.read_all_messages(timeout=0.1))
+        thread.join()
+
+        self.assertEqual(
+            [(c.type, c.id, bytes(c.data)) for c in self.commands], [(c.type, c.id, c.data) for c in received]
+        )
+
+    def test_write_message(self):
+        def _write():
+            for command in self.commands:
+                common.write_message(self.sender, command)
+
+        self.check_received(_write)
+
+    def test_write_messages(self):
+        self.check_received(lambda: common.write_messages(self.sender, self.commands))
+
+    def test_write_messages_without_sendmsg(self):
+        def _write():
+            buffers = []
+            for command in self.commands:
+                buffers.extend((command.header(), command.data))
+            common._sendall_all(self.sender, [memoryview(b) for b in buffers])
+
+        self.check_received(_write)
+
+    def test_disconnected(self):
+        self.receiver.close()
+        with self.assertRaises(common.ClientDisconnectedException):
+            common.write_messages(self.sender, self.commands)
+
+
+class TestArrayDecoders(unittest.TestCase):
+    def encode(self, schema, values):
+        return b"xx" + common.int_to_bytes(len(values), 4) + b"".join(struct.pack(schema, *v) for v in values)
+
+    def test_vector3(self):
+        values = [(float(i), i + 0.5, -i) for i in range(10)]
+        data = self.encode("3f", values)
+
+        decoded, end = common.decode_vector3_array(data, 2)
+        self.assertEqual(decoded, values)
+        self.assertEqual(end, len(data))
+
+        decoded, end = common.decode_vector3_buffer(data, 2)
+        self.assertEqual(list(decoded), [x for v in values for x in v])
+        self.assertEqual(end, len(data))
+
+    def test_int(self):
+        values = [(i * 3,) for i in range(10)]
+        data = memoryview(self.encode("I", values))
+        self.assertEqual(common.decode_int_array(data, 2), ([v[0] for v in values], len(data)))
+        self.assertEqual(list(common.decode_int_buffer(data, 2)[0]), [v[0] for v in values])
+        self.assertEqual(common.decode_float_array(self.encode("f", []), 2), ([], 6))
+        self.assertEqual(common.decode_int_array(self.encode("I", []), 2), ([], 6))
+
+    def test_int3(self):
+        values = [(i, i + 1, i + 2) for i in range(10)]
+        data = self.encode("3I", values)
+        self.assertEqual(common.decode_int3_array(data, 2), (values, len(data)))
+        self.assertEqual(len(common.decode_int3_buffer(data, 2)[0]), 30)
+
+
+class TestCommandBatch(unittest.TestCase):
+    def transform(self, name):
+        return Command(MessageType.TRANSFORM, common.encode_string(name))
+
+    def test_batch_commands(self):
+        small = [self.transform(f"/Cube{i}") for i in range(3)]
+        large = Command(MessageType.MESH, bytes(common.COMPRESSION_THRESHOLD))
+        protocol = Command(MessageType.LIST_ROOMS)
+        commands = small + [large] + small[:1] + [protocol] + small
+
+        batched = common.batch_commands(commands)
+        self.assertEqual(
+            [c.type for c in batched],
+            [
+                MessageType.COMMAND_BATCH,
+                MessageType.MESH,
+                MessageType.TRANSFORM,
+                MessageType.LIST_ROOMS,
+                MessageType.COMMAND_BATCH,
+            ],
+        )
+        expanded = common.expand_command_batches(batched)
+        self.assertEqual([(c.type, c.id, bytes(c.data)) for c in expanded], [(c.type, c.id, c.data) for c in commands])
+
+    def test_max_batch_size(self):
+        commands = [Command(MessageType.TRANSFORM, bytes(1000)) for _ in range(200)]
+        batched = common.batch_commands(commands)
+        self.assertEqual(len(batched), 4)
+        self.assertTrue(all(len(c.data) <= common.MAX_BATCH_SIZE for c in batched))
+        self.assertEqual(len(common.expand_command_batches(batched)), 200)
+
+    def test_decode_command_batch(self):
+        data = b"xx" + common.encode_command_batch([self.transform("/Cube"), Command(MessageType.FRAME, b"")])
+        commands = common.decode_command_batch(memoryview(data)[2:])
+        self.assertEqual([c.type for c in commands], [MessageType.TRANSFORM, MessageType.FRAME])
+        self.assertEqual(common.decode_string(commands[0].data, 0)[0], "/Cube")
+        self.assertEqual(len(commands[1].data), 0)
+
+
+class TestCommandLanes(unittest.TestCase):
+    def command(self, message_type, path="", size=0):
+        return Command(message_type, common.encode_string(path) + bytes(size))
+
+    def take(self, lanes, bulk_size=None):
+        interactive, bulk = lanes.take(bulk_size)
+        return [c.type for c in interactive], [c.type for c in bulk]
+
+    def test_interactive_first(self):
+        lanes = common.CommandLanes()
+        lanes.put(self.command(MessageType.MESH, "/Parent/Cube", 100000))
+        lanes.put(self.command(MessageType.TEXTURE, "/textures/wood.png", 100000))
+        lanes.put(self.command(MessageType.TRANSFORM, "/Parent/Plane"))
+        lanes.put(Command(MessageType.FRAME, common.encode_int(10)))
+        self.assertEqual(len(lanes), 4)
+        self.assertEqual(
+            self.take(lanes),
+            ([MessageType.TRANSFORM, MessageType.FRAME], [MessageType.MESH, MessageType.TEXTURE]),
+        )
+        self.assertEqual(len(lanes), 0)
+
+    def test_same_object_order(self):
+        lanes = common.CommandLanes()
+        lanes.put(self.command(MessageType.TRANSFORM, "/Parent/Cube"))
+        lanes.put(self.command(MessageType.MESH, "/Parent/Cube", 100000))
+        lanes.put(self.command(MessageType.TRANSFORM, "/Parent/Cube"))
+        lanes.put(self.command(MessageType.OBJECT_VISIBILITY, "Cube"))
+        lanes.put(self.command(MessageType.TRANSFORM, "/Sphere"))
+        self.assertEqual(
+            self.take(lanes),
+            (
+                [MessageType.TRANSFORM, MessageType.TRANSFORM],
+                [MessageType.MESH, MessageType.TRANSFORM, MessageType.OBJECT_VISIBILITY],
+            ),
+        )
+
+        # the mesh is sent, the next transforms are interactive again
+        lanes.put(self.command(MessageType.TRANSFORM, "/Parent/Cube"))
+        self.assertEqual(self.take(lanes), ([MessageType.TRANSFORM], []))
+
+    def test_unknown_objects(self):
+        lanes = common.CommandLanes()
+        lanes.put(self.command(MessageType.ADD_OBJECT_TO_COLLECTION, "Collection"))
+        lanes.put(self.command(MessageType.TRANSFORM, "/Cube"))
+        lanes.put(Command(MessageType.FRAME, common.encode_int(10)))
+        self.assertEqual(
+            self.take(lanes), ([MessageType.FRAME], [MessageType.ADD_OBJECT_TO_COLLECTION, MessageType.TRANSFORM])
+        )
+
+    def test_presence(self):
+        presence = Command(MessageType.CLIENT_PRESENCE, common.encode_json({"userscenes": {}}))
+        self.assertEqual(common.command_objects(presence), frozenset())
+
+        lanes = common.CommandLanes()
+        lanes.put(self.command(MessageType.MESH, "/Cube", 100000))
+        lanes.put(presence)
+        lanes.put(self.command(MessageType.TRANSFORM, "/Sphere"))
+        self.assertEqual(self.take(lanes), ([MessageType.CLIENT_PRESENCE, MessageType.TRANSFORM], [MessageType.MESH]))
+
+    def test_bulk_size(self):
+        lanes = common.CommandLanes()
+        for _ in range(3):
+            lanes.put(self.command(MessageType.MESH, "/Cube", 1000))
+        lanes.put(Command(MessageType.FRAME, common.encode_int(10)))
+        self.assertEqual(self.take(lanes, 1500), ([MessageType.FRAME], [MessageType.MESH, MessageType.MESH]))
+        # at least one bulk command
+        self.assertEqual(self.take(lanes, 1), ([], [MessageType.MESH]))
+        self.assertEqual(self.take(lanes, 1), ([], []))
+
+    def test_batch(self):
+        transforms = [self.command(MessageType.TRANSFORM, f"/Cube{i}") for i in range(3)]
+        batch = common.batch_commands(transforms)[0]
+        self.assertEqual(common.command_lane(batch), common.Lane.INTERACTIVE)
+        self.assertEqual(common.command_objects(batch), {"Cube0", "Cube1", "Cube2"})
+
+        mixed = common.batch_commands(transforms + [self.command(MessageType.ADD_OBJECT_TO_COLLECTION, "C")])[0]
+        self.assertEqual(common.command_lane(mixed), common.Lane.BULK)
+        self.assertIsNone(common.command_objects(mixed))
+
+        lanes = common.CommandLanes()
+        lanes.put(self.command(MessageType.MESH, "/Cube1", 1000))
+        lanes.put(batch)
+        self.assertEqual(self.take(lanes), ([], [MessageType.MESH, MessageType.COMMAND_BATCH]))
+
+    def test_byte_size(self):
+        lanes = common.CommandLanes()
+        mesh = self.command(MessageType.MESH, "/Cube", 1000)
+        transform = self.command(MessageType.TRANSFORM, "/Cube")
+        lanes.put(mesh, replay=True)
+        lanes.put(transform)
+        self.assertEqual(lanes.byte_size, mesh.byte_size() + transform.byte_size())
+        self.assertEqual(lanes.replay_byte_size, mesh.byte_size())
+        lanes.take()
+        self.assertEqual((lanes.byte_size, lanes.replay_byte_size), (0, 0))
+
+        lanes.put(mesh)
+        lanes.clear()
+        self.assertEqual((len(lanes), lanes.byte_size), (0, 0))
+        self.assertEqual(self.take(lanes), ([], []))
+
+    def test_coalesce(self):
+        lanes = common.CommandLanes()
+        lanes.put(self.command(MessageType.TRANSFORM, "/Cube"))
+        lanes.coalesce = True
+        transforms = [self.command(MessageType.TRANSFORM, f"/Parent/Cube{i % 2}") for i in range(6)]
+        frames = [Command(MessageType.FRAME, common.encode_int(i)) for i in range(3)]
+        for transform, frame in zip(transforms, frames + frames):
+            lanes.put(transform)
+            lanes.put(frame)
+        lanes.put(self.command(MessageType.MESH, "/Cube1", 1000))
+        lanes.put(self.command(MessageType.TRANSFORM, "/Cube1"))
+        lanes.put(self.command(MessageType.TRANSFORM, "/Cube1"))
+
+        self.assertEqual(lanes.coalesced_count, 11)
+        self.assertEqual(len(lanes), 5)
+        interactive, bulk = lanes.take()
+        # the transform queued before coalescing is kept, and the last transform of Cube1 waits for the mesh
+        self.assertEqual(len(interactive), 3)
+        self.assertEqual(interactive[1:], [transforms[4], frames[2]])
+        self.assertEqual([c.type for c in bulk], [MessageType.MESH, MessageType.TRANSFORM])
+        self.assertEqual(lanes.byte_size, 0)
+
+    def test_coalesce_client_updates(self):
+        def client_update(attributes):
+            return Command(MessageType.CLIENT_UPDATE, common.encode_json({"client": attributes}))
+
+        lanes = common.CommandLanes()
+        lanes.coalesce = True
+        lanes.put(client_update({"frame": 1, "room": "room"}))
+        lanes.put(Command(MessageType.CLIENT_UPDATE, common.encode_json({"other": {"frame": 1}})))
+        lanes.put(client_update({"frame": 2}))
+        interactive, _ = lanes.take()
+        self.assertEqual(
+            [common.decode_json(c.data, 0)[0] for c in interactive],
+            [{"other": {"frame": 1}}, {"client": {"frame": 2, "room": "room"}}],
+        )
+
+
+class TestChunks(unittest.TestCase):
+    def setUp(self):
+        self.mesh = Command(MessageType.MESH, common.encode_string("/Cube") + bytes(range(256)) * 40)
+
+    def assemble(self, assembler, chunks):
+        results = [assembler.add(chunk) for chunk in chunks]
+        self.assertTrue(all(r is None for r in results[:-1]))
+        return results[-1]
+
+    def test_split_command(self):
+        chunks = list(common.split_command(self.mesh, 1000))
+        self.assertEqual(len(chunks), 11)
+        self.assertTrue(all(c.type == MessageType.CHUNK for c in chunks))
+        self.assertEqual([common.chunk_info(c).last for c in chunks], [False] * 10 + [True])
+        info = common.chunk_info(chunks[0])
+        self.assertEqual((info.message_type, info.size, info.offset), (MessageType.MESH, len(self.mesh.data), 0))
+
+        command = self.assemble(common.ChunkAssembler(), chunks)
+        self.assertEqual(
+            (command.type, command.id, bytes(command.data)), (self.mesh.type, self.mesh.id, self.mesh.data)
+        )
+
+    def test_interleaved(self):
+        other = common.compress_command(Command(MessageType.TEXTURE, bytes(20000)), common.Compression.ZLIB)
+        chunks = list(common.split_command(self.mesh, 1000))
+        other_chunks = list(common.split_command(other, 10))
+
+        assembler = common.ChunkAssembler()
+        self.assertIsNone(assembler.add(other_chunks[0]))
+        command = self.assemble(assembler, chunks)
+        self.assertEqual(bytes(command.data), self.mesh.data)
+        command = self.assemble(assembler, other_chunks[1:])
+        self.assertEqual((command.type, command.compression), (MessageType.TEXTURE, common.Compression.ZLIB))
+        self.assertEqual(common.decompress_command(command).data, bytes(20000))
+
+    def test_unknown_transfer(self):
+        chunks = list(common.split_command(self.mesh, 1000))
+        assembler = common.ChunkAssembler()
+        self.assertIsNone(assembler.add(chunks[-1]))
+
+    def test_spool(self):
+        command = self.assemble(common.ChunkAssembler(spool_size=100), common.split_command(self.mesh, 1000))
+        self.assertEqual(bytes(command.data), self.mesh.data)
+        self.assertEqual(common.decode_command_path(command), "/Cube")
+
+    def test_file_command(self):
+        content = bytes(range(256)) * 100
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "texture.png")
+            with open(path, "wb") as f:
+                f.write(content)
+            prefix = common.encode_string(path) + common.encode_int(len(content))
+            command = common.FileCommand(MessageType.TEXTURE, prefix, path, len(content))
+            self.assertEqual(command.byte_size(), common.MESSAGE_HEADER_SIZE + len(prefix) + len(content))
+            self.assertFalse(common.is_batchable(command))
+            self.assertEqual(command.load().data, prefix + content)
+
+            assembled = self.assemble(common.ChunkAssembler(), common.split_command(command, 1000))
+            self.assertEqual(bytes(assembled.data), prefix + content)
+
+    def test_lanes(self):
+        def split(command):
+            return common.split_command(command, 1000) if command.type == MessageType.MESH else None
+
+        lanes = common.CommandLanes()
+        lanes.put(self.mesh)
+        lanes.put(Command(MessageType.TRANSFORM, common.encode_string("/Cube")))
+        lanes.put(Command(MessageType.FRAME, common.encode_int(10)))
+        lanes.put(Command(MessageType.TRANSFORM, common.encode_string("/Plane")))
+
+        interactive, bulk = lanes.take(5000, split)
+        self.assertEqual([c.type for c in interactive], [MessageType.FRAME, MessageType.TRANSFORM])
+        self.assertEqual([c.type for c in bulk], [MessageType.CHUNK] * 5)
+
+        # the mesh is not sent yet, its transform is held back
+        lanes.put(Command(MessageType.TRANSFORM, common.encode_string("/Cube")))
+        interactive, bulk = lanes.take(5000, split)
+        self.assertEqual(interactive, [])
+        self.assertEqual([c.type for c in bulk], [MessageType.CHUNK] * 5)
+
+        interactive, bulk = lanes.take(5000, split)
+        self.assertEqual([c.type for c in bulk], [MessageType.CHUNK, MessageType.TRANSFORM, MessageType.TRANSFORM])
+        self.assertEqual(len(lanes), 0)
+
+
+class TestAttributes(unittest.TestCase):
+    def test_quantize_floats(self):
+        view = {"eye": [1.000012, 2.5, 3], "screen_corners": [(0.123456, 1.0)], "name": "view", "visible": True}
+        self.assertEqual(
+            common.quantize_floats({"views": view}, 4),
+            {"views": {"eye": [1.0, 2.5, 3], "screen_corners": [[0.1235, 1.0]], "name": "view", "visible": True}},
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
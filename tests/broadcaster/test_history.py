@@ -0,0 +1,194 @@
+import json
+import struct
+import unittest
+
+import mixer.broadcaster.common as common
+from mixer.broadcaster.common import Command, MessageType
+from mixer.broadcaster.history import RoomHistory, blenddata_path
+
+
+def transform(path: str, value: int = 0) -> Command:
+    return Command(MessageType.TRANSFORM, common.encode_string(path) + common.encode_int(value))
+
+
+def mesh(path: str, value: int = 0) -> Command:
+    return Command(MessageType.MESH, common.encode_string(path) + common.encode_int(value))
+
+
+def json_update(collection: str, key: str, value: int = 0) -> Command:
+    proxy = {
+        "__bpy_proxy_class__": "BpyIDProxy",
+        "_data": {"value": value, "ref": {"__bpy_proxy_class__": "BpyIDRefProxy", "_blenddata_path": ["x", "y"]}},
+        "_blenddata_path": [collection, key],
+        "_class_name": "Mesh",
+    }
+    return Command(MessageType.BLENDER_DATA_UPDATE, common.encode_string(json.dumps(proxy)))
+
+
+def binary_update(collection: str, key: str) -> Command:
+    # MAGIC, string table, then a BpyIDProxy with a blenddata path, as BinaryCodec encodes it
+    strings = [collection, key, "Mesh"]
+    data = b"MXB\x01" + struct.pack("<I", len(strings))
+    for string in strings:
+        data += struct.pack("<I", len(string.encode())) + string.encode()
+    data += struct.pack("<BBB", 12, 0, 3) + struct.pack("<BI", 7, 2) + struct.pack("<BIBI", 5, 0, 5, 1)
+    data += struct.pack("<I", 2) + struct.pack("<BI", 9, 0)  # class name, empty data
+    return Command(MessageType.BLENDER_DATA_BINARY_UPDATE, data)
+
+
+def remove(collection: str, key: str) -> Command:
+    return Command(MessageType.BLENDER_DATA_REMOVE, common.encode_string(collection) + common.encode_string(key))
+
+
+def delete(path: str) -> Command:
+    return Command(MessageType.DELETE, common.encode_string(path))
+
+
+def rename(old_path: str, new_path: str) -> Command:
+    return Command(MessageType.RENAME, common.encode_string(old_path) + common.encode_string(new_path))
+
+
+class TestBlenddataPath(unittest.TestCase):
+    def test_json(self):
+        self.assertEqual(blenddata_path(json_update("meshes", "Cube")), ("meshes", "Cube"))
+
+        command = json_update("meshes", "Cube")
+        data = common.compress(command.data, common.Compression.ZLIB)
+        compressed = Command(command.type, data, compression=common.Compression.ZLIB)
+        self.assertEqual(blenddata_path(compressed), ("meshes", "Cube"))
+
+    def test_json_large(self):
+        proxy = {"__bpy_proxy_class__": "BpyIDProxy", "_data": {"v": "x" * 10000}, "_blenddata_path": ["a", "b"]}
+        command = Command(MessageType.BLENDER_DATA_UPDATE, common.encode_string(json.dumps(proxy)))
+        self.assertEqual(blenddata_path(command), ("a", "b"))
+
+    def test_binary(self):
+        self.assertEqual(blenddata_path(binary_update("objects", "Cube")), ("objects", "Cube"))
+
+    def test_json_like_binary(self):
+        # the string length prefix of a JSON update may encode as the magic of the binary codec
+        proxy = {"__bpy_proxy_class__": "BpyIDProxy", "_data": {"v": ""}, "_blenddata_path": ["a", "b"]}
+        proxy["_data"]["v"] = "x" * (0x0142584D - len(json.dumps(proxy)))
+        command = Command(MessageType.BLENDER_DATA_UPDATE, common.encode_string(json.dumps(proxy)))
+        self.assertEqual(bytes(command.data[:4]), b"MXB\x01")
+        self.assertEqual(blenddata_path(command), ("a", "b"))
+
+
+class TestRoomHistory(unittest.TestCase):
+    def setUp(self):
+        self.history = RoomHistory()
+
+    def add(self, *commands):
+        for command in commands:
+            self.history.add(command)
+
+    def assertCommands(self, expected):
+        commands, _ = self.history.commands_after()
+        self.assertEqual([c.id for c in commands], [c.id for c in expected])
+        self.assertEqual(len(self.history), len(expected))
+        self.assertEqual(self.history.byte_size, sum(c.byte_size() for c in expected))
+
+    def test_adjacent(self):
+        t = [transform("/Cube", i) for i in range(3)]
+        p = transform("/Plane")
+        self.add(t[0], t[1], p, t[2])
+        self.assertCommands([t[1], p, t[2]])
+
+        history = RoomHistory(compact=False)
+        for command in (t[0], t[1], p, t[2]):
+            history.add(command)
+        self.assertEqual(len(history), 3)
+
+    def test_superseded(self):
+        m = mesh("/Cube")
+        t = [transform("/Cube", i) for i in range(3)]
+        p = [transform("/Plane", i) for i in range(3)]
+        self.add(m, t[0], p[0], t[1], p[1], t[2], p[2])
+        # the first command of each object creates it
+        self.assertCommands([m, p[0], t[2], p[2]])
+
+    def test_barrier(self):
+        m = mesh("/Cube")
+        t = [transform("/Cube", i) for i in range(3)]
+        camera = Command(MessageType.CAMERA, common.encode_string("/Camera"))
+        connection = Command(MessageType.GREASE_PENCIL_CONNECTION, common.encode_string("/Cube"))
+        unknown = Command(MessageType.ADD_OBJECT_TO_COLLECTION, common.encode_string("Collection"))
+
+        self.add(m, t[0], camera, t[1])
+        self.assertCommands([m, camera, t[1]])
+
+        self.add(connection, t[2])
+        self.assertCommands([m, camera, t[1], connection, t[2]])
+
+        t = [transform("/Cube", i) for i in range(2)]
+        self.add(t[0], unknown, t[1])
+        commands, _ = self.history.commands_after()
+        self.assertEqual(commands[-3:], [t[0], unknown, t[1]])
+
+    def test_delete(self):
+        m = mesh("/Cube")
+        t = [transform("/Cube", i) for i in range(2)]
+        d = delete("Cube")
+        self.add(m, t[0], t[1], d)
+        self.assertCommands([m, d])
+
+        # a new object with the same name
+        t = [transform("/Cube", i) for i in range(3)]
+        self.add(*t)
+        self.assertCommands([m, d, t[2]])
+
+    def test_rename(self):
+        m = mesh("/Cube")
+        t = [transform("/Cube"), transform("/Box")]
+        r = rename("/Cube", "/Box")
+        self.add(m, t[0], r, t[1])
+        self.assertCommands([m, r, t[1]])
+
+        self.add(delete("/Cube"))
+        self.assertEqual(len(self.history), 4)
+
+    def test_blenddata(self):
+        updates = [json_update("meshes", "Cube", i) for i in range(3)]
+        other = json_update("meshes", "Plane")
+        binary = [binary_update("objects", "Cube") for i in range(2)]
+        self.add(updates[0], other, updates[1], binary[0], binary[1], updates[2])
+        self.assertCommands([updates[0], other, binary[1], updates[2]])
+
+        r = remove("meshes", "Cube")
+        self.add(r)
+        self.assertCommands([updates[0], other, binary[1], r])
+
+    def test_blenddata_encodings(self):
+        updates = [json_update("meshes", "Cube", i) for i in range(2)]
+        binary = binary_update("meshes", "Cube")
+        self.add(updates[0], updates[1], binary)
+        self.assertCommands([binary])
+
+    def test_commands_after(self):
+        t = [transform("/Cube", i) for i in range(2)]
+        p = transform("/Plane")
+        self.add(mesh("/Cube"), t[0], p)
+        commands, sequence = self.history.commands_after()
+        self.assertEqual(len(commands), 3)
+
+        # t[0] is dropped after it was sent
+        self.add(t[1])
+        commands, _ = self.history.commands_after(sequence)
+        self.assertEqual(commands, [t[1]])
+
+    def test_pack(self):
+        m = mesh("/Cube")
+        self.add(m)
+        for i in range(5000):
+            self.add(transform("/Cube", i), transform("/Plane", i))
+            _, sequence = self.history.commands_after()
+        self.assertEqual(len(self.history), 4)
+        self.assertLess(len(self.history._commands), 2000)
+
+        self.add(transform("/Sphere"))
+        commands, _ = self.history.commands_after(sequence)
+        self.assertEqual(len(commands), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
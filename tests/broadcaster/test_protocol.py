@@ -0,0 +1,972 @@
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List
+import unittest
+from unittest import mock
+import urllib.request
+
+from mixer.broadcaster.apps import server as server_module
+from mixer.broadcaster.apps.server import AsyncServer, Server, SlowClientPolicy
+from mixer.broadcaster.apps import sharded_server
+from mixer.broadcaster.apps.sharded_server import ShardedServer
+from mixer.broadcaster import client as client_module
+from mixer.broadcaster.client import Client
+import mixer.broadcaster.common as common
+from mixer.broadcaster.common import Command, Compression, MessageType
+from mixer.broadcaster.session import SessionRecord, load_session, play_session
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("", 0))
+        return sock.getsockname()[1]
+
+
+class LegacyClient(Client):
+    """
+    A client that does not request any protocol extension.
+    """
+
+    def capabilities(self):
+        return {}
+
+
+class ServerTestCase(unittest.TestCase):
+    """
+    Run a server in a thread and connect clients to it.
+    """
+
+    server_class = Server
+    room_log = False  # log the rooms in a temporary directory
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp() if self.room_log else None
+        self.start_server()
+
+    def tearDown(self):
+        self.stop_server()
+        if self.directory is not None:
+            shutil.rmtree(self.directory)
+
+    def start_server(self):
+        self.port = free_port()
+        self.server = self.create_server()
+        self.server_thread = threading.Thread(None, self.server.run, args=(self.port,))
+        self.server_thread.start()
+        self.clients = []
+
+    def stop_server(self):
+        for client in self.clients:
+            client.disconnect()
+        self.server.shutdown()
+        self.server_thread.join()
+
+    def create_server(self) -> Server:
+        server = self.server_class()
+        if self.directory is not None:
+            server.room_log_directory = self.directory
+            server.restore_rooms()
+        return server
+
+    def connect(self, client_class=Client, **kwargs) -> Client:
+        client = client_class("localhost", self.port, **kwargs)
+        for _ in range(50):
+            client.connect()
+            if client.is_connected():
+                break
+            time.sleep(0.1)
+        self.assertTrue(client.is_connected())
+        self.clients.append(client)
+        return client
+
+    def receive(self, client: Client, message_type: MessageType, timeout=5.0) -> Command:
+        """
+        Return the first received command of message_type, skipping the others.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            client.fetch_outgoing_commands()
+            command = client._reader.read_message(timeout=0.1)
+            if command is None:
+                continue
+            command = common.decompress_command(command)
+            if client.has_default_handler(command.type):
+                client._default_command_handlers[command.type](client, command)
+            if command.type == message_type:
+                return command
+        self.fail(f"{message_type.name} not received")
+
+    def receive_room_commands(self, client: Client, count: int, timeout=5.0) -> List[Command]:
+        """
+        Return the room commands received until they contain count commands, batches are not expanded.
+        """
+        received: List[Command] = []
+        deadline = time.monotonic() + timeout
+        while len(common.expand_command_batches(received)) < count:
+            self.assertLess(time.monotonic(), deadline, "room commands not received")
+            command = client._reader.read_message(timeout=0.1)
+            if command is not None and command.type > MessageType.COMMAND:
+                received.append(common.decompress_command(command))
+        return received
+
+    def sync(self, client: Client):
+        """
+        Wait until the server has handled the commands sent by client.
+        """
+        # the server handles the commands of a client in order, so they are handled once this is answered
+        client.send_list_rooms()
+        self.receive(client, MessageType.LIST_ROOMS)
+
+    def create_room(self, client: Client, room_name: str):
+        client.join_room(room_name)
+        self.receive(client, MessageType.CONTENT)
+        client.send_command(Command(MessageType.CONTENT))
+        self.sync(client)
+
+    def join_room(self, client: Client, room_name: str):
+        client.join_room(room_name)
+        self.receive(client, MessageType.JOIN_ROOM)
+
+
+class TestCompression(ServerTestCase):
+    def test_negotiation(self):
+        zlib_client = self.connect()
+        lzma_client = self.connect(compression=Compression.LZMA)
+        legacy_client = self.connect(compression=Compression.NONE)
+        for client in (zlib_client, lzma_client, legacy_client):
+            self.receive(client, MessageType.CLIENT_CAPABILITIES)
+
+        self.assertEqual(zlib_client.compression, Compression.ZLIB)
+        self.assertEqual(lzma_client.compression, Compression.LZMA)
+        self.assertEqual(legacy_client.compression, Compression.NONE)
+
+    def test_forward(self):
+        sender = self.connect()
+        self.receive(sender, MessageType.CLIENT_CAPABILITIES)
+        self.create_room(sender, "room")
+
+        data = common.encode_string("/Cube") + bytes(range(16)) * 1000
+        sender.send_command(Command(MessageType.MESH, data))
+        sender.send_command(Command(MessageType.MESH, common.encode_string("/Cube") + b"small"))
+        sender.send_command(Command(MessageType.MESH, common.encode_string("/Plane") + data))
+        self.sync(sender)
+
+        expected = [common.encode_string("/Cube") + b"small", common.encode_string("/Plane") + data]
+        for kwargs in ({}, {"compression": Compression.NONE}):
+            receiver = self.connect(**kwargs)
+            receiver.join_room("room")
+            received = [self.receive(receiver, MessageType.MESH).data for _ in range(2)]
+            self.assertEqual(received, expected)
+
+
+class TestCommandBatch(ServerTestCase):
+    def transform(self, name: str) -> Command:
+        return Command(MessageType.TRANSFORM, common.encode_string(name) + bytes(200))
+
+    def test_forward(self):
+        sender = self.connect()
+        receiver = self.connect()
+        legacy_receiver = self.connect(client_class=LegacyClient)
+        for client in (sender, receiver, legacy_receiver):
+            self.receive(client, MessageType.CLIENT_CAPABILITIES)
+        self.assertTrue(sender.command_batch)
+        self.assertFalse(legacy_receiver.command_batch)
+
+        self.create_room(sender, "room")
+        self.join_room(receiver, "room")
+        self.join_room(legacy_receiver, "room")
+
+        commands = [self.transform(f"/Cube{i}") for i in range(100)]
+        for command in commands:
+            sender.add_command(command)
+        sender.fetch_outgoing_commands()
+        expected = [bytes(c.data) for c in commands]
+
+        received = self.receive_room_commands(receiver, len(commands))
+        self.assertEqual([c.type for c in received], [MessageType.COMMAND_BATCH])
+        self.assertEqual([bytes(c.data) for c in common.expand_command_batches(received)], expected)
+
+        received = self.receive_room_commands(legacy_receiver, len(commands))
+        self.assertEqual({c.type for c in received}, {MessageType.TRANSFORM})
+        self.assertEqual([bytes(c.data) for c in received], expected)
+
+    def test_history(self):
+        sender = self.connect()
+        self.receive(sender, MessageType.CLIENT_CAPABILITIES)
+        self.create_room(sender, "room")
+
+        # consecutive transforms of the same object are merged in the room history, even when batched
+        commands = [self.transform("/Cube"), self.transform("/Cube"), self.transform("/Plane")]
+        for command in commands:
+            sender.add_command(command)
+        sender.fetch_outgoing_commands()
+        self.sync(sender)
+        self.assertEqual(sender.rooms_attributes["room"][common.RoomAttributes.COMMAND_COUNT], 2)
+
+        receiver = self.connect()
+        self.receive(receiver, MessageType.CLIENT_CAPABILITIES)
+        receiver.join_room("room")
+        received = self.receive_room_commands(receiver, 2)
+        self.assertEqual([bytes(c.data) for c in received], [bytes(c.data) for c in commands[1:]])
+
+
+class TestChunk(ServerTestCase):
+    def test_forward(self):
+        sender = self.connect()
+        receiver = self.connect()
+        legacy_receiver = self.connect(client_class=LegacyClient)
+        for client in (sender, receiver, legacy_receiver):
+            self.receive(client, MessageType.CLIENT_CAPABILITIES)
+        self.assertTrue(sender.chunk)
+        self.assertFalse(legacy_receiver.chunk)
+
+        self.create_room(sender, "room")
+        self.join_room(receiver, "room")
+        self.join_room(legacy_receiver, "room")
+
+        # not compressible
+        data = common.encode_string("/Cube") + os.urandom(3 * common.CHUNK_SIZE)
+        sender.add_command(Command(MessageType.MESH, data))
+        sender.add_command(Command(MessageType.TRANSFORM, common.encode_string("/Cube")))
+        sender.fetch_outgoing_commands()
+
+        received = self.receive_room_commands(receiver, 5)
+        self.assertEqual([c.type for c in received], [MessageType.CHUNK] * 4 + [MessageType.TRANSFORM])
+        assembler = common.ChunkAssembler()
+        assembled = [assembler.add(c) for c in received[:4]][-1]
+        self.assertEqual((assembled.type, bytes(assembled.data)), (MessageType.MESH, data))
+
+        received = self.receive_room_commands(legacy_receiver, 2)
+        self.assertEqual([c.type for c in received], [MessageType.MESH, MessageType.TRANSFORM])
+        self.assertEqual(bytes(received[0].data), data)
+
+        # the room stores the assembled mesh, sent in chunks to a joining client
+        self.sync(sender)
+        self.assertEqual(sender.rooms_attributes["room"][common.RoomAttributes.COMMAND_COUNT], 2)
+        joiner = self.connect()
+        self.receive(joiner, MessageType.CLIENT_CAPABILITIES)
+        joiner.join_room("room")
+        received = self.receive_room_commands(joiner, 5)
+        self.assertEqual([c.type for c in received], [MessageType.CHUNK] * 4 + [MessageType.TRANSFORM])
+
+
+class TestRoom(ServerTestCase):
+    def test_keep_open(self):
+        creator = self.connect()
+        self.create_room(creator, "room")
+        creator.set_room_keep_open("room", True)
+        creator.leave_room("room")
+        self.receive(creator, MessageType.LEAVE_ROOM)
+        self.sync(creator)
+        self.assertTrue(creator.rooms_attributes["room"][common.RoomAttributes.KEEP_OPEN])
+
+        observer = self.connect()
+        self.sync(observer)
+        self.assertEqual(observer.rooms_attributes["room"][common.RoomAttributes.COMMAND_COUNT], 0)
+        observer.delete_room("room")
+        self.receive(observer, MessageType.ROOM_DELETED)
+        self.assertNotIn("room", observer.rooms_attributes)
+
+    def test_close_when_empty(self):
+        creator = self.connect()
+        self.create_room(creator, "room")
+        creator.send_command(Command(MessageType.MESH, common.encode_string("/Cube")))
+
+        observer = self.connect()
+        self.join_room(observer, "room")
+        creator.disconnect()
+        self.receive(observer, MessageType.CLIENT_DISCONNECTED)
+        self.sync(observer)
+        self.assertEqual(observer.rooms_attributes["room"][common.RoomAttributes.COMMAND_COUNT], 1)
+
+        observer.leave_room("room")
+        self.receive(observer, MessageType.ROOM_DELETED)
+
+
+class TestRoomLogged(TestRoom):
+    room_log = True
+
+    def test_restore(self):
+        creator = self.connect()
+        self.create_room(creator, "room")
+        creator.set_room_keep_open("room", True)
+        creator.set_room_attributes("room", {"custom": 1})
+        mesh = Command(MessageType.MESH, common.encode_string("/Cube") + os.urandom(100))
+        transforms = [Command(MessageType.TRANSFORM, common.encode_string("/Cube") + bytes([i])) for i in range(3)]
+        for command in [mesh] + transforms:
+            creator.send_command(command)
+        self.create_room(self.connect(), "closed")
+        self.sync(creator)
+        self.assertEqual(creator.rooms_attributes["room"][common.RoomAttributes.COMMAND_COUNT], 2)
+
+        # a new server on the same directory, as after a crash
+        self.stop_server()
+        self.start_server()
+
+        joiner = self.connect()
+        self.sync(joiner)
+        self.assertEqual(set(joiner.rooms_attributes), {"room"})
+        attributes = joiner.rooms_attributes["room"]
+        self.assertEqual(attributes[common.RoomAttributes.COMMAND_COUNT], 2)
+        self.assertEqual(attributes["custom"], 1)
+        self.assertTrue(attributes[common.RoomAttributes.KEEP_OPEN])
+
+        joiner.join_room("room")
+        received = self.receive_room_commands(joiner, 2)
+        self.assertEqual([bytes(c.data) for c in received], [bytes(mesh.data), bytes(transforms[-1].data)])
+
+
+class TestRoomUpdates(ServerTestCase):
+    def create_server(self) -> Server:
+        server = super().create_server()
+        server.room_update_interval = 0.2
+        return server
+
+    def test_coalesced(self):
+        creator = self.connect()
+        self.create_room(creator, "room")
+        observer = self.connect()
+        self.sync(observer)
+        for i in range(100):
+            creator.send_command(Command(MessageType.MESH, common.encode_string(f"/Mesh{i}")))
+
+        update_count = 0
+        while observer.rooms_attributes["room"][common.RoomAttributes.COMMAND_COUNT] < 100:
+            self.receive(observer, MessageType.ROOM_UPDATE)
+            update_count += 1
+        self.assertLess(update_count, 10)
+
+    def test_opt_out(self):
+        creator = self.connect()
+        self.create_room(creator, "room")
+        quiet = self.connect(room_statistics=False)
+        self.sync(quiet)
+        creator.send_command(Command(MessageType.MESH, common.encode_string("/Cube")))
+        self.sync(creator)
+        time.sleep(0.4)
+
+        # the statistics were flushed, but not sent to quiet
+        creator.set_room_keep_open("room", True)
+        update, _ = common.decode_json(self.receive(quiet, MessageType.ROOM_UPDATE).data, 0)
+        self.assertEqual(update, {"room": {common.RoomAttributes.KEEP_OPEN: True}})
+
+        # LIST_ROOMS still tells the statistics
+        self.sync(quiet)
+        self.assertEqual(quiet.rooms_attributes["room"][common.RoomAttributes.COMMAND_COUNT], 1)
+
+
+class TestPresence(ServerTestCase):
+    def setup_room(self, *client_classes):
+        clients = [self.connect(client_class) for client_class in client_classes]
+        for client in clients:
+            self.receive(client, MessageType.CLIENT_CAPABILITIES)
+        self.create_room(clients[0], "room")
+        for client in clients[1:]:
+            self.join_room(client, "room")
+        return clients
+
+    def client_id(self, client: Client) -> str:
+        return "%s:%s" % client.socket.getsockname()
+
+    def view(self, x: float) -> Dict[str, Any]:
+        return {common.ClientAttributes.USERSCENES: {"Scene": {"views": {"1": {"eye": [x, 0.0, 0.0]}}}}}
+
+    def test_room_scoped(self):
+        sender, receiver = self.setup_room(Client, Client)
+        outsider = self.connect()
+        self.receive(outsider, MessageType.CLIENT_CAPABILITIES)
+        self.create_room(outsider, "other room")
+
+        sender.set_presence_attributes(self.view(1.000001))
+        self.receive(receiver, MessageType.CLIENT_PRESENCE)
+        self.assertEqual(
+            receiver.clients_attributes[self.client_id(sender)][common.ClientAttributes.USERSCENES],
+            self.view(1.0)[common.ClientAttributes.USERSCENES],
+        )
+
+        self.sync(outsider)
+        self.assertNotIn(common.ClientAttributes.USERSCENES, outsider.clients_attributes[self.client_id(sender)])
+
+    def test_coalesced(self):
+        self.server.presence_interval = 0.2
+        sender, receiver = self.setup_room(Client, Client)
+        sender.presence_interval = 0
+        for i in range(100):
+            sender.set_presence_attributes(self.view(float(i)))
+
+        update_count = 0
+        last = self.view(99.0)[common.ClientAttributes.USERSCENES]
+        while receiver.clients_attributes[self.client_id(sender)].get(common.ClientAttributes.USERSCENES) != last:
+            self.receive(receiver, MessageType.CLIENT_PRESENCE)
+            update_count += 1
+        self.assertLess(update_count, 10)
+
+    def test_client_rate_cap(self):
+        (sender,) = self.setup_room(Client)
+        sender.presence_interval = 60
+        sender.set_presence_attributes(self.view(1.0))
+        sender.set_presence_attributes(self.view(2.0))
+        self.sync(sender)
+        attributes = self.server._connections[self.client_id(sender)].presence_attributes
+        self.assertEqual(attributes, self.view(1.0))
+
+    def test_interactive(self):
+        sender, receiver = self.setup_room(Client, Client)
+        sender.add_command(Command(MessageType.MESH, common.encode_string("/Cube") + bytes(1024 * 1024)))
+        sender.add_command(Command(MessageType.CLIENT_PRESENCE, common.encode_json(self.view(1.0))))
+        sender.add_command(Command(MessageType.TRANSFORM, common.encode_string("/Sphere")))
+
+        written: List[MessageType] = []
+        write = sender._write
+
+        def record(commands: List[Command]):
+            written.extend(command.type for command in commands)
+            write(commands)
+
+        with mock.patch.object(sender, "_write", record):
+            sender.fetch_outgoing_commands()
+        # the presence does not wait for the mesh, nor delays the transform of another object
+        self.assertEqual(written[:2], [MessageType.CLIENT_PRESENCE, MessageType.TRANSFORM])
+
+        self.receive(receiver, MessageType.CLIENT_PRESENCE)
+        self.assertEqual(
+            receiver.clients_attributes[self.client_id(sender)][common.ClientAttributes.USERSCENES],
+            self.view(1.0)[common.ClientAttributes.USERSCENES],
+        )
+
+    def test_snapshot(self):
+        (sender,) = self.setup_room(Client)
+        sender.set_presence_attributes(self.view(1.0))
+        self.sync(sender)
+
+        joiner = self.connect()
+        self.receive(joiner, MessageType.CLIENT_CAPABILITIES)
+        self.join_room(joiner, "room")
+        # the snapshot is interactive, so it is received before the next answer, maybe before JOIN_ROOM
+        self.sync(joiner)
+        self.assertEqual(
+            joiner.clients_attributes[self.client_id(sender)][common.ClientAttributes.USERSCENES],
+            self.view(1.0)[common.ClientAttributes.USERSCENES],
+        )
+
+    def test_legacy_client(self):
+        sender, receiver = self.setup_room(Client, LegacyClient)
+        sender.set_presence_attributes(self.view(1.0))
+
+        # the presence is sent as CLIENT_UPDATE, after the room updates of the join
+        sender_attributes: Dict[str, Any] = {}
+        while common.ClientAttributes.USERSCENES not in sender_attributes:
+            update, _ = common.decode_json(self.receive(receiver, MessageType.CLIENT_UPDATE).data, 0)
+            sender_attributes = update.get(self.client_id(sender), {})
+        self.assertEqual(sender_attributes, self.view(1.0))
+
+
+class TestReplay(ServerTestCase):
+    """
+    Replay of a room history larger than the commands sent at once to a joining client.
+    """
+
+    def test_join(self):
+        sender = self.connect()
+        self.receive(sender, MessageType.CLIENT_CAPABILITIES)
+        self.create_room(sender, "room")
+
+        commands = []
+        for i in range(300):
+            commands.append(Command(MessageType.MESH, common.encode_string(f"/Object{i}") + os.urandom(1000)))
+            if i % 50 == 0:
+                # superseded by the next one, leaving holes in the history
+                commands.append(Command(MessageType.TRANSFORM, common.encode_string("/Object0") + bytes([i])))
+            if i == 100:
+                commands.append(
+                    Command(MessageType.MESH, common.encode_string("/Large") + os.urandom(common.CHUNK_SIZE))
+                )
+            if i == 200:
+                # compressed by the sender
+                commands.append(Command(MessageType.MESH, common.encode_string("/Zeros") + bytes(20000)))
+        for command in commands:
+            sender.send_command(command)
+        self.sync(sender)
+
+        transforms = [c for c in commands if c.type == MessageType.TRANSFORM]
+        expected = [bytes(c.data) for c in commands if c.type != MessageType.TRANSFORM or c is transforms[-1]]
+        self.assertEqual(sender.rooms_attributes["room"][common.RoomAttributes.COMMAND_COUNT], len(expected))
+
+        for client_class in (Client, LegacyClient):
+            joiner = self.connect(client_class=client_class)
+            self.receive(joiner, MessageType.CLIENT_CAPABILITIES)
+            joiner.join_room("room")
+            assembler = common.ChunkAssembler()
+            received = []
+            while len(received) < len(expected):
+                for command in self.receive_room_commands(joiner, 1):
+                    if command.type == MessageType.CHUNK:
+                        command = assembler.add(command)
+                    if command is not None:
+                        received.append(bytes(common.decompress_command(command).data))
+            self.assertEqual(received, expected)
+
+
+class TestReplayLogged(TestReplay):
+    room_log = True
+
+
+class TestSlowClient(ServerTestCase):
+    """
+    A client that does not read while the room is sent more than its send queue budget.
+    """
+
+    def create_server(self) -> Server:
+        server = super().create_server()
+        server.send_queue_budget = 1024 * 1024
+        return server
+
+    def setup_room(self):
+        sender = self.connect()
+        receiver = self.connect()
+        for client in (sender, receiver):
+            self.receive(client, MessageType.CLIENT_CAPABILITIES)
+        self.create_room(sender, "room")
+        self.join_room(receiver, "room")
+        return sender, receiver
+
+    def meshes(self, count: int) -> List[Command]:
+        # more than the socket buffers can hold
+        return [
+            Command(MessageType.MESH, common.encode_string(f"/Mesh{i}") + os.urandom(1024 * 1024)) for i in range(count)
+        ]
+
+    def send_queue_attributes(self, observer: Client, client: Client) -> Dict[str, Any]:
+        observer.send_command(Command(MessageType.LIST_CLIENTS))
+        clients_attributes, _ = common.decode_json(self.receive(observer, MessageType.LIST_CLIENTS).data, 0)
+        return clients_attributes.get("%s:%s" % client.socket.getsockname())
+
+    def test_coalesce(self):
+        self.server.slow_client_policy = SlowClientPolicy.COALESCE
+        sender, receiver = self.setup_room()
+        transforms = [Command(MessageType.TRANSFORM, common.encode_string("/Cube") + bytes([i])) for i in range(100)]
+        # the queue also receives the room updates flushed while the test reads it
+        patcher = mock.patch.object(server_module, "SEND_QUEUE_HARD_LIMIT", 1000)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for command in self.meshes(20) + transforms:
+            sender.send_command(command)
+        self.sync(sender)
+        attributes = self.send_queue_attributes(sender, receiver)
+        self.assertGreater(attributes[common.ClientAttributes.COALESCED_COMMAND_COUNT], 0)
+        self.assertGreater(attributes[common.ClientAttributes.SEND_QUEUE_PEAK], 1024 * 1024)
+
+        # the meshes and the last transform are received, not all the transforms
+        mesh_count = transform_count = 0
+        last_transform = None
+        while mesh_count < 20 or last_transform != bytes(transforms[-1].data):
+            for command in common.expand_command_batches(self.receive_room_commands(receiver, 1, timeout=10.0)):
+                if command.type == MessageType.CHUNK and common.chunk_info(command).last:
+                    mesh_count += 1
+                elif command.type == MessageType.TRANSFORM:
+                    transform_count += 1
+                    last_transform = bytes(command.data)
+        self.assertLess(transform_count, len(transforms))
+
+    def test_disconnect(self):
+        self.server.slow_client_policy = SlowClientPolicy.DISCONNECT
+        sender, receiver = self.setup_room()
+        for command in self.meshes(20):
+            sender.send_command(command)
+        self.sync(sender)
+
+        error = self.receive(receiver, MessageType.SEND_ERROR, timeout=10.0)
+        self.assertIn("budget", common.decode_string(error.data, 0)[0])
+        self.assertIsNone(self.send_queue_attributes(sender, receiver))
+
+    def test_pause(self):
+        self.server.slow_client_policy = SlowClientPolicy.PAUSE
+        sender, receiver = self.setup_room()
+        observer = self.connect()
+        meshes = self.meshes(20)
+
+        # the sender is blocked while the room is paused
+        thread = threading.Thread(target=lambda: [sender.send_command(c) for c in meshes])
+        thread.start()
+        deadline = time.monotonic() + 10.0
+        while not self.send_queue_attributes(observer, receiver)[common.ClientAttributes.CONGESTION_COUNT]:
+            self.assertLess(time.monotonic(), deadline, "room not paused")
+
+        # nothing is dropped
+        assembler = common.ChunkAssembler()
+        received = []
+        while len(received) < len(meshes):
+            for chunk in self.receive_room_commands(receiver, 1, timeout=10.0):
+                command = assembler.add(chunk)
+                if command is not None:
+                    received.append(bytes(command.data))
+        thread.join()
+        self.assertTrue(received == [bytes(c.data) for c in meshes])
+
+
+class TestServerStats(ServerTestCase):
+    def server_stats(self, client: Client) -> Dict[str, Any]:
+        client.send_command(Command(MessageType.SERVER_STATS))
+        return common.decode_json(self.receive(client, MessageType.SERVER_STATS).data, 0)[0]
+
+    def test_stats(self):
+        sender = self.connect()
+        receiver = self.connect()
+        self.create_room(sender, "room")
+        self.join_room(receiver, "room")
+        transforms = [Command(MessageType.TRANSFORM, common.encode_string("/Cube") + bytes([i])) for i in range(10)]
+        for command in transforms:
+            sender.send_command(command)
+        self.receive_room_commands(receiver, len(transforms))
+
+        stats = self.server_stats(sender)
+        self.assertEqual(stats["connection_count"], 2)
+        self.assertEqual(stats["message_types"]["TRANSFORM"], 10)
+        self.assertEqual(stats["join_duration"]["count"], 1)
+
+        room = stats["rooms"]["room"]
+        self.assertEqual(room["commands_in"], 10)
+        self.assertEqual(room["bytes_in"], sum(c.byte_size() for c in transforms))
+        self.assertEqual(room["bytes_out"], room["bytes_in"])
+
+        sender_stats = stats["clients"]["%s:%s" % sender.socket.getsockname()]
+        receiver_stats = stats["clients"]["%s:%s" % receiver.socket.getsockname()]
+        self.assertGreater(sender_stats["commands_in"], 10)
+        self.assertGreater(receiver_stats["commands_out"], 10)
+        self.assertGreater(stats["send_lag"]["count"], 0)
+
+        # the counters of disconnected clients are kept
+        receiver.disconnect()
+        self.clients.remove(receiver)
+        for _ in range(50):
+            stats = self.server_stats(sender)
+            if stats["connection_count"] == 1:
+                break
+            time.sleep(0.1)
+        self.assertEqual(stats["connection_count"], 1)
+        self.assertGreater(stats["commands_out"], receiver_stats["commands_out"])
+
+    def test_export(self):
+        path = os.path.join(tempfile.mkdtemp(), "stats.json")
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        self.server.export_stats(path, free_port(), interval=0.05)
+        self.connect()
+
+        deadline = time.monotonic() + 5.0
+        while not os.path.exists(path):
+            self.assertLess(time.monotonic(), deadline, "stats file not written")
+            time.sleep(0.05)
+        with open(path) as file:
+            self.assertIn("rooms", json.load(file))
+
+        port = self.server._stats_exporter._http_server.server_address[1]
+        with urllib.request.urlopen(f"http://localhost:{port}/metrics", timeout=5) as response:
+            self.assertIn("mixer_connections", response.read().decode())
+        with urllib.request.urlopen(f"http://localhost:{port}/", timeout=5) as response:
+            self.assertIn("clients", json.load(response))
+
+
+class TestSession(ServerTestCase):
+    def create_server(self) -> Server:
+        server = super().create_server()
+        server.session_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, server.session_directory)
+        server.presence_interval = 0
+        return server
+
+    def test_record_and_play(self):
+        creator = self.connect()
+        joiner = self.connect()
+        self.create_room(creator, "room")
+        self.join_room(joiner, "room")
+        room_commands = [
+            Command(MessageType.MESH, common.encode_string("/Cube") + bytes(100)),
+            Command(MessageType.TRANSFORM, common.encode_string("/Cube") + bytes([1])),
+        ]
+        # in order, each command is received before the next one is sent
+        creator.send_command(room_commands[0])
+        self.receive_room_commands(joiner, 1)
+        joiner.send_command(Command(MessageType.CLIENT_PRESENCE, common.encode_json({"frame": 1})))
+        self.receive(creator, MessageType.CLIENT_PRESENCE)
+        creator.send_command(room_commands[1])
+        self.receive_room_commands(joiner, 1)
+        for client in (creator, joiner):
+            client.leave_room("room")
+            self.receive(client, MessageType.LEAVE_ROOM)
+        self.sync(creator)
+
+        (name,) = os.listdir(self.server.session_directory)
+        header, records = load_session(os.path.join(self.server.session_directory, name))
+        self.assertEqual(header["name"], "room")
+        self.assertEqual(
+            [r.command.type for r in records],
+            [MessageType.MESH, MessageType.CLIENT_PRESENCE, MessageType.TRANSFORM],
+        )
+        self.assertEqual(len({r.sender for r in records}), 2)
+        self.assertEqual(records[0].sender, records[2].sender)
+        self.assertEqual([r.time for r in records], sorted(r.time for r in records))
+
+        # played in an existing room, with one client per recorded sender
+        observer = self.connect()
+        self.create_room(observer, "played")
+        result = play_session("localhost", self.port, "played", records, speed=0)
+        self.assertEqual(result["client_count"], 2)
+        received = self.receive_room_commands(observer, 2)
+        self.assertEqual([bytes(c.data) for c in received], [bytes(c.data) for c in room_commands])
+
+    def test_speed(self):
+        transform = Command(MessageType.TRANSFORM, common.encode_string("/Cube"))
+        records = [SessionRecord(0.0, "a", transform), SessionRecord(0.4, "b", transform)]
+        self.connect()  # the server is started
+        # the room is created by the player
+        result = play_session("localhost", self.port, "played", records, speed=2, sender_count=1)
+        self.assertEqual(result["client_count"], 1)
+        self.assertGreaterEqual(result["duration"], 0.2)
+        self.assertLess(result["duration"], 0.4)
+
+
+class TestClientIOThread(ServerTestCase):
+    def fetch_until(self, client: Client, predicate, timeout=5.0) -> List[Command]:
+        """
+        Return the commands fetched until predicate returns True for them.
+        """
+        received: List[Command] = []
+        deadline = time.monotonic() + timeout
+        while not predicate(received):
+            self.assertLess(time.monotonic(), deadline, "commands not received")
+            client.fetch_outgoing_commands()
+            client.wait_incoming_commands(0.1)
+            received.extend(client.fetch_incoming_commands())
+        return received
+
+    def fetch_room_commands(self, client: Client, count: int) -> List[Command]:
+        received = self.fetch_until(client, lambda r: len([c for c in r if c.type > MessageType.COMMAND]) >= count)
+        return [c for c in received if c.type > MessageType.COMMAND]
+
+    def connect_room(self) -> List[Client]:
+        creator = self.connect(io_thread=True)
+        joiner = self.connect(io_thread=True)
+        creator.join_room("room")
+        self.fetch_until(creator, lambda r: MessageType.CONTENT in [c.type for c in r])
+        creator.add_command(Command(MessageType.CONTENT))
+        self.fetch_until(creator, lambda r: creator.rooms_attributes.get("room", {}).get("joinable"))
+        joiner.join_room("room")
+        self.fetch_until(joiner, lambda r: MessageType.JOIN_ROOM in [c.type for c in r])
+        self.assertTrue(creator.chunk and creator.command_batch)
+        return creator, joiner
+
+    def test_room(self):
+        creator, joiner = self.connect_room()
+
+        # not compressible, sent in chunks
+        mesh = Command(MessageType.MESH, common.encode_string("/Cube") + os.urandom(3 * common.CHUNK_SIZE))
+        transforms = [Command(MessageType.TRANSFORM, common.encode_string("/Cube") + bytes([i])) for i in range(10)]
+        for command in [mesh] + transforms:
+            creator.add_command(command)
+        creator.fetch_outgoing_commands()
+        # the commands given to the thread are sent before it stops
+        creator.disconnect()
+
+        received = self.fetch_room_commands(joiner, 11)
+        self.assertEqual([c.type for c in received], [MessageType.MESH] + [MessageType.TRANSFORM] * 10)
+        self.assertEqual([bytes(c.data) for c in received], [bytes(c.data) for c in [mesh] + transforms])
+
+    def test_incoming_budget(self):
+        creator, joiner = self.connect_room()
+        meshes = [Command(MessageType.MESH, common.encode_string(f"/Cube{i}") + bytes(1000)) for i in range(20)]
+        # the thread stops reading after each message, until the commands are fetched
+        with mock.patch.object(client_module, "INCOMING_BUDGET", 1):
+            for command in meshes:
+                creator.send_command(command)
+            received = self.fetch_room_commands(joiner, len(meshes))
+        self.assertEqual([bytes(c.data) for c in received], [bytes(c.data) for c in meshes])
+
+    def test_connection_lost(self):
+        client = self.connect(io_thread=True)
+        self.fetch_until(client, lambda r: client.client_id is not None)
+        self.clients.remove(client)  # not disconnected by the test
+        self.stop_server()
+        with self.assertRaises(common.ClientDisconnectedException):
+            self.fetch_until(client, lambda r: False)
+        self.assertFalse(client.is_connected())
+        self.start_server()
+
+    def test_has_incoming_commands(self):
+        creator, joiner = self.connect_room()
+        creator.send_command(Command(MessageType.TRANSFORM, common.encode_string("/Cube")))
+        deadline = time.monotonic() + 5.0
+        while not joiner.has_incoming_commands():
+            self.assertLess(time.monotonic(), deadline, "commands not received")
+            time.sleep(0.01)
+        received = self.fetch_room_commands(joiner, 1)
+        self.assertEqual([c.type for c in received], [MessageType.TRANSFORM])
+
+        joiner.disconnect()
+        self.assertFalse(joiner.has_incoming_commands())
+
+
+class TestCompressionAsyncio(TestCompression):
+    server_class = AsyncServer
+
+
+class TestCommandBatchAsyncio(TestCommandBatch):
+    server_class = AsyncServer
+
+
+class TestChunkAsyncio(TestChunk):
+    server_class = AsyncServer
+
+
+class TestRoomAsyncio(TestRoom):
+    server_class = AsyncServer
+
+
+class TestSlowClientAsyncio(TestSlowClient):
+    server_class = AsyncServer
+
+
+class TestServerStatsAsyncio(TestServerStats):
+    server_class = AsyncServer
+
+
+class TestRoomUpdatesAsyncio(TestRoomUpdates):
+    server_class = AsyncServer
+
+
+class TestPresenceAsyncio(TestPresence):
+    server_class = AsyncServer
+
+
+class TestClientIOThreadAsyncio(TestClientIOThread):
+    server_class = AsyncServer
+
+
+class TestSessionAsyncio(TestSession):
+    server_class = AsyncServer
+
+
+class TestReplayAsyncio(TestReplay):
+    server_class = AsyncServer
+
+
+class TestReplayLoggedAsyncio(TestReplay):
+    server_class = AsyncServer
+    room_log = True
+
+
+sharding_supported = unittest.skipUnless(sharded_server.is_supported(), "needs Unix sockets")
+
+
+@sharding_supported
+class TestSharding(ServerTestCase):
+    server_class = ShardedServer
+
+    def wait_until(self, client: Client, condition):
+        """
+        Wait until condition() is true, since room updates from the workers are relayed asynchronously.
+        """
+        for _ in range(50):
+            self.sync(client)
+            if condition():
+                return
+            time.sleep(0.1)
+        self.fail("condition not met")
+
+    def test_rooms(self):
+        creator_a = self.connect()
+        creator_b = self.connect()
+        self.create_room(creator_a, "room_a")
+        self.create_room(creator_b, "room_b")
+        self.assertEqual(sorted(self.server._room_owners.values()), [0, 1])
+        creator_b.send_command(Command(MessageType.MESH, common.encode_string("/Cube")))
+
+        # served by the front process, by the workers
+        observer = self.connect()
+        for client in (observer, creator_a, creator_b):
+            rooms = client.rooms_attributes
+            self.wait_until(
+                client,
+                lambda: set(rooms) == {"room_a", "room_b"}
+                and rooms["room_b"][common.RoomAttributes.COMMAND_COUNT] == 1,
+            )
+
+        # from the worker of room_a to the worker of room_b, through the front process
+        creator_a.leave_room("room_a")
+        self.receive(creator_a, MessageType.ROOM_DELETED)
+        creator_a.join_room("room_b")
+        received = self.receive_room_commands(creator_a, 1)
+        self.assertEqual(bytes(received[0].data), common.encode_string("/Cube"))
+        self.wait_until(observer, lambda: set(observer.rooms_attributes) == {"room_b"})
+
+        creator_b.send_command(Command(MessageType.MESH, common.encode_string("/Plane")))
+        received = self.receive_room_commands(creator_a, 1)
+        self.assertEqual(bytes(received[0].data), common.encode_string("/Plane"))
+
+    def test_pending_after_join(self):
+        creator = self.connect()
+        self.create_room(creator, "room")
+        joiner = self.connect()
+        # received by the front process with JOIN_ROOM, and passed to the worker with the connection
+        joiner.send_commands(
+            [
+                Command(MessageType.JOIN_ROOM, "room".encode("utf8")),
+                Command(MessageType.MESH, common.encode_string("/Cube")),
+            ]
+        )
+        received = self.receive_room_commands(creator, 1)
+        self.assertEqual(bytes(received[0].data), common.encode_string("/Cube"))
+
+    def test_room_operations(self):
+        creator = self.connect()
+        self.create_room(creator, "room")
+        observer = self.connect()
+        observer.set_room_keep_open("room", True)
+        observer.set_room_attributes("room", {"custom": 1})
+        attributes = creator.rooms_attributes
+        self.wait_until(
+            creator,
+            lambda: attributes["room"].get("custom") == 1 and attributes["room"][common.RoomAttributes.KEEP_OPEN],
+        )
+
+
+@sharding_supported
+class TestRoomSharded(TestRoom):
+    server_class = ShardedServer
+
+
+@sharding_supported
+class TestChunkSharded(TestChunk):
+    server_class = ShardedServer
+
+
+class TestCompressCommand(unittest.TestCase):
+    def test_roundtrip(self):
+        data = common.encode_string("/Cube") + bytes(range(16)) * 1000
+        for compression in (Compression.ZLIB, Compression.LZMA):
+            command = common.compress_command(Command(MessageType.MESH, data, 12), compression)
+            self.assertEqual(command.compression, compression)
+            self.assertLess(len(command.data), len(data))
+            self.assertEqual(common.decode_command_path(command), "/Cube")
+
+            header = common.unpack_message_header(command.header())
+            self.assertEqual(header, (len(command.data), 12, MessageType.MESH, compression))
+
+            decompressed = common.decompress_command(command)
+            self.assertEqual((decompressed.data, decompressed.compression), (data, Compression.NONE))
+
+    def test_not_compressed(self):
+        small = Command(MessageType.MESH, b"small")
+        self.assertIs(common.compress_command(small, Compression.ZLIB), small)
+        transform = Command(MessageType.TRANSFORM, bytes(common.COMPRESSION_THRESHOLD * 2))
+        self.assertIs(common.compress_command(transform, Compression.ZLIB), transform)
+        mesh = Command(MessageType.MESH, bytes(common.COMPRESSION_THRESHOLD * 2))
+        self.assertIs(common.compress_command(mesh, Compression.NONE), mesh)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import mixer.broadcaster.common as common
+from mixer.broadcaster.common import Command, Compression, MessageType
+from mixer.broadcaster.room_bake import load_room
+from mixer.broadcaster.room_log import RoomLog
+
+
+def mesh(path: str, size: int = 100) -> Command:
+    return Command(MessageType.MESH, common.encode_string(path) + bytes(range(256)) * (size // 256) + bytes(size % 256))
+
+
+class TestRoomLog(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def reopen(self, log: RoomLog, segment_size: int = 1000) -> RoomLog:
+        log.close()
+        (log,) = RoomLog.open_all(self.directory, segment_size)
+        return log
+
+    def test_append(self):
+        log = RoomLog.create(self.directory, "room/1")
+        commands = [mesh("/Cube"), Command(MessageType.TRANSFORM), Command(MessageType.MESH, b"x", 0, Compression.ZLIB)]
+        logged = [log.append(c) for c in commands]
+        log.save_attributes({"keep_open": True})
+
+        for command, logged_command in zip(commands, logged):
+            self.assertEqual(logged_command.to_byte_buffer(), command.to_byte_buffer())
+            self.assertEqual(logged_command.byte_size(), command.byte_size())
+
+        log = self.reopen(log)
+        self.assertEqual(log.room_name, "room/1")
+        self.assertEqual(log.attributes, {"keep_open": True})
+        restored = log.commands()
+        self.assertEqual([c.to_byte_buffer() for c in restored], [c.to_byte_buffer() for c in commands])
+        self.assertEqual(restored[2].compression, Compression.ZLIB)
+
+        # appended after the restored commands
+        command = mesh("/Plane")
+        log.append(command)
+        log = self.reopen(log)
+        self.assertEqual(log.commands()[-1].to_byte_buffer(), command.to_byte_buffer())
+        log.close()
+
+    def test_truncated(self):
+        log = RoomLog.create(self.directory, "room")
+        commands = [mesh("/Cube"), mesh("/Plane")]
+        for command in commands:
+            log.append(command)
+        log.close()
+
+        (segment,) = [n for n in os.listdir(log.path) if n.endswith(".log")]
+        path = os.path.join(log.path, segment)
+        size = os.path.getsize(path)
+        with open(path, "r+b") as file:
+            file.truncate(size - 10)
+
+        log = self.reopen(log)
+        self.assertEqual([c.to_byte_buffer() for c in log.commands()], [commands[0].to_byte_buffer()])
+        self.assertEqual(os.path.getsize(path), size - commands[1].byte_size())
+
+        log.append(commands[1])
+        log = self.reopen(log)
+        self.assertEqual(len(log.commands()), 2)
+        log.close()
+
+    def test_segments(self):
+        log = RoomLog.create(self.directory, "room", segment_size=1000)
+        logged = [log.append(mesh(f"/Cube{i}", 400)) for i in range(6)]
+        segments = sorted(n for n in os.listdir(log.path) if n.endswith(".log"))
+        self.assertEqual(len(segments), 3)
+
+        # segments are load_room() files
+        attributes, commands = load_room(os.path.join(log.path, segments[1]))
+        self.assertEqual(attributes["name"], "room")
+        self.assertEqual([c.to_byte_buffer() for c in commands], [c.to_byte_buffer() for c in logged[2:4]])
+
+        # a segment is deleted when all its commands are released, except the last one
+        log.release(logged[2])
+        self.assertEqual(len(os.listdir(log.path)), 4)
+        log.release(logged[3])
+        self.assertEqual(len(os.listdir(log.path)), 3)
+        log.release(logged[4])
+        log.release(logged[5])
+        self.assertEqual(len(os.listdir(log.path)), 3)
+
+        # the released commands of the last segment are dropped again by the restored room history
+        log = self.reopen(log)
+        expected = logged[:2] + logged[4:]
+        self.assertEqual([c.to_byte_buffer() for c in log.commands()], [c.to_byte_buffer() for c in expected])
+        log.close()
+
+    def test_delete(self):
+        log = RoomLog.create(self.directory, "room", segment_size=1000)
+        commands = [mesh(f"/Cube{i}", 400) for i in range(3)]
+        logged = [log.append(c) for c in commands]
+        log.sync()
+        # the commands may still be queued for clients when the room is deleted
+        log.delete()
+        self.assertFalse(os.path.exists(log.path))
+        self.assertEqual([c.to_byte_buffer() for c in logged], [c.to_byte_buffer() for c in commands])
+
+    def test_create(self):
+        log = RoomLog.create(self.directory, "room")
+        log.append(mesh("/Cube"))
+        log.close()
+        log = RoomLog.create(self.directory, "room")
+        log = self.reopen(log)
+        self.assertEqual(log.commands(), [])
+        log.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
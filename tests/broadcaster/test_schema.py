@@ -0,0 +1,99 @@
+import unittest
+
+import mixer.broadcaster.common as common
+from mixer.broadcaster.common import MessageType
+from mixer.broadcaster import schema
+from mixer.broadcaster.schema import get_schema
+
+
+class Vector(tuple):
+    x = property(lambda self: self[0])
+    y = property(lambda self: self[1])
+    z = property(lambda self: self[2])
+
+
+class Matrix:
+    def __init__(self, columns):
+        self.col = columns
+
+
+class TestSchema(unittest.TestCase):
+    def test_transform(self):
+        matrix = Matrix([(1.0, 0.0, 0.0, 0.0), (0.0, 1.0, 0.0, 0.0), (0.0, 0.0, 1.0, 0.0), (1.0, 2.0, 3.0, 1.0)])
+        data = get_schema(MessageType.TRANSFORM).encode("/Parent/Cube", matrix, matrix, matrix)
+        expected = common.encode_string("/Parent/Cube") + common.encode_matrix(matrix) * 3
+        self.assertEqual(data, expected)
+
+        transform = get_schema(MessageType.TRANSFORM).decode(memoryview(data))
+        self.assertEqual(transform.path, "/Parent/Cube")
+        self.assertEqual(transform.local_matrix, tuple(matrix.col))
+
+    def test_mixed_fields(self):
+        values = ("Material", True, "LINE", "SOLID", (1.0, 0.0, 0.0), False, True, "SOLID", (0.0, 1.0, 0.0, 0.5))
+        data = get_schema(MessageType.GREASE_PENCIL_MATERIAL).encode(*values)
+        expected = (
+            common.encode_string("Material")
+            + common.encode_bool(True)
+            + common.encode_string("LINE")
+            + common.encode_string("SOLID")
+            + common.encode_color((1.0, 0.0, 0.0))
+            + common.encode_bool(False)
+            + common.encode_bool(True)
+            + common.encode_string("SOLID")
+            + common.encode_color((0.0, 1.0, 0.0, 0.5))
+        )
+        self.assertEqual(data, expected)
+
+        decoded = get_schema(MessageType.GREASE_PENCIL_MATERIAL).decode(data)
+        self.assertEqual(decoded.color, (1.0, 0.0, 0.0, 1.0))
+        self.assertEqual(decoded.fill_color, (0.0, 1.0, 0.0, 0.5))
+        self.assertEqual((decoded.show_stroke, decoded.use_overlap_strokes, decoded.show_fill), (True, False, True))
+        self.assertEqual((decoded.mode, decoded.fill_style), ("LINE", "SOLID"))
+
+    def test_collection(self):
+        data = get_schema(MessageType.COLLECTION).encode("Collection", True, Vector((1.0, 2.0, 3.0)), False)
+        expected = (
+            common.encode_string("Collection")
+            + common.encode_bool(True)
+            + common.encode_vector3(Vector((1.0, 2.0, 3.0)))
+            + common.encode_bool(False)
+        )
+        self.assertEqual(data, expected)
+        self.assertEqual(
+            tuple(get_schema(MessageType.COLLECTION).decode(data)), ("Collection", True, (1.0, 2.0, 3.0), False)
+        )
+
+    def test_fixed_size(self):
+        frame_start_end = get_schema(MessageType.FRAME_START_END)
+        self.assertEqual(frame_start_end.size, 8)
+        self.assertEqual(frame_start_end.encode(1, 250), common.encode_int(1) + common.encode_int(250))
+        self.assertEqual(frame_start_end.decode_from(b"xx" + frame_start_end.encode(1, 250), 2), ((1, 250), 10))
+
+        command = get_schema(MessageType.FRAME).command(12)
+        self.assertEqual((command.type, command.data), (MessageType.FRAME, common.encode_int(12)))
+
+    def test_arrays(self):
+        message = schema.MessageSchema(
+            MessageType.COMMAND,
+            [
+                ("names", schema.STRING_ARRAY),
+                ("count", schema.INT),
+                ("indices", schema.INT_ARRAY),
+                ("weights", schema.FLOAT_ARRAY),
+                ("rotation", schema.QUATERNION),
+            ],
+        )
+        values = (["a", "été"], 2, [1, -2, 3], [0.5, 0.25], (1.0, 0.0, 0.0, 0.0))
+        data = message.encode(*values)
+        self.assertEqual(data[:18], common.encode_string_array(["a", "été"]))
+        self.assertEqual(tuple(message.decode(data)), values)
+
+    def test_errors(self):
+        with self.assertRaises(TypeError):
+            get_schema(MessageType.FRAME_START_END).encode(1)
+        with self.assertRaises(ValueError):
+            schema.register_schema(MessageType.FRAME, ("frame", schema.INT))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+from typing import List, Tuple
+import unittest
+from unittest import mock
+
+import mixer.broadcaster.common as common
+from mixer.broadcaster.common import Command, Compression, MessageType
+from mixer.broadcaster.room_bake import save_room
+from mixer.broadcaster.session import SessionRecorder, is_recorded, load_session
+
+
+class TestSessionFile(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def record(self) -> Tuple[SessionRecorder, List[Tuple[str, Command]]]:
+        commands = [
+            ("a", Command(MessageType.MESH, common.encode_string("/Cube") + bytes(100))),
+            ("b", Command(MessageType.CLIENT_PRESENCE, common.encode_json({"frame": 1}))),
+            ("a", Command(MessageType.TRANSFORM, b"x", 0, Compression.ZLIB)),
+        ]
+        with mock.patch("time.monotonic", return_value=10.0):
+            recorder = SessionRecorder.create(self.directory, "room/1")
+        for index, (sender, command) in enumerate(commands):
+            with mock.patch("time.monotonic", return_value=10.0 + index):
+                recorder.record(sender, command)
+        recorder.close()
+        return recorder, commands
+
+    def test_load(self):
+        recorder, commands = self.record()
+        self.assertEqual(os.listdir(self.directory), [os.path.basename(recorder.path)])
+
+        header, records = load_session(recorder.path)
+        self.assertEqual(header["name"], "room/1")
+        self.assertEqual([r.time for r in records], [0.0, 1.0, 2.0])
+        self.assertEqual([r.sender for r in records], ["a", "b", "a"])
+        for record, (_, command) in zip(records, commands):
+            self.assertEqual(record.command.to_byte_buffer(), command.to_byte_buffer())
+
+    def test_truncated(self):
+        recorder, _ = self.record()
+        size = os.path.getsize(recorder.path)
+        with open(recorder.path, "r+b") as file:
+            file.truncate(size - 1)
+        _, records = load_session(recorder.path)
+        self.assertEqual([r.sender for r in records], ["a", "b"])
+
+    def test_not_a_session(self):
+        path = os.path.join(self.directory, "room")
+        save_room({"name": "room"}, [Command(MessageType.MESH)], path)
+        with self.assertRaises(ValueError):
+            load_session(path)
+
+    def test_is_recorded(self):
+        self.assertTrue(is_recorded(Command(MessageType.TRANSFORM)))
+        self.assertTrue(is_recorded(Command(MessageType.CLIENT_PRESENCE)))
+        self.assertFalse(is_recorded(Command(MessageType.JOIN_ROOM)))
+        self.assertFalse(is_recorded(Command(MessageType.LIST_ROOMS)))
+
+
+if __name__ == "__main__":
+    unittest.main()
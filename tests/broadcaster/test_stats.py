@@ -0,0 +1,123 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import mixer.broadcaster.common as common
+from mixer.broadcaster.common import Command, CommandRun, MessageType
+from mixer.broadcaster import stats
+from mixer.broadcaster.stats import ConnectionStats, Histogram, RateMeter
+
+
+def transform(path: str) -> Command:
+    return Command(MessageType.TRANSFORM, common.encode_string(path))
+
+
+def snapshot() -> dict:
+    return {
+        "uptime": 1.5,
+        "connection_count": 1,
+        "commands_in": 2,
+        "bytes_in": 20,
+        "commands_out": 3,
+        "bytes_out": 30,
+        "message_types": {"TRANSFORM": 2},
+        "join_duration": Histogram().to_dict(),
+        "send_lag": Histogram().to_dict(),
+        "rooms": {
+            'a "room"': {
+                "client_count": 1,
+                "command_count": 2,
+                "byte_size": 20,
+                "commands_in": 2,
+                "bytes_in": 20,
+                "bytes_out": 0,
+                "command_rate": 0.2,
+            }
+        },
+        "clients": {
+            "127.0.0.1:1234": {
+                "commands_in": 2,
+                "bytes_in": 20,
+                "commands_out": 3,
+                "bytes_out": 30,
+                "send_queue_size": 0,
+                "send_queue_command_count": 0,
+                "send_lag": 0.0,
+            }
+        },
+    }
+
+
+class TestHistogram(unittest.TestCase):
+    def test_observe(self):
+        histogram = Histogram((1.0, 10.0))
+        for value in (0.5, 1.0, 5.0, 100.0):
+            histogram.observe(value)
+        self.assertEqual(histogram.to_dict(), {"count": 4, "sum": 106.5, "buckets": {"1.0": 2, "10.0": 3, "+Inf": 4}})
+
+    def test_merge(self):
+        first, second = Histogram((1.0,)), Histogram((1.0,))
+        first.observe(0.5)
+        second.observe(2.0)
+        first.merge(second)
+        self.assertEqual(first.to_dict()["buckets"], {"1.0": 1, "+Inf": 2})
+
+
+class TestRateMeter(unittest.TestCase):
+    def test_rate(self):
+        meter = RateMeter(window=10)
+        with mock.patch("time.monotonic", return_value=100.5):
+            meter.add(30)
+        with mock.patch("time.monotonic", return_value=101.5):
+            meter.add(5)
+            # the current second is not counted
+            self.assertEqual(meter.rate(), 3.0)
+        with mock.patch("time.monotonic", return_value=111.5):
+            self.assertEqual(meter.rate(), 0.5)
+        with mock.patch("time.monotonic", return_value=120.5):
+            self.assertEqual(meter.rate(), 0.0)
+
+
+class TestConnectionStats(unittest.TestCase):
+    def test_counts(self):
+        connection_stats = ConnectionStats()
+        connection_stats.received(transform("/Cube"))
+        connection_stats.received(transform("/Cube"))
+        connection_stats.sent([transform("/Cube"), CommandRun([transform("/A"), transform("/B")])])
+
+        total = ConnectionStats()
+        total.merge(connection_stats)
+        total.merge(connection_stats)
+        self.assertEqual(total.commands_in, 4)
+        self.assertEqual(total.commands_out, 6)
+        self.assertEqual(total.bytes_in, 4 * transform("/Cube").byte_size())
+        self.assertEqual(total.message_types, {MessageType.TRANSFORM: 4})
+
+
+class TestExport(unittest.TestCase):
+    def test_prometheus(self):
+        text = stats.to_prometheus(snapshot())
+        self.assertIn("mixer_connections 1\n", text)
+        self.assertIn('mixer_messages_in_total{type="TRANSFORM"} 2\n', text)
+        self.assertIn('mixer_room_history_commands{room="a \\"room\\""} 2\n', text)
+        self.assertIn('mixer_join_duration_seconds_bucket{le="+Inf"} 0\n', text)
+        self.assertIn('mixer_client_bytes_out_total{client="127.0.0.1:1234"} 30\n', text)
+
+    def test_write_stats_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "stats.json")
+            stats.write_stats_file(path, snapshot())
+            with open(path) as file:
+                self.assertEqual(json.load(file), snapshot())
+
+            path = os.path.join(directory, "stats.prom")
+            stats.write_stats_file(path, snapshot())
+            with open(path) as file:
+                self.assertEqual(file.read(), stats.to_prometheus(snapshot()))
+            self.assertEqual(sorted(os.listdir(directory)), ["stats.json", "stats.prom"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -51,7 +51,8 @@ class Grabber:
                             continue
                         # Ignore command serial Id, that may not match
                         command.id = 0
-                        self.streams.data[command.type].append(command.data)
+                        # command.data is a memoryview into the receive buffer, which cannot be sorted
+                        self.streams.data[command.type].append(bytes(command.data))
             except ClientDisconnectedException:
                 print("Grabber: disconnected before received command stream.", file=sys.stderr)
 
@@ -27,6 +27,7 @@ class VRtistTestCase(MixerTestCase):
             MessageType.BLENDER_DATA_REMOVE,
             MessageType.BLENDER_DATA_RENAME,
             MessageType.BLENDER_DATA_UPDATE,
+            MessageType.BLENDER_DATA_BINARY_UPDATE,
         ]
         for k in a.keys():
             message_type = str(MessageType(k))